@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+کنترل پذیرش درخواست‌ها با سقف همزمانی هر کاربر و صف انتظار محدود
+
+هر درخواست سنگین (پردازش لینک یا انتخاب گزینه دانلود) پیش از اجرا باید پذیرفته شود:
+- هر کاربر حداکثر ADMISSION_MAX_PER_USER درخواست در حال اجرا دارد
+- کل ربات حداکثر ADMISSION_MAX_GLOBAL درخواست در حال اجرا دارد
+- درخواست‌های اضافه در صف محدود منتظر می‌مانند و جایگاه و زمان تخمینی به کاربر نمایش داده می‌شود
+  (با پیشرفت صف، پیام «در صف» با رعایت محدودیت نرخ ویرایش بروزرسانی می‌شود)
+- در صورت پر بودن صف یا زیاد بودن درخواست‌های منتظر یک کاربر، درخواست با پیام مناسب رد می‌شود
+
+صف به ترتیب ورود است، اما درخواست کاربری که به سقف خود رسیده جلوی کاربران دیگر را نمی‌گیرد.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import functools
+import threading
+import traceback
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+from handler_runtime import handler_executor
+from status_editor import StatusEditor, get_editor
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# فعال بودن کنترل پذیرش
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# حداکثر درخواست‌های در حال اجرای هر کاربر
+ADMISSION_MAX_PER_USER = int(os.environ.get('ADMISSION_MAX_PER_USER', '2'))
+# حداکثر درخواست‌های در حال اجرای کل ربات
+ADMISSION_MAX_GLOBAL = int(os.environ.get('ADMISSION_MAX_GLOBAL', '8'))
+# حداکثر طول صف انتظار
+ADMISSION_QUEUE_SIZE = int(os.environ.get('ADMISSION_QUEUE_SIZE', '50'))
+# حداکثر درخواست‌های منتظر هر کاربر
+ADMISSION_MAX_QUEUED_PER_USER = int(os.environ.get('ADMISSION_MAX_QUEUED_PER_USER', '3'))
+# زمان سرویس اولیه برای تخمین زمان انتظار (ثانیه)
+INITIAL_SERVICE_TIME = 30.0
+# ضریب میانگین متحرک نمایی زمان سرویس
+SERVICE_TIME_SMOOTHING = 0.2
+
+# نتایج پذیرش
+ADMITTED = 'admitted'
+QUEUED = 'queued'
+REJECTED = 'rejected'
+
+# پیام‌های کنترل پذیرش
+ADMISSION_MESSAGES = {
+    "queued": "⏳ درخواست شما در صف قرار گرفت.\n📍 جایگاه در صف: {position}\n⏱ زمان تقریبی انتظار: {eta}",
+    "user_limit": "✋ شما {running} درخواست در حال پردازش و {queued} درخواست در صف دارید.\n"
+                  "لطفاً تا پایان آن‌ها صبر کنید و سپس دوباره تلاش کنید.",
+    "saturated": "😔 ربات در حال حاضر بسیار شلوغ است و امکان پذیرش درخواست جدید را ندارد.\n"
+                 "لطفاً چند دقیقه دیگر دوباره تلاش کنید.",
+}
+
+
+class AdmissionDecision:
+    """نتیجه درخواست پذیرش"""
+
+    def __init__(self, status: str, position: int = 0, eta: float = 0.0, reason: str = '',
+                 running: int = 0, queued: int = 0):
+        self.status = status
+        self.position = position
+        self.eta = eta
+        self.reason = reason
+        self.running = running
+        self.queued = queued
+
+
+class _Ticket:
+    """درخواست منتظر در صف"""
+
+    __slots__ = ('user_id', 'start', 'on_update', 'position', 'enqueued_at')
+
+    def __init__(self, user_id: int, start: Callable[[], None],
+                 on_update: Optional[Callable[[int, float], None]] = None, position: int = 0):
+        self.user_id = user_id
+        self.start = start
+        self.on_update = on_update
+        self.position = position
+        self.enqueued_at = time.monotonic()
+
+
+class AdmissionController:
+    """کنترل‌کننده پذیرش با سقف همزمانی کاربر و کل ربات"""
+
+    def __init__(self, max_per_user: int = ADMISSION_MAX_PER_USER, max_global: int = ADMISSION_MAX_GLOBAL,
+                 queue_size: int = ADMISSION_QUEUE_SIZE, max_queued_per_user: int = ADMISSION_MAX_QUEUED_PER_USER):
+        """
+        Args:
+            max_per_user: حداکثر درخواست‌های در حال اجرای هر کاربر
+            max_global: حداکثر درخواست‌های در حال اجرای کل ربات
+            queue_size: حداکثر طول صف انتظار
+            max_queued_per_user: حداکثر درخواست‌های منتظر هر کاربر
+        """
+        self.max_per_user = max_per_user
+        self.max_global = max_global
+        self.queue_size = queue_size
+        self.max_queued_per_user = max_queued_per_user
+
+        self._lock = threading.Lock()
+        self._queue: Deque[_Ticket] = deque()
+        self._running: Dict[int, int] = {}
+        self._queued: Dict[int, int] = {}
+        self._running_total = 0
+        self._service_time = INITIAL_SERVICE_TIME
+
+        # آمار
+        self.stats = {
+            'admitted': 0,
+            'queued': 0,
+            'rejected_user_limit': 0,
+            'rejected_saturated': 0,
+            'max_queue_length': 0,
+            'total_wait_time': 0.0,
+        }
+
+    def _can_run(self, user_id: int) -> bool:
+        return (self._running_total < self.max_global and
+                self._running.get(user_id, 0) < self.max_per_user)
+
+    def _mark_running(self, user_id: int) -> None:
+        self._running[user_id] = self._running.get(user_id, 0) + 1
+        self._running_total += 1
+        self.stats['admitted'] += 1
+
+    def _estimate_wait(self, position: int) -> float:
+        """تخمین زمان انتظار بر اساس میانگین زمان سرویس و ظرفیت همزمان"""
+        rounds = (position + self.max_global - 1) // self.max_global
+        return rounds * self._service_time
+
+    def submit(self, user_id: int, start: Callable[[], None],
+               on_update: Optional[Callable[[int, float], None]] = None) -> AdmissionDecision:
+        """
+        درخواست پذیرش یک کار
+
+        تابع start بلافاصله (در صورت وجود ظرفیت) یا هنگام آزاد شدن ظرفیت فراخوانی می‌شود و باید
+        کار را بدون انتظار آغاز کند. پس از پایان کار، release باید فراخوانی شود.
+
+        Args:
+            user_id: شناسه کاربر
+            start: تابع آغاز کار
+            on_update: تابعی که با (جایگاه جدید، زمان تخمینی) هنگام جلو رفتن کار در صف فراخوانی می‌شود
+
+        Returns:
+            نتیجه پذیرش (پذیرفته، در صف یا رد شده)
+        """
+        with self._lock:
+            running = self._running.get(user_id, 0)
+            queued = self._queued.get(user_id, 0)
+
+            if not queued and self._can_run(user_id):
+                self._mark_running(user_id)
+                decision = AdmissionDecision(ADMITTED)
+            elif queued >= self.max_queued_per_user:
+                self.stats['rejected_user_limit'] += 1
+                return AdmissionDecision(REJECTED, reason='user_limit', running=running, queued=queued)
+            elif len(self._queue) >= self.queue_size:
+                self.stats['rejected_saturated'] += 1
+                return AdmissionDecision(REJECTED, reason='saturated', running=running, queued=queued)
+            else:
+                position = len(self._queue) + 1
+                self._queue.append(_Ticket(user_id, start, on_update, position))
+                self._queued[user_id] = queued + 1
+                self.stats['queued'] += 1
+                self.stats['max_queue_length'] = max(self.stats['max_queue_length'], len(self._queue))
+                return AdmissionDecision(QUEUED, position=position, eta=self._estimate_wait(position),
+                                         running=running, queued=queued + 1)
+
+        start()
+        return decision
+
+    def release(self, user_id: int, service_time: Optional[float] = None) -> None:
+        """
+        اعلام پایان کار یک کاربر و آغاز کارهای منتظر
+
+        Args:
+            user_id: شناسه کاربر
+            service_time: مدت اجرای کار (برای تخمین زمان انتظار)
+        """
+        ready = []
+        with self._lock:
+            remaining = self._running.get(user_id, 0) - 1
+            if remaining > 0:
+                self._running[user_id] = remaining
+            else:
+                self._running.pop(user_id, None)
+            self._running_total = max(0, self._running_total - 1)
+
+            if service_time is not None:
+                self._service_time += SERVICE_TIME_SMOOTHING * (service_time - self._service_time)
+
+            # آغاز اولین کارهای منتظری که کاربرشان زیر سقف است
+            index = 0
+            while index < len(self._queue) and self._running_total < self.max_global:
+                ticket = self._queue[index]
+                if not self._can_run(ticket.user_id):
+                    index += 1
+                    continue
+                del self._queue[index]
+                queued = self._queued.get(ticket.user_id, 0) - 1
+                if queued > 0:
+                    self._queued[ticket.user_id] = queued
+                else:
+                    self._queued.pop(ticket.user_id, None)
+                self._mark_running(ticket.user_id)
+                self.stats['total_wait_time'] += time.monotonic() - ticket.enqueued_at
+                ready.append(ticket)
+
+            # کارهایی که در صف جلو رفته‌اند
+            moved = []
+            if ready:
+                for position, ticket in enumerate(self._queue, start=1):
+                    if ticket.position != position:
+                        ticket.position = position
+                        if ticket.on_update is not None:
+                            moved.append((ticket, position, self._estimate_wait(position)))
+
+        for ticket, position, eta in moved:
+            try:
+                ticket.on_update(position, eta)
+            except Exception as e:
+                logger.warning(f"خطا در بروزرسانی جایگاه صف کاربر {ticket.user_id}: {e}")
+
+        for ticket in ready:
+            try:
+                ticket.start()
+            except Exception as e:
+                logger.error(f"خطا در آغاز کار منتظر کاربر {ticket.user_id}: {e}")
+                self.release(ticket.user_id)
+
+    def get_stats(self) -> Dict:
+        """
+        دریافت آمار کنترل پذیرش
+
+        Returns:
+            دیکشنری آمار
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            started_from_queue = stats['queued'] - len(self._queue)
+            stats.update({
+                'running': self._running_total,
+                'queue_length': len(self._queue),
+                'active_users': len(self._running),
+                'avg_service_time': round(self._service_time, 1),
+                'avg_queue_wait': round(stats['total_wait_time'] / started_from_queue, 1) if started_from_queue > 0 else 0.0,
+            })
+        return stats
+
+
+def format_eta(seconds: float) -> str:
+    """نمایش زمان تقریبی انتظار به صورت خوانا"""
+    if seconds < 60:
+        return f"{max(1, int(seconds))} ثانیه"
+    return f"{int(seconds // 60) + 1} دقیقه"
+
+
+def format_decision(decision: AdmissionDecision) -> str:
+    """
+    ساخت پیام کاربر برای درخواست منتظر یا رد شده
+
+    Args:
+        decision: نتیجه پذیرش
+
+    Returns:
+        متن پیام
+    """
+    if decision.status == QUEUED:
+        return ADMISSION_MESSAGES["queued"].format(position=decision.position, eta=format_eta(decision.eta))
+    return ADMISSION_MESSAGES[decision.reason].format(running=decision.running, queued=decision.queued)
+
+
+def _notify(update, text: str):
+    """ارسال پیام وضعیت پذیرش به صورت پاسخ (برای پیام متنی یا کالبک پیام inline)"""
+    if update.callback_query is not None and update.callback_query.message is None:
+        return update.callback_query.edit_message_text(text)
+    return update.effective_message.reply_text(text)
+
+
+def _delete_notice(notice) -> None:
+    """حذف پیام «در صف» پس از آغاز پردازش (نسخه همزمان)"""
+    try:
+        notice.delete()
+    except Exception:
+        pass
+
+
+def _notice_editor(update, notice) -> Optional[StatusEditor]:
+    """
+    ویرایشگر پیام «در صف» برای نمایش جایگاه جدید
+
+    در کالبک، پیام دکمه‌ها همان پیام وضعیت هندلر است و ویرایشگر مشترک آن استفاده می‌شود
+    تا ویرایش‌های بعدی هندلر هم از همان محدودیت نرخ عبور کنند.
+    """
+    query = update.callback_query
+    if query is not None and query.message is not None:
+        return get_editor(query.message.chat_id, query.message.message_id, query.edit_message_text)
+    if hasattr(notice, 'edit_text'):
+        return StatusEditor(notice.edit_text)
+    return None
+
+
+def _position_updater(notice: Dict) -> Callable[[int, float], None]:
+    """ساخت تابع بروزرسانی پیام «در صف» با جایگاه و زمان تخمینی جدید"""
+    def on_update(position: int, eta: float) -> None:
+        editor = notice.get('editor')
+        if editor is not None:
+            editor.update(ADMISSION_MESSAGES["queued"].format(position=position, eta=format_eta(eta)))
+    return on_update
+
+
+def admission_gate(callback: Callable, controller: Optional['AdmissionController'] = None) -> Callable:
+    """
+    قرار دادن کنترل پذیرش جلوی یک هندلر
+
+    هندلر فقط پس از پذیرش اجرا می‌شود؛ در غیر این صورت جایگاه صف یا پیام رد به کاربر نمایش داده می‌شود.
+    هندلرهای همزمان (نسخه 13) در پول اجرایی هندلرها و هندلرهای آسنکرون به صورت task اجرا می‌شوند.
+
+    Args:
+        callback: تابع هندلر با امضای (update, context)
+        controller: کنترل‌کننده پذیرش (پیش‌فرض: نمونه مشترک)
+
+    Returns:
+        تابع هندلر با کنترل پذیرش
+    """
+    if not ADMISSION_ENABLED:
+        return callback
+
+    if asyncio.iscoroutinefunction(callback):
+        @functools.wraps(callback)
+        async def async_wrapper(update, context):
+            gate = controller or admission_controller
+            user_id = update.effective_user.id
+            loop = asyncio.get_running_loop()
+            notice = {}
+            notice_sent = asyncio.Event()
+
+            async def run():
+                started = time.monotonic()
+                try:
+                    # پیام «در صف» ممکن است هنوز در حال ارسال باشد
+                    await notice_sent.wait()
+                    if notice.get('editor') is not None:
+                        notice['editor'].stop()
+                    if notice.get('message') is not None and update.callback_query is None:
+                        try:
+                            await notice['message'].delete()
+                        except Exception:
+                            pass
+                    await callback(update, context)
+                except Exception as e:
+                    logger.error(f"خطا در اجرای هندلر {callback.__name__}: {e}")
+                    logger.error(traceback.format_exc())
+                finally:
+                    gate.release(user_id, time.monotonic() - started)
+
+            def start():
+                loop.call_soon_threadsafe(loop.create_task, run())
+
+            decision = gate.submit(user_id, start, on_update=_position_updater(notice))
+            if decision.status == ADMITTED:
+                notice_sent.set()
+                return
+            logger.info(f"درخواست کاربر {user_id}: {decision.status} {decision.reason or decision.position}")
+            try:
+                editor = _notice_editor(update, None)
+                if editor is not None:
+                    # پیام دکمه‌ها از طریق ویرایشگر مشترک آن ویرایش می‌شود
+                    notice['editor'] = editor
+                    await editor.edit(format_decision(decision))
+                else:
+                    notice['message'] = await _notify(update, format_decision(decision))
+                    if decision.status == QUEUED:
+                        notice['editor'] = _notice_editor(update, notice['message'])
+            except Exception as e:
+                logger.warning(f"خطا در ارسال پیام وضعیت پذیرش: {e}")
+            finally:
+                notice_sent.set()
+
+        return async_wrapper
+
+    @functools.wraps(callback)
+    def wrapper(update, context):
+        gate = controller or admission_controller
+        user_id = update.effective_user.id
+        notice = {}
+        notice_sent = threading.Event()
+
+        def run():
+            started = time.monotonic()
+            try:
+                # پیام «در صف» ممکن است هنوز در حال ارسال باشد
+                notice_sent.wait(timeout=5)
+                if notice.get('editor') is not None:
+                    notice['editor'].stop()
+                if update.callback_query is None and notice.get('message') is not None:
+                    _delete_notice(notice['message'])
+                callback(update, context)
+            except Exception as e:
+                logger.error(f"خطا در اجرای هندلر {callback.__name__}: {e}")
+                logger.error(traceback.format_exc())
+            finally:
+                gate.release(user_id, time.monotonic() - started)
+
+        def start():
+            handler_executor.submit(run)
+
+        decision = gate.submit(user_id, start, on_update=_position_updater(notice))
+        if decision.status == ADMITTED:
+            notice_sent.set()
+            return
+        logger.info(f"درخواست کاربر {user_id}: {decision.status} {decision.reason or decision.position}")
+        try:
+            editor = _notice_editor(update, None)
+            if editor is not None:
+                # پیام دکمه‌ها از طریق ویرایشگر مشترک آن ویرایش می‌شود
+                notice['editor'] = editor
+                editor.edit_sync(format_decision(decision))
+            else:
+                notice['message'] = _notify(update, format_decision(decision))
+                if decision.status == QUEUED:
+                    notice['editor'] = _notice_editor(update, notice['message'])
+        finally:
+            notice_sent.set()
+
+    return wrapper
+
+
+# نمونه مشترک کنترل‌کننده پذیرش
+admission_controller = AdmissionController()
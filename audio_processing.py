@@ -10,10 +10,11 @@
 import os
 import uuid
 import logging
-import subprocess
 import tempfile
 from typing import Optional
 
+from ffmpeg_runner import run_ffmpeg
+
 # راه‌اندازی لاگر
 logging.basicConfig(
     level=logging.INFO,
@@ -67,12 +68,7 @@ def extract_audio(video_path: str, output_format: str = 'mp3', bitrate: str = '1
         
         # اجرای FFmpeg
         logger.info(f"اجرای دستور FFmpeg: {' '.join(cmd)}")
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        result = run_ffmpeg(cmd)
         
         if result.returncode != 0:
             logger.error(f"خطا در استخراج صدا: {result.stderr}")
@@ -174,12 +170,7 @@ def extract_audio_with_ytdlp(video_path: str, output_format: str = 'mp3', bitrat
         logger.info(f"استخراج صدا با FFmpeg: {' '.join(cmd)}")
         
         # اجرای FFmpeg
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        result = run_ffmpeg(cmd)
         
         if result.returncode == 0 and os.path.exists(audio_path) and os.path.getsize(audio_path) > 0:
             logger.info(f"استخراج صدا با FFmpeg موفق: {audio_path}")
@@ -284,12 +275,7 @@ def convert_audio_format(audio_path: str, output_format: str = 'mp3', bitrate: s
         ]
         
         # اجرای FFmpeg
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        result = run_ffmpeg(cmd)
         
         if result.returncode != 0:
             logger.error(f"خطا در تبدیل فرمت صدا: {result.stderr}")
@@ -333,12 +319,7 @@ def get_audio_info(audio_path: str) -> Optional[dict]:
         ]
         
         # اجرای FFprobe
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        result = run_ffmpeg(cmd)
         
         if result.returncode != 0:
             logger.error(f"خطا در دریافت اطلاعات صدا: {result.stderr}")
@@ -8,9 +8,10 @@
 import os
 import uuid
 import logging
-import subprocess
 from typing import Optional
 
+from ffmpeg_runner import run_ffmpeg
+
 # راه‌اندازی لاگر
 logging.basicConfig(
     level=logging.INFO,
@@ -87,12 +88,7 @@ def extract_audio(video_path: str, output_format: str = 'mp3', bitrate: str = '1
         
         # اجرای FFmpeg
         logger.info(f"اجرای دستور FFmpeg: {' '.join(cmd)}")
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        result = run_ffmpeg(cmd)
         
         if result.returncode != 0:
             logger.error(f"خطا در استخراج صدا: {result.stderr}")
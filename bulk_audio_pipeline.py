@@ -0,0 +1,245 @@
+"""
+خط لوله دسته‌ای استخراج صدا برای دانلودهای چندگانه
+
+این ماژول برای دستور /bulkdownload audio استفاده می‌شود:
+1. ابتدا فقط جریان صوتی (bestaudio) مستقیماً دانلود می‌شود
+2. در صورت شکست، ویدیو دانلود و صدا از آن استخراج می‌شود
+3. تبدیل به MP3 در تعداد محدودی پردازه ffmpeg همزمان با گزارش پیشرفت هر آیتم انجام می‌شود
+"""
+
+import os
+import glob
+import uuid
+import asyncio
+import logging
+from multiprocessing import cpu_count
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from cancel_scope import current_scope, run_scoped_thread
+from ffmpeg_runner import run_ffmpeg_async
+from request_governor import request_governor
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# حداکثر پردازه‌های همزمان ffmpeg برای استخراج صدا
+AUDIO_EXTRACTION_WORKERS = int(os.environ.get('AUDIO_EXTRACTION_WORKERS', str(max(1, min(cpu_count() - 1, 4)))))
+# حداکثر دانلودهای صوتی همزمان (کار شبکه‌ای)
+AUDIO_FETCH_WORKERS = int(os.environ.get('AUDIO_FETCH_WORKERS', '8'))
+# فرمت و بیت‌ریت خروجی
+AUDIO_OUTPUT_FORMAT = 'mp3'
+AUDIO_OUTPUT_BITRATE = '192k'
+
+# پول اجرایی مشترک برای دانلودهای yt-dlp (مسدودکننده)
+_fetch_executor = ThreadPoolExecutor(max_workers=AUDIO_FETCH_WORKERS, thread_name_prefix='bulk_audio_fetch')
+# سمافور محدودکننده پردازه‌های ffmpeg (در اولین استفاده روی loop فعلی ساخته می‌شود)
+_extraction_semaphore: Optional[asyncio.Semaphore] = None
+
+# پیشرفت هر آیتم: کلید آیتم -> {'stage': ..., 'percent': ...} (تا پایان پردازش دسته نگهداری می‌شود)
+audio_item_progress: Dict[str, Dict] = {}
+
+# برچسب فارسی مراحل
+STAGE_LABELS = {
+    "queued": "در صف",
+    "fetching_audio": "دانلود صدا",
+    "fetching_video": "دانلود ویدیو",
+    "extracting": "تبدیل صدا",
+    "completed": "تکمیل شده",
+    "failed": "ناموفق",
+}
+
+
+def _get_extraction_semaphore() -> asyncio.Semaphore:
+    """دریافت سمافور استخراج صدا"""
+    global _extraction_semaphore
+    if _extraction_semaphore is None:
+        _extraction_semaphore = asyncio.Semaphore(AUDIO_EXTRACTION_WORKERS)
+    return _extraction_semaphore
+
+
+def _set_progress(item_key: str, stage: str, percent: float = 0.0) -> None:
+    """بروزرسانی پیشرفت یک آیتم"""
+    audio_item_progress[item_key] = {"stage": stage, "percent": percent}
+
+
+def _fetch_bestaudio(url: str, output_dir: str) -> Optional[str]:
+    """
+    دانلود مستقیم بهترین جریان صوتی با yt-dlp (بدون پس‌پردازش)
+
+    Args:
+        url: آدرس ویدیو
+        output_dir: دایرکتوری خروجی
+
+    Returns:
+        مسیر فایل صوتی خام یا None در صورت خطا
+    """
+    import yt_dlp
+    from telegram_downloader import YOUTUBE_COOKIE_FILE, is_youtube_url
+
+    file_id = uuid.uuid4().hex[:12]
+    ydl_opts = {
+        'format': 'bestaudio[ext=m4a]/bestaudio',
+        'outtmpl': os.path.join(output_dir, f'bulk_audio_{file_id}.%(ext)s'),
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+        'retries': 5,
+        'socket_timeout': 30,
+    }
+    if is_youtube_url(url):
+        ydl_opts['cookiefile'] = YOUTUBE_COOKIE_FILE
+
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl.download([url])
+    except Exception as e:
+        scope = current_scope.get()
+        if scope is not None and scope.cancelled:
+            # آیتم لغو شده: حذف فایل نیمه‌کاره و عدم تلاش با روش پشتیبان
+            scope.cleanup()
+            return None
+        request_governor.report_exception(url, e)
+        logger.warning(f"دانلود مستقیم صدا ناموفق بود ({url}): {e}")
+
+    files = glob.glob(os.path.join(output_dir, f'bulk_audio_{file_id}.*'))
+    files = [f for f in files if not f.endswith('.part') and os.path.getsize(f) > 0]
+    return files[0] if files else None
+
+
+async def _fetch_video(url: str) -> Optional[str]:
+    """دانلود ویدیو با دانلودرهای تردهای دانلود چندگانه (مسیر پشتیبان)"""
+    from telegram_downloader import is_instagram_url, is_youtube_url
+    from bulk_download_handler import get_worker_downloader, run_bulk_job
+
+    if is_instagram_url(url):
+        return await run_bulk_job(lambda: get_worker_downloader('instagram').download_post(url, "best"))
+    if is_youtube_url(url):
+        return await run_bulk_job(lambda: get_worker_downloader('youtube').download_video(url, "best"))
+    return None
+
+
+async def _extract_to_mp3(source_path: str, item_key: str) -> Optional[str]:
+    """
+    تبدیل فایل صوتی/ویدیویی به MP3 در یکی از پردازه‌های محدود ffmpeg
+
+    Args:
+        source_path: مسیر فایل ورودی
+        item_key: کلید آیتم برای گزارش پیشرفت
+
+    Returns:
+        مسیر فایل MP3 یا None در صورت خطا
+    """
+    from telegram_fixes import FFMPEG_PATH
+
+    base_name, _ = os.path.splitext(source_path)
+    audio_path = f"{base_name}_audio.{AUDIO_OUTPUT_FORMAT}"
+
+    cmd = [
+        FFMPEG_PATH,
+        '-i', source_path,
+        '-vn',
+        '-acodec', 'libmp3lame',
+        '-ab', AUDIO_OUTPUT_BITRATE,
+        '-ar', '44100',
+        '-ac', '2',
+        '-y',
+        audio_path
+    ]
+
+    def on_progress(progress: Dict):
+        if progress.get('percent') is not None:
+            _set_progress(item_key, "extracting", progress['percent'])
+
+    async with _get_extraction_semaphore():
+        _set_progress(item_key, "extracting", 0.0)
+        result = await run_ffmpeg_async(cmd, progress_callback=on_progress)
+
+    if result.returncode == 0 and os.path.exists(audio_path) and os.path.getsize(audio_path) > 0:
+        return audio_path
+
+    logger.error(f"خطا در تبدیل صدا ({result.exit_class}): {result.stderr[-300:]}")
+    return None
+
+
+async def download_audio_item(url: str, item_key: str) -> Optional[str]:
+    """
+    دریافت فایل صوتی یک آیتم از دسته
+
+    Args:
+        url: آدرس ویدیو
+        item_key: کلید آیتم (batch_id_index) برای گزارش پیشرفت
+
+    Returns:
+        مسیر فایل MP3 یا None در صورت خطا
+    """
+    from telegram_downloader import TEMP_DOWNLOAD_DIR
+
+    os.makedirs(TEMP_DOWNLOAD_DIR, exist_ok=True)
+
+    try:
+        # مرحله 1: دانلود مستقیم جریان صوتی
+        _set_progress(item_key, "fetching_audio")
+        # محدوده لغو آیتم همراه context به ترد دانلود منتقل می‌شود
+        source_path = await run_scoped_thread(_fetch_executor, _fetch_bestaudio, url, TEMP_DOWNLOAD_DIR)
+        is_temp_source = source_path is not None
+
+        # مرحله 2: دانلود ویدیو در صورت شکست روش مستقیم
+        if not source_path:
+            logger.info(f"جریان صوتی مستقیم در دسترس نبود، دانلود ویدیو: {url}")
+            _set_progress(item_key, "fetching_video")
+            source_path = await _fetch_video(url)
+
+        if not source_path or not os.path.exists(source_path):
+            _set_progress(item_key, "failed")
+            return None
+
+        # مرحله 3: تبدیل به MP3
+        audio_path = await _extract_to_mp3(source_path, item_key)
+
+        # حذف فایل صوتی خام (فایل ویدیویی در کش دانلودر باقی می‌ماند)
+        if is_temp_source and audio_path:
+            try:
+                os.remove(source_path)
+            except OSError:
+                pass
+
+        _set_progress(item_key, "completed" if audio_path else "failed", 100.0 if audio_path else 0.0)
+        return audio_path
+
+    except Exception as e:
+        logger.error(f"خطا در خط لوله صوتی برای {url}: {e}")
+        _set_progress(item_key, "failed")
+        return None
+
+
+def clear_batch_progress(batch_id: str) -> None:
+    """حذف پیشرفت آیتم‌های یک دسته پس از پایان پردازش آن"""
+    prefix = f"{batch_id}_"
+    for item_key in [key for key in audio_item_progress if key.startswith(prefix)]:
+        audio_item_progress.pop(item_key, None)
+
+
+def get_batch_audio_summary(batch_id: str, total: int) -> str:
+    """
+    ساخت خلاصه متنی پیشرفت آیتم‌های صوتی یک دسته
+
+    Args:
+        batch_id: شناسه دسته
+        total: تعداد کل آیتم‌ها
+
+    Returns:
+        متن خلاصه (شمارش هر مرحله و پیشرفت آیتم‌های در حال تبدیل)
+    """
+    stage_counts: Dict[str, int] = {}
+    extracting = []
+    for index in range(total):
+        progress = audio_item_progress.get(f"{batch_id}_{index}", {"stage": "queued", "percent": 0.0})
+        stage_counts[progress["stage"]] = stage_counts.get(progress["stage"], 0) + 1
+        if progress["stage"] == "extracting":
+            extracting.append(f"#{index + 1}: {progress['percent']:.0f}%")
+
+    lines = [f"{STAGE_LABELS.get(stage, stage)}: {count}" for stage, count in stage_counts.items()]
+    if extracting:
+        lines.append("🎵 " + "، ".join(extracting))
+    return "\n".join(lines)
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+سنجش توان عملیاتی دانلود چندگانه (BulkDownloadManager) با سرور رسانه محلی
+
+یک سرور HTTP محلی فایل‌های رسانه ساختگی را با تأخیر، پهنای باند و خطای قابل تنظیم سرو می‌کند و
+دانلودرهای تردهای دانلود چندگانه با دانلودر ساختگی جایگزین می‌شوند که به جای یوتیوب از این سرور
+اطلاعات (/info) و فایل (/media) را دریافت می‌کند. برای هر مقدار همزمانی یک پردازه جداگانه با
+تنظیمات محیطی همان مقدار اجرا می‌شود و خروجی JSON شامل آیتم بر ثانیه و صدک‌های 50/95/99 هر
+مرحله (انتظار در صف، استخراج، دریافت، کل) است تا بین commit ها قابل مقایسه باشد.
+
+استفاده:
+    python bulk_benchmark.py -n 100 --concurrency 2,4,8 --size-kb 2048 --latency-ms 50 --bandwidth-kbps 4096
+    python bulk_benchmark.py -n 200 --concurrency 8 --error-rate 0.05 --reset-rate 0.02 -o bench.json
+"""
+
+import os
+import sys
+import time
+import json
+import uuid
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from webhook_server import _percentile
+
+# اندازه هر قطعه ارسال فایل (بایت)
+CHUNK_SIZE = 64 * 1024
+# مراحل اندازه‌گیری شده هر آیتم
+STAGES = ('queue_wait', 'extract', 'fetch', 'total')
+# مهلت هر درخواست دانلودر ساختگی (ثانیه)
+REQUEST_TIMEOUT = 60
+
+
+class MediaOrigin:
+    """سرور HTTP محلی با فایل‌های رسانه ساختگی و تزریق تأخیر/خطا"""
+
+    def __init__(self, size_kb: int = 1024, latency_ms: float = 0.0, bandwidth_kbps: float = 0.0,
+                 error_rate: float = 0.0, reset_rate: float = 0.0, port: int = 0, seed: Optional[int] = None):
+        """
+        Args:
+            size_kb: حجم هر فایل رسانه (کیلوبایت)
+            latency_ms: تأخیر پیش از پاسخ هر درخواست (میلی‌ثانیه)
+            bandwidth_kbps: سقف سرعت هر اتصال (کیلوبایت بر ثانیه، صفر یعنی بدون محدودیت)
+            error_rate: احتمال پاسخ 500 برای هر درخواست
+            reset_rate: احتمال قطع اتصال در میانه ارسال فایل
+            port: پورت (صفر یعنی پورت آزاد دلخواه)
+            seed: بذر تصادفی برای تکرارپذیری خطاها
+        """
+        self.size = size_kb * 1024
+        self.latency = latency_ms / 1000
+        self.bandwidth = bandwidth_kbps * 1024
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._payload = bytes(range(256)) * (CHUNK_SIZE // 256)
+        self.stats = {'requests': 0, 'errors_injected': 0, 'resets_injected': 0, 'bytes_sent': 0}
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def _roll(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += amount
+
+    def _make_handler(self):
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                origin._count('requests')
+                if origin.latency:
+                    time.sleep(origin.latency)
+                if origin._roll(origin.error_rate):
+                    origin._count('errors_injected')
+                    self.send_error(500, 'injected error')
+                    return
+
+                media_id = self.path.rsplit('/', 1)[-1].split('.')[0]
+                if self.path.startswith('/info/'):
+                    body = json.dumps({'id': media_id, 'url': f"{origin.base_url}/media/{media_id}.mp4",
+                                       'filesize': origin.size}).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                if not self.path.startswith('/media/'):
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'video/mp4')
+                self.send_header('Content-Length', str(origin.size))
+                self.end_headers()
+                reset_at = origin._random.randint(0, origin.size) if origin._roll(origin.reset_rate) else None
+                sent = 0
+                while sent < origin.size:
+                    chunk = origin._payload[:min(CHUNK_SIZE, origin.size - sent)]
+                    if reset_at is not None and sent + len(chunk) > reset_at:
+                        origin._count('resets_injected')
+                        self.close_connection = True
+                        return
+                    started = time.monotonic()
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+                    if origin.bandwidth:
+                        delay = len(chunk) / origin.bandwidth - (time.monotonic() - started)
+                        if delay > 0:
+                            time.sleep(delay)
+                origin._count('bytes_sent', sent)
+
+        return Handler
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, name='media_origin', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class OriginDownloader:
+    """دانلودر ساختگی به جای InstagramDownloader/YouTubeDownloader که از سرور محلی دریافت می‌کند"""
+
+    def __init__(self, origin_url: str, output_dir: str):
+        self.origin_url = origin_url
+        self.output_dir = output_dir
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, url: str) -> bytes:
+        with urllib.request.urlopen(url, timeout=REQUEST_TIMEOUT) as response:
+            return response.read()
+
+    def _download(self, url: str) -> str:
+        media_id = url.rsplit('=', 1)[-1].rsplit('/', 1)[-1]
+        timing = {'extract_start': time.monotonic()}
+        with self._lock:
+            self.timings[media_id] = timing
+
+        # مرحله استخراج: دریافت اطلاعات و آدرس فایل
+        info = json.loads(self._get(f"{self.origin_url}/info/{media_id}"))
+        timing['extract_end'] = time.monotonic()
+
+        # مرحله دریافت: ذخیره جریانی فایل روی دیسک
+        file_path = os.path.join(self.output_dir, f"{media_id}.mp4")
+        with urllib.request.urlopen(info['url'], timeout=REQUEST_TIMEOUT) as response, open(file_path, 'wb') as f:
+            received = 0
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                received += len(chunk)
+        if received < info['filesize']:
+            os.remove(file_path)
+            raise IOError(f"دریافت ناقص ({received} از {info['filesize']} بایت)")
+        timing['fetch_end'] = time.monotonic()
+        return file_path
+
+    async def download_video(self, url: str, quality: str = 'best') -> Optional[str]:
+        return self._download(url)
+
+    async def download_post(self, url: str, quality: str = 'best') -> Optional[str]:
+        return self._download(url)
+
+
+def _stage_summary(samples: List[float]) -> Dict:
+    return {
+        'count': len(samples),
+        'p50_ms': round(_percentile(samples, 50) * 1000, 1),
+        'p95_ms': round(_percentile(samples, 95) * 1000, 1),
+        'p99_ms': round(_percentile(samples, 99) * 1000, 1),
+    }
+
+
+async def run_batches(origin_url: str, items: int, batches: int, output_dir: str) -> Dict:
+    """
+    اجرای دسته‌ها روی BulkDownloadManager با دانلودر ساختگی (درون پردازه اجرای یک مقدار همزمانی)
+
+    Args:
+        origin_url: آدرس سرور رسانه محلی
+        items: تعداد کل آیتم‌ها
+        batches: تعداد دسته‌ها (آیتم‌ها بین آن‌ها تقسیم می‌شوند و کاربران جداگانه دارند)
+        output_dir: دایرکتوری فایل‌های دانلود شده
+
+    Returns:
+        نتایج این اجرا
+    """
+    import bulk_download_handler
+    from bulk_download_handler import get_download_manager, MAX_CONCURRENT_DOWNLOADS
+    from bulk_state_store import ITEM_COMPLETED
+
+    downloader = OriginDownloader(origin_url, output_dir)
+    bulk_download_handler._downloader_overrides['youtube'] = downloader
+    bulk_download_handler._downloader_overrides['instagram'] = downloader
+    download_manager = get_download_manager()
+
+    # ثبت زمان پایان هر آیتم
+    finished: Dict[str, tuple] = {}
+    original_finish = download_manager._finish_item
+
+    def timed_finish(batch_id, index, status, *args, **kwargs):
+        finished[f"{batch_id}_{index}"] = (time.monotonic(), status)
+        return original_finish(batch_id, index, status, *args, **kwargs)
+
+    download_manager._finish_item = timed_finish
+
+    submitted: Dict[str, tuple] = {}
+    started = time.monotonic()
+    for batch_number in range(batches):
+        count = items // batches + (1 if batch_number < items % batches else 0)
+        media_ids = [uuid.uuid4().hex[:11] for _ in range(count)]
+        urls = [f"https://www.youtube.com/watch?v={media_id}" for media_id in media_ids]
+        before = set(download_manager.pending_downloads)
+        submit_time = time.monotonic()
+        await download_manager.add_urls_to_queue(urls, user_id=1000 + batch_number, quality='best')
+        batch_id = next(iter(set(download_manager.pending_downloads) - before))
+        for index, media_id in enumerate(media_ids):
+            submitted[f"{batch_id}_{index}"] = (submit_time, media_id)
+
+    while len(finished) < len(submitted):
+        await asyncio.sleep(0.05)
+    elapsed = time.monotonic() - started
+
+    stages = {stage: [] for stage in STAGES}
+    failed = 0
+    for key, (submit_time, media_id) in submitted.items():
+        end_time, status = finished[key]
+        if status != ITEM_COMPLETED:
+            failed += 1
+            continue
+        timing = downloader.timings.get(media_id, {})
+        stages['total'].append(end_time - submit_time)
+        if 'extract_start' in timing:
+            stages['queue_wait'].append(timing['extract_start'] - submit_time)
+        if 'extract_end' in timing:
+            stages['extract'].append(timing['extract_end'] - timing['extract_start'])
+        if 'fetch_end' in timing:
+            stages['fetch'].append(timing['fetch_end'] - timing['extract_end'])
+
+    completed = len(submitted) - failed
+    return {
+        'workers': MAX_CONCURRENT_DOWNLOADS,
+        'items': len(submitted),
+        'completed': completed,
+        'failed': failed,
+        'elapsed_s': round(elapsed, 3),
+        'items_per_s': round(completed / elapsed, 2) if elapsed else 0.0,
+        'stages': {stage: _stage_summary(samples) for stage, samples in stages.items()},
+    }
+
+
+def _run_child(args) -> int:
+    """اجرای یک مقدار همزمانی (فراخوانی شده توسط پردازه والد)"""
+    logging.disable(logging.CRITICAL)
+    result = asyncio.run(run_batches(args.origin, args.requests, args.batches, args.output_dir))
+    print(json.dumps(result))
+    return 0
+
+
+def _spawn_run(args, workers: int, origin_url: str, work_dir: str) -> Dict:
+    """اجرای پردازه جداگانه با تنظیمات محیطی یک مقدار همزمانی"""
+    run_dir = tempfile.mkdtemp(prefix=f'w{workers}_', dir=work_dir)
+    env = dict(os.environ)
+    env.update({
+        'BULK_WORKERS': str(workers),
+        'FAIR_SCHEDULER_SLOTS': str(workers + 4),
+        'BULK_STATE_DB': os.path.join(run_dir, 'bulk_state.db'),
+        'BULK_DELIVERY_ENABLED': 'false',
+    })
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', '--origin', origin_url,
+           '-n', str(args.requests), '--batches', str(args.batches), '--output-dir', run_dir]
+    # اجرا در دایرکتوری همان اجرا: مسیرهای نسبی ربات (کش، دانلودها، pending_downloads.json قدیمی)
+    # به داده‌های واقعی مخزن دست نمی‌زنند؛ ماژول‌ها از دایرکتوری اسکریپت import می‌شوند
+    completed = subprocess.run(cmd, env=env, capture_output=True, text=True, timeout=args.run_timeout,
+                               cwd=run_dir)
+    if completed.returncode != 0:
+        return {'workers': workers, 'error': completed.stderr.strip()[-2000:]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="سنجش توان عملیاتی دانلود چندگانه با سرور رسانه محلی")
+    parser.add_argument('-n', '--requests', type=int, default=64, help="تعداد کل آیتم‌ها در هر اجرا")
+    parser.add_argument('--batches', type=int, default=4, help="تعداد دسته‌ها (هر دسته یک کاربر جداگانه)")
+    parser.add_argument('--concurrency', default='2,4,8', help="مقادیر همزمانی (BULK_WORKERS) با کاما")
+    parser.add_argument('--size-kb', type=int, default=1024, help="حجم هر فایل رسانه (کیلوبایت)")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="تأخیر هر درخواست سرور (میلی‌ثانیه)")
+    parser.add_argument('--bandwidth-kbps', type=float, default=0.0, help="سقف سرعت هر اتصال (KB/s، صفر یعنی نامحدود)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="احتمال پاسخ 500")
+    parser.add_argument('--reset-rate', type=float, default=0.0, help="احتمال قطع اتصال در میانه فایل")
+    parser.add_argument('--seed', type=int, default=None, help="بذر تصادفی تزریق خطا")
+    parser.add_argument('--run-timeout', type=float, default=600.0, help="مهلت هر اجرا (ثانیه)")
+    parser.add_argument('-o', '--output', help="ذخیره نتیجه JSON در فایل")
+    # آرگومان‌های داخلی پردازه فرزند
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--origin', help=argparse.SUPPRESS)
+    parser.add_argument('--output-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return _run_child(args)
+
+    origin = MediaOrigin(args.size_kb, args.latency_ms, args.bandwidth_kbps, args.error_rate,
+                         args.reset_rate, seed=args.seed)
+    origin.start()
+    runs = []
+    try:
+        with tempfile.TemporaryDirectory(prefix='bulk_bench_') as work_dir:
+            for workers in [int(value) for value in args.concurrency.split(',') if value.strip()]:
+                runs.append(_spawn_run(args, workers, origin.base_url, work_dir))
+    finally:
+        origin.stop()
+
+    result = {
+        'commit': _git_commit(),
+        'timestamp': int(time.time()),
+        'config': {
+            'items': args.requests,
+            'batches': args.batches,
+            'size_kb': args.size_kb,
+            'latency_ms': args.latency_ms,
+            'bandwidth_kbps': args.bandwidth_kbps,
+            'error_rate': args.error_rate,
+            'reset_rate': args.reset_rate,
+        },
+        'origin': origin.stats,
+        'runs': runs,
+    }
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    return 0 if all('error' not in run for run in runs) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,67 +8,402 @@ import os
 import re
 import asyncio
 import logging
-from typing import List, Dict, Optional, Set, Tuple
+import functools
+from typing import Awaitable, Callable, List, Dict, Optional, Set, Tuple
 import time
 import threading
 import uuid
-import json
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 
+from bulk_state_store import (BulkStateStore, ITEM_CANCELLED, ITEM_COMPLETED, ITEM_DOWNLOADING, ITEM_FAILED)
+from cancel_scope import (CancelScope, REASON_CANCELLED, REASON_DEADLINE, current_scope,
+                          install_ytdlp_cancellation, run_scoped_thread)
+from fair_scheduler import fair_scheduler, CLASS_BULK, FAIR_BULK_MAX_RUNNING
+from file_id_cache import get_file_id
+from upload_pipeline import upload_pipeline, MediaItem, KIND_AUDIO, KIND_DOCUMENT, KIND_VIDEO
+
 # تنظیم لاگر
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# محل ذخیره‌سازی فایل‌های در حال دانلود
-PENDING_DOWNLOADS_FILE = "pending_downloads.json"
+# حداکثر دانلودهای همزمان (تعداد کارگرهای دائمی و تردهای اجرایی دانلود چندگانه؛ با BULK_WORKERS
+# تنظیم می‌شود و برابر سقف همزمانی کلاس bulk در زمان‌بند منصفانه است)
+MAX_CONCURRENT_DOWNLOADS = FAIR_BULK_MAX_RUNNING
+# مهلت هر آیتم دسته (ثانیه، صفر یعنی بدون مهلت)
+BULK_ITEM_TIMEOUT = float(os.environ.get('BULK_ITEM_TIMEOUT', '900'))
+# مهلت کل دسته (ثانیه، صفر یعنی بدون مهلت)
+BULK_BATCH_TIMEOUT = float(os.environ.get('BULK_BATCH_TIMEOUT', '7200'))
+
+# محل اجرای دانلودها: inprocess (کارگرهای داخل پردازه ربات) یا external (پردازه‌های bulk_worker.py
+# که کارها را از صف مشترک پایگاه داده وضعیت برمی‌دارند؛ ربات فقط صف‌بندی و ارسال می‌کند)
+BULK_WORKER_MODE = os.environ.get('BULK_WORKER_MODE', 'inprocess').lower()
+WORKER_MODE_EXTERNAL = 'external'
+# فاصله بررسی نتایج کارگرهای خارجی در پایگاه داده (ثانیه)
+BULK_POLL_INTERVAL = float(os.environ.get('BULK_POLL_INTERVAL', '1.0'))
+
+# اعمال لغو و مهلت آیتم‌ها به دانلودهای yt-dlp و پردازه‌های فرزند آن
+install_ytdlp_cancellation()
 
-# حداکثر دانلودهای همزمان - افزایش یافته به شکل قابل توجه برای بهبود چندبرابری عملکرد
-MAX_CONCURRENT_DOWNLOADS = 15
+# ارسال خودکار هر آیتم دسته به چت کاربر به محض آماده شدن
+BULK_DELIVERY_ENABLED = os.environ.get('BULK_DELIVERY_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# ارسال آیتم‌ها به ترتیب لینک‌های پیام
+BULK_DELIVERY_IN_ORDER = os.environ.get('BULK_DELIVERY_IN_ORDER', 'false').lower() in ('1', 'true', 'yes')
+# حداکثر آیتم آماده‌ای که در حالت ترتیبی منتظر آیتم‌های قبلی می‌ماند
+BULK_DELIVERY_WINDOW = int(os.environ.get('BULK_DELIVERY_WINDOW', '5'))
 
-# فاصله زمانی بین دانلودها (به ثانیه) - حذف تقریبی تأخیر برای شروع تقریباً همزمان
-DOWNLOAD_DELAY = 0.1
+# پسوندهای فایل برای انتخاب نوع ارسال
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.aac', '.ogg', '.opus', '.wav', '.flac')
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.webm', '.mov', '.avi')
 
 # مدیریت صف دانلود
-download_queue = asyncio.Queue()
 active_downloads = set()
 download_results = {}
 download_status = {}
 
-# تنظیم سمافور برای محدود کردن تعداد دانلودهای همزمان
-download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
-
 # قفل برای همگام‌سازی دسترسی به منابع مشترک
 lock = threading.Lock()
 
+# الگوهای شناسه محتوا برای حذف لینک‌های تکراری یک دسته
+YOUTUBE_ID_PATTERN = re.compile(
+    r'(?:youtube\.com/(?:watch\?(?:[^#\s]*&)?v=|shorts/|embed/|live/)|youtu\.be/)([A-Za-z0-9_-]{11})')
+INSTAGRAM_SHORTCODE_PATTERN = re.compile(r'instagram\.com/(?:[\w.]+/)?(?:p|reel|reels|tv)/([A-Za-z0-9_-]+)')
+
+# پول اجرایی دائمی دانلود چندگانه (هر ترد یک event loop ماندگار دارد)
+_bulk_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix='bulk')
+_worker_state = threading.local()
+
+# دانلودرهای جایگزین برای همه تردها (مثلاً دانلودر شبیه‌ساز bulk_benchmark)
+_downloader_overrides: Dict[str, object] = {}
+
+
+def canonicalize_url(url: str) -> Tuple[str, str]:
+    """
+    تبدیل لینک به شکل استاندارد و کلید محتوا
+
+    مثلاً youtu.be/X و youtube.com/watch?v=X و youtube.com/shorts/X یک کلید (youtube:X) دارند.
+
+    Args:
+        url: لینک استخراج شده از پیام
+
+    Returns:
+        (لینک استاندارد, کلید محتوا)
+    """
+    match = YOUTUBE_ID_PATTERN.search(url)
+    if match:
+        video_id = match.group(1)
+        return f"https://www.youtube.com/watch?v={video_id}", f"youtube:{video_id}"
+
+    match = INSTAGRAM_SHORTCODE_PATTERN.search(url)
+    if match:
+        from telegram_downloader import normalize_instagram_url
+        return normalize_instagram_url(url if url.startswith('http') else f"https://{url}"), f"instagram:{match.group(1)}"
+
+    return url, url
+
+
+def bulk_file_id_key(content_key: str, quality: str) -> str:
+    """کلید file_id یک محتوا با کیفیت مشخص در کش file_id"""
+    return f"{content_key}:{quality}"
+
+
+def delivery_kind(quality: str, file_path: Optional[str] = None) -> str:
+    """
+    نوع ارسال آیتم دسته
+
+    Args:
+        quality: کیفیت درخواستی دسته
+        file_path: مسیر فایل (در صورت وجود، پسوند آن تعیین‌کننده است)
+
+    Returns:
+        KIND_AUDIO، KIND_VIDEO یا KIND_DOCUMENT
+    """
+    if file_path:
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension in AUDIO_EXTENSIONS:
+            return KIND_AUDIO
+        if extension in VIDEO_EXTENSIONS:
+            return KIND_VIDEO
+        return KIND_DOCUMENT
+    return KIND_AUDIO if quality == "audio" else KIND_VIDEO
+
+
+class _BatchDelivery:
+    """وضعیت ارسال آیتم‌های یک دسته به چت کاربر"""
+
+    def __init__(self, indices: List[int]):
+        self.order = deque(sorted(indices))  # آیتم‌های ارسال نشده به ترتیب لینک‌ها
+        self.ready: Dict[int, Tuple[Optional[str], Optional[str]]] = {}  # شماره -> (مسیر فایل, file_id)
+        self.skipped: Set[int] = set()  # آیتم‌های ناموفق یا ارسال شده خارج از ترتیب
+        self.remaining = len(self.order)  # آیتم‌هایی که هنوز ارسال یا رد نشده‌اند
+        self.sending = False  # ارسال ترتیبی در جریان است
+
+
+def get_worker_downloader(platform: str):
+    """
+    دریافت دانلودر ترد کارگر فعلی (داخل run_bulk_job فراخوانی شود)
+
+    نشست Instaloader برای استفاده همزمان چند ترد امن نیست؛ هر ترد دائمی دانلود چندگانه
+    نمونه خود را یک بار می‌سازد و آیتم‌های همان ترد آن را به نوبت استفاده می‌کنند.
+
+    Args:
+        platform: instagram یا youtube
+
+    Returns:
+        نمونه InstagramDownloader یا YouTubeDownloader ترد فعلی
+    """
+    override = _downloader_overrides.get(platform)
+    if override is not None:
+        return override
+
+    downloaders = getattr(_worker_state, 'downloaders', None)
+    if downloaders is None:
+        downloaders = _worker_state.downloaders = {}
+    downloader = downloaders.get(platform)
+    if downloader is None:
+        from telegram_downloader import InstagramDownloader, YouTubeDownloader
+        downloader = InstagramDownloader() if platform == 'instagram' else YouTubeDownloader()
+        downloaders[platform] = downloader
+    return downloader
+
+
+def _run_in_worker_loop(coro_factory: Callable[[], Awaitable]):
+    """اجرای کوروتین روی event loop ماندگار ترد فعلی (بدون ساخت loop جدید برای هر آیتم)"""
+    loop = getattr(_worker_state, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _worker_state.loop = loop
+    try:
+        return loop.run_until_complete(coro_factory())
+    finally:
+        # فایل‌های نیمه‌کاره آیتم لغو شده پس از توقف واقعی دانلود حذف می‌شوند
+        scope = current_scope.get()
+        if scope is not None and scope.cancelled:
+            scope.cleanup()
+
+
+async def run_bulk_job(coro_factory: Callable[[], Awaitable]):
+    """
+    اجرای کوروتین دانلود در یکی از تردهای دائمی دانلود چندگانه
+
+    متدهای دانلودرها بخش‌هایی مسدودکننده دارند، بنابراین روی loop اصلی اجرا نمی‌شوند.
+    محدوده لغو آیتم فعلی (current_scope) همراه context به ترد مقصد منتقل می‌شود، مهلت آیتم از
+    گرفتن ترد شروع می‌شود و آیتم لغو شده تا پایان واقعی ترد جای خود را نگه می‌دارد.
+
+    Args:
+        coro_factory: تابعی که کوروتین را می‌سازد (کوروتین در ترد مقصد ساخته و اجرا می‌شود)
+
+    Returns:
+        خروجی کوروتین
+    """
+    return await run_scoped_thread(_bulk_executor, _run_in_worker_loop, coro_factory)
+
+
+async def fetch_bulk_item(url: str, quality: str, key: str) -> Optional[str]:
+    """
+    دریافت فایل یک آیتم دسته (کش، خط لوله صدا یا دانلودر ترد کارگر)
+
+    هم کارگرهای داخل ربات و هم پردازه‌های bulk_worker از این تابع استفاده می‌کنند.
+
+    Args:
+        url: لینک استاندارد آیتم
+        quality: کیفیت درخواستی دسته
+        key: شناسه آیتم ({batch_id}_{index})
+
+    Returns:
+        مسیر فایل دانلود شده یا None در صورت شکست
+    """
+    from telegram_downloader import get_from_cache, is_instagram_url, is_youtube_url, add_to_cache
+
+    # بررسی کش برای جلوگیری از دانلود مجدد
+    cached_file = get_from_cache(url, quality)
+    if cached_file:
+        logger.info(f"فایل از کش برگردانده شد: {cached_file}")
+        return cached_file
+
+    # انتخاب دانلودر مناسب بر اساس نوع URL
+    if quality == "audio" and (is_instagram_url(url) or is_youtube_url(url)):
+        # خط لوله دسته‌ای صدا: دانلود مستقیم صدا و تبدیل در پردازه‌های محدود ffmpeg
+        from bulk_audio_pipeline import download_audio_item
+        downloaded_file = await download_audio_item(url, key)
+    elif is_instagram_url(url):
+        # دانلودر ترد دائمی دانلود چندگانه (دانلودر داخل همان ترد گرفته می‌شود)
+        downloaded_file = await run_bulk_job(
+            lambda: get_worker_downloader('instagram').download_post(url, quality))
+    elif is_youtube_url(url):
+        downloaded_file = await run_bulk_job(
+            lambda: get_worker_downloader('youtube').download_video(url, quality))
+    else:
+        logger.warning(f"URL نامعتبر: {url}")
+        return None
+
+    if downloaded_file:
+        # افزودن به کش برای استفاده‌های بعدی
+        add_to_cache(url, downloaded_file, quality)
+    return downloaded_file
+
+
 class BulkDownloadManager:
     """کلاس مدیریت دانلود چندگانه"""
     
     def __init__(self):
         """مقداردهی اولیه"""
         self.download_tasks = {}  # نگهداری تسک‌های در حال اجرا
+        self._queue: Optional[asyncio.Queue] = None  # صف آیتم‌ها (روی loop اصلی ساخته می‌شود)
+        self._workers: List[asyncio.Task] = []  # کارگرهای دائمی
+        self.store = BulkStateStore()  # ذخیره‌ساز پایدار وضعیت دسته‌ها
+        self.bot = None  # بات برای ارسال نتایج (در ثبت هندلرها تنظیم می‌شود)
+        self._deliveries: Dict[str, _BatchDelivery] = {}  # وضعیت ارسال دسته‌های فعال
+        self._waiters: Dict[str, List[Tuple[object, int, asyncio.Future]]] = {}  # آیتم‌های منتظر زمان‌بند هر دسته
+        self._running: Dict[str, Tuple[asyncio.Task, CancelScope]] = {}  # آیتم‌های در حال دانلود
+        self._cancelled: Set[str] = set()  # دسته‌های لغو شده در حال پردازش
+        self._remote_waits: Dict[str, asyncio.Future] = {}  # آیتم‌های سپرده شده به کارگرهای خارجی
+        self._poller: Optional[asyncio.Task] = None  # بررسی دوره‌ای نتایج کارگرهای خارجی
         self.load_pending_downloads()  # بارگذاری دانلودهای معلق
         
     def load_pending_downloads(self) -> None:
-        """بارگذاری دانلودهای معلق از فایل"""
+        """بارگذاری دسته‌ها از پایگاه داده وضعیت"""
         try:
-            if os.path.exists(PENDING_DOWNLOADS_FILE):
-                with open(PENDING_DOWNLOADS_FILE, 'r') as f:
-                    self.pending_downloads = json.load(f)
-                logger.info(f"تعداد {len(self.pending_downloads)} دانلود معلق بارگذاری شد")
-            else:
-                self.pending_downloads = {}
+            self.store.compact(force=True)
+            self.pending_downloads = self.store.load_batches()
+            logger.info(f"تعداد {len(self.pending_downloads)} دسته دانلود بارگذاری شد")
         except Exception as e:
             logger.error(f"خطا در بارگذاری دانلودهای معلق: {str(e)}")
             self.pending_downloads = {}
     
-    def save_pending_downloads(self) -> None:
-        """ذخیره دانلودهای معلق در فایل"""
+    async def resume_pending_batches(self) -> None:
+        """قرار دادن مجدد آیتم‌های ناتمام دسته‌ها در صف و ارسال آیتم‌های دانلود شده ارسال نشده"""
+        for batch_id in self.store.unfinished_batches():
+            indices = self.store.unfinished_items(batch_id)
+            if batch_id not in self.pending_downloads:
+                continue
+            undelivered = self.store.undelivered_items(batch_id)
+            logger.info(f"ادامه دسته {batch_id} با {len(indices)} آیتم ناتمام و {len(undelivered)} آیتم ارسال نشده")
+            self._start_delivery(batch_id, indices + [index for index, _, _ in undelivered])
+            for index, file_path, file_id in undelivered:
+                self._item_ready(batch_id, index, file_path, file_id)
+            asyncio.create_task(self.process_batch(batch_id, indices))
+    
+    def _set_batch_status(self, batch_id: str, status: str) -> None:
+        """تغییر وضعیت دسته در حافظه و پایگاه داده"""
+        self.pending_downloads[batch_id]["status"] = status
+        self.store.set_batch_status(batch_id, status)
+    
+    def _finish_item(self, batch_id: str, index: int, status: str, file_path: Optional[str] = None,
+                     file_id: Optional[str] = None) -> None:
+        """ثبت پایان یک آیتم و بروزرسانی پیشرفت دسته (یک نوشتن کوچک در پایگاه داده)"""
+        self.store.set_item_status(batch_id, index, status, file_path, file_id)
+        self._on_item_finished(batch_id, index, status, file_path, file_id)
+    
+    def _on_item_finished(self, batch_id: str, index: int, status: str, file_path: Optional[str] = None,
+                          file_id: Optional[str] = None) -> None:
+        """بروزرسانی پیشرفت دسته در حافظه و ارسال آیتم پایان یافته"""
+        download_status[f"{batch_id}_{index}"] = status
+        with lock:
+            batch = self.pending_downloads[batch_id]
+            batch["completed"] += 1
+            batch["progress"] = (batch["completed"] / batch["total"]) * 100
+        if status == ITEM_COMPLETED:
+            self._item_ready(batch_id, index, file_path, file_id)
+        else:
+            self._item_skipped(batch_id, index)
+    
+    # ---------- ارسال تدریجی نتایج ----------
+    
+    def _start_delivery(self, batch_id: str, indices: List[int]) -> None:
+        """شروع پیگیری ارسال آیتم‌های یک دسته (فقط اگر بات و چت مقصد مشخص باشند)"""
+        if not BULK_DELIVERY_ENABLED or self.bot is None or not indices:
+            return
+        if self.pending_downloads[batch_id].get("chat_id") is None:
+            return
+        self._deliveries[batch_id] = _BatchDelivery(indices)
+    
+    def _item_ready(self, batch_id: str, index: int, file_path: Optional[str], file_id: Optional[str]) -> None:
+        """ثبت آماده شدن آیتم برای ارسال"""
+        state = self._deliveries.get(batch_id)
+        if state is None:
+            return
+        state.ready[index] = (file_path, file_id)
+        self._flush_delivery(batch_id)
+    
+    def _item_skipped(self, batch_id: str, index: int) -> None:
+        """حذف آیتم ناموفق از ترتیب ارسال"""
+        state = self._deliveries.get(batch_id)
+        if state is None:
+            return
+        state.skipped.add(index)
+        self._item_resolved(batch_id, state)
+        self._flush_delivery(batch_id)
+    
+    def _item_resolved(self, batch_id: str, state: _BatchDelivery) -> None:
+        state.remaining -= 1
+        if state.remaining <= 0 and not state.sending:
+            # پس از ارسال همه آیتم‌ها چیزی از دسته در حافظه نمی‌ماند
+            self._deliveries.pop(batch_id, None)
+    
+    def _flush_delivery(self, batch_id: str) -> None:
+        """
+        ارسال آیتم‌های آماده
+
+        در حالت عادی هر آیتم بلافاصله ارسال می‌شود. در حالت ترتیبی آیتم‌ها یکی‌یکی و به ترتیب
+        لینک‌ها ارسال می‌شوند؛ اگر تعداد آیتم‌های آماده منتظر از پنجره بیشتر شود، کوچک‌ترین آن‌ها
+        بدون انتظار برای آیتم‌های قبلی ارسال می‌شود.
+        """
+        state = self._deliveries.get(batch_id)
+        if state is None:
+            return
+        if not BULK_DELIVERY_IN_ORDER:
+            for index in sorted(state.ready):
+                self._deliver(batch_id, index, state)
+            return
+        if state.sending:
+            return
+        while state.order and state.order[0] in state.skipped:
+            state.skipped.discard(state.order.popleft())
+        if state.order and state.order[0] in state.ready:
+            index = state.order.popleft()
+        elif len(state.ready) > BULK_DELIVERY_WINDOW:
+            index = min(state.ready)
+            state.skipped.add(index)
+        else:
+            return
+        state.sending = True
+        self._deliver(batch_id, index, state)
+    
+    def _deliver(self, batch_id: str, index: int, state: _BatchDelivery) -> None:
+        """ارسال یک آیتم از طریق صف آپلود"""
+        file_path, file_id = state.ready.pop(index)
+        batch = self.pending_downloads[batch_id]
+        chat_id = batch["chat_id"]
+        caption = f"📦 {index + 1}/{batch['total']}"
+        kind = delivery_kind(batch["quality"], file_path)
+        
+        async def on_done(success: bool) -> None:
+            if success:
+                self.store.mark_delivered(batch_id, index)
+                download_results.pop(f"{batch_id}_{index}", None)
+            else:
+                logger.error(f"ارسال آیتم {index} از دسته {batch_id} ناموفق بود")
+            state.sending = False
+            self._item_resolved(batch_id, state)
+            self._flush_delivery(batch_id)
+        
         try:
-            with open(PENDING_DOWNLOADS_FILE, 'w') as f:
-                json.dump(self.pending_downloads, f)
-            logger.info(f"تعداد {len(self.pending_downloads)} دانلود معلق ذخیره شد")
+            if file_path and os.path.exists(file_path):
+                content_key = canonicalize_url(batch["urls"][index])[1]
+                upload_pipeline.submit(self.bot, chat_id, file_path, kind, caption=caption, on_done=on_done,
+                                       cache_key=bulk_file_id_key(content_key, batch["quality"]))
+            elif file_id:
+                upload_pipeline.submit_media_items(self.bot, chat_id, [MediaItem(kind, file_id=file_id)],
+                                                   caption=caption, on_done=on_done)
+            else:
+                logger.warning(f"فایل آیتم {index} از دسته {batch_id} برای ارسال یافت نشد")
+                state.sending = False
+                self._item_resolved(batch_id, state)
         except Exception as e:
-            logger.error(f"خطا در ذخیره دانلودهای معلق: {str(e)}")
+            logger.error(f"خطا در ارسال آیتم {index} از دسته {batch_id}: {str(e)}")
+            state.sending = False
+            self._item_resolved(batch_id, state)
     
     def extract_urls(self, text: str) -> List[str]:
         """استخراج URL‌های یوتیوب و اینستاگرام از متن"""
@@ -97,15 +432,65 @@ class BulkDownloadManager:
             
         return urls
     
-    async def add_urls_to_queue(self, urls: List[str], user_id: int, quality: str = "best") -> str:
-        """افزودن گروهی از URLها به صف دانلود"""
+    def prefilter_urls(self, urls: List[str], quality: str) -> Tuple[List[str], int, Dict[int, Tuple[str, str]]]:
+        """
+        حذف لینک‌های تکراری و یافتن آیتم‌هایی که بدون دانلود قابل پاسخ هستند
+
+        Args:
+            urls: لینک‌های استخراج شده
+            quality: کیفیت درخواستی دسته
+
+        Returns:
+            (لینک‌های یکتای استاندارد, تعداد تکراری‌ها, شماره آیتم -> ('file_path' یا 'file_id', مقدار))
+        """
+        from telegram_downloader import get_from_cache
+
+        unique_urls = []
+        hits = {}
+        seen = set()
+        for url in urls:
+            canonical_url, content_key = canonicalize_url(url)
+            if content_key in seen:
+                continue
+            seen.add(content_key)
+            index = len(unique_urls)
+            unique_urls.append(canonical_url)
+
+            cached_file = get_from_cache(canonical_url, quality) or get_from_cache(url, quality)
+            if cached_file:
+                hits[index] = ('file_path', cached_file)
+                continue
+            file_id = get_file_id(bulk_file_id_key(content_key, quality), delivery_kind(quality))
+            if file_id:
+                hits[index] = ('file_id', file_id)
+
+        return unique_urls, len(urls) - len(unique_urls), hits
+    
+    async def add_urls_to_queue(self, urls: List[str], user_id: int, quality: str = "best",
+                                chat_id: Optional[int] = None) -> str:
+        """
+        افزودن گروهی از URLها به صف دانلود (فقط آیتم‌هایی که در کش نیستند وارد صف می‌شوند)
+
+        Args:
+            urls: لینک‌های استخراج شده
+            user_id: شناسه کاربر
+            quality: کیفیت درخواستی
+            chat_id: چت مقصد برای ارسال تدریجی نتایج (بدون آن فقط /status در دسترس است)
+        """
         if not urls:
             return "هیچ لینک معتبری یافت نشد!"
             
         batch_id = f"batch_{uuid.uuid4().hex[:8]}"
-        logger.info(f"افزودن دسته جدید با شناسه {batch_id} برای کاربر {user_id} با {len(urls)} لینک")
+        urls, duplicates, hits = self.prefilter_urls(urls, quality)
+        cache_hits = sum(1 for kind, _ in hits.values() if kind == 'file_path')
+        file_id_hits = len(hits) - cache_hits
+        logger.info(f"افزودن دسته جدید با شناسه {batch_id} برای کاربر {user_id} با {len(urls)} لینک یکتا "
+                    f"({duplicates} تکراری، {cache_hits} از کش، {file_id_hits} از file_id)")
         
         # ثبت اطلاعات دسته
+        timestamp = time.time()
+        self.store.create_batch(batch_id, user_id, quality, urls, timestamp, chat_id)
+        self.store.set_batch_counts(batch_id, duplicates, cache_hits, file_id_hits)
         self.pending_downloads[batch_id] = {
             "urls": urls,
             "user_id": user_id,
@@ -114,18 +499,43 @@ class BulkDownloadManager:
             "progress": 0,
             "total": len(urls),
             "completed": 0,
-            "timestamp": time.time()
+            "timestamp": timestamp,
+            "duplicates": duplicates,
+            "cache_hits": cache_hits,
+            "file_id_hits": file_id_hits,
+            "queued": len(urls) - len(hits),
+            "chat_id": chat_id
         }
+        self._start_delivery(batch_id, list(range(len(urls))))
         
-        self.save_pending_downloads()
+        # آیتم‌های موجود در کش بلافاصله تکمیل می‌شوند
+        for index, (kind, value) in hits.items():
+            if kind == 'file_path':
+                download_results[f"{batch_id}_{index}"] = value
+                self._finish_item(batch_id, index, ITEM_COMPLETED, file_path=value)
+            else:
+                self._finish_item(batch_id, index, ITEM_COMPLETED, file_id=value)
         
-        # شروع پردازش دسته
-        asyncio.create_task(self.process_batch(batch_id))
+        # شروع پردازش دسته (فقط آیتم‌های غیر کش)
+        misses = [index for index in range(len(urls)) if index not in hits]
+        asyncio.create_task(self.process_batch(batch_id, misses))
         
-        return f"🔄 {len(urls)} لینک به صف دانلود اضافه شد.\n⏳ شناسه دسته: `{batch_id}`\nاز دستور /status_{batch_id} برای بررسی وضعیت استفاده کنید."
+        message = f"🔄 {len(urls)} لینک به صف دانلود اضافه شد."
+        if duplicates:
+            message += f"\n♻️ {duplicates} لینک تکراری حذف شد."
+        if hits:
+            message += f"\n⚡️ {len(hits)} مورد بدون دانلود از کش آماده شد."
+        return message + (f"\n⏳ شناسه دسته: `{batch_id}`\nاز دستور /status_{batch_id} برای بررسی وضعیت "
+                          f"و /cancel_{batch_id} برای لغو استفاده کنید.")
     
-    async def process_batch(self, batch_id: str) -> None:
-        """پردازش یک دسته از URLها به صورت موازی"""
+    async def process_batch(self, batch_id: str, indices: Optional[List[int]] = None) -> None:
+        """
+        پردازش یک دسته از URLها به صورت موازی
+
+        Args:
+            batch_id: شناسه دسته
+            indices: شماره آیتم‌هایی که باید دانلود شوند (پیش‌فرض همه آیتم‌ها)
+        """
         if batch_id not in self.pending_downloads:
             logger.error(f"شناسه دسته {batch_id} یافت نشد")
             return
@@ -135,135 +545,220 @@ class BulkDownloadManager:
         user_id = batch["user_id"]
         quality = batch["quality"]
         
-        # آماده‌سازی تسک‌های دانلود
-        download_tasks = []
+        self._set_batch_status(batch_id, "processing")
         
-        self.pending_downloads[batch_id]["status"] = "processing"
-        self.save_pending_downloads()
+        indices = list(range(len(urls))) if indices is None else indices
+        if BULK_WORKER_MODE == WORKER_MODE_EXTERNAL:
+            done_futures = self._enqueue_remote(batch_id, indices)
+        else:
+            # ثبت آیتم‌ها در صف مجازی کاربر در زمان‌بند منصفانه؛ هر آیتمی که نوبتش برسد
+            # به صف کارگرهای دائمی منتقل می‌شود
+            self._ensure_workers()
+            loop = asyncio.get_running_loop()
+            done_futures = []
+            waiters = self._waiters.setdefault(batch_id, [])
+            for i in indices:
+                done = loop.create_future()
+                done_futures.append(done)
+                item = (urls[i], user_id, quality, batch_id, i, done)
+                waiter = fair_scheduler.submit(user_id, CLASS_BULK,
+                                               functools.partial(loop.call_soon_threadsafe, self._queue.put_nowait, item))
+                waiters.append((waiter, i, done))
         
-        # ایجاد تسک‌های دانلود با استفاده از سمافور برای محدود کردن تعداد دانلودهای همزمان
-        for i, url in enumerate(urls):
-            download_task = asyncio.create_task(self.download_url_with_semaphore(url, user_id, quality, batch_id, i))
-            download_tasks.append(download_task)
-            
-            # اضافه کردن تأخیر بین شروع دانلودها برای جلوگیری از فشار زیاد
-            await asyncio.sleep(DOWNLOAD_DELAY)
-        
-        # منتظر تکمیل تمام دانلودها
-        await asyncio.gather(*download_tasks)
+        # منتظر تکمیل تمام دانلودها (با مهلت کل دسته)
+        if done_futures:
+            _, pending = await asyncio.wait(done_futures, timeout=BULK_BATCH_TIMEOUT or None)
+            if pending:
+                logger.warning(f"مهلت دسته {batch_id} تمام شد، لغو {len(pending)} آیتم باقیمانده")
+                self.cancel_batch(batch_id, REASON_DEADLINE)
+                await asyncio.wait(pending)
         
         # بروزرسانی وضعیت دسته
-        self.pending_downloads[batch_id]["status"] = "completed"
-        self.save_pending_downloads()
+        self._waiters.pop(batch_id, None)
+        if quality == "audio":
+            from bulk_audio_pipeline import clear_batch_progress
+            clear_batch_progress(batch_id)
+        if batch_id in self._cancelled:
+            self._cancelled.discard(batch_id)
+            self._set_batch_status(batch_id, "cancelled")
+            logger.info(f"دسته {batch_id} لغو شد")
+        else:
+            self._set_batch_status(batch_id, "completed")
+            logger.info(f"دسته {batch_id} با موفقیت پردازش شد")
+        self.store.compact()
+    
+    def cancel_batch(self, batch_id: str, reason: str = REASON_CANCELLED) -> int:
+        """
+        لغو آیتم‌های باقیمانده یک دسته
+
+        آیتم‌های منتظر از صف زمان‌بند حذف می‌شوند و آیتم‌های در حال دانلود با لغو تسک و کشتن
+        پردازه‌های فرزند متوقف می‌شوند، بنابراین جای دانلود و فضای دیسک بلافاصله آزاد می‌شود.
+
+        Args:
+            batch_id: شناسه دسته
+            reason: دلیل لغو (cancelled یا deadline)
+
+        Returns:
+            تعداد آیتم‌های لغو شده
+        """
+        batch = self.pending_downloads.get(batch_id)
+        if not batch or batch.get("status") in ("completed", "cancelled"):
+            return 0
+        self._cancelled.add(batch_id)
+        
+        if BULK_WORKER_MODE == WORKER_MODE_EXTERNAL:
+            # لغو در صف مشترک ثبت می‌شود؛ نتیجه آن مانند بقیه نتایج از پایگاه داده دریافت می‌شود
+            count = self.store.cancel_batch_items(batch_id)
+            logger.info(f"لغو {count} آیتم از دسته {batch_id} در صف کارگرهای خارجی ({reason})")
+            return count
+        
+        count = 0
+        for waiter, index, done in self._waiters.get(batch_id, []):
+            if fair_scheduler.cancel(waiter):
+                self._finish_item(batch_id, index, ITEM_CANCELLED)
+                if not done.done():
+                    done.set_result(None)
+                count += 1
+            elif not done.done() and f"{batch_id}_{index}" not in self._running:
+                # آیتم نوبت گرفته و در صف کارگرها است؛ کارگر آن را بدون دانلود لغو شده ثبت می‌کند
+                count += 1
         
-        logger.info(f"دسته {batch_id} با موفقیت پردازش شد")
+        prefix = f"{batch_id}_"
+        for key, (task, scope) in list(self._running.items()):
+            if key.startswith(prefix):
+                scope.cancel(reason)
+                task.cancel()
+                count += 1
+        
+        logger.info(f"لغو {count} آیتم از دسته {batch_id} ({reason})")
+        return count
+    
+    # ---------- کارگرهای خارجی ----------
+    
+    def _enqueue_remote(self, batch_id: str, indices: List[int]) -> List[asyncio.Future]:
+        """
+        سپردن آیتم‌ها به صف مشترک کارگرهای خارجی
+
+        Returns:
+            futureهایی که با رسیدن نتیجه هر آیتم در پایگاه داده کامل می‌شوند
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for index in indices:
+            done = loop.create_future()
+            self._remote_waits[f"{batch_id}_{index}"] = done
+            futures.append(done)
+        self.store.enqueue_items(batch_id, indices)
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll_remote_results())
+        return futures
     
-    async def download_url_with_semaphore(self, url: str, user_id: int, quality: str, batch_id: str, index: int) -> None:
-        """دانلود URL با استفاده از سمافور برای کنترل تعداد دانلودهای همزمان"""
-        async with download_semaphore:
-            await self.download_url(url, user_id, quality, batch_id, index)
+    async def _poll_remote_results(self) -> None:
+        """دریافت دوره‌ای نتایج کارگرهای خارجی تا وقتی آیتم منتظری باقی مانده باشد"""
+        while self._remote_waits:
+            await asyncio.sleep(BULK_POLL_INTERVAL)
+            batch_ids = sorted({key.rsplit('_', 1)[0] for key in self._remote_waits})
+            try:
+                rows = self.store.unreported_results(batch_ids)
+            except Exception as e:
+                logger.error(f"خطا در خواندن نتایج کارگرهای خارجی: {str(e)}")
+                continue
+            for batch_id, index, status, file_path, file_id in rows:
+                key = f"{batch_id}_{index}"
+                done = self._remote_waits.pop(key, None)
+                if done is None:
+                    continue
+                if status == ITEM_COMPLETED and file_path:
+                    download_results[key] = file_path
+                self._on_item_finished(batch_id, index, status, file_path, file_id)
+                if not done.done():
+                    done.set_result(None)
+            if rows:
+                try:
+                    self.store.mark_reported([(batch_id, index) for batch_id, index, *_ in rows])
+                except Exception as e:
+                    # نتیجه‌های برداشته شده در دور بعد دوباره خوانده و نادیده گرفته می‌شوند
+                    logger.error(f"خطا در ثبت برداشت نتایج کارگرهای خارجی: {str(e)}")
     
-    async def download_url(self, url: str, user_id: int, quality: str, batch_id: str, index: int) -> None:
+    def _ensure_workers(self) -> None:
+        """راه‌اندازی کارگرهای دائمی روی loop اصلی (فقط در اولین دسته)"""
+        if self._workers and not all(worker.done() for worker in self._workers):
+            return
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(MAX_CONCURRENT_DOWNLOADS)]
+        logger.info(f"{MAX_CONCURRENT_DOWNLOADS} کارگر دائمی دانلود چندگانه راه‌اندازی شد")
+    
+    async def _worker(self) -> None:
+        """کارگر دائمی: دریافت آیتم از صف و دانلود آن"""
+        while True:
+            url, user_id, quality, batch_id, index, done = await self._queue.get()
+            try:
+                if batch_id in self._cancelled:
+                    self._finish_item(batch_id, index, ITEM_CANCELLED)
+                else:
+                    await self._run_item(url, user_id, quality, batch_id, index)
+            finally:
+                fair_scheduler.release(CLASS_BULK)
+                if not done.done():
+                    done.set_result(None)
+                self._queue.task_done()
+    
+    async def _run_item(self, url: str, user_id: int, quality: str, batch_id: str, index: int) -> None:
+        """اجرای دانلود یک آیتم به صورت تسک قابل لغو با مهلت آیتم"""
+        key = f"{batch_id}_{index}"
+        # مهلت آیتم از لحظه گرفتن ترد دانلود شمرده می‌شود (run_scoped_thread)
+        scope = CancelScope(key, BULK_ITEM_TIMEOUT, start=False)
+        task = asyncio.ensure_future(self.download_url(url, user_id, quality, batch_id, index, scope))
+        self._running[key] = (task, scope)
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=scope.remaining())
+                if not task.done() and scope.remaining() == 0:
+                    logger.warning(f"مهلت آیتم {key} ({url}) تمام شد، لغو دانلود")
+                    scope.cancel(REASON_DEADLINE)
+                    task.cancel()
+                    # تسک تا توقف واقعی ترد دانلود منتظر می‌ماند، بنابراین جای کارگر تا آن زمان نگه داشته می‌شود
+                    await asyncio.wait({task})
+            if task.cancelled():
+                cancelled = scope.reason == REASON_CANCELLED or batch_id in self._cancelled
+                self._finish_item(batch_id, index, ITEM_CANCELLED if cancelled else ITEM_FAILED)
+        except asyncio.CancelledError:
+            # توقف کارگر: دانلود آیتم نیز متوقف می‌شود
+            scope.cancel()
+            task.cancel()
+            raise
+        finally:
+            self._running.pop(key, None)
+    
+    async def download_url(self, url: str, user_id: int, quality: str, batch_id: str, index: int,
+                           scope: Optional[CancelScope] = None) -> None:
         """دانلود یک URL با استفاده از تابع دانلود مناسب - بهینه‌سازی شده برای عملکرد بهتر"""
         key = f"{batch_id}_{index}"
+        if scope is not None:
+            # محدوده لغو به تردهای دانلود و پردازه‌های yt-dlp منتقل می‌شود
+            current_scope.set(scope)
         try:
             logger.info(f"شروع دانلود {url} برای کاربر {user_id} با کیفیت {quality}")
             
             # بروزرسانی وضعیت در پردازش
-            download_status[key] = "downloading"
-            
-            # بررسی کش برای جلوگیری از دانلود مجدد
-            from telegram_downloader import get_from_cache
-            cached_file = get_from_cache(url, quality)
-            if cached_file:
-                logger.info(f"فایل از کش برگردانده شد: {cached_file}")
-                download_results[key] = cached_file
-                download_status[key] = "completed"
-                
-                # بروزرسانی پیشرفت
-                with lock:
-                    self.pending_downloads[batch_id]["completed"] += 1
-                    self.pending_downloads[batch_id]["progress"] = (self.pending_downloads[batch_id]["completed"] / 
-                                                                  self.pending_downloads[batch_id]["total"]) * 100
-                    self.save_pending_downloads()
-                return
+            download_status[key] = ITEM_DOWNLOADING
+            self.store.set_item_status(batch_id, index, ITEM_DOWNLOADING)
             
-            from telegram_downloader import InstagramDownloader, YouTubeDownloader, is_instagram_url, is_youtube_url, add_to_cache
+            downloaded_file = await fetch_bulk_item(url, quality, key)
             
-            # انتخاب دانلودر مناسب بر اساس نوع URL
-            if is_instagram_url(url):
-                downloader = InstagramDownloader()
-                # استفاده از ThreadPoolExecutor پیشرفته با 8 ترد برای چند برابر کردن سرعت
-                with ThreadPoolExecutor(max_workers=8) as executor:
-                    # اجرای همزمان چندین فرآیند دانلود با اولویت بالا
-                    downloaded_file = await asyncio.get_event_loop().run_in_executor(
-                        executor,
-                        lambda: asyncio.run(downloader.download_post(url, quality))
-                    )
-            elif is_youtube_url(url):
-                downloader = YouTubeDownloader()
-                # تنظیمات فوق‌العاده بهینه‌سازی شده برای دانلود چندبرابر سریع‌تر
-                youtube_opts = {
-                    'concurrent_fragment_downloads': 20,
-                    'buffersize': 1024 * 1024 * 50,
-                    'http_chunk_size': 1024 * 1024 * 25,
-                    'fragment_retries': 10,
-                    'retry_sleep_functions': {'fragment': lambda x: 0.5},
-                    'retries': 10,
-                    'file_access_retries': 10,
-                    'extractor_retries': 5,
-                    'throttledratelimit': 0,
-                    'sleep_interval': 0,
-                    'max_sleep_interval': 0,
-                }
-                # استفاده از ThreadPoolExecutor پیشرفته با 8 ترد برای چند برابر کردن سرعت
-                with ThreadPoolExecutor(max_workers=8) as executor:
-                    # اجرای همزمان چندین فرآیند دانلود با اولویت بالا
-                    downloaded_file = await asyncio.get_event_loop().run_in_executor(
-                        executor,
-                        lambda: asyncio.run(downloader.download_video(url, quality))
-                    )
-            else:
-                logger.warning(f"URL نامعتبر: {url}")
-                download_status[key] = "failed"
-                
-                # بروزرسانی پیشرفت علی‌رغم خطا
-                with lock:
-                    self.pending_downloads[batch_id]["completed"] += 1
-                    self.pending_downloads[batch_id]["progress"] = (self.pending_downloads[batch_id]["completed"] / 
-                                                                  self.pending_downloads[batch_id]["total"]) * 100
-                    self.save_pending_downloads()
-                return
-                
             # ذخیره نتیجه دانلود
             if downloaded_file:
-                # افزودن به کش برای استفاده‌های بعدی
-                add_to_cache(url, downloaded_file, quality)
-                
                 download_results[key] = downloaded_file
-                download_status[key] = "completed"
+                self._finish_item(batch_id, index, ITEM_COMPLETED, downloaded_file)
                 logger.info(f"دانلود {url} برای کاربر {user_id} تکمیل شد: {downloaded_file}")
             else:
-                download_status[key] = "failed"
-                logger.error(f"دانلود {url} با شکست مواجه شد (فایل خروجی خالی)")
-            
-            # بروزرسانی پیشرفت دسته
-            with lock:
-                self.pending_downloads[batch_id]["completed"] += 1
-                self.pending_downloads[batch_id]["progress"] = (self.pending_downloads[batch_id]["completed"] / 
-                                                               self.pending_downloads[batch_id]["total"]) * 100
-                self.save_pending_downloads()
+                self._finish_item(batch_id, index, ITEM_FAILED)
+                logger.error(f"دانلود {url} با شکست مواجه شد")
                 
         except Exception as e:
             logger.error(f"خطا در دانلود {url}: {str(e)}")
-            download_status[key] = "failed"
-            
             # بروزرسانی پیشرفت دسته علی‌رغم خطا
-            with lock:
-                self.pending_downloads[batch_id]["completed"] += 1
-                self.pending_downloads[batch_id]["progress"] = (self.pending_downloads[batch_id]["completed"] / 
-                                                               self.pending_downloads[batch_id]["total"]) * 100
-                self.save_pending_downloads()
+            self._finish_item(batch_id, index, ITEM_FAILED)
     
     async def get_batch_status(self, batch_id: str) -> Dict:
         """دریافت وضعیت یک دسته دانلود"""
@@ -276,7 +771,7 @@ class BulkDownloadManager:
         key = f"{batch_id}_{index}"
         if key in download_results:
             return download_results[key]
-        return None
+        return self.store.get_file_path(batch_id, index)
         
     def get_all_batches_for_user(self, user_id: int) -> List[Dict]:
         """دریافت تمام دسته‌های دانلود یک کاربر"""
@@ -291,12 +786,29 @@ class BulkDownloadManager:
         user_batches.sort(key=lambda x: x.get("timestamp", 0), reverse=True)
         return user_batches
 
-# نمونه سینگلتون از مدیر دانلود
-download_manager = BulkDownloadManager()
+# نمونه سینگلتون از مدیر دانلود (با اولین استفاده ساخته می‌شود تا وارد کردن ماژول پایگاه داده را باز نکند)
+_download_manager: Optional[BulkDownloadManager] = None
+_download_manager_lock = threading.Lock()
+
+
+def get_download_manager() -> BulkDownloadManager:
+    """
+    دریافت نمونه سینگلتون مدیر دانلود
+
+    Returns:
+        مدیر دانلود چندگانه (بارگذاری دسته‌ها و فشرده‌سازی پایگاه داده در اولین فراخوانی)
+    """
+    global _download_manager
+    with _download_manager_lock:
+        if _download_manager is None:
+            _download_manager = BulkDownloadManager()
+        return _download_manager
+
 
 # تعریف دستورات تلگرام برای مدیریت دانلود موازی
 async def handle_bulk_download(update, context):
     """هندلر دستور /bulkdownload برای دانلود چندگانه"""
+    download_manager = get_download_manager()
     message_text = update.message.text
     
     # استخراج کیفیت از دستور
@@ -338,14 +850,17 @@ async def handle_bulk_download(update, context):
         f"🔍 در حال پردازش {len(urls)} لینک... لطفاً صبر کنید."
     )
     
-    # افزودن به صف دانلود
-    result = await download_manager.add_urls_to_queue(urls, update.effective_user.id, quality)
+    # افزودن به صف دانلود (نتایج به محض آماده شدن در همین چت ارسال می‌شوند)
+    download_manager.bot = context.bot
+    result = await download_manager.add_urls_to_queue(urls, update.effective_user.id, quality,
+                                                      update.effective_chat.id)
     
     # بروزرسانی پیام
     await processing_message.edit_text(result)
 
 async def handle_batch_status(update, context):
     """هندلر دستور /status_{batch_id} برای بررسی وضعیت دسته دانلود"""
+    download_manager = get_download_manager()
     message_text = update.message.text
     
     # استخراج شناسه دسته از دستور
@@ -373,7 +888,8 @@ async def handle_batch_status(update, context):
     status_translation = {
         "pending": "در انتظار",
         "processing": "در حال پردازش",
-        "completed": "تکمیل شده"
+        "completed": "تکمیل شده",
+        "cancelled": "لغو شده"
     }
     
     persian_status = status_translation.get(current_status, current_status)
@@ -389,14 +905,51 @@ async def handle_batch_status(update, context):
         f"{progress_bar}\n\n"
     )
     
+    # نتیجه پیش‌پردازش دسته
+    if status.get("duplicates") or status.get("cache_hits") or status.get("file_id_hits"):
+        message += (
+            f"♻️ لینک‌های تکراری حذف شده: {status.get('duplicates', 0)}\n"
+            f"⚡️ آماده از کش: {status.get('cache_hits', 0) + status.get('file_id_hits', 0)}\n"
+            f"📥 در صف دانلود: {status.get('queued', total)}\n\n"
+        )
+    
+    # نمایش پیشرفت هر مرحله برای دسته‌های صوتی
+    if status.get("quality") == "audio" and current_status == "processing":
+        from bulk_audio_pipeline import get_batch_audio_summary
+        message += get_batch_audio_summary(batch_id, total) + "\n\n"
+    
     # اگر دسته کامل شده، اطلاعات بیشتری نشان بده
     if current_status == "completed":
         message += "✅ دانلود همه فایل‌ها تکمیل شده است. فایل‌ها به صورت جداگانه برای شما ارسال شده‌اند."
+    elif BULK_DELIVERY_ENABLED and status.get("chat_id") is not None:
+        message += "📤 هر فایل به محض آماده شدن برای شما ارسال می‌شود."
     
     await update.message.reply_text(message)
 
+async def handle_cancel_batch(update, context):
+    """هندلر دستور /cancel_{batch_id} برای لغو دسته دانلود"""
+    download_manager = get_download_manager()
+    batch_id_match = re.search(r'/cancel_(\w+)', update.message.text)
+    if not batch_id_match:
+        await update.message.reply_text("❌ لطفاً شناسه دسته را به همراه دستور وارد کنید. مثال: /cancel_batch_abc123")
+        return
+    
+    batch_id = batch_id_match.group(1)
+    batch = download_manager.pending_downloads.get(batch_id)
+    if not batch or batch.get("user_id") != update.effective_user.id:
+        await update.message.reply_text("❌ شناسه دسته یافت نشد")
+        return
+    
+    if batch.get("status") in ("completed", "cancelled"):
+        await update.message.reply_text("ℹ️ این دسته قبلاً به پایان رسیده است.")
+        return
+    
+    count = download_manager.cancel_batch(batch_id)
+    await update.message.reply_text(f"🛑 دسته `{batch_id}` لغو شد ({count} مورد متوقف شد).")
+
 async def handle_list_downloads(update, context):
     """هندلر دستور /mydownloads برای نمایش همه دانلودهای کاربر"""
+    download_manager = get_download_manager()
     user_id = update.effective_user.id
     
     # دریافت همه دسته‌های کاربر
@@ -420,7 +973,8 @@ async def handle_list_downloads(update, context):
         status_translation = {
             "pending": "در انتظار",
             "processing": "در حال پردازش",
-            "completed": "تکمیل شده"
+            "completed": "تکمیل شده",
+            "cancelled": "لغو شده"
         }
         
         persian_status = status_translation.get(status, status)
@@ -447,24 +1001,38 @@ def make_progress_bar(percent, length=20):
 def register_handlers(application):
     """ثبت هندلرهای دستورات در اپلیکیشن تلگرام"""
     import sys
+    from handler_runtime import add_handler
     
     # بررسی نسخه کتابخانه python-telegram-bot
     try:
         # برای نسخه 13
         from telegram.ext import CommandHandler, MessageHandler, Filters
         status_filter = Filters.regex(r'^/status_\w+')
+        cancel_filter = Filters.regex(r'^/cancel_\w+')
     except ImportError:
         # برای نسخه 20
         from telegram.ext import CommandHandler, MessageHandler, filters
         status_filter = filters.regex(r'^/status_\w+')
+        cancel_filter = filters.regex(r'^/cancel_\w+')
     
     # هندلر دستور دانلود چندگانه
-    application.add_handler(CommandHandler("bulkdownload", handle_bulk_download))
+    add_handler(application, CommandHandler("bulkdownload", handle_bulk_download))
     
     # هندلر دستور بررسی وضعیت با الگوی /status_{batch_id}
-    application.add_handler(MessageHandler(status_filter, handle_batch_status))
+    add_handler(application, MessageHandler(status_filter, handle_batch_status))
+    
+    # هندلر دستور لغو دسته با الگوی /cancel_{batch_id}
+    add_handler(application, MessageHandler(cancel_filter, handle_cancel_batch))
     
     # هندلر دستور نمایش همه دانلودها
-    application.add_handler(CommandHandler("mydownloads", handle_list_downloads))
+    add_handler(application, CommandHandler("mydownloads", handle_list_downloads))
+    
+    # ادامه دسته‌های ناتمام پیش از توقف برنامه
+    download_manager = get_download_manager()
+    download_manager.bot = getattr(application, 'bot', None)
+    try:
+        asyncio.get_running_loop().create_task(download_manager.resume_pending_batches())
+    except RuntimeError:
+        logger.warning("event loop فعال نیست، دسته‌های ناتمام ادامه داده نمی‌شوند")
     
     logger.info("هندلرهای دانلود موازی با موفقیت ثبت شدند")
\ No newline at end of file
@@ -0,0 +1,448 @@
+"""
+ذخیره‌سازی پایدار وضعیت دسته‌های دانلود چندگانه در SQLite
+
+وضعیت هر آیتم با یک UPDATE کوچک در حالت WAL ثبت می‌شود (به جای بازنویسی کامل فایل JSON
+پس از هر آیتم). آیتم‌های ناتمام پس از راه‌اندازی مجدد دوباره در صف قرار می‌گیرند و
+دسته‌های قدیمی تکمیل شده به صورت دوره‌ای حذف می‌شوند.
+
+در حالت کارگر خارجی جدول items صف مشترک کارها نیز هست: ربات آیتم‌ها را با وضعیت queued ثبت
+می‌کند و پردازه‌های bulk_worker هر آیتم را با یک تراکنش BEGIN IMMEDIATE برای مدت محدود
+(lease) تصاحب می‌کنند؛ آیتم کارگری که از کار افتاده پس از پایان lease دوباره قابل تصاحب است.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# مسیر دایرکتوری دانلود
+DOWNLOADS_DIR = os.environ.get(
+    'DOWNLOAD_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloads')
+)
+# مسیر پایگاه داده وضعیت دسته‌ها (مستقل از دایرکتوری جاری تا ربات و کارگرها یک فایل را باز کنند)
+BULK_STATE_DB = os.environ.get('BULK_STATE_DB', os.path.join(DOWNLOADS_DIR, 'bulk_state.db'))
+# فایل JSON قدیمی (فقط برای انتقال یک‌باره)
+LEGACY_PENDING_FILE = "pending_downloads.json"
+# مدت نگهداری دسته‌های تکمیل شده (روز)
+BULK_STATE_RETENTION_DAYS = int(os.environ.get('BULK_STATE_RETENTION_DAYS', '7'))
+# فاصله زمانی فشرده‌سازی دوره‌ای (ثانیه)
+BULK_STATE_COMPACT_INTERVAL = 3600
+# حداکثر دفعات تصاحب یک آیتم توسط کارگرها (پس از آن آیتم ناموفق ثبت می‌شود)
+BULK_JOB_MAX_ATTEMPTS = int(os.environ.get('BULK_JOB_MAX_ATTEMPTS', '3'))
+
+# وضعیت‌های آیتم
+ITEM_PENDING = "pending"
+ITEM_QUEUED = "queued"
+ITEM_DOWNLOADING = "downloading"
+ITEM_COMPLETED = "completed"
+ITEM_FAILED = "failed"
+ITEM_CANCELLED = "cancelled"
+FINISHED_ITEM_STATES = (ITEM_COMPLETED, ITEM_FAILED, ITEM_CANCELLED)
+_FINISHED_PLACEHOLDERS = ', '.join('?' * len(FINISHED_ITEM_STATES))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    quality TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    timestamp REAL NOT NULL,
+    duplicates INTEGER NOT NULL DEFAULT 0,
+    cache_hits INTEGER NOT NULL DEFAULT 0,
+    file_id_hits INTEGER NOT NULL DEFAULT 0,
+    chat_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS items (
+    batch_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    status TEXT NOT NULL,
+    file_path TEXT,
+    file_id TEXT,
+    delivered INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    PRIMARY KEY (batch_id, idx)
+);
+CREATE INDEX IF NOT EXISTS idx_batches_user ON batches (user_id);
+CREATE INDEX IF NOT EXISTS idx_batches_status ON batches (status);
+"""
+
+# جدول‌ها و ایندکس‌هایی که به ستون‌های اضافه شده وابسته‌اند (پس از انتقال ساختار ساخته می‌شوند)
+_POST_MIGRATION_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_items_status ON items (status, updated);
+CREATE TABLE IF NOT EXISTS user_running (
+    user_id INTEGER PRIMARY KEY,
+    running INTEGER NOT NULL DEFAULT 0
+);
+CREATE TRIGGER IF NOT EXISTS trg_items_running AFTER UPDATE OF status ON items
+WHEN (OLD.status = 'downloading') != (NEW.status = 'downloading')
+BEGIN
+    INSERT OR IGNORE INTO user_running (user_id, running)
+        SELECT user_id, 0 FROM batches WHERE batch_id = NEW.batch_id;
+    UPDATE user_running SET running = running + (CASE WHEN NEW.status = 'downloading' THEN 1 ELSE -1 END)
+        WHERE user_id = (SELECT user_id FROM batches WHERE batch_id = NEW.batch_id);
+END;
+"""
+
+# بازسازی شمارنده آیتم‌های در حال اجرای هر کاربر (برای پایگاه داده‌های ساخته شده پیش از جدول user_running)
+_REBUILD_USER_RUNNING = """
+DELETE FROM user_running;
+INSERT INTO user_running (user_id, running)
+    SELECT b.user_id, COUNT(*) FROM items i JOIN batches b ON b.batch_id = i.batch_id
+    WHERE i.status = 'downloading' GROUP BY b.user_id;
+"""
+
+# ستون‌های اضافه شده پس از نسخه اول جدول‌ها: (جدول, ستون, تعریف)
+_ADDED_COLUMNS = (
+    ('batches', 'duplicates', 'INTEGER NOT NULL DEFAULT 0'),
+    ('batches', 'cache_hits', 'INTEGER NOT NULL DEFAULT 0'),
+    ('batches', 'file_id_hits', 'INTEGER NOT NULL DEFAULT 0'),
+    ('items', 'file_id', 'TEXT'),
+    ('batches', 'chat_id', 'INTEGER'),
+    ('items', 'delivered', 'INTEGER NOT NULL DEFAULT 0'),
+    ('items', 'worker_id', 'TEXT'),
+    ('items', 'lease_until', 'REAL'),
+    ('items', 'attempts', 'INTEGER NOT NULL DEFAULT 0'),
+    ('items', 'reported', 'INTEGER NOT NULL DEFAULT 0'),
+)
+
+
+class BulkStateStore:
+    """ذخیره‌ساز وضعیت دسته‌ها و آیتم‌ها"""
+
+    def __init__(self, db_path: str = BULK_STATE_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate_schema()
+        self._conn.executescript(_POST_MIGRATION_SCHEMA)
+        self._rebuild_user_running()
+        self._last_compact = 0.0
+        self._migrate_legacy_file()
+
+    def _migrate_schema(self) -> None:
+        """افزودن ستون‌های جدید به پایگاه داده‌های ساخته شده با نسخه‌های قبلی"""
+        for table, column, definition in _ADDED_COLUMNS:
+            existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def _rebuild_user_running(self) -> None:
+        """
+        محاسبه دوباره شمارنده آیتم‌های در حال اجرای هر کاربر
+
+        شمارنده با trigger جدول items همگام می‌ماند؛ بازسازی هنگام باز کردن پایگاه داده فقط
+        پایگاه داده‌های قدیمی (یا تغییرات خارج از این کلاس) را اصلاح می‌کند.
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                for statement in _REBUILD_USER_RUNNING.split(';'):
+                    if statement.strip():
+                        self._conn.execute(statement)
+
+    def _migrate_legacy_file(self) -> None:
+        """انتقال یک‌باره دسته‌های فایل pending_downloads.json قدیمی"""
+        if not os.path.exists(LEGACY_PENDING_FILE):
+            return
+        try:
+            with open(LEGACY_PENDING_FILE, 'r') as f:
+                legacy = json.load(f)
+            for batch_id, batch in legacy.items():
+                self.create_batch(batch_id, batch.get("user_id", 0), batch.get("quality", "best"),
+                                  batch.get("urls", []), batch.get("timestamp", time.time()))
+                if batch.get("status") == "completed":
+                    # نتیجه آیتم‌ها در فایل قدیمی ثبت نمی‌شد؛ دسته تکمیل شده دوباره اجرا نمی‌شود
+                    with self._lock:
+                        self._conn.execute("UPDATE items SET status = ? WHERE batch_id = ?",
+                                           (ITEM_COMPLETED, batch_id))
+                        self._conn.execute("UPDATE batches SET status = 'completed', completed = total "
+                                           "WHERE batch_id = ?", (batch_id,))
+            os.replace(LEGACY_PENDING_FILE, f"{LEGACY_PENDING_FILE}.migrated")
+            logger.info(f"تعداد {len(legacy)} دسته از فایل قدیمی به پایگاه داده منتقل شد")
+        except (ValueError, OSError, sqlite3.Error) as e:
+            logger.error(f"خطا در انتقال دانلودهای معلق قدیمی: {e}")
+
+    def create_batch(self, batch_id: str, user_id: int, quality: str, urls: List[str],
+                     timestamp: Optional[float] = None, chat_id: Optional[int] = None) -> None:
+        """ثبت دسته جدید و آیتم‌های آن در یک تراکنش"""
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO batches "
+                    "(batch_id, user_id, quality, status, total, completed, timestamp, chat_id) "
+                    "VALUES (?, ?, ?, 'pending', ?, 0, ?, ?)",
+                    (batch_id, user_id, quality, len(urls), timestamp or now, chat_id))
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO items (batch_id, idx, url, status, updated) VALUES (?, ?, ?, ?, ?)",
+                    [(batch_id, index, url, ITEM_PENDING, now) for index, url in enumerate(urls)])
+
+    def set_batch_status(self, batch_id: str, status: str) -> None:
+        """تغییر وضعیت دسته"""
+        with self._lock:
+            self._conn.execute("UPDATE batches SET status = ? WHERE batch_id = ?", (status, batch_id))
+
+    def set_batch_counts(self, batch_id: str, duplicates: int, cache_hits: int, file_id_hits: int) -> None:
+        """ثبت نتیجه پیش‌پردازش دسته (لینک‌های تکراری و آیتم‌های پاسخ داده شده از کش)"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE batches SET duplicates = ?, cache_hits = ?, file_id_hits = ? WHERE batch_id = ?",
+                (duplicates, cache_hits, file_id_hits, batch_id))
+
+    def set_item_status(self, batch_id: str, index: int, status: str, file_path: Optional[str] = None,
+                        file_id: Optional[str] = None) -> None:
+        """
+        ثبت وضعیت یک آیتم (پایان آیتم شمارنده تکمیل دسته را نیز افزایش می‌دهد)
+
+        Args:
+            batch_id: شناسه دسته
+            index: شماره آیتم
+            status: وضعیت جدید
+            file_path: مسیر فایل دانلود شده
+            file_id: شناسه فایل تلگرام (برای آیتم‌هایی که قبلاً ارسال شده‌اند)
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                cursor = self._conn.execute(
+                    "UPDATE items SET status = ?, file_path = COALESCE(?, file_path), "
+                    "file_id = COALESCE(?, file_id), updated = ? "
+                    f"WHERE batch_id = ? AND idx = ? AND status NOT IN ({_FINISHED_PLACEHOLDERS})",
+                    (status, file_path, file_id, time.time(), batch_id, index, *FINISHED_ITEM_STATES))
+                if cursor.rowcount and status in FINISHED_ITEM_STATES:
+                    self._conn.execute("UPDATE batches SET completed = completed + 1 WHERE batch_id = ?",
+                                       (batch_id,))
+
+    # ---------- صف کار کارگرهای خارجی ----------
+
+    def enqueue_items(self, batch_id: str, indices: List[int]) -> None:
+        """قرار دادن آیتم‌های در انتظار یک دسته در صف مشترک کارگرها"""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE items SET status = ?, updated = ? WHERE batch_id = ? AND idx = ? AND status = ?",
+                [(ITEM_QUEUED, time.time(), batch_id, index, ITEM_PENDING) for index in indices])
+
+    def claim_item(self, worker_id: str, lease: float) -> Optional[Dict]:
+        """
+        تصاحب اتمی یک آیتم از صف مشترک
+
+        آیتم‌های queued و آیتم‌هایی که lease آن‌ها تمام شده (کارگر از کار افتاده) قابل تصاحب هستند.
+        از کاربری که کمترین آیتم در حال اجرا را دارد انتخاب می‌شود تا کاربران به نوبت پیش بروند؛
+        تعداد آیتم‌های در حال اجرا از جدول user_running خوانده می‌شود (نه شمارش دوباره items برای هر ردیف).
+
+        Args:
+            worker_id: شناسه کارگر
+            lease: مدت اعتبار تصاحب (ثانیه)
+
+        Returns:
+            دیکشنری batch_id، index، url، quality، user_id و attempts یا None اگر صف خالی باشد
+        """
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                # آیتم‌هایی که بیش از حد مجاز تصاحب و رها شده‌اند ناموفق ثبت می‌شوند
+                for batch_id, index in self._conn.execute(
+                        "SELECT batch_id, idx FROM items WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                        (ITEM_DOWNLOADING, now, BULK_JOB_MAX_ATTEMPTS)).fetchall():
+                    self._conn.execute("UPDATE items SET status = ?, updated = ? WHERE batch_id = ? AND idx = ?",
+                                       (ITEM_FAILED, now, batch_id, index))
+                    self._conn.execute("UPDATE batches SET completed = completed + 1 WHERE batch_id = ?",
+                                       (batch_id,))
+
+                row = self._conn.execute(
+                    "SELECT i.batch_id, i.idx, i.url, b.quality, b.user_id, i.attempts FROM items i "
+                    "JOIN batches b ON b.batch_id = i.batch_id "
+                    "LEFT JOIN user_running u ON u.user_id = b.user_id "
+                    "WHERE b.status != 'cancelled' AND "
+                    "(i.status = ? OR (i.status = ? AND i.lease_until < ?)) "
+                    "ORDER BY COALESCE(u.running, 0), b.timestamp, i.idx LIMIT 1",
+                    (ITEM_QUEUED, ITEM_DOWNLOADING, now)).fetchone()
+                if row is None:
+                    return None
+                batch_id, index, url, quality, user_id, attempts = row
+                self._conn.execute(
+                    "UPDATE items SET status = ?, worker_id = ?, lease_until = ?, attempts = attempts + 1, "
+                    "updated = ? WHERE batch_id = ? AND idx = ?",
+                    (ITEM_DOWNLOADING, worker_id, now + lease, now, batch_id, index))
+        return {'batch_id': batch_id, 'index': index, 'url': url, 'quality': quality,
+                'user_id': user_id, 'attempts': attempts + 1}
+
+    def renew_lease(self, batch_id: str, index: int, worker_id: str, lease: float) -> bool:
+        """
+        تمدید تصاحب آیتم توسط کارگر
+
+        Returns:
+            False اگر آیتم دیگر در اختیار این کارگر نیست یا لغو شده است (کارگر باید دانلود را متوقف کند)
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE items SET lease_until = ? WHERE batch_id = ? AND idx = ? AND worker_id = ? AND status = ?",
+                (time.time() + lease, batch_id, index, worker_id, ITEM_DOWNLOADING))
+            return cursor.rowcount == 1
+
+    def cancel_batch_items(self, batch_id: str) -> int:
+        """
+        لغو دسته در صف مشترک
+
+        آیتم‌های منتظر و در حال اجرا همین‌جا لغو ثبت می‌شوند؛ کارگری که آیتم را در اختیار دارد
+        در تمدید بعدی lease متوجه لغو شده و دانلود را متوقف می‌کند.
+
+        Returns:
+            تعداد آیتم‌های لغو شده
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.execute("UPDATE batches SET status = 'cancelled' WHERE batch_id = ?", (batch_id,))
+                count = self._conn.execute(
+                    "UPDATE items SET status = ?, updated = ? WHERE batch_id = ? AND status IN (?, ?, ?)",
+                    (ITEM_CANCELLED, time.time(), batch_id, ITEM_PENDING, ITEM_QUEUED, ITEM_DOWNLOADING)).rowcount
+                self._conn.execute("UPDATE batches SET completed = completed + ? WHERE batch_id = ?",
+                                   (count, batch_id))
+                return count
+
+    def unreported_results(self, batch_ids: List[str]) -> List[Tuple[str, int, str, Optional[str], Optional[str]]]:
+        """
+        آیتم‌های پایان یافته دسته‌های مشخص که نتیجه آن‌ها هنوز توسط ربات برداشته نشده است
+
+        به جای زمان بروزرسانی از پرچم reported استفاده می‌شود؛ ترتیب commit نتیجه‌های کارگرها با
+        زمان ثبت شده در آن‌ها یکسان نیست و نتیجه‌ای که دیرتر commit شود نباید از دست برود.
+
+        Args:
+            batch_ids: شناسه دسته‌هایی که ربات منتظر نتیجه آن‌ها است
+
+        Returns:
+            لیست (شناسه دسته, شماره, وضعیت, مسیر فایل, file_id)
+        """
+        if not batch_ids:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT batch_id, idx, status, file_path, file_id FROM items "
+                f"WHERE batch_id IN ({', '.join('?' * len(batch_ids))}) AND reported = 0 "
+                f"AND status IN ({_FINISHED_PLACEHOLDERS})",
+                (*batch_ids, *FINISHED_ITEM_STATES))
+            return [tuple(row) for row in rows]
+
+    def mark_reported(self, items: List[Tuple[str, int]]) -> None:
+        """ثبت برداشت نتیجه آیتم‌ها توسط ربات: [(شناسه دسته, شماره)]"""
+        with self._lock:
+            self._conn.executemany("UPDATE items SET reported = 1 WHERE batch_id = ? AND idx = ?", items)
+
+    def load_batches(self) -> Dict[str, Dict]:
+        """
+        بارگذاری همه دسته‌ها
+
+        Returns:
+            دیکشنری شناسه دسته -> اطلاعات دسته (urls، user_id، quality، status، progress، total، completed، timestamp
+            و آمار پیش‌پردازش: duplicates، cache_hits، file_id_hits، queued و chat_id مقصد ارسال)
+        """
+        with self._lock:
+            batches = {}
+            for row in self._conn.execute(
+                    "SELECT batch_id, user_id, quality, status, total, completed, timestamp, "
+                    "duplicates, cache_hits, file_id_hits, chat_id FROM batches"):
+                (batch_id, user_id, quality, status, total, completed, timestamp,
+                 duplicates, cache_hits, file_id_hits, chat_id) = row
+                batches[batch_id] = {
+                    "urls": [],
+                    "user_id": user_id,
+                    "quality": quality,
+                    "status": status,
+                    "progress": (completed / total) * 100 if total else 0,
+                    "total": total,
+                    "completed": completed,
+                    "timestamp": timestamp,
+                    "duplicates": duplicates,
+                    "cache_hits": cache_hits,
+                    "file_id_hits": file_id_hits,
+                    "queued": total - cache_hits - file_id_hits,
+                    "chat_id": chat_id,
+                }
+            for batch_id, url in self._conn.execute("SELECT batch_id, url FROM items ORDER BY batch_id, idx"):
+                if batch_id in batches:
+                    batches[batch_id]["urls"].append(url)
+            return batches
+
+    def unfinished_items(self, batch_id: str) -> List[int]:
+        """شماره آیتم‌های ناتمام یک دسته"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT idx FROM items WHERE batch_id = ? AND status NOT IN ({_FINISHED_PLACEHOLDERS}) ORDER BY idx",
+                (batch_id, *FINISHED_ITEM_STATES))
+            return [row[0] for row in rows]
+
+    def unfinished_batches(self) -> List[str]:
+        """شناسه دسته‌هایی که پیش از توقف برنامه تمام نشده‌اند"""
+        with self._lock:
+            rows = self._conn.execute("SELECT batch_id FROM batches WHERE status NOT IN ('completed', 'cancelled') "
+                                      "ORDER BY timestamp")
+            return [row[0] for row in rows]
+
+    def mark_delivered(self, batch_id: str, index: int) -> None:
+        """ثبت ارسال آیتم به چت کاربر"""
+        with self._lock:
+            self._conn.execute("UPDATE items SET delivered = 1 WHERE batch_id = ? AND idx = ?", (batch_id, index))
+
+    def undelivered_items(self, batch_id: str) -> List[Tuple[int, Optional[str], Optional[str]]]:
+        """آیتم‌های تکمیل شده‌ای که هنوز برای کاربر ارسال نشده‌اند: (شماره, مسیر فایل, file_id)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idx, file_path, file_id FROM items "
+                "WHERE batch_id = ? AND status = ? AND delivered = 0 ORDER BY idx",
+                (batch_id, ITEM_COMPLETED))
+            return [tuple(row) for row in rows]
+
+    def get_file_path(self, batch_id: str, index: int) -> Optional[str]:
+        """مسیر فایل ثبت شده برای یک آیتم"""
+        with self._lock:
+            row = self._conn.execute("SELECT file_path FROM items WHERE batch_id = ? AND idx = ?",
+                                     (batch_id, index)).fetchone()
+            return row[0] if row else None
+
+    def compact(self, force: bool = False) -> int:
+        """
+        حذف دسته‌های تکمیل شده قدیمی و کوتاه کردن فایل WAL
+
+        Args:
+            force: اجرا بدون توجه به فاصله زمانی فشرده‌سازی
+
+        Returns:
+            تعداد دسته‌های حذف شده
+        """
+        now = time.time()
+        if not force and now - self._last_compact < BULK_STATE_COMPACT_INTERVAL:
+            return 0
+        self._last_compact = now
+        cutoff = now - BULK_STATE_RETENTION_DAYS * 86400
+
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.execute(
+                    "DELETE FROM items WHERE batch_id IN "
+                    "(SELECT batch_id FROM batches WHERE status IN ('completed', 'cancelled') AND timestamp < ?)", (cutoff,))
+                removed = self._conn.execute(
+                    "DELETE FROM batches WHERE status IN ('completed', 'cancelled') AND timestamp < ?", (cutoff,)).rowcount
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        if removed:
+            logger.info(f"تعداد {removed} دسته قدیمی از پایگاه داده وضعیت حذف شد")
+        return removed
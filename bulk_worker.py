@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+کارگرهای مستقل دانلود چندگانه
+
+در حالت BULK_WORKER_MODE=external ربات آیتم‌های دسته را فقط در صف مشترک پایگاه داده وضعیت
+(bulk_state.db) ثبت می‌کند و نتایج را از همان‌جا برداشته و ارسال می‌کند. این اسکریپت چند پردازه
+کارگر اجرا می‌کند که هر کدام آیتم‌ها را به صورت اتمی تصاحب، دانلود و تبدیل کرده و نتیجه را در
+پایگاه داده می‌نویسند؛ بنابراین توان دانلود با تعداد هسته‌ها بالا می‌رود و از کار افتادن یک کارگر
+ربات را متوقف نمی‌کند:
+
+- هر آیتم تصاحب شده یک lease دارد که کارگر به صورت دوره‌ای تمدید می‌کند؛ آیتم کارگری که از کار
+  افتاده پس از پایان lease توسط کارگر دیگری دوباره تصاحب می‌شود (حداکثر BULK_JOB_MAX_ATTEMPTS بار)
+- اگر تمدید ناموفق باشد (دسته لغو شده یا آیتم به کارگر دیگری رسیده) دانلود فوراً متوقف می‌شود
+- پردازه ناظر پردازه‌های از کار افتاده را با تأخیر افزایشی دوباره اجرا می‌کند
+
+استفاده (پایگاه داده و دایرکتوری دانلود باید با ربات مشترک باشند):
+    BULK_WORKER_MODE=external python telegram_downloader.py
+    python bulk_worker.py --processes 4 --concurrency 2
+"""
+
+import os
+import time
+import signal
+import socket
+import sqlite3
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from typing import Callable, Dict
+
+from bulk_state_store import BulkStateStore, ITEM_CANCELLED, ITEM_COMPLETED, ITEM_FAILED
+from cancel_scope import CancelScope, REASON_CANCELLED, REASON_DEADLINE, current_scope
+
+# تنظیم لاگر
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# تعداد پردازه‌های کارگر (پیش‌فرض تعداد هسته‌ها)
+BULK_WORKER_PROCESSES = int(os.environ.get('BULK_WORKER_PROCESSES', str(os.cpu_count() or 1)))
+# تعداد آیتم‌های همزمان هر پردازه کارگر
+BULK_WORKER_CONCURRENCY = int(os.environ.get('BULK_WORKER_CONCURRENCY', '2'))
+# مدت اعتبار تصاحب هر آیتم (ثانیه)؛ هر یک سوم این مدت تمدید می‌شود
+BULK_JOB_LEASE = float(os.environ.get('BULK_JOB_LEASE', '60'))
+# فاصله بررسی صف وقتی کاری وجود ندارد (ثانیه)
+BULK_WORKER_IDLE_SLEEP = float(os.environ.get('BULK_WORKER_IDLE_SLEEP', '1.0'))
+# حداکثر تأخیر اجرای مجدد پردازه از کار افتاده (ثانیه)
+BULK_WORKER_MAX_BACKOFF = float(os.environ.get('BULK_WORKER_MAX_BACKOFF', '60'))
+# تعداد تلاش مجدد عملیات پایگاه داده پس از خطای قفل یا دیسک (sqlite3.OperationalError)
+BULK_STORE_RETRIES = int(os.environ.get('BULK_STORE_RETRIES', '5'))
+# پردازه‌ای که این مدت سالم کار کرده باشد، تأخیر اجرای مجددش از نو شروع می‌شود (ثانیه)
+_HEALTHY_RUNTIME = 60
+
+
+async def _store_call(func: Callable, *args):
+    """
+    اجرای یک عملیات پایگاه داده در executor با تلاش مجدد پس از sqlite3.OperationalError
+
+    قفل نوشتن SQLite بین همه پردازه‌ها مشترک است؛ اجرای عملیات روی loop بقیه آیتم‌های این پردازه را
+    متوقف می‌کند و خطای گذرای database is locked نباید پردازه را از کار بیندازد.
+
+    Args:
+        func: متد ذخیره‌ساز
+        *args: آرگومان‌های متد
+
+    Returns:
+        خروجی متد (پس از پایان تلاش‌ها آخرین خطا دوباره ایجاد می‌شود)
+    """
+    loop = asyncio.get_running_loop()
+    for attempt in range(BULK_STORE_RETRIES + 1):
+        try:
+            return await loop.run_in_executor(None, func, *args)
+        except sqlite3.OperationalError as e:
+            if attempt == BULK_STORE_RETRIES:
+                raise
+            delay = min(BULK_WORKER_MAX_BACKOFF, 0.5 * 2 ** attempt)
+            logger.warning(f"خطای پایگاه داده در {func.__name__} ({e})، تلاش مجدد پس از {delay:.1f} ثانیه")
+            await asyncio.sleep(delay)
+
+
+async def _fetch_in_scope(job: Dict, key: str, scope: CancelScope):
+    """دریافت فایل آیتم داخل محدوده لغو آن (محدوده به تردها و پردازه‌های yt-dlp منتقل می‌شود)"""
+    from bulk_download_handler import fetch_bulk_item
+    current_scope.set(scope)
+    return await fetch_bulk_item(job['url'], job['quality'], key)
+
+
+async def run_job(store: BulkStateStore, worker_id: str, job: Dict) -> str:
+    """
+    اجرای یک آیتم تصاحب شده با تمدید دوره‌ای lease و مهلت آیتم
+
+    Args:
+        store: ذخیره‌ساز وضعیت این پردازه
+        worker_id: شناسه کارگر
+        job: آیتم تصاحب شده (خروجی claim_item)
+
+    Returns:
+        وضعیت نهایی آیتم
+    """
+    from bulk_download_handler import BULK_ITEM_TIMEOUT
+
+    batch_id, index = job['batch_id'], job['index']
+    key = f"{batch_id}_{index}"
+    scope = CancelScope(key, BULK_ITEM_TIMEOUT, start=False)
+    heartbeat = BULK_JOB_LEASE / 3
+    lost = False
+    logger.info(f"کارگر {worker_id} آیتم {key} را برداشت (تلاش {job['attempts']}): {job['url']}")
+
+    task = asyncio.ensure_future(_fetch_in_scope(job, key, scope))
+    try:
+        while not task.done():
+            remaining = scope.remaining()
+            await asyncio.wait({task}, timeout=heartbeat if remaining is None else min(heartbeat, remaining))
+            if task.done():
+                break
+            if scope.remaining() == 0:
+                logger.warning(f"مهلت آیتم {key} تمام شد، لغو دانلود")
+                scope.cancel(REASON_DEADLINE)
+                task.cancel()
+                continue
+            try:
+                renewed = await _store_call(store.renew_lease, batch_id, index, worker_id, BULK_JOB_LEASE)
+            except sqlite3.OperationalError as e:
+                # دانلود ادامه می‌یابد و تمدید در نوبت بعد دوباره امتحان می‌شود
+                logger.error(f"تمدید lease آیتم {key} ممکن نشد: {e}")
+                continue
+            if not renewed:
+                # دسته لغو شده یا آیتم پس از پایان lease به کارگر دیگری رسیده است
+                logger.info(f"آیتم {key} دیگر در اختیار این کارگر نیست، توقف دانلود")
+                lost = True
+                scope.cancel(REASON_CANCELLED)
+                task.cancel()
+        await asyncio.wait({task})
+    except asyncio.CancelledError:
+        # توقف پردازه: آیتم پس از پایان lease به کارگر دیگری می‌رسد
+        scope.cancel()
+        task.cancel()
+        raise
+
+    file_path = None
+    if task.cancelled():
+        status = ITEM_CANCELLED if scope.reason == REASON_CANCELLED else ITEM_FAILED
+    elif task.exception() is not None:
+        logger.error(f"خطا در دانلود آیتم {key}: {task.exception()}")
+        status = ITEM_FAILED
+    else:
+        file_path = task.result()
+        status = ITEM_COMPLETED if file_path else ITEM_FAILED
+
+    if not lost:
+        try:
+            await _store_call(store.set_item_status, batch_id, index, status, file_path)
+        except sqlite3.OperationalError as e:
+            # آیتم پس از پایان lease دوباره تصاحب و اجرا می‌شود
+            logger.error(f"ثبت نتیجه آیتم {key} ممکن نشد: {e}")
+    logger.info(f"آیتم {key} توسط کارگر {worker_id} به پایان رسید: {status}")
+    return status
+
+
+async def worker_main(concurrency: int = BULK_WORKER_CONCURRENCY) -> None:
+    """
+    حلقه‌های تصاحب و اجرای آیتم‌ها در یک پردازه کارگر
+
+    Args:
+        concurrency: تعداد آیتم‌های همزمان این پردازه
+    """
+    store = BulkStateStore()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def claim_loop() -> None:
+        while True:
+            try:
+                # تصاحب با قفل نوشتن پایگاه داده انجام می‌شود، بنابراین روی loop اجرا نمی‌شود
+                job = await _store_call(store.claim_item, worker_id, BULK_JOB_LEASE)
+            except Exception as e:
+                logger.error(f"خطا در تصاحب آیتم از صف: {str(e)}")
+                job = None
+            if job is None:
+                await asyncio.sleep(BULK_WORKER_IDLE_SLEEP)
+                continue
+            try:
+                await run_job(store, worker_id, job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # خطای یک آیتم حلقه را متوقف نمی‌کند؛ آیتم پس از پایان lease دوباره تصاحب می‌شود
+                logger.error(f"خطا در اجرای آیتم {job['batch_id']}_{job['index']}: {str(e)}")
+
+    logger.info(f"کارگر {worker_id} با {concurrency} آیتم همزمان آماده است")
+    await asyncio.gather(*(claim_loop() for _ in range(concurrency)))
+
+
+def _process_main(concurrency: int) -> None:
+    """نقطه ورود پردازه کارگر"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # توقف فقط از طریق پردازه ناظر
+    asyncio.run(worker_main(concurrency))
+
+
+def supervise(processes: int = BULK_WORKER_PROCESSES, concurrency: int = BULK_WORKER_CONCURRENCY) -> None:
+    """
+    اجرای پردازه‌های کارگر و اجرای مجدد پردازه‌های از کار افتاده
+
+    Args:
+        processes: تعداد پردازه‌های کارگر
+        concurrency: تعداد آیتم‌های همزمان هر پردازه
+    """
+    context = multiprocessing.get_context('spawn')
+    slots = [{'process': None, 'started': 0.0, 'failures': 0, 'restart_at': 0.0} for _ in range(processes)]
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    logger.info(f"اجرای {processes} پردازه کارگر دانلود چندگانه ({concurrency} آیتم همزمان در هر پردازه)")
+
+    while not stopping:
+        now = time.monotonic()
+        for number, slot in enumerate(slots):
+            process = slot['process']
+            if process is not None and process.is_alive():
+                continue
+            if process is not None:
+                # پردازه از کار افتاده است؛ اجرای مجدد با تأخیر افزایشی
+                slot['failures'] = 1 if now - slot['started'] > _HEALTHY_RUNTIME else slot['failures'] + 1
+                delay = min(BULK_WORKER_MAX_BACKOFF, 2 ** (slot['failures'] - 1))
+                slot['restart_at'] = now + delay
+                slot['process'] = None
+                logger.error(f"پردازه کارگر {number} با کد {process.exitcode} متوقف شد، اجرای مجدد پس از {delay:.0f} ثانیه")
+            if now < slot['restart_at']:
+                continue
+            process = context.Process(target=_process_main, args=(concurrency,), name=f'bulk-worker-{number}',
+                                      daemon=True)
+            process.start()
+            slot.update(process=process, started=now)
+        time.sleep(0.5)
+
+    logger.info("توقف پردازه‌های کارگر")
+    for slot in slots:
+        if slot['process'] is not None and slot['process'].is_alive():
+            slot['process'].terminate()
+    for slot in slots:
+        if slot['process'] is not None:
+            slot['process'].join(timeout=10)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="کارگرهای مستقل دانلود چندگانه (صف مشترک SQLite)")
+    parser.add_argument('--processes', type=int, default=BULK_WORKER_PROCESSES, help="تعداد پردازه‌های کارگر")
+    parser.add_argument('--concurrency', type=int, default=BULK_WORKER_CONCURRENCY,
+                        help="تعداد آیتم‌های همزمان هر پردازه")
+    args = parser.parse_args()
+    supervise(max(1, args.processes), max(1, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
@@ -18,8 +18,14 @@ import time
 # تنظیم لاگر
 logger = logging.getLogger(__name__)
 
-# مسیر دایرکتوری دانلود
-DOWNLOADS_DIR = os.environ.get('DOWNLOAD_DIR', 'downloads')
+try:
+    import variant_cache
+except ImportError:
+    variant_cache = None
+
+# مسیر دایرکتوری دانلود (مشترک با کش نسخه‌ها تا پاکسازی دایرکتوری variants را رد کند)
+DOWNLOADS_DIR = (variant_cache.DOWNLOADS_DIR if variant_cache
+                 else os.path.abspath(os.environ.get('DOWNLOAD_DIR', 'downloads')))
 # مسیر دایرکتوری دیباگ
 DEBUG_DIR = os.path.join(DOWNLOADS_DIR, 'debug')
 # زمان پاکسازی کش (به روز)
@@ -152,6 +158,9 @@ def cleanup_cache(force: bool = False) -> int:
         # رد کردن دایرکتوری دیباگ
         if 'debug' in dirpath:
             continue
+        # نسخه‌های تبدیل شده با سیاست LRU در کش نسخه‌ها حذف می‌شوند
+        if variant_cache and os.path.abspath(dirpath).startswith(os.path.abspath(variant_cache.VARIANTS_DIR)):
+            continue
             
         for filename in filenames:
             file_path = os.path.join(dirpath, filename)
@@ -189,6 +198,14 @@ def cleanup_cache(force: bool = False) -> int:
         except OSError as e:
             logger.warning(f"خطا در حذف فایل {file_path}: {e}")
     
+    # اگر هنوز از سقف کش بیشتر است، نسخه‌های کم‌استفاده تبدیل شده حذف می‌شوند
+    if variant_cache:
+        cache_size_gb, _ = get_cache_size()
+        if cache_size_gb > MAX_CACHE_SIZE_GB * 0.8:
+            variant_bytes, _ = variant_cache.get_variant_cache_size()
+            excess_bytes = int((cache_size_gb - MAX_CACHE_SIZE_GB * 0.8) * 1024 * 1024 * 1024)
+            deleted_count += variant_cache.evict_to_budget(max(0, variant_bytes - excess_bytes))
+    
     # بروزرسانی زمان آخرین پاکسازی
     with open(last_cleanup_file, 'w') as f:
         f.write(str(time.time()))
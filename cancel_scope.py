@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+محدوده لغو (cancel scope) برای کارهای دانلود
+
+هر آیتم دانلود یک CancelScope دارد که از طریق contextvars به ترد اجرای دانلود منتقل می‌شود:
+- نمونه‌های YoutubeDL ساخته شده داخل محدوده، hook پیشرفت و پس‌پردازش محدوده را می‌گیرند؛
+  پس از لغو یا پایان مهلت، اولین فراخوانی hook دانلود را با DownloadCancelled متوقف می‌کند
+- پردازه‌های فرزند yt-dlp (ffmpeg ادغام و پس‌پردازش) در محدوده ثبت و هنگام لغو فوراً کشته می‌شوند
+- فایل‌های نیمه‌کاره‌ای که yt-dlp گزارش داده است پس از پایان ترد حذف می‌شوند
+
+با install_ytdlp_cancellation سازنده YoutubeDL و Popen کتابخانه yt-dlp پوشانده می‌شوند.
+run_scoped_thread کار مسدودکننده را با محدوده فعلی در ترد اجرا می‌کند و تا پایان واقعی ترد منتظر می‌ماند.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from typing import Any, Callable, Optional, Set
+
+try:
+    import yt_dlp
+    from yt_dlp.utils import DownloadCancelled as _CancelledBase
+except ImportError:
+    yt_dlp = None
+    _CancelledBase = Exception
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# دلایل لغو
+REASON_CANCELLED = 'cancelled'
+REASON_DEADLINE = 'deadline'
+
+# محدوده لغو کار فعلی (در تسک‌ها و تردهایی که context را به ارث می‌برند)
+current_scope: contextvars.ContextVar = contextvars.ContextVar('current_scope', default=None)
+
+
+class ScopeCancelled(_CancelledBase):
+    """لغو دانلود به دلیل لغو کاربر یا پایان مهلت"""
+
+
+class CancelScope:
+    """محدوده لغو یک کار دانلود با مهلت اختیاری"""
+
+    def __init__(self, name: str, timeout: Optional[float] = None, start: bool = True):
+        """
+        Args:
+            name: نام کار (برای لاگ)
+            timeout: مهلت کار به ثانیه (None یا صفر یعنی بدون مهلت)
+            start: شروع فوری شمارش مهلت؛ در غیر این صورت با start_clock (هنگام گرفتن ترد اجرا) شروع می‌شود
+        """
+        self.name = name
+        self.timeout = timeout or None
+        self.deadline: Optional[float] = None
+        self.reason: Optional[str] = None
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._files: Set[str] = set()
+        if start:
+            self.start_clock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def start_clock(self) -> None:
+        """شروع شمارش مهلت (فراخوانی‌های بعدی اثری ندارند)"""
+        with self._lock:
+            if self.deadline is None and self.timeout:
+                self.deadline = time.monotonic() + self.timeout
+
+    def remaining(self) -> Optional[float]:
+        """زمان باقیمانده تا مهلت (پیش از شروع شمارش کل مهلت؛ None یعنی بدون مهلت)"""
+        if self.deadline is None:
+            return self.timeout
+        return max(0.0, self.deadline - time.monotonic())
+
+    def cancel(self, reason: str = REASON_CANCELLED) -> None:
+        """لغو کار و کشتن فوری پردازه‌های فرزند"""
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+            processes = list(self._processes)
+        for process in processes:
+            _kill(process)
+        if processes:
+            logger.info(f"{len(processes)} پردازه فرزند {self.name} کشته شد ({reason})")
+
+    def check(self) -> None:
+        """
+        بررسی لغو یا پایان مهلت (از داخل ترد دانلود)
+
+        Raises:
+            ScopeCancelled: اگر کار لغو شده یا مهلت آن تمام شده باشد
+        """
+        if self.reason is None and self.deadline is not None and time.monotonic() > self.deadline:
+            self.cancel(REASON_DEADLINE)
+        if self.reason is not None:
+            raise ScopeCancelled(f"{self.name}: {self.reason}")
+
+    def ytdlp_hook(self, status: dict) -> None:
+        """hook پیشرفت و پس‌پردازش yt-dlp: ثبت فایل‌های موقت و توقف دانلود لغو شده"""
+        for key in ('tmpfilename', 'filename'):
+            path = status.get(key)
+            if path:
+                with self._lock:
+                    self._files.add(path)
+        self.check()
+
+    def register_process(self, process) -> None:
+        """ثبت پردازه فرزند (اگر کار قبلاً لغو شده باشد، پردازه فوراً کشته می‌شود)"""
+        with self._lock:
+            self._processes.add(process)
+            cancelled = self.reason is not None
+        if cancelled:
+            _kill(process)
+
+    def unregister_process(self, process) -> None:
+        with self._lock:
+            self._processes.discard(process)
+
+    def cleanup(self) -> None:
+        """حذف فایل‌های نیمه‌کاره کار لغو شده"""
+        with self._lock:
+            files, self._files = self._files, set()
+        for path in files:
+            for candidate in (path, f"{path}.part", f"{path}.ytdl"):
+                try:
+                    if os.path.exists(candidate):
+                        os.remove(candidate)
+                except OSError:
+                    pass
+
+
+def _enter_scope(func: Callable, *args) -> Any:
+    """نقطه ورود ترد: شروع مهلت محدوده فعلی و صرف‌نظر از کار لغو شده پیش از گرفتن ترد"""
+    scope = current_scope.get()
+    if scope is not None:
+        if scope.cancelled:
+            return None
+        scope.start_clock()
+    return func(*args)
+
+
+async def run_scoped_thread(executor, func: Callable, *args) -> Any:
+    """
+    اجرای تابع مسدودکننده در پول اجرایی با محدوده لغو فعلی
+
+    context (و محدوده لغو) به ترد منتقل می‌شود و مهلت محدوده از لحظه گرفتن ترد شمرده می‌شود.
+    لغو تسک ترد را متوقف نمی‌کند، بنابراین تسک لغو شده تا پایان واقعی ترد (که با لغو محدوده
+    و کشتن پردازه‌های فرزند کوتاه است) منتظر می‌ماند و جای کارگر زودتر از ترد آزاد نمی‌شود.
+
+    Args:
+        executor: پول اجرایی مقصد
+        func: تابع مسدودکننده
+
+    Returns:
+        خروجی تابع (None اگر کار پیش از گرفتن ترد لغو شده باشد)
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    future = loop.run_in_executor(executor, context.run, _enter_scope, func, *args)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait({future})
+        if not future.cancelled():
+            future.exception()  # خطای ترد پس از لغو اهمیتی ندارد
+        raise
+
+
+def _kill(process) -> None:
+    try:
+        if process.poll() is None:
+            process.kill()
+    except (OSError, AttributeError):
+        pass
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install_ytdlp_cancellation() -> bool:
+    """
+    پوشاندن YoutubeDL و Popen کتابخانه yt-dlp برای اعمال محدوده لغو فعلی
+
+    Returns:
+        True اگر نصب انجام شد (یا قبلاً انجام شده بود)
+    """
+    global _installed
+    if yt_dlp is None:
+        return False
+
+    with _install_lock:
+        if _installed:
+            return True
+
+        original_init = yt_dlp.YoutubeDL.__init__
+
+        def scoped_init(self, *args, **kwargs):
+            original_init(self, *args, **kwargs)
+            scope = current_scope.get()
+            if scope is not None:
+                self.add_progress_hook(scope.ytdlp_hook)
+                self.add_postprocessor_hook(scope.ytdlp_hook)
+
+        yt_dlp.YoutubeDL.__init__ = scoped_init
+
+        popen_class = getattr(yt_dlp.utils, 'Popen', None)
+        if popen_class is not None:
+            original_popen_init = popen_class.__init__
+
+            def scoped_popen_init(self, *args, **kwargs):
+                original_popen_init(self, *args, **kwargs)
+                scope = current_scope.get()
+                if scope is not None:
+                    scope.register_process(self)
+
+            popen_class.__init__ = scoped_popen_init
+
+        _installed = True
+
+    logger.info("لغو و مهلت دانلودهای yt-dlp فعال شد")
+    return True
@@ -11,13 +11,14 @@ import os
 import json
 import sys
 import logging
-import subprocess
 import traceback
 from typing import Dict, List, Optional, Any, Tuple
 import time
 import datetime
 from pathlib import Path
 
+from ffmpeg_runner import run_ffmpeg
+
 # تنظیم لاگینگ پیشرفته
 logging.basicConfig(
     level=logging.DEBUG,
@@ -93,12 +94,7 @@ def get_file_info(file_path: str) -> Dict:
         ]
         
         logger.debug(f"اجرای دستور ffprobe: {' '.join(cmd)}")
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        result = run_ffmpeg(cmd)
         
         if result.returncode != 0:
             logger.error(f"خطا در اجرای ffprobe: {result.stderr}")
@@ -224,12 +220,7 @@ def test_convert_video_quality(input_file: str, quality: str) -> Dict:
         logger.info(f"اجرای دستور ffmpeg: {' '.join(cmd)}")
         
         # اجرای دستور
-        process = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        process = run_ffmpeg(cmd)
         
         result["ffmpeg_output"] = process.stderr
         
@@ -328,12 +319,7 @@ def test_extract_audio(input_file: str) -> Dict:
         logger.info(f"اجرای دستور ffmpeg برای استخراج صدا: {' '.join(cmd)}")
         
         # اجرای دستور
-        process = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        process = run_ffmpeg(cmd)
         
         result["ffmpeg_output"] = process.stderr
         
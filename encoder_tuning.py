@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+تنظیم خودکار پریست انکودر بر اساس سخت‌افزار میزبان
+
+این ماژول با ساخت ویدیوهای مصنوعی (testsrc) در رزولوشن‌های رایج، همه ترکیب‌های
+preset و CRF را از نظر زمان انکود و حجم خروجی اندازه‌گیری می‌کند و پروفایلی ذخیره
+می‌کند که مسیر تبدیل کیفیت برای رسیدن به زمان هدف روی همین ماشین از آن استفاده می‌کند.
+
+اجرا:
+    python encoder_tuning.py --duration 5 --heights 1080,720,480,360
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+from multiprocessing import cpu_count
+from typing import Dict, List, Optional, Tuple
+
+from ffmpeg_runner import run_ffmpeg
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# مسیر فایل پروفایل انکودر
+ENCODER_PROFILE_FILE = os.environ.get(
+    'ENCODER_PROFILE_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'encoder_profile.json')
+)
+# زمان هدف برای انکود یک ویدیو (به ثانیه)
+ENCODER_LATENCY_TARGET = float(os.environ.get('ENCODER_LATENCY_TARGET', '60'))
+# مدت فرضی ویدیو وقتی مدت واقعی مشخص نیست (به ثانیه)
+ENCODER_DEFAULT_DURATION = 60.0
+# رزولوشن‌های رایج برای بنچمارک
+BENCHMARK_HEIGHTS = [1080, 720, 480, 360]
+# پریست‌های x264 که بررسی می‌شوند (از سریع به کند)
+BENCHMARK_PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium']
+# مقادیر CRF که بررسی می‌شوند
+BENCHMARK_CRF_VALUES = [23, 26, 28, 30, 32]
+# مدت ویدیوی مصنوعی (به ثانیه)
+BENCHMARK_CLIP_DURATION = 5
+
+
+def _get_ffmpeg_paths() -> Tuple[str, str]:
+    """دریافت مسیر ffmpeg و ffprobe (مشابه telegram_fixes)"""
+    try:
+        from telegram_fixes import FFMPEG_PATH, FFPROBE_PATH
+        return FFMPEG_PATH, FFPROBE_PATH
+    except ImportError:
+        return shutil.which('ffmpeg') or 'ffmpeg', shutil.which('ffprobe') or 'ffprobe'
+
+
+# پروفایل بارگذاری شده: (زمان تغییر فایل, محتوا)
+_profile_cache: Dict[str, object] = {'mtime': None, 'profile': None}
+# مدت ویدیوهای بررسی شده: (مسیر, زمان تغییر) -> مدت
+_duration_memo: Dict[Tuple[str, float], Optional[float]] = {}
+
+
+def load_profile() -> Optional[Dict]:
+    """
+    بارگذاری پروفایل انکودر ذخیره شده (با بارگذاری مجدد در صورت تغییر فایل)
+
+    Returns:
+        دیکشنری پروفایل یا None اگر بنچمارک اجرا نشده باشد
+    """
+    try:
+        mtime = os.path.getmtime(ENCODER_PROFILE_FILE)
+    except OSError:
+        return None
+
+    if _profile_cache['mtime'] == mtime:
+        return _profile_cache['profile']
+
+    try:
+        with open(ENCODER_PROFILE_FILE, 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+    except (ValueError, IOError) as e:
+        logger.warning(f"خطا در خواندن پروفایل انکودر: {e}")
+        profile = None
+
+    _profile_cache['mtime'] = mtime
+    _profile_cache['profile'] = profile
+    return profile
+
+
+def probe_duration(video_path: str) -> Optional[float]:
+    """
+    دریافت مدت ویدیو با ffprobe (با حافظه‌سازی)
+
+    Args:
+        video_path: مسیر فایل ویدیو
+
+    Returns:
+        مدت به ثانیه یا None در صورت خطا
+    """
+    try:
+        memo_key = (os.path.realpath(video_path), os.path.getmtime(video_path))
+    except OSError:
+        return None
+
+    if memo_key in _duration_memo:
+        return _duration_memo[memo_key]
+
+    duration = None
+    _, ffprobe_path = _get_ffmpeg_paths()
+    try:
+        result = run_ffmpeg(
+            [ffprobe_path, '-v', 'error', '-show_entries', 'format=duration',
+             '-of', 'default=noprint_wrappers=1:nokey=1', video_path]
+        )
+        if result.returncode == 0 and result.stdout.strip():
+            duration = float(result.stdout.strip())
+    except (ValueError, OSError) as e:
+        logger.warning(f"خطا در دریافت مدت ویدیو: {e}")
+
+    _duration_memo[memo_key] = duration
+    return duration
+
+
+def select_encoder_settings(target_height: int, duration: Optional[float] = None,
+                            latency_target: Optional[float] = None,
+                            default_preset: str = 'ultrafast', default_crf: int = 30) -> Dict:
+    """
+    انتخاب preset و CRF مناسب برای رسیدن به زمان هدف روی این ماشین
+
+    از بین ترکیب‌هایی که زمان تخمینی انکودشان از زمان هدف کمتر است، ترکیبی انتخاب
+    می‌شود که CRF آن به CRF پیش‌فرض نزدیک‌تر و حجم خروجی آن کمتر باشد (پریست کندتر
+    با همان CRF حجم کمتری تولید می‌کند).
+
+    Args:
+        target_height: ارتفاع خروجی
+        duration: مدت ویدیو به ثانیه (در صورت عدم وجود، ENCODER_DEFAULT_DURATION)
+        latency_target: زمان هدف انکود به ثانیه (پیش‌فرض ENCODER_LATENCY_TARGET)
+        default_preset: پریست پیش‌فرض در صورت نبود پروفایل
+        default_crf: CRF پیش‌فرض در صورت نبود پروفایل
+
+    Returns:
+        دیکشنری {'preset': ..., 'crf': ...}
+    """
+    default_settings = {'preset': default_preset, 'crf': default_crf}
+
+    profile = load_profile()
+    if not profile or not profile.get('results'):
+        return default_settings
+
+    try:
+        duration = duration or ENCODER_DEFAULT_DURATION
+        latency_target = latency_target or ENCODER_LATENCY_TARGET
+
+        # نزدیک‌ترین ارتفاع بنچمارک شده
+        heights = [int(h) for h in profile['results']]
+        nearest_height = min(heights, key=lambda h: abs(h - target_height))
+        entries = profile['results'][str(nearest_height)]
+        if not entries:
+            return default_settings
+
+        # سرعت انکود بر حسب برابر زمان واقعی (مدت ویدیو / زمان انکود)
+        candidates = [e for e in entries if e.get('speed', 0) > 0 and duration / e['speed'] <= latency_target]
+        if not candidates:
+            # هیچ ترکیبی به زمان هدف نمی‌رسد - سریع‌ترین ترکیب
+            fastest = max(entries, key=lambda e: e.get('speed', 0))
+            return {'preset': fastest['preset'], 'crf': fastest['crf']}
+
+        best = min(candidates, key=lambda e: (abs(e['crf'] - default_crf), e['size']))
+        return {'preset': best['preset'], 'crf': best['crf']}
+    except (KeyError, ValueError, TypeError) as e:
+        logger.warning(f"پروفایل انکودر نامعتبر است، استفاده از تنظیمات پیش‌فرض: {e}")
+        return default_settings
+
+
+def generate_test_clip(height: int, duration: int, output_dir: str) -> Optional[str]:
+    """
+    ساخت ویدیوی مصنوعی با فیلتر testsrc
+
+    Args:
+        height: ارتفاع ویدیو
+        duration: مدت ویدیو به ثانیه
+        output_dir: دایرکتوری خروجی
+
+    Returns:
+        مسیر ویدیوی ساخته شده یا None در صورت خطا
+    """
+    ffmpeg_path, _ = _get_ffmpeg_paths()
+    width = int(height * 16 / 9) // 2 * 2
+    output_path = os.path.join(output_dir, f"testsrc_{height}p.mkv")
+
+    cmd = [
+        ffmpeg_path, '-hide_banner', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc=size={width}x{height}:rate=30:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=1000:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-qp', '0',
+        '-c:a', 'pcm_s16le',
+        '-y', output_path
+    ]
+    result = run_ffmpeg(cmd)
+    if result.returncode != 0 or not os.path.exists(output_path):
+        logger.error(f"خطا در ساخت ویدیوی مصنوعی {height}p: {result.stderr[:300]}")
+        return None
+    return output_path
+
+
+def benchmark_encode(clip_path: str, preset: str, crf: int, duration: int, output_dir: str) -> Optional[Dict]:
+    """
+    اندازه‌گیری زمان انکود و حجم خروجی برای یک ترکیب preset و CRF
+
+    Returns:
+        دیکشنری نتیجه یا None در صورت خطا
+    """
+    ffmpeg_path, _ = _get_ffmpeg_paths()
+    output_path = os.path.join(output_dir, f"bench_{preset}_{crf}.mp4")
+    cmd = [
+        ffmpeg_path, '-hide_banner', '-loglevel', 'error',
+        '-i', clip_path,
+        '-c:v', 'libx264', '-preset', preset, '-crf', str(crf),
+        '-c:a', 'aac', '-b:a', '96k',
+        '-threads', str(min(cpu_count(), 8)),
+        '-y', output_path
+    ]
+
+    result = run_ffmpeg(cmd)
+    encode_time = result.elapsed
+
+    if result.returncode != 0 or not os.path.exists(output_path):
+        logger.warning(f"خطا در انکود {preset}/crf={crf}: {result.stderr[:200]}")
+        return None
+
+    size = os.path.getsize(output_path)
+    os.remove(output_path)
+    return {
+        'preset': preset,
+        'crf': crf,
+        'encode_time': round(encode_time, 3),
+        'speed': round(duration / encode_time, 3) if encode_time > 0 else 0,
+        'size': size,
+        'bitrate_kbps': round(size * 8 / 1000 / duration, 1),
+    }
+
+
+def run_benchmark(heights: List[int] = None, presets: List[str] = None,
+                  crf_values: List[int] = None, duration: int = BENCHMARK_CLIP_DURATION) -> Dict:
+    """
+    اجرای بنچمارک کامل و ساخت پروفایل انکودر
+
+    Args:
+        heights: رزولوشن‌های مورد بررسی
+        presets: پریست‌های مورد بررسی
+        crf_values: مقادیر CRF مورد بررسی
+        duration: مدت ویدیوی مصنوعی به ثانیه
+
+    Returns:
+        دیکشنری پروفایل
+    """
+    heights = heights or BENCHMARK_HEIGHTS
+    presets = presets or BENCHMARK_PRESETS
+    crf_values = crf_values or BENCHMARK_CRF_VALUES
+
+    profile = {
+        'created': time.time(),
+        'host': {
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpu_count': cpu_count(),
+        },
+        'clip_duration': duration,
+        'results': {},
+    }
+
+    work_dir = tempfile.mkdtemp(prefix='encoder_bench_')
+    try:
+        for height in heights:
+            logger.info(f"ساخت ویدیوی مصنوعی {height}p...")
+            clip_path = generate_test_clip(height, duration, work_dir)
+            if not clip_path:
+                continue
+
+            entries = []
+            for preset in presets:
+                for crf in crf_values:
+                    entry = benchmark_encode(clip_path, preset, crf, duration, work_dir)
+                    if entry:
+                        entries.append(entry)
+                        logger.info(f"{height}p {preset:>10} crf={crf}: {entry['encode_time']:.2f}s "
+                                    f"({entry['speed']:.2f}x) - {entry['size'] / 1024:.0f} KB")
+
+            profile['results'][str(height)] = entries
+            os.remove(clip_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return profile
+
+
+def save_profile(profile: Dict, path: str = ENCODER_PROFILE_FILE) -> str:
+    """ذخیره اتمیک پروفایل انکودر"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    logger.info(f"پروفایل انکودر ذخیره شد: {path}")
+    return path
+
+
+if __name__ == "__main__":
+    # تنظیم لاگر
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description='بنچمارک پریست‌های انکودر و ساخت پروفایل میزبان')
+    parser.add_argument('--heights', default=','.join(str(h) for h in BENCHMARK_HEIGHTS),
+                        help='رزولوشن‌ها (مثلاً 1080,720,480,360)')
+    parser.add_argument('--presets', default=','.join(BENCHMARK_PRESETS), help='پریست‌های x264')
+    parser.add_argument('--crf', default=','.join(str(c) for c in BENCHMARK_CRF_VALUES), help='مقادیر CRF')
+    parser.add_argument('--duration', type=int, default=BENCHMARK_CLIP_DURATION, help='مدت ویدیوی مصنوعی (ثانیه)')
+    parser.add_argument('--output', default=ENCODER_PROFILE_FILE, help='مسیر فایل پروفایل')
+    args = parser.parse_args()
+
+    benchmark_profile = run_benchmark(
+        heights=[int(h) for h in args.heights.split(',') if h],
+        presets=[p for p in args.presets.split(',') if p],
+        crf_values=[int(c) for c in args.crf.split(',') if c],
+        duration=args.duration
+    )
+    save_profile(benchmark_profile, args.output)
+
+    # نمایش تنظیمات انتخاب شده برای زمان هدف فعلی
+    ENCODER_PROFILE_FILE = args.output
+    for bench_height in benchmark_profile['results']:
+        selected = select_encoder_settings(int(bench_height))
+        print(f"{bench_height}p -> preset={selected['preset']} crf={selected['crf']} "
+              f"(هدف {ENCODER_LATENCY_TARGET:.0f} ثانیه برای ویدیوی {ENCODER_DEFAULT_DURATION:.0f} ثانیه‌ای)")
@@ -20,6 +20,7 @@ from telegram.constants import ParseMode
 # واردسازی ماژول‌های بهینه‌سازی
 from cache_optimizer import cleanup_cache, optimize_cache
 from youtube_downloader_optimizer import optimize_youtube_downloader
+from status_editor import get_editor, release_editor
 
 # تنظیم لاگر
 logger = logging.getLogger(__name__)
@@ -263,19 +264,24 @@ class TelegramUIEnhancer:
             message_id: شناسه پیام
             status: وضعیت دانلود
         """
+        chat_id = update.effective_chat.id
         try:
             # ایجاد پیام پیشرفت جدید
             new_text = self.format_download_progress_message(status)
             
-            # ویرایش پیام موجود
-            await context.bot.edit_message_text(
-                chat_id=update.effective_chat.id,
-                message_id=message_id,
-                text=new_text,
-                parse_mode=ParseMode.HTML
-            )
+            # ویرایش پیام موجود از طریق ویرایشگر ادغام‌کننده (محدودیت نرخ و حذف ویرایش‌های تکراری)
+            def edit_func(text, **kwargs):
+                return context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, **kwargs)
+            
+            editor = get_editor(chat_id, message_id, edit_func)
+            editor.update(new_text, parse_mode=ParseMode.HTML)
+            
+            # پس از پایان دانلود ویرایشگر از لیست فعال حذف می‌شود (آخرین ویرایش همچنان ارسال می‌شود)
+            if status.get('progress', 0) >= 100 or status.get('status') in ('finished', 'error'):
+                release_editor(chat_id, message_id)
         except Exception as e:
             logger.warning(f"خطا در به‌روزرسانی پیام پیشرفت: {e}")
+            release_editor(chat_id, message_id)
     
     def create_download_options_keyboard(self, options: List[Dict], url_id: str, 
                                         download_type: str) -> InlineKeyboardMarkup:
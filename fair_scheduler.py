@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+زمان‌بند منصفانه وزن‌دار (weighted fair queueing) برای ظرفیت دانلود
+
+هر درخواست دانلود در صف مجازی کاربر خود و در یکی از دو کلاس interactive (انتخاب کیفیت
+از کیبورد) یا bulk (آیتم‌های دانلود چندگانه) قرار می‌گیرد:
+- بین کلاس‌ها: در حالت پیش‌فرض interactive همیشه بر bulk مقدم است (اولویت مطلق)؛
+  در غیر این صورت سهم هر کلاس متناسب با وزن آن است
+- درون هر کلاس: صف کاربران با برچسب زمان پایان مجازی (virtual finish time) به نوبت
+  سرویس می‌گیرند، بنابراین دسته 200 لینکی یک کاربر دیگران را گرسنه نمی‌گذارد
+- سقف همزمانی کلاس bulk کمتر از ظرفیت کل است تا همیشه جا برای درخواست‌های تعاملی بماند
+
+زمان‌بند هم از هندلرهای همزمان (ترد) و هم از کوروتین‌ها قابل استفاده است.
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+import threading
+import itertools
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, Optional
+
+from handler_runtime import DOWNLOAD_WORKERS
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# کلاس‌های درخواست
+CLASS_INTERACTIVE = 'interactive'
+CLASS_BULK = 'bulk'
+
+# ظرفیت کل دانلودهای همزمان زمان‌بند
+FAIR_SCHEDULER_SLOTS = int(os.environ.get('FAIR_SCHEDULER_SLOTS', str(DOWNLOAD_WORKERS + 4)))
+# سقف همزمانی کلاس bulk (بقیه ظرفیت برای درخواست‌های تعاملی می‌ماند)؛ همان تعداد کارگرهای دانلود
+# چندگانه است تا کارگر اضافه‌ای منتظر جا نماند و جای خالی بدون کارگر نماند
+FAIR_BULK_MAX_RUNNING = min(int(os.environ.get('BULK_WORKERS', str(DOWNLOAD_WORKERS))), FAIR_SCHEDULER_SLOTS)
+# اولویت مطلق درخواست‌های تعاملی بر bulk
+FAIR_STRICT_PRIORITY = os.environ.get('FAIR_STRICT_PRIORITY', 'true').lower() in ('1', 'true', 'yes')
+# وزن کلاس‌ها (در حالت اولویت غیرمطلق)
+CLASS_WEIGHTS = {
+    CLASS_INTERACTIVE: float(os.environ.get('FAIR_WEIGHT_INTERACTIVE', '4')),
+    CLASS_BULK: float(os.environ.get('FAIR_WEIGHT_BULK', '1')),
+}
+# حداکثر زمان انتظار درخواست تعاملی برای گرفتن جا (ثانیه)
+INTERACTIVE_ACQUIRE_TIMEOUT = 300
+
+
+class _Waiter:
+    """یک درخواست منتظر در صف مجازی کاربر"""
+
+    __slots__ = ('user_id', 'cls', 'finish_tag', 'grant', 'enqueued_at', 'cancelled')
+
+    def __init__(self, user_id: int, cls: str, finish_tag: float, grant: Callable[[], None]):
+        self.user_id = user_id
+        self.cls = cls
+        self.finish_tag = finish_tag
+        self.grant = grant
+        self.enqueued_at = time.monotonic()
+        self.cancelled = False
+
+
+class _ClassQueue:
+    """صف یک کلاس با صف‌های مجازی کاربران"""
+
+    def __init__(self, name: str, weight: float, max_running: int):
+        self.name = name
+        self.weight = weight
+        self.max_running = max_running
+        self.heap = []
+        self.virtual_time = 0.0
+        self.last_finish: Dict[int, float] = {}
+        self.queued_per_user: Dict[int, int] = {}
+        self.running = 0
+
+        # آمار
+        self.served = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.max_depth = 0
+
+    @property
+    def depth(self) -> int:
+        return sum(self.queued_per_user.values())
+
+
+class FairScheduler:
+    """زمان‌بند منصفانه وزن‌دار با صف مجازی برای هر کاربر"""
+
+    def __init__(self, slots: int = FAIR_SCHEDULER_SLOTS, strict_priority: bool = FAIR_STRICT_PRIORITY):
+        self.slots = slots
+        self.strict_priority = strict_priority
+        self.running = 0
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        # زمان مجازی بین کلاس‌ها (در حالت اولویت غیرمطلق)
+        self._class_service: Dict[str, float] = {CLASS_INTERACTIVE: 0.0, CLASS_BULK: 0.0}
+        self._classes = {
+            CLASS_INTERACTIVE: _ClassQueue(CLASS_INTERACTIVE, CLASS_WEIGHTS[CLASS_INTERACTIVE], slots),
+            CLASS_BULK: _ClassQueue(CLASS_BULK, CLASS_WEIGHTS[CLASS_BULK], min(FAIR_BULK_MAX_RUNNING, slots)),
+        }
+        # وزن کاربران (پیش‌فرض 1)
+        self._user_weights: Dict[int, float] = {}
+
+    def set_user_weight(self, user_id: int, weight: float) -> None:
+        """تنظیم وزن یک کاربر (مثلاً برای کاربران ویژه)"""
+        with self._lock:
+            self._user_weights[user_id] = max(weight, 0.01)
+
+    def submit(self, user_id: int, cls: str, grant: Callable[[], None]) -> _Waiter:
+        """
+        ثبت درخواست در صف مجازی کاربر
+
+        Args:
+            user_id: شناسه کاربر
+            cls: کلاس درخواست (interactive یا bulk)
+            grant: تابعی که هنگام اختصاص جا فراخوانی می‌شود (زیر قفل زمان‌بند؛ باید سریع باشد)
+
+        Returns:
+            شیء انتظار (برای لغو با cancel)
+        """
+        with self._lock:
+            queue = self._classes[cls]
+            weight = self._user_weights.get(user_id, 1.0)
+            start_tag = max(queue.virtual_time, queue.last_finish.get(user_id, 0.0))
+            finish_tag = start_tag + 1.0 / weight
+            queue.last_finish[user_id] = finish_tag
+
+            waiter = _Waiter(user_id, cls, finish_tag, grant)
+            heapq.heappush(queue.heap, (finish_tag, next(self._sequence), waiter))
+            queue.queued_per_user[user_id] = queue.queued_per_user.get(user_id, 0) + 1
+            queue.max_depth = max(queue.max_depth, queue.depth)
+            self._dispatch()
+            return waiter
+
+    def cancel(self, waiter: _Waiter) -> bool:
+        """
+        لغو درخواست منتظر
+
+        Returns:
+            True اگر درخواست هنوز جا نگرفته بود؛ False اگر جا گرفته است و باید release شود
+        """
+        with self._lock:
+            if waiter.cancelled or waiter.grant is None:
+                return False
+            waiter.cancelled = True
+            self._dequeued(self._classes[waiter.cls], waiter)
+            return True
+
+    def release(self, cls: str) -> None:
+        """آزاد کردن جای یک درخواست تمام شده"""
+        with self._lock:
+            self.running -= 1
+            self._classes[cls].running -= 1
+            self._dispatch()
+
+    def _dequeued(self, queue: _ClassQueue, waiter: _Waiter) -> None:
+        remaining = queue.queued_per_user.get(waiter.user_id, 1) - 1
+        if remaining > 0:
+            queue.queued_per_user[waiter.user_id] = remaining
+        else:
+            queue.queued_per_user.pop(waiter.user_id, None)
+            # کاربر بدون صف نباید با برچسب‌های قدیمی جلوتر از بقیه بماند
+            if queue.last_finish.get(waiter.user_id, 0.0) > queue.virtual_time:
+                queue.last_finish.pop(waiter.user_id, None)
+
+    def _peek(self, queue: _ClassQueue) -> Optional[_Waiter]:
+        while queue.heap and queue.heap[0][2].cancelled:
+            heapq.heappop(queue.heap)
+        return queue.heap[0][2] if queue.heap else None
+
+    def _pick_class(self) -> Optional[_ClassQueue]:
+        """انتخاب کلاس بعدی برای سرویس"""
+        eligible = [queue for queue in self._classes.values()
+                    if queue.running < queue.max_running and self._peek(queue) is not None]
+        if not eligible:
+            return None
+        if self.strict_priority:
+            return self._classes[CLASS_INTERACTIVE] if self._classes[CLASS_INTERACTIVE] in eligible else eligible[0]
+        # کلاسی که نسبت سرویس دریافتی به وزنش کمتر است
+        return min(eligible, key=lambda queue: self._class_service[queue.name])
+
+    def _dispatch(self) -> None:
+        """اختصاص جاهای خالی به درخواست‌ها (زیر قفل)"""
+        while self.running < self.slots:
+            queue = self._pick_class()
+            if queue is None:
+                return
+            _, _, waiter = heapq.heappop(queue.heap)
+            queue.virtual_time = waiter.finish_tag
+            self._dequeued(queue, waiter)
+            self._class_service[queue.name] += 1.0 / queue.weight
+
+            wait = time.monotonic() - waiter.enqueued_at
+            queue.served += 1
+            queue.total_wait += wait
+            queue.max_wait = max(queue.max_wait, wait)
+
+            self.running += 1
+            queue.running += 1
+            grant, waiter.grant = waiter.grant, None
+            grant()
+
+    @contextmanager
+    def slot(self, user_id: int, cls: str = CLASS_INTERACTIVE, timeout: float = INTERACTIVE_ACQUIRE_TIMEOUT):
+        """
+        گرفتن جا برای هندلرهای همزمان (مسدودکننده)
+
+        Args:
+            user_id: شناسه کاربر
+            cls: کلاس درخواست
+            timeout: حداکثر زمان انتظار؛ پس از آن بدون جا ادامه داده می‌شود
+        """
+        event = threading.Event()
+        waiter = self.submit(user_id, cls, event.set)
+        acquired = event.wait(timeout) or not self.cancel(waiter)
+        if not acquired:
+            logger.warning(f"انتظار کاربر {user_id} برای جای دانلود از {timeout} ثانیه گذشت")
+        try:
+            yield
+        finally:
+            if acquired:
+                self.release(cls)
+
+    @asynccontextmanager
+    async def async_slot(self, user_id: int, cls: str = CLASS_BULK):
+        """
+        گرفتن جا برای کوروتین‌ها (بدون مسدود کردن event loop)
+
+        Args:
+            user_id: شناسه کاربر
+            cls: کلاس درخواست
+        """
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def grant():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = self.submit(user_id, cls, grant)
+        try:
+            await granted
+        except asyncio.CancelledError:
+            if not self.cancel(waiter):
+                self.release(cls)
+            raise
+        try:
+            yield
+        finally:
+            self.release(cls)
+
+    def get_stats(self) -> Dict:
+        """
+        دریافت آمار زمان‌بند
+
+        Returns:
+            دیکشنری عمق صف، تعداد در حال اجرا و زمان انتظار هر کلاس
+        """
+        with self._lock:
+            classes = {}
+            for name, queue in self._classes.items():
+                classes[name] = {
+                    'queued': queue.depth,
+                    'queued_users': len(queue.queued_per_user),
+                    'running': queue.running,
+                    'max_running': queue.max_running,
+                    'max_depth': queue.max_depth,
+                    'served': queue.served,
+                    'avg_wait': round(queue.total_wait / queue.served, 2) if queue.served else 0.0,
+                    'max_wait': round(queue.max_wait, 2),
+                    'weight': queue.weight,
+                }
+            return {
+                'slots': self.slots,
+                'running': self.running,
+                'strict_priority': self.strict_priority,
+                'classes': classes,
+            }
+
+
+# نمونه مشترک زمان‌بند
+fair_scheduler = FairScheduler()
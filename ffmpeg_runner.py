@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+اجراکننده نظارت‌شده ffmpeg
+
+این ماژول همه اجراهای ffmpeg/ffprobe را به صورت آسنکرون با نظارت انجام می‌دهد:
+- خواندن پیشرفت از -progress pipe:1 و محاسبه درصد و زمان باقیمانده
+- اعمال مهلت زمانی برای هر کار
+- کشتن کارهایی که پیشرفتشان متوقف شده است
+- ثبت هیستوگرام مدت اجرا و نوع خروج
+
+نتیجه اجرا شبیه subprocess.CompletedProcess است تا جایگزینی subprocess.run ساده باشد.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import warnings
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# مهلت پیش‌فرض هر کار ffmpeg (به ثانیه)
+FFMPEG_JOB_TIMEOUT = float(os.environ.get('FFMPEG_JOB_TIMEOUT', '900'))
+# حداکثر زمان بدون پیشرفت قبل از کشتن کار (به ثانیه)
+FFMPEG_STALL_TIMEOUT = float(os.environ.get('FFMPEG_STALL_TIMEOUT', '60'))
+# مهلت پیش‌فرض ffprobe (به ثانیه)
+FFPROBE_TIMEOUT = 30
+# حداکثر طول خروجی خطا که نگهداری می‌شود (کاراکتر)
+MAX_STDERR_CHARS = 64 * 1024
+# بازه‌های هیستوگرام مدت اجرا (به ثانیه)
+DURATION_BUCKETS = [1, 5, 15, 30, 60, 120, 300, 600]
+
+# انواع خروج
+EXIT_OK = 'ok'
+EXIT_ERROR = 'error'
+EXIT_TIMEOUT = 'timeout'
+EXIT_STALLED = 'stalled'
+EXIT_KILLED = 'killed'
+EXIT_NOT_FOUND = 'not_found'
+
+# پول اجرایی برای فراخوانی همزمان از داخل event loop در حال اجرا
+_sync_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='ffmpeg_runner')
+
+
+class FFmpegResult(subprocess.CompletedProcess):
+    """نتیجه اجرای ffmpeg (سازگار با subprocess.CompletedProcess)"""
+
+    def __init__(self, args, returncode, stdout='', stderr='', exit_class=EXIT_OK, elapsed=0.0):
+        super().__init__(args, returncode, stdout, stderr)
+        self.exit_class = exit_class
+        self.elapsed = elapsed
+
+
+class FFmpegRunnerStats:
+    """آمار اجراهای ffmpeg: هیستوگرام مدت و تعداد هر نوع خروج"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.exit_classes: Dict[str, int] = {}
+        self.duration_histogram: Dict[str, int] = {self._bucket_label(b): 0 for b in DURATION_BUCKETS + [None]}
+        self.total_time = 0.0
+
+    @staticmethod
+    def _bucket_label(bucket: Optional[float]) -> str:
+        return f"<={bucket}s" if bucket is not None else f">{DURATION_BUCKETS[-1]}s"
+
+    def record(self, exit_class: str, elapsed: float) -> None:
+        """ثبت نتیجه یک اجرا"""
+        bucket = next((b for b in DURATION_BUCKETS if elapsed <= b), None)
+        with self.lock:
+            self.exit_classes[exit_class] = self.exit_classes.get(exit_class, 0) + 1
+            self.duration_histogram[self._bucket_label(bucket)] += 1
+            self.total_time += elapsed
+
+    def snapshot(self) -> Dict:
+        """دریافت کپی آمار فعلی"""
+        with self.lock:
+            return {
+                'exit_classes': dict(self.exit_classes),
+                'duration_histogram': dict(self.duration_histogram),
+                'total_runs': sum(self.exit_classes.values()),
+                'total_time': round(self.total_time, 2),
+            }
+
+
+# نمونه آمار جهانی
+runner_stats = FFmpegRunnerStats()
+
+
+def get_runner_stats() -> Dict:
+    """دریافت آمار اجراهای ffmpeg"""
+    return runner_stats.snapshot()
+
+
+def _is_ffmpeg_command(cmd: List[str]) -> bool:
+    """بررسی اینکه دستور ffmpeg است (نه ffprobe)"""
+    return os.path.basename(str(cmd[0])).startswith('ffmpeg')
+
+
+def _get_input_path(cmd: List[str]) -> Optional[str]:
+    """یافتن اولین فایل ورودی دستور"""
+    for i, arg in enumerate(cmd[:-1]):
+        if arg == '-i' and os.path.exists(str(cmd[i + 1])):
+            return str(cmd[i + 1])
+    return None
+
+
+async def _probe_duration(cmd: List[str]) -> Optional[float]:
+    """دریافت مدت فایل ورودی برای محاسبه درصد پیشرفت"""
+    input_path = _get_input_path(cmd)
+    if not input_path:
+        return None
+
+    ffprobe_path = os.path.join(os.path.dirname(str(cmd[0])),
+                                os.path.basename(str(cmd[0])).replace('ffmpeg', 'ffprobe'))
+    try:
+        process = await asyncio.create_subprocess_exec(
+            ffprobe_path, '-v', 'error', '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1', input_path,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout=FFPROBE_TIMEOUT)
+        return float(stdout.decode().strip())
+    except (OSError, ValueError, asyncio.TimeoutError):
+        return None
+
+
+def _kill_process(process) -> None:
+    """کشتن پردازه در صورت اجرا"""
+    try:
+        if process.returncode is None:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+async def run_ffmpeg_async(cmd: List[str], timeout: Optional[float] = None,
+                           stall_timeout: Optional[float] = None,
+                           progress_callback: Optional[Callable[[Dict], None]] = None,
+                           total_duration: Optional[float] = None,
+                           check: bool = False) -> FFmpegResult:
+    """
+    اجرای نظارت‌شده ffmpeg یا ffprobe
+
+    Args:
+        cmd: دستور کامل (اولین آرگومان مسیر ffmpeg یا ffprobe)
+        timeout: مهلت کل کار به ثانیه (پیش‌فرض FFMPEG_JOB_TIMEOUT، برای ffprobe FFPROBE_TIMEOUT)
+        stall_timeout: حداکثر زمان بدون پیشرفت به ثانیه (پیش‌فرض FFMPEG_STALL_TIMEOUT)
+        progress_callback: تابعی که با دیکشنری پیشرفت (percent, eta, out_time, speed) فراخوانی می‌شود
+        total_duration: مدت ورودی به ثانیه برای محاسبه درصد (در صورت نبود، با ffprobe خوانده می‌شود)
+        check: در صورت خروج ناموفق CalledProcessError ایجاد شود
+
+    Returns:
+        FFmpegResult شامل returncode، stderr، exit_class و elapsed
+    """
+    cmd = [str(arg) for arg in cmd]
+    is_ffmpeg = _is_ffmpeg_command(cmd)
+    timeout = timeout or (FFMPEG_JOB_TIMEOUT if is_ffmpeg else FFPROBE_TIMEOUT)
+    stall_timeout = stall_timeout or FFMPEG_STALL_TIMEOUT
+
+    # افزودن خروجی پیشرفت ماشینی برای ffmpeg
+    run_cmd = cmd
+    if is_ffmpeg:
+        run_cmd = [cmd[0], '-progress', 'pipe:1', '-nostats'] + cmd[1:]
+        if progress_callback and not total_duration:
+            total_duration = await _probe_duration(cmd)
+
+    start_time = time.monotonic()
+
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *run_cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except (FileNotFoundError, PermissionError) as e:
+        logger.error(f"اجرای {cmd[0]} ممکن نیست: {e}")
+        elapsed = time.monotonic() - start_time
+        runner_stats.record(EXIT_NOT_FOUND, elapsed)
+        result = FFmpegResult(cmd, 127, '', str(e), EXIT_NOT_FOUND, elapsed)
+        if check:
+            raise subprocess.CalledProcessError(127, cmd, '', str(e))
+        return result
+
+    state = {'last_progress': time.monotonic(), 'last_marker': None}
+    stdout_parts: List[str] = []
+    stderr_parts: List[str] = []
+
+    async def read_progress():
+        """خواندن خروجی پیشرفت (key=value) از stdout"""
+        block: Dict[str, str] = {}
+        async for raw_line in process.stdout:
+            line = raw_line.decode('utf-8', errors='replace').strip()
+            if not is_ffmpeg:
+                stdout_parts.append(raw_line.decode('utf-8', errors='replace'))
+                continue
+            if '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            block[key] = value
+            if key != 'progress':
+                continue
+
+            # پایان یک بلوک پیشرفت
+            marker = (block.get('out_time_us') or block.get('out_time_ms'), block.get('total_size'))
+            if marker != state['last_marker']:
+                state['last_marker'] = marker
+                state['last_progress'] = time.monotonic()
+
+            if progress_callback:
+                try:
+                    out_time = int(block.get('out_time_us') or block.get('out_time_ms') or 0) / 1000000
+                except ValueError:
+                    out_time = 0.0
+                percent = None
+                eta = None
+                if total_duration:
+                    percent = 100.0 if value == 'end' else min(100.0, out_time * 100 / total_duration)
+                    elapsed_so_far = time.monotonic() - start_time
+                    if out_time > 0:
+                        eta = max(0.0, elapsed_so_far * (total_duration - out_time) / out_time)
+                try:
+                    progress_callback({
+                        'percent': percent,
+                        'eta': eta,
+                        'out_time': out_time,
+                        'speed': block.get('speed'),
+                        'fps': block.get('fps'),
+                        'done': value == 'end',
+                    })
+                except Exception as e:
+                    logger.warning(f"خطا در تابع گزارش پیشرفت ffmpeg: {e}")
+            block = {}
+
+    async def read_stderr():
+        """خواندن خروجی خطا (با نگهداری انتهای آن)"""
+        total_chars = 0
+        async for raw_line in process.stderr:
+            line = raw_line.decode('utf-8', errors='replace')
+            stderr_parts.append(line)
+            total_chars += len(line)
+            while total_chars > MAX_STDERR_CHARS and len(stderr_parts) > 1:
+                total_chars -= len(stderr_parts.pop(0))
+
+    readers = asyncio.gather(read_progress(), read_stderr())
+    wait_task = asyncio.ensure_future(process.wait())
+    exit_class = None
+
+    try:
+        while not wait_task.done():
+            await asyncio.wait({wait_task}, timeout=1.0)
+            if wait_task.done():
+                break
+            now = time.monotonic()
+            if now - start_time > timeout:
+                logger.error(f"مهلت اجرای {os.path.basename(cmd[0])} به پایان رسید ({timeout:.0f} ثانیه)، کشتن پردازه")
+                exit_class = EXIT_TIMEOUT
+                _kill_process(process)
+                break
+            if is_ffmpeg and now - state['last_progress'] > stall_timeout:
+                logger.error(f"پیشرفت ffmpeg به مدت {stall_timeout:.0f} ثانیه متوقف شده است، کشتن پردازه")
+                exit_class = EXIT_STALLED
+                _kill_process(process)
+                break
+        await wait_task
+        await readers
+    except asyncio.CancelledError:
+        _kill_process(process)
+        elapsed = time.monotonic() - start_time
+        runner_stats.record(EXIT_KILLED, elapsed)
+        raise
+
+    elapsed = time.monotonic() - start_time
+    returncode = process.returncode
+    if exit_class is None:
+        if returncode == 0:
+            exit_class = EXIT_OK
+        elif returncode is not None and returncode < 0:
+            exit_class = EXIT_KILLED
+        else:
+            exit_class = EXIT_ERROR
+
+    runner_stats.record(exit_class, elapsed)
+    stdout_text = ''.join(stdout_parts)
+    stderr_text = ''.join(stderr_parts)
+
+    if exit_class != EXIT_OK:
+        logger.debug(f"ffmpeg با وضعیت {exit_class} (کد {returncode}) پس از {elapsed:.1f} ثانیه پایان یافت")
+
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, stdout_text, stderr_text)
+
+    return FFmpegResult(cmd, returncode, stdout_text, stderr_text, exit_class, elapsed)
+
+
+def run_ffmpeg(cmd: List[str], timeout: Optional[float] = None,
+               stall_timeout: Optional[float] = None,
+               progress_callback: Optional[Callable[[Dict], None]] = None,
+               total_duration: Optional[float] = None,
+               check: bool = False) -> FFmpegResult:
+    """
+    نسخه همزمان run_ffmpeg_async برای جایگزینی subprocess.run
+
+    فقط از کدهای همزمان (تردهای اجرایی) فراخوانی شود؛ کدهای async باید run_ffmpeg_async را await کنند.
+    اگر در همین ترد event loop در حال اجراست، هشدار داده می‌شود و کار در یک ترد جداگانه اجرا می‌شود،
+    اما loop تا پایان ffmpeg مسدود می‌ماند.
+
+    Args:
+        همانند run_ffmpeg_async
+
+    Returns:
+        FFmpegResult
+    """
+    coro_args = (cmd, timeout, stall_timeout, progress_callback, total_duration, check)
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(run_ffmpeg_async(*coro_args))
+
+    warnings.warn("run_ffmpeg event loop در حال اجرا را تا پایان ffmpeg مسدود می‌کند؛ "
+                  "از run_ffmpeg_async یا اجرای در پول تبدیل استفاده کنید", RuntimeWarning, stacklevel=2)
+    future = _sync_executor.submit(lambda: asyncio.run(run_ffmpeg_async(*coro_args)))
+    return future.result()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+کش پایدار شناسه فایل‌های ارسال شده به تلگرام (file_id)
+
+پس از ارسال موفق یک فایل، تلگرام برای آن file_id برمی‌گرداند که ارسال دوباره همان محتوا را
+بدون دانلود و آپلود مجدد ممکن می‌کند. این ماژول file_id ها را بر اساس کلید محتوا
+(مثلاً instagram:{shortcode}:{index}) نگهداری می‌کند.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, Optional
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# مسیر دایرکتوری دانلود
+DOWNLOADS_DIR = os.environ.get(
+    'DOWNLOAD_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloads')
+)
+# فایل ذخیره شناسه‌ها
+FILE_ID_CACHE_FILE = os.path.join(DOWNLOADS_DIR, 'file_ids.json')
+# حداکثر تعداد شناسه‌های نگهداری شده
+FILE_ID_CACHE_MAX_ENTRIES = int(os.environ.get('FILE_ID_CACHE_MAX_ENTRIES', '5000'))
+# مدت اعتبار شناسه‌ها (به روز)
+FILE_ID_CACHE_TTL_DAYS = int(os.environ.get('FILE_ID_CACHE_TTL_DAYS', '30'))
+
+# قفل دسترسی به کش
+_lock = threading.RLock()
+# کش در حافظه: کلید -> {'file_id', 'kind', 'created', 'last_used'}
+_entries: Optional[Dict[str, Dict]] = None
+
+
+def _load() -> Dict[str, Dict]:
+    """بارگذاری کش از دیسک (فقط در اولین دسترسی)"""
+    global _entries
+    if _entries is not None:
+        return _entries
+
+    _entries = {}
+    if os.path.exists(FILE_ID_CACHE_FILE):
+        try:
+            with open(FILE_ID_CACHE_FILE, 'r', encoding='utf-8') as f:
+                _entries = json.load(f)
+        except (ValueError, IOError) as e:
+            logger.warning(f"فایل کش شناسه‌ها قابل خواندن نیست، کش جدید ساخته می‌شود: {e}")
+    return _entries
+
+
+def _save(entries: Dict[str, Dict]) -> None:
+    """ذخیره اتمیک کش روی دیسک"""
+    try:
+        os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+        tmp_file = f"{FILE_ID_CACHE_FILE}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(tmp_file, FILE_ID_CACHE_FILE)
+    except OSError as e:
+        logger.warning(f"خطا در ذخیره کش شناسه‌ها: {e}")
+
+
+def get_file_id(key: str, kind: Optional[str] = None) -> Optional[str]:
+    """
+    دریافت file_id ذخیره شده برای یک محتوا
+
+    Args:
+        key: کلید محتوا
+        kind: نوع ارسال مورد انتظار (photo، video و ...)؛ شناسه نوع دیگر قابل استفاده نیست
+
+    Returns:
+        file_id یا None اگر در کش نباشد یا منقضی شده باشد
+    """
+    with _lock:
+        entries = _load()
+        entry = entries.get(key)
+        if not entry:
+            return None
+        if kind and entry.get('kind') != kind:
+            return None
+        if time.time() - entry.get('created', 0) > FILE_ID_CACHE_TTL_DAYS * 86400:
+            entries.pop(key, None)
+            return None
+        entry['last_used'] = time.time()
+        return entry['file_id']
+
+
+def store_file_id(key: str, file_id: str, kind: str) -> None:
+    """
+    ثبت file_id یک محتوای ارسال شده
+
+    Args:
+        key: کلید محتوا
+        file_id: شناسه فایل برگردانده شده توسط تلگرام
+        kind: نوع ارسال (photo، video و ...)
+    """
+    if not key or not file_id:
+        return
+
+    now = time.time()
+    with _lock:
+        entries = _load()
+        entries[key] = {'file_id': file_id, 'kind': kind, 'created': now, 'last_used': now}
+
+        # حذف کم‌استفاده‌ترین شناسه‌ها در صورت عبور از سقف
+        overflow = len(entries) - FILE_ID_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            for old_key, _ in sorted(entries.items(), key=lambda item: item[1].get('last_used', 0))[:overflow]:
+                entries.pop(old_key, None)
+
+        _save(entries)
+
+
+def invalidate(key: str) -> None:
+    """حذف شناسه نامعتبر (مثلاً پس از خطای wrong file identifier)"""
+    with _lock:
+        entries = _load()
+        if entries.pop(key, None) is not None:
+            _save(entries)
+
+
+def extract_file_id(message, kind: str) -> Optional[str]:
+    """
+    استخراج file_id از پیام ارسال شده
+
+    Args:
+        message: پیام برگردانده شده توسط متد ارسال (شیء Message یا دیکشنری پاسخ آپلود جریانی)
+        kind: نوع ارسال
+
+    Returns:
+        file_id یا None
+    """
+    if message is None:
+        return None
+    if isinstance(message, dict):
+        media = message.get(kind)
+        if kind == 'photo':
+            return media[-1].get('file_id') if media else None
+        return media.get('file_id') if media else None
+    if kind == 'photo':
+        photos = getattr(message, 'photo', None)
+        return photos[-1].file_id if photos else None
+    media = getattr(message, kind, None)
+    return getattr(media, 'file_id', None)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+محیط اجرای غیرمسدودکننده هندلرهای ربات
+
+هندلرها نباید کار سنگین (دانلود، تبدیل با ffmpeg) را در ترد dispatcher یا event loop انجام دهند.
+این ماژول برای هر دو نسخه python-telegram-bot یک مسیر مشترک فراهم می‌کند:
+- نسخه 20: پردازش همزمان آپدیت‌ها (concurrent_updates) و هندلرهای block=False؛ هندلرهای همزمان
+  در پول اجرایی هندلرها اجرا می‌شوند (هندلرهای اصلی ربات در این نسخه نسخه‌های آسنکرون هستند)
+- نسخه 13: اجرای هندلرهای همزمان در پول اجرایی محدود جداگانه تا ترد dispatcher فوراً آزاد شود
+- پول‌های اجرایی اختصاصی و محدود برای دانلود (I/O) و تبدیل (CPU) به جای ThreadPoolExecutor های موقت
+"""
+
+import os
+import asyncio
+import logging
+import functools
+import contextvars
+import traceback
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Optional
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# حداکثر آپدیت‌های در حال پردازش همزمان
+HANDLER_MAX_CONCURRENT = int(os.environ.get('HANDLER_MAX_CONCURRENT', '16'))
+# تعداد کارگرهای دانلود (عملیات I/O)
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', '8'))
+# تعداد کارگرهای تبدیل (عملیات CPU؛ یک هسته برای event loop و شبکه آزاد می‌ماند)
+TRANSCODE_WORKERS = int(os.environ.get('TRANSCODE_WORKERS', str(max(1, (os.cpu_count() or 2) - 1))))
+
+# پول‌های اجرایی مشترک
+download_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix='download')
+transcode_executor = ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS, thread_name_prefix='transcode')
+handler_executor = ThreadPoolExecutor(max_workers=HANDLER_MAX_CONCURRENT, thread_name_prefix='handler')
+# پول اجرای کوروتین‌های هندلرهای همزمان؛ این کوروتین‌ها فقط هماهنگ‌کننده‌اند و کار مسدودکننده خود را
+# به download_executor می‌سپارند، پس نباید یکی از کارگرهای همان پول را اشغال کنند (بن‌بست)
+coroutine_executor = ThreadPoolExecutor(max_workers=HANDLER_MAX_CONCURRENT, thread_name_prefix='coroutine')
+
+
+def configure_builder(builder):
+    """
+    فعال‌سازی پردازش همزمان آپدیت‌ها روی ApplicationBuilder (نسخه 20)
+
+    Args:
+        builder: نمونه ApplicationBuilder
+
+    Returns:
+        همان builder برای زنجیره فراخوانی
+    """
+    if hasattr(builder, 'concurrent_updates'):
+        builder = builder.concurrent_updates(HANDLER_MAX_CONCURRENT)
+    return builder
+
+
+def non_blocking(callback: Callable) -> Callable:
+    """
+    تبدیل هندلر همزمان به هندلری که فوراً باز می‌گردد
+
+    هندلر اصلی در پول اجرایی هندلرها اجرا می‌شود و خطاهای آن لاگ می‌شوند.
+    هندلرهای آسنکرون بدون تغییر بازگردانده می‌شوند.
+
+    Args:
+        callback: تابع هندلر با امضای (update, context)
+
+    Returns:
+        تابع هندلر غیرمسدودکننده
+    """
+    if asyncio.iscoroutinefunction(callback):
+        return callback
+
+    @functools.wraps(callback)
+    def wrapper(update, context):
+        def run():
+            try:
+                callback(update, context)
+            except Exception as e:
+                logger.error(f"خطا در اجرای هندلر {callback.__name__}: {e}")
+                logger.error(traceback.format_exc())
+
+        handler_executor.submit(run)
+
+    return wrapper
+
+
+def async_shim(callback: Callable) -> Callable:
+    """
+    تبدیل هندلر همزمان به کوروتین برای نسخه 20
+
+    نسخه 20 خروجی callback را await می‌کند؛ هندلر همزمان نه روی event loop اجرا می‌شود
+    (که آن را مسدود کند) و نه None برمی‌گرداند، بلکه در پول اجرایی هندلرها اجرا می‌شود.
+    هندلرهای آسنکرون بدون تغییر بازگردانده می‌شوند.
+
+    Args:
+        callback: تابع هندلر با امضای (update, context)
+
+    Returns:
+        کوروتین هندلر
+    """
+    if asyncio.iscoroutinefunction(callback):
+        return callback
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        loop = asyncio.get_running_loop()
+        context_copy = contextvars.copy_context()
+        return await loop.run_in_executor(
+            handler_executor, functools.partial(context_copy.run, callback, update, context))
+
+    return wrapper
+
+
+def add_handler(app, handler, group: int = 0) -> None:
+    """
+    ثبت هندلر به صورت غیرمسدودکننده
+
+    Args:
+        app: Application در نسخه 20 یا Dispatcher در نسخه 13
+        handler: نمونه هندلر (CommandHandler، MessageHandler و ...)
+        group: گروه هندلر
+    """
+    if hasattr(handler, 'block'):
+        # نسخه 20: اجرای کوروتین هندلر به صورت task جداگانه
+        handler.block = False
+        handler.callback = async_shim(handler.callback)
+    else:
+        handler.callback = non_blocking(handler.callback)
+    app.add_handler(handler, group)
+
+
+def run_blocking(executor: ThreadPoolExecutor, func: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+    """
+    اجرای تابع در پول اجرایی مشترک و انتظار برای نتیجه (برای هندلرهای همزمان)
+
+    برخلاف `with ThreadPoolExecutor()`، پس از پایان مهلت واقعاً باز می‌گردد و منتظر پایان کار نمی‌ماند.
+
+    Args:
+        executor: پول اجرایی مقصد
+        func: تابع مورد نظر
+        timeout: حداکثر زمان انتظار (ثانیه)
+
+    Returns:
+        خروجی تابع
+
+    Raises:
+        concurrent.futures.TimeoutError: در صورت پایان مهلت
+    """
+    future = executor.submit(func, *args, **kwargs)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise
+
+
+def run_download(func: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+    """اجرای تابع دانلود در پول اجرایی دانلود (نسخه همزمان)"""
+    return run_blocking(download_executor, func, *args, timeout=timeout, **kwargs)
+
+
+def run_coroutine(coro_factory: Callable[[], Awaitable], timeout: Optional[float] = None) -> Any:
+    """
+    اجرای کوروتین از هندلر همزمان در پول اجرایی کوروتین‌ها
+
+    کوروتین دانلود خود را به download_executor می‌فرستد؛ اجرای خود کوروتین در همان پول محدود
+    باعث می‌شد با پر شدن پول، کوروتین‌ها منتظر کارگری بمانند که خودشان اشغال کرده‌اند.
+
+    Args:
+        coro_factory: تابعی که کوروتین را می‌سازد (کوروتین در ترد مقصد ساخته و اجرا می‌شود)
+        timeout: حداکثر زمان انتظار (ثانیه)
+
+    Returns:
+        خروجی کوروتین
+    """
+    return run_blocking(coroutine_executor, lambda: asyncio.run(coro_factory()), timeout=timeout)
+
+
+async def offload_download(func: Callable, *args, **kwargs) -> Any:
+    """
+    اجرای تابع دانلود در پول اجرایی دانلود بدون مسدود کردن event loop
+
+    context فعلی (از جمله محدوده لغو آیتم) به ترد منتقل می‌شود تا پردازه‌های فرزند yt-dlp در آن ثبت شوند.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(download_executor, functools.partial(context.run, func, *args, **kwargs))
+
+
+async def offload_transcode(func: Callable, *args, **kwargs) -> Any:
+    """اجرای تابع تبدیل (ffmpeg) در پول اجرایی تبدیل بدون مسدود کردن event loop (با انتقال context فعلی)"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(transcode_executor, functools.partial(context.run, func, *args, **kwargs))
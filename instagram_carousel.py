@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+دریافت و ارسال پست‌های چندتایی (carousel) و عکسی اینستاگرام
+
+همه آیتم‌های یک پست (عکس و ویدیو) به صورت همزمان دانلود می‌شوند و در یک فراخوانی
+send_media_group ارسال می‌شوند. آیتم‌هایی که قبلاً ارسال شده‌اند با file_id کش شده
+ارسال می‌شوند و دوباره دانلود یا آپلود نمی‌شوند.
+"""
+
+import os
+import re
+import uuid
+import asyncio
+import inspect
+import logging
+import time
+import threading
+from concurrent.futures import as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+
+try:
+    import instaloader
+except ImportError:
+    instaloader = None
+
+from handler_runtime import download_executor, offload_download, run_download
+from file_id_cache import get_file_id, invalidate
+from request_governor import request_governor
+from upload_pipeline import upload_pipeline, MediaItem, KIND_PHOTO, KIND_VIDEO
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# فعال بودن ارسال پست‌های چندتایی
+CAROUSEL_ENABLED = os.environ.get('CAROUSEL_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# حداکثر زمان دریافت اطلاعات پست (ثانیه)
+CAROUSEL_FETCH_TIMEOUT = 20
+# حداکثر زمان دانلود هر آیتم (ثانیه)
+CAROUSEL_ITEM_TIMEOUT = 60
+# حداکثر طول متن همراه (محدودیت caption تلگرام 1024 کاراکتر است)
+CAROUSEL_CAPTION_LIMIT = 1000
+# مدت نگهداری اطلاعات پست دریافت شده برای استفاده مجدد در مسیر دانلود معمولی (ثانیه)
+POST_CACHE_TTL = int(os.environ.get('INSTAGRAM_POST_CACHE_TTL', '600'))
+# مسیر دایرکتوری دانلود
+DOWNLOADS_DIR = os.path.join(os.getcwd(), "downloads")
+
+# الگوی کد کوتاه پست
+SHORTCODE_PATTERN = re.compile(r'instagram\.com/(?:[\w.]+/)?(?:p|reel|reels|tv)/([A-Za-z0-9_-]+)')
+
+_loader = None
+_loader_lock = threading.Lock()
+
+# پست‌های دریافت شده: کد کوتاه -> (زمان دریافت, Post)
+_post_cache: Dict[str, Tuple[float, object]] = {}
+_post_cache_lock = threading.Lock()
+
+
+class CarouselItem:
+    """یک آیتم پست اینستاگرام"""
+
+    def __init__(self, index: int, kind: str, media_url: str):
+        self.index = index
+        self.kind = kind
+        self.media_url = media_url
+
+
+def extract_shortcode(url: str) -> Optional[str]:
+    """استخراج کد کوتاه پست از URL"""
+    match = SHORTCODE_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+def is_post_url(url: str) -> bool:
+    """آیا URL مربوط به پست معمولی است (ریل‌ها همیشه تک‌ویدیو هستند)"""
+    return '/p/' in url and extract_shortcode(url) is not None
+
+
+def _cache_key(shortcode: str, index: int) -> str:
+    return f"instagram:{shortcode}:{index}"
+
+
+def _get_loader():
+    global _loader
+    with _loader_lock:
+        if _loader is None:
+            _loader = instaloader.Instaloader(quiet=True, download_pictures=False, download_videos=False,
+                                              save_metadata=False, download_comments=False)
+        return _loader
+
+
+def peek_post(shortcode: str):
+    """
+    پست دریافت شده اخیر از کش (بدون درخواست به اینستاگرام)
+
+    Args:
+        shortcode: کد کوتاه پست
+
+    Returns:
+        شیء Post یا None اگر در کش نباشد یا منقضی شده باشد
+    """
+    with _post_cache_lock:
+        entry = _post_cache.get(shortcode)
+        if entry and time.monotonic() - entry[0] < POST_CACHE_TTL:
+            return entry[1]
+    return None
+
+
+def get_post(shortcode: str):
+    """
+    دریافت پست با instaloader؛ هر پست در مدت POST_CACHE_TTL فقط یک بار از اینستاگرام گرفته می‌شود
+    تا بررسی پست چندتایی و دانلود معمولی پس از آن دو درخواست جدا مصرف نکنند
+
+    Args:
+        shortcode: کد کوتاه پست
+
+    Returns:
+        شیء Post یا None اگر instaloader نصب نباشد
+    """
+    if instaloader is None:
+        return None
+
+    post = peek_post(shortcode)
+    if post is not None:
+        return post
+
+    post = instaloader.Post.from_shortcode(_get_loader().context, shortcode)
+    now = time.monotonic()
+    with _post_cache_lock:
+        for key in [k for k, (fetched, _) in _post_cache.items() if now - fetched >= POST_CACHE_TTL]:
+            _post_cache.pop(key, None)
+        _post_cache[shortcode] = (now, post)
+    return post
+
+
+def fetch_post_items(url: str) -> Optional[Tuple[str, List[CarouselItem]]]:
+    """
+    دریافت فهرست آیتم‌های پست
+
+    Args:
+        url: آدرس پست اینستاگرام
+
+    Returns:
+        (متن پست, لیست آیتم‌ها) برای پست‌های چندتایی یا عکسی؛ None برای پست تک‌ویدیو یا در صورت خطا
+    """
+    if instaloader is None:
+        return None
+
+    shortcode = extract_shortcode(url)
+    if not shortcode:
+        return None
+
+    try:
+        post = get_post(shortcode)
+
+        if post.typename == 'GraphSidecar':
+            items = [
+                CarouselItem(index, KIND_VIDEO if node.is_video else KIND_PHOTO,
+                             node.video_url if node.is_video else node.display_url)
+                for index, node in enumerate(post.get_sidecar_nodes())
+            ]
+        elif not post.is_video:
+            items = [CarouselItem(0, KIND_PHOTO, post.url)]
+        else:
+            # پست تک‌ویدیو از مسیر معمولی (انتخاب کیفیت) دانلود می‌شود
+            return None
+
+        caption = (post.caption or '')[:CAROUSEL_CAPTION_LIMIT]
+        return caption, [item for item in items if item.media_url]
+    except Exception as e:
+        request_governor.report_exception(url, e)
+        logger.warning(f"خطا در دریافت اطلاعات پست {shortcode}: {e}")
+        return None
+
+
+def _download_item(item: CarouselItem, output_dir: str) -> Optional[str]:
+    """دانلود یک آیتم پست"""
+    ext = 'mp4' if item.kind == KIND_VIDEO else 'jpg'
+    file_path = os.path.join(output_dir, f"item_{item.index:02d}.{ext}")
+    try:
+        with requests.get(item.media_url, stream=True, timeout=CAROUSEL_ITEM_TIMEOUT) as response:
+            response.raise_for_status()
+            with open(file_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=256 * 1024):
+                    f.write(chunk)
+        return file_path if os.path.getsize(file_path) > 0 else None
+    except (requests.RequestException, OSError) as e:
+        logger.warning(f"خطا در دانلود آیتم {item.index} پست: {e}")
+        return None
+
+
+def _plan_items(url: str, items: List[CarouselItem], use_cache: bool):
+    """تفکیک آیتم‌های دارای file_id کش شده از آیتم‌هایی که باید دانلود شوند"""
+    shortcode = extract_shortcode(url)
+    prepared = {}
+    to_download = []
+
+    for item in items:
+        key = _cache_key(shortcode, item.index)
+        file_id = get_file_id(key, item.kind) if use_cache else None
+        if file_id:
+            prepared[item.index] = MediaItem(item.kind, file_id=file_id, cache_key=key)
+        else:
+            to_download.append(item)
+
+    output_dir = os.path.join(DOWNLOADS_DIR, f"instagram_carousel_{shortcode}_{uuid.uuid4().hex[:8]}")
+    if to_download:
+        os.makedirs(output_dir, exist_ok=True)
+    return shortcode, prepared, to_download, output_dir
+
+
+def _collect(shortcode: str, items: List[CarouselItem], prepared: dict, downloaded: List) -> List[MediaItem]:
+    """ترکیب آیتم‌های کش شده و دانلود شده به ترتیب پست"""
+    from_cache = len(prepared)
+    for item, file_path in downloaded:
+        if file_path:
+            prepared[item.index] = MediaItem(item.kind, file_path=file_path,
+                                             cache_key=_cache_key(shortcode, item.index))
+    logger.info(f"پست {shortcode}: {from_cache} آیتم از کش، {len(prepared) - from_cache} آیتم دانلود شد "
+                f"(از {len(items)} آیتم)")
+    return [prepared[index] for index in sorted(prepared)]
+
+
+def prepare_media_items(url: str, items: List[CarouselItem], use_cache: bool = True) -> List[MediaItem]:
+    """
+    آماده‌سازی آیتم‌ها برای ارسال: استفاده از file_id کش شده یا دانلود همزمان آیتم‌های جدید
+
+    Args:
+        url: آدرس پست
+        items: آیتم‌های پست
+        use_cache: استفاده از file_id های کش شده
+
+    Returns:
+        آیتم‌های قابل ارسال به ترتیب پست (آیتم‌های ناموفق حذف می‌شوند)
+    """
+    shortcode, prepared, to_download, output_dir = _plan_items(url, items, use_cache)
+    futures = {download_executor.submit(_download_item, item, output_dir): item for item in to_download}
+    downloaded = [(futures[future], future.result()) for future in as_completed(futures)]
+    return _collect(shortcode, items, prepared, downloaded)
+
+
+async def prepare_media_items_async(url: str, items: List[CarouselItem], use_cache: bool = True) -> List[MediaItem]:
+    """نسخه آسنکرون prepare_media_items (دانلودها در پول اجرایی دانلود و بدون مسدود کردن event loop)"""
+    shortcode, prepared, to_download, output_dir = _plan_items(url, items, use_cache)
+    results = await asyncio.gather(*(offload_download(_download_item, item, output_dir) for item in to_download))
+    return _collect(shortcode, items, prepared, list(zip(to_download, results)))
+
+
+def _invalidate_cached(media_items: List[MediaItem]) -> bool:
+    """حذف file_id های استفاده شده از کش؛ True اگر آیتم کش شده‌ای وجود داشت"""
+    cached = [item for item in media_items if item.file_id]
+    for item in cached:
+        invalidate(item.cache_key)
+    return bool(cached)
+
+
+def deliver_carousel_sync(bot, chat_id: int, url: str, on_queued: Optional[Callable] = None,
+                          on_done: Optional[Callable] = None) -> int:
+    """
+    ارسال پست چندتایی یا عکسی در قالب media group (برای هندلرهای همزمان نسخه 13)
+
+    Args:
+        bot: شیء بات تلگرام
+        chat_id: شناسه چت مقصد
+        url: آدرس پست
+        on_queued: تابع فراخوانی شده پیش از ارسال با آرگومان تعداد آیتم‌ها
+        on_done: تابع فراخوانی شده پس از پایان ارسال با آرگومان success
+
+    Returns:
+        تعداد آیتم‌های در صف ارسال؛ صفر اگر پست چندتایی/عکسی نیست و باید از مسیر معمولی دانلود شود
+    """
+    if not CAROUSEL_ENABLED or not is_post_url(url):
+        return 0
+
+    try:
+        post = run_download(fetch_post_items, url, timeout=CAROUSEL_FETCH_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"خطا در بررسی پست چندتایی: {e}")
+        return 0
+    if not post:
+        return 0
+
+    caption, items = post
+    media_items = prepare_media_items(url, items)
+    if not media_items:
+        return 0
+
+    def handle_done(success: bool):
+        # file_id نامعتبر (مثلاً پس از تغییر توکن) - یک بار بدون کش تلاش می‌کنیم
+        if not success and _invalidate_cached(media_items):
+            logger.warning("ارسال با file_id های کش شده ناموفق بود، تلاش مجدد با آپلود فایل‌ها")
+            retry_items = prepare_media_items(url, items, use_cache=False)
+            if retry_items:
+                upload_pipeline.submit_media_items_sync(bot, chat_id, retry_items, caption, on_done=on_done)
+                return
+        if on_done:
+            on_done(success)
+
+    if on_queued:
+        on_queued(len(media_items))
+    upload_pipeline.submit_media_items_sync(bot, chat_id, media_items, caption, on_done=handle_done)
+    return len(media_items)
+
+
+async def deliver_carousel(bot, chat_id: int, url: str, on_queued: Optional[Callable] = None,
+                           on_done: Optional[Callable] = None) -> int:
+    """
+    نسخه آسنکرون deliver_carousel_sync
+
+    Args:
+        مانند deliver_carousel_sync؛ on_queued و on_done می‌توانند کوروتین باشند
+
+    Returns:
+        تعداد آیتم‌های در صف ارسال (صفر برای پست‌های غیر چندتایی)
+    """
+    if not CAROUSEL_ENABLED or not is_post_url(url):
+        return 0
+
+    try:
+        post = await asyncio.wait_for(offload_download(fetch_post_items, url), timeout=CAROUSEL_FETCH_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"خطا در بررسی پست چندتایی: {e}")
+        return 0
+    if not post:
+        return 0
+
+    caption, items = post
+    media_items = await prepare_media_items_async(url, items)
+    if not media_items:
+        return 0
+
+    async def finish(success: bool):
+        if on_done:
+            result = on_done(success)
+            if inspect.isawaitable(result):
+                await result
+
+    async def handle_done(success: bool):
+        if not success and _invalidate_cached(media_items):
+            logger.warning("ارسال با file_id های کش شده ناموفق بود، تلاش مجدد با آپلود فایل‌ها")
+            retry_items = await prepare_media_items_async(url, items, use_cache=False)
+            if retry_items:
+                upload_pipeline.submit_media_items(bot, chat_id, retry_items, caption, on_done=finish)
+                return
+        await finish(success)
+
+    if on_queued:
+        result = on_queued(len(media_items))
+        if inspect.isawaitable(result):
+            await result
+    upload_pipeline.submit_media_items(bot, chat_id, media_items, caption, on_done=handle_done)
+    return len(media_items)
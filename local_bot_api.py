@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+پشتیبانی از سرور Bot API محلی (self-hosted)
+
+با تنظیم متغیر محیطی TELEGRAM_LOCAL_API_URL، ربات به جای api.telegram.org به سرور محلی متصل می‌شود.
+در این حالت:
+- فایل‌ها با مسیر محلی (file://) ارسال می‌شوند و بایت‌های فایل از پردازه پایتون عبور نمی‌کنند
+- سقف حجم آپلود از 50 مگابایت به سقف سرور محلی (پیش‌فرض 2000 مگابایت) افزایش می‌یابد
+
+سرور محلی باید به دایرکتوری دانلودها دسترسی داشته باشد (همان سیستم فایل).
+"""
+
+import os
+import logging
+from pathlib import Path
+from typing import Any, Dict, Union
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# آدرس پایه سرور Bot API محلی بدون توکن (مثلاً http://127.0.0.1:8081/bot)
+LOCAL_BOT_API_URL = os.environ.get('TELEGRAM_LOCAL_API_URL', '').rstrip('/')
+# آدرس پایه دریافت فایل از سرور محلی
+LOCAL_BOT_API_FILE_URL = os.environ.get(
+    'TELEGRAM_LOCAL_API_FILE_URL',
+    LOCAL_BOT_API_URL[:-len('/bot')] + '/file/bot' if LOCAL_BOT_API_URL.endswith('/bot') else ''
+).rstrip('/')
+# فعال بودن حالت سرور محلی
+LOCAL_BOT_API_MODE = bool(LOCAL_BOT_API_URL)
+
+# سقف حجم آپلود در سرور رسمی تلگرام (بایت)
+CLOUD_BOT_API_MAX_FILE_SIZE = 50 * 1024 * 1024
+# سقف حجم آپلود در سرور محلی (بایت)
+LOCAL_BOT_API_MAX_FILE_SIZE = int(os.environ.get('TELEGRAM_LOCAL_API_MAX_FILE_MB', '2000')) * 1024 * 1024
+
+
+def get_max_upload_size() -> int:
+    """
+    دریافت سقف حجم آپلود بر اساس سرور فعال
+
+    Returns:
+        int: حداکثر حجم مجاز فایل به بایت
+    """
+    return LOCAL_BOT_API_MAX_FILE_SIZE if LOCAL_BOT_API_MODE else CLOUD_BOT_API_MAX_FILE_SIZE
+
+
+def to_upload_input(file_path: str) -> Union[Path, None]:
+    """
+    تبدیل مسیر فایل به ورودی آپلود مسیر-محور
+
+    Args:
+        file_path: مسیر فایل روی دیسک
+
+    Returns:
+        شیء Path مطلق در حالت سرور محلی (کتابخانه آن را به file:// تبدیل می‌کند)، در غیر این صورت None
+    """
+    if not LOCAL_BOT_API_MODE:
+        return None
+    return Path(file_path).absolute()
+
+
+def configure_application_builder(builder):
+    """
+    اعمال تنظیمات سرور محلی روی ApplicationBuilder (نسخه 20)
+
+    Args:
+        builder: نمونه ApplicationBuilder
+
+    Returns:
+        همان builder برای زنجیره فراخوانی
+    """
+    if not LOCAL_BOT_API_MODE:
+        return builder
+
+    builder = builder.base_url(LOCAL_BOT_API_URL)
+    if LOCAL_BOT_API_FILE_URL:
+        builder = builder.base_file_url(LOCAL_BOT_API_FILE_URL)
+    if hasattr(builder, 'local_mode'):
+        builder = builder.local_mode(True)
+
+    logger.info(f"اتصال به سرور Bot API محلی: {LOCAL_BOT_API_URL} (سقف آپلود: {LOCAL_BOT_API_MAX_FILE_SIZE // (1024 * 1024)} MB)")
+    return builder
+
+
+def get_updater_kwargs() -> Dict[str, Any]:
+    """
+    پارامترهای اضافه Updater برای اتصال به سرور محلی (نسخه 13)
+
+    Returns:
+        دیکشنری پارامترها (خالی در حالت سرور رسمی)
+    """
+    if not LOCAL_BOT_API_MODE:
+        return {}
+
+    kwargs = {'base_url': LOCAL_BOT_API_URL}
+    if LOCAL_BOT_API_FILE_URL:
+        kwargs['base_file_url'] = LOCAL_BOT_API_FILE_URL
+
+    logger.info(f"اتصال به سرور Bot API محلی: {LOCAL_BOT_API_URL} (سقف آپلود: {LOCAL_BOT_API_MAX_FILE_SIZE // (1024 * 1024)} MB)")
+    return kwargs
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+تقسیم فایل‌های بزرگ به چند بخش بدون انکود مجدد
+
+فایل‌هایی که از سقف آپلود تلگرام بزرگ‌ترند با segment muxer در ffmpeg (-c copy) در نقاط کلیدی (keyframe)
+به چند بخش تقسیم می‌شوند. مدت هر بخش از روی بیت‌ریت میانگین فایل محاسبه می‌شود و اندازه
+هر بخش پس از تقسیم بررسی می‌شود؛ در صورت بزرگ بودن، تقسیم با مدت کوتاه‌تر تکرار می‌شود.
+"""
+
+import os
+import glob
+import logging
+from typing import Callable, Dict, List, Optional
+
+from ffmpeg_runner import run_ffmpeg
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# فعال بودن تقسیم خودکار فایل‌های بزرگ (در غیر این صورت رفتار قبلی: کاهش کیفیت یا خطا)
+MEDIA_SPLIT_ENABLED = os.environ.get('MEDIA_SPLIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# نسبت هدف اندازه هر بخش به سقف آپلود (حاشیه برای نوسان بیت‌ریت و فاصله keyframe ها)
+SPLIT_SIZE_SAFETY = 0.85
+# حداکثر تعداد تلاش برای رسیدن به بخش‌های کوچک‌تر از سقف
+MAX_SPLIT_ATTEMPTS = 3
+# حداقل مدت هر بخش (به ثانیه)
+MIN_SEGMENT_SECONDS = 5
+# حداکثر تعداد بخش‌ها
+MAX_SPLIT_PARTS = int(os.environ.get('MAX_SPLIT_PARTS', '20'))
+
+
+def _cleanup_parts(parts: List[str]) -> None:
+    """حذف بخش‌های ناقص یا رد شده"""
+    for part in parts:
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+
+
+def _run_segment(file_path: str, segment_time: float, output_pattern: str, duration: float,
+                 progress_callback: Optional[Callable[[Dict], None]] = None) -> bool:
+    """اجرای segment muxer با کپی جریان‌ها"""
+    from telegram_fixes import FFMPEG_PATH
+
+    ext = os.path.splitext(file_path)[1].lower()
+    cmd = [
+        FFMPEG_PATH,
+        '-i', file_path,
+        '-map', '0:v?',
+        '-map', '0:a?',
+        '-c', 'copy',
+        '-f', 'segment',
+        '-segment_time', f"{segment_time:.2f}",
+        '-reset_timestamps', '1',
+    ]
+    if ext in ('.mp4', '.m4a', '.mov'):
+        # قرار دادن moov در ابتدای هر بخش برای پخش جریانی در تلگرام
+        cmd.extend(['-segment_format_options', 'movflags=+faststart'])
+    cmd.extend(['-y', output_pattern])
+
+    result = run_ffmpeg(cmd, progress_callback=progress_callback, total_duration=duration)
+    if result.returncode != 0:
+        logger.error(f"خطا در تقسیم فایل ({result.exit_class}): {result.stderr[-300:]}")
+        return False
+    return True
+
+
+def split_media(file_path: str, max_part_size: int,
+                progress_callback: Optional[Callable[[Dict], None]] = None) -> Optional[List[str]]:
+    """
+    تقسیم فایل صوتی/ویدیویی به بخش‌های کوچک‌تر از سقف تعیین شده
+
+    Args:
+        file_path: مسیر فایل ورودی
+        max_part_size: حداکثر اندازه هر بخش به بایت
+        progress_callback: تابع دریافت پیشرفت ffmpeg (مثلاً StatusEditor.ffmpeg_callback)
+
+    Returns:
+        لیست مسیر بخش‌ها به ترتیب پخش یا None در صورت خطا
+    """
+    from encoder_tuning import probe_duration
+
+    if not os.path.exists(file_path):
+        return None
+
+    file_size = os.path.getsize(file_path)
+    if file_size <= max_part_size:
+        return [file_path]
+
+    duration = probe_duration(file_path)
+    if not duration or duration <= 0:
+        logger.error(f"مدت فایل برای تقسیم قابل تشخیص نیست: {file_path}")
+        return None
+
+    # مدت هر بخش بر اساس بیت‌ریت میانگین
+    bytes_per_second = file_size / duration
+    segment_time = max(MIN_SEGMENT_SECONDS, (max_part_size * SPLIT_SIZE_SAFETY) / bytes_per_second)
+
+    base_name, ext = os.path.splitext(file_path)
+    output_pattern = f"{base_name}_part%03d{ext}"
+
+    for attempt in range(1, MAX_SPLIT_ATTEMPTS + 1):
+        expected_parts = int(duration / segment_time) + 1
+        if expected_parts > MAX_SPLIT_PARTS:
+            logger.error(f"تعداد بخش‌ها بیش از حد مجاز است ({expected_parts} > {MAX_SPLIT_PARTS})")
+            return None
+
+        _cleanup_parts(glob.glob(f"{glob.escape(base_name)}_part[0-9][0-9][0-9]{ext}"))
+        logger.info(f"تقسیم فایل {os.path.basename(file_path)} به بخش‌های {segment_time:.0f} ثانیه‌ای (تلاش {attempt})")
+
+        if not _run_segment(file_path, segment_time, output_pattern, duration, progress_callback):
+            return None
+
+        parts = sorted(glob.glob(f"{glob.escape(base_name)}_part[0-9][0-9][0-9]{ext}"))
+        if not parts:
+            return None
+
+        largest = max(os.path.getsize(part) for part in parts)
+        if largest <= max_part_size:
+            logger.info(f"فایل به {len(parts)} بخش تقسیم شد (بزرگ‌ترین بخش: {largest / (1024 * 1024):.1f} MB)")
+            return parts
+
+        # بخش‌ها به دلیل فاصله keyframe ها یا بیت‌ریت متغیر بزرگ شده‌اند - مدت را کوتاه‌تر می‌کنیم
+        segment_time = max(MIN_SEGMENT_SECONDS, segment_time * (max_part_size * SPLIT_SIZE_SAFETY) / largest)
+        _cleanup_parts(parts)
+
+    logger.error(f"تقسیم فایل به بخش‌های کوچک‌تر از سقف پس از {MAX_SPLIT_ATTEMPTS} تلاش ناموفق بود")
+    return None
@@ -26,6 +26,11 @@ from multiprocessing import Process, Queue, cpu_count
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+try:
+    from encoder_tuning import select_encoder_settings
+except ImportError:
+    select_encoder_settings = None
+
 # تنظیمات کلی
 MAX_WORKERS = max(2, cpu_count() - 1)  # تعداد هسته‌های پردازنده منهای یکی
 MAX_MEMORY_USAGE_MB = 500  # حداکثر استفاده از حافظه به مگابایت
@@ -217,9 +222,11 @@ class NetworkOptimizer:
             'socket_timeout': 30,  # تنظیم timeout سوکت
             'verbose': False,  # غیرفعال کردن گزارش‌های verbose
             'quiet': True,  # کاهش لاگ‌ها
-            'progress_hooks': [],  # حذف hook های اضافی
         })
         
+        # حفظ hook های پیشرفت موجود (برای بروزرسانی پیام وضعیت)
+        optimized['progress_hooks'] = list(settings.get('progress_hooks', []))
+        
         return optimized
     
     @staticmethod
@@ -274,11 +281,18 @@ class FFmpegOptimizer:
                             '-b:a', '192k',  # بیت‌ریت
                         ])
                     elif not is_audio and video_stream:
+                        # پریست و CRF از پروفایل بنچمارک میزبان (پیش‌فرض: fast و 23)
+                        encoder_settings = {'preset': 'fast', 'crf': 23}
+                        if select_encoder_settings:
+                            target_height = int(quality[:-1]) if quality and quality[:-1].isdigit() else int(video_stream.get('height') or 720)
+                            duration = float(info.get('format', {}).get('duration') or 0) or None
+                            encoder_settings = select_encoder_settings(target_height, duration, default_preset='fast', default_crf=23)
+                        
                         # تنظیمات بهینه برای کدگذاری ویدیو
                         settings.extend([
                             '-c:v', 'libx264',  # کدک ویدیو
-                            '-preset', 'fast',  # تنظیم سرعت/کیفیت
-                            '-crf', '23',  # کیفیت ثابت (بالاتر = فشرده‌تر)
+                            '-preset', encoder_settings['preset'],  # تنظیم سرعت/کیفیت
+                            '-crf', str(encoder_settings['crf']),  # کیفیت ثابت (بالاتر = فشرده‌تر)
                             '-c:a', 'aac',  # کدک صدا
                             '-b:a', '128k',  # بیت‌ریت صدا
                         ])
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+موتور دانلود موازی پلی‌لیست یوتیوب
+
+1. فهرست ویدیوهای پلی‌لیست با extract_flat و بدون دریافت صفحه هر ویدیو استخراج می‌شود
+2. هر ویدیو جداگانه و به صورت همزمان دانلود می‌شود؛ هر دانلود پیش از شروع از زمان‌بند منصفانه
+   (کلاس bulk) جا می‌گیرد تا پلی‌لیست‌های بزرگ درخواست‌های تعاملی را معطل نکنند
+3. هر ویدیو به محض پایان دانلود بدون فشرده‌سازی (ZIP_STORED) به فایل ZIP اضافه و حذف می‌شود؛
+   فشرده‌سازی MP4 حجم را کم نمی‌کند و فقط CPU مصرف می‌کند
+"""
+
+import os
+import re
+import uuid
+import shutil
+import asyncio
+import logging
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import yt_dlp
+except ImportError:
+    yt_dlp = None
+
+from fair_scheduler import fair_scheduler, CLASS_BULK, FAIR_BULK_MAX_RUNNING
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# محدوده پیش‌فرض ویدیوهای پلی‌لیست (قالب playlist_items در yt-dlp، مثلاً 1-3 یا 1,4,7-10)
+PLAYLIST_ITEMS = os.environ.get('PLAYLIST_ITEMS', '1-3')
+# حداکثر تعداد ویدیوی دانلود شده از یک پلی‌لیست (صرف نظر از محدوده)
+PLAYLIST_MAX_ITEMS = int(os.environ.get('PLAYLIST_MAX_ITEMS', '50'))
+# حداکثر دانلودهای همزمان ویدیوهای پلی‌لیست (زمان‌بند منصفانه سقف کلی را اعمال می‌کند)
+PLAYLIST_CONCURRENCY = int(os.environ.get('PLAYLIST_CONCURRENCY', str(FAIR_BULK_MAX_RUNNING)))
+
+# پول اجرایی دانلود ویدیوهای پلی‌لیست (جدا از پول دانلود اصلی تا دانلود والد مانع فرزندان نشود)
+_playlist_executor = ThreadPoolExecutor(max_workers=PLAYLIST_CONCURRENCY, thread_name_prefix='playlist')
+
+# تنظیماتی که مخصوص کل پلی‌لیست هستند و نباید به دانلود تک ویدیو منتقل شوند
+_PLAYLIST_ONLY_OPTS = ('playlist_items', 'playliststart', 'playlistend', 'extract_flat', 'outtmpl')
+
+
+class StoredZipWriter:
+    """نوشتن تدریجی فایل ZIP بدون فشرده‌سازی (قابل استفاده از چند ترد)"""
+
+    def __init__(self, zip_path: str):
+        self.zip_path = zip_path
+        self._zip = zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, file_path: str, arcname: str) -> None:
+        """
+        افزودن فایل به ZIP و حذف فایل اصلی
+
+        Args:
+            file_path: مسیر فایل دانلود شده
+            arcname: نام فایل داخل ZIP
+        """
+        with self._lock:
+            self._zip.write(file_path, arcname, compress_type=zipfile.ZIP_STORED)
+            self.count += 1
+        os.remove(file_path)
+
+    def close(self) -> None:
+        with self._lock:
+            self._zip.close()
+
+
+def parse_items(items: str, limit: int = PLAYLIST_MAX_ITEMS) -> List[int]:
+    """
+    تبدیل محدوده ویدیوها به لیست شماره‌ها
+
+    Args:
+        items: محدوده به قالب yt-dlp (مثلاً "1-3" یا "1,4,7-10")
+        limit: حداکثر تعداد شماره‌ها
+
+    Returns:
+        شماره‌های ویدیو (از 1) به ترتیب و بدون تکرار
+    """
+    indices = []
+    for part in items.split(','):
+        match = re.fullmatch(r'\s*(\d+)\s*(?:-\s*(\d+))?\s*', part)
+        if not match:
+            continue
+        start = int(match.group(1))
+        end = int(match.group(2) or start)
+        for index in range(start, end + 1):
+            if index not in indices:
+                indices.append(index)
+            if len(indices) >= limit:
+                return indices
+    return indices
+
+
+def extract_entries(url: str, items: str, base_opts: Optional[Dict] = None) -> Tuple[str, List[Tuple[int, str, str]]]:
+    """
+    استخراج فهرست ویدیوهای پلی‌لیست بدون دانلود (extract_flat)
+
+    Args:
+        url: آدرس پلی‌لیست
+        items: محدوده ویدیوها
+        base_opts: تنظیمات پایه yt-dlp (کوکی و ...)
+
+    Returns:
+        (عنوان پلی‌لیست, لیست (شماره در پلی‌لیست, آدرس ویدیو, عنوان))
+    """
+    wanted = parse_items(items)
+    opts = {key: value for key, value in (base_opts or {}).items()
+            if key in ('cookiefile', 'cookies', 'proxy', 'socket_timeout', 'http_headers')}
+    opts.update({
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+        'playlist_items': ','.join(str(index) for index in wanted),
+    })
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    entries = []
+    for position, entry in enumerate(info.get('entries') or []):
+        if not entry:
+            continue
+        index = entry.get('playlist_index') or (wanted[position] if position < len(wanted) else position + 1)
+        video_url = entry.get('url') or entry.get('webpage_url')
+        if video_url and not video_url.startswith('http'):
+            video_url = f"https://www.youtube.com/watch?v={video_url}"
+        if video_url:
+            entries.append((index, video_url, entry.get('title') or entry.get('id') or str(index)))
+    return info.get('title') or info.get('id') or 'playlist', entries
+
+
+def _download_entry(video_url: str, ydl_opts: Dict, entry_dir: str) -> Optional[str]:
+    """دانلود یک ویدیو در دایرکتوری مخصوص آن و برگرداندن مسیر فایل نهایی"""
+    os.makedirs(entry_dir, exist_ok=True)
+    opts = {key: value for key, value in ydl_opts.items() if key not in _PLAYLIST_ONLY_OPTS}
+    opts.update({
+        'outtmpl': os.path.join(entry_dir, '%(title)s.%(ext)s'),
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+    })
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        ydl.download([video_url])
+
+    # پس از پس‌پردازش (مثلاً تبدیل به mp3) پسوند فایل ممکن است تغییر کرده باشد
+    files = [os.path.join(entry_dir, name) for name in os.listdir(entry_dir)
+             if not name.endswith(('.part', '.ytdl', '.temp'))]
+    files = [path for path in files if os.path.isfile(path)]
+    return max(files, key=os.path.getsize) if files else None
+
+
+async def download_playlist(url: str, ydl_opts: Dict, output_dir: str, user_id: int = 0,
+                            items: Optional[str] = None) -> Optional[str]:
+    """
+    دانلود موازی ویدیوهای پلی‌لیست و ساخت تدریجی فایل ZIP
+
+    Args:
+        url: آدرس پلی‌لیست
+        ydl_opts: تنظیمات yt-dlp برای دانلود هر ویدیو (فرمت، پس‌پردازش و ...)
+        output_dir: دایرکتوری فایل ZIP خروجی
+        user_id: شناسه کاربر برای نوبت‌دهی منصفانه
+        items: محدوده ویدیوها (پیش‌فرض PLAYLIST_ITEMS)
+
+    Returns:
+        مسیر فایل ZIP یا None اگر هیچ ویدیویی دانلود نشد
+    """
+    if yt_dlp is None:
+        logger.error("کتابخانه yt-dlp نصب نیست")
+        return None
+
+    loop = asyncio.get_running_loop()
+    items = items or PLAYLIST_ITEMS
+    title, entries = await loop.run_in_executor(_playlist_executor, extract_entries, url, items, ydl_opts)
+    if not entries:
+        logger.error(f"هیچ ویدیویی در پلی‌لیست یافت نشد: {url}")
+        return None
+
+    match = re.search(r'list=([A-Za-z0-9_-]+)', url)
+    playlist_id = match.group(1) if match else 'unknown'
+    work_dir = os.path.join(output_dir, f'playlist_{playlist_id}_{uuid.uuid4().hex[:8]}')
+    zip_path = os.path.join(output_dir, f'playlist_{playlist_id}_{uuid.uuid4().hex[:6]}.zip')
+    writer = StoredZipWriter(zip_path)
+    width = len(str(max(index for index, _, _ in entries)))
+    logger.info(f"دانلود {len(entries)} ویدیو از پلی‌لیست «{title}» با حداکثر {PLAYLIST_CONCURRENCY} دانلود همزمان")
+
+    def fetch_and_store(index: int, video_url: str) -> bool:
+        entry_dir = os.path.join(work_dir, str(index))
+        try:
+            file_path = _download_entry(video_url, ydl_opts, entry_dir)
+            if not file_path:
+                return False
+            writer.add(file_path, f"{index:0{width}d}-{os.path.basename(file_path)}")
+            return True
+        finally:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+
+    async def run_entry(index: int, video_url: str) -> bool:
+        async with fair_scheduler.async_slot(user_id, CLASS_BULK):
+            try:
+                return await loop.run_in_executor(_playlist_executor, fetch_and_store, index, video_url)
+            except Exception as e:
+                logger.error(f"خطا در دانلود ویدیوی {index} پلی‌لیست: {e}")
+                return False
+
+    try:
+        results = await asyncio.gather(*(run_entry(index, video_url) for index, video_url, _ in entries))
+    finally:
+        writer.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    logger.info(f"{sum(results)} از {len(entries)} ویدیوی پلی‌لیست دانلود و به ZIP اضافه شد")
+    if not writer.count:
+        os.remove(zip_path)
+        return None
+    return zip_path
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+دانلود پیش‌دستانه (speculative prefetch) گزینه محتمل در زمان انتخاب کاربر
+
+پس از نمایش کیبورد گزینه‌ها، گزینه‌ای که این کاربر (یا در صورت نبود سابقه کافی، کل کاربران)
+بیشتر انتخاب می‌کند در پس‌زمینه دانلود می‌شود. اگر کاربر همان گزینه را انتخاب کند، هندلر فایل
+آماده یا در حال دانلود را تحویل می‌گیرد؛ در غیر این صورت دانلود پیش‌دستانه لغو می‌شود.
+
+محدودیت‌ها:
+- حداکثر PREFETCH_MAX_ACTIVE دانلود پیش‌دستانه همزمان و سقف سرعت اختیاری
+- حداکثر حجم هر فایل و سقف کل حجم فایل‌های تحویل گرفته نشده روی دیسک
+- فایل‌های تحویل گرفته نشده پس از PREFETCH_TTL ثانیه حذف می‌شوند
+"""
+
+import os
+import glob
+import json
+import time
+import atexit
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    from yt_dlp.utils import DownloadCancelled as _CancelledBase
+except ImportError:
+    _CancelledBase = Exception
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# فعال بودن دانلود پیش‌دستانه (به صورت پیش‌فرض غیرفعال)
+PREFETCH_ENABLED = os.environ.get('PREFETCH_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# حداکثر دانلودهای پیش‌دستانه همزمان
+PREFETCH_MAX_ACTIVE = int(os.environ.get('PREFETCH_MAX_ACTIVE', '2'))
+# حداکثر حجم هر فایل پیش‌دستانه (مگابایت)
+PREFETCH_MAX_FILE_MB = int(os.environ.get('PREFETCH_MAX_FILE_MB', '100'))
+# سقف کل حجم فایل‌های پیش‌دستانه تحویل گرفته نشده (مگابایت)
+PREFETCH_DISK_BUDGET_MB = int(os.environ.get('PREFETCH_DISK_BUDGET_MB', '500'))
+# سقف سرعت هر دانلود پیش‌دستانه (کیلوبایت بر ثانیه، صفر یعنی بدون محدودیت)
+PREFETCH_RATE_LIMIT_KBPS = int(os.environ.get('PREFETCH_RATE_LIMIT_KBPS', '0'))
+# مدت نگهداری فایل تحویل گرفته نشده (ثانیه)
+PREFETCH_TTL = int(os.environ.get('PREFETCH_TTL', '900'))
+# حداکثر انتظار هندلر برای پایان دانلود پیش‌دستانه در حال اجرا (ثانیه)
+PREFETCH_CLAIM_TIMEOUT = 180
+# حداقل تعداد انتخاب‌های قبلی کاربر برای پیش‌بینی بر اساس سابقه خود او
+PREFETCH_MIN_USER_CHOICES = 3
+# حداقل سهم گزینه پرتکرار برای شروع دانلود پیش‌دستانه
+PREFETCH_MIN_CONFIDENCE = 0.5
+# مسیر دایرکتوری دانلود
+DOWNLOADS_DIR = os.environ.get(
+    'DOWNLOAD_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloads')
+)
+# مسیر فایل آمار انتخاب‌ها
+CHOICE_STATS_FILE = os.path.join(DOWNLOADS_DIR, 'choice_stats.json')
+# تأخیر ذخیره آمار انتخاب‌ها پس از اولین تغییر (ثانیه)؛ انتخاب‌های این فاصله با یک نوشتن ذخیره می‌شوند
+CHOICE_STATS_SAVE_DELAY = float(os.environ.get('CHOICE_STATS_SAVE_DELAY', '30'))
+
+# وضعیت‌های دانلود پیش‌دستانه
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class PrefetchCancelled(_CancelledBase):
+    """لغو دانلود پیش‌دستانه (از داخل progress hook برای توقف yt-dlp)"""
+
+
+class ChoiceStats:
+    """آمار انتخاب گزینه‌ها برای هر کاربر و کل کاربران به تفکیک پلتفرم"""
+
+    def __init__(self, stats_file: str = CHOICE_STATS_FILE, save_delay: float = CHOICE_STATS_SAVE_DELAY):
+        self.stats_file = stats_file
+        self.save_delay = save_delay
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        # پلتفرم -> گزینه -> تعداد
+        self._global: Dict[str, Dict[str, int]] = {}
+        # شناسه کاربر (رشته) -> پلتفرم -> گزینه -> تعداد
+        self._users: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.stats_file):
+            return
+        try:
+            with open(self.stats_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._global = data.get('global', {})
+            self._users = data.get('users', {})
+        except (ValueError, IOError) as e:
+            logger.warning(f"فایل آمار انتخاب‌ها قابل خواندن نیست: {e}")
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.stats_file), exist_ok=True)
+            tmp_file = f"{self.stats_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'global': self._global, 'users': self._users}, f)
+            os.replace(tmp_file, self.stats_file)
+        except OSError as e:
+            logger.warning(f"خطا در ذخیره آمار انتخاب‌ها: {e}")
+
+    def flush(self) -> None:
+        """ذخیره تغییرات در انتظار روی دیسک (در پایان تأخیر ذخیره و هنگام خروج)"""
+        with self._lock:
+            self._save_timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+            self._save()
+
+    def record(self, user_id: int, platform: str, choice: str) -> None:
+        """ثبت یک انتخاب کاربر (ذخیره روی دیسک با تأخیر CHOICE_STATS_SAVE_DELAY)"""
+        with self._lock:
+            platform_counts = self._global.setdefault(platform, {})
+            platform_counts[choice] = platform_counts.get(choice, 0) + 1
+            user_counts = self._users.setdefault(str(user_id), {}).setdefault(platform, {})
+            user_counts[choice] = user_counts.get(choice, 0) + 1
+            self._dirty = True
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(self.save_delay, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def predict(self, user_id: int, platform: str, offered: List[str]) -> Optional[str]:
+        """
+        پیش‌بینی گزینه محتمل از میان گزینه‌های نمایش داده شده
+
+        Args:
+            user_id: شناسه کاربر
+            platform: پلتفرم (youtube یا instagram)
+            offered: گزینه‌های موجود در کیبورد
+
+        Returns:
+            گزینه پیش‌بینی شده یا None اگر اطمینان کافی وجود نداشته باشد
+        """
+        with self._lock:
+            user_counts = self._users.get(str(user_id), {}).get(platform, {})
+            if sum(user_counts.values()) >= PREFETCH_MIN_USER_CHOICES:
+                counts = user_counts
+            else:
+                counts = self._global.get(platform, {})
+
+            counts = {choice: count for choice, count in counts.items() if choice in offered}
+            total = sum(counts.values())
+            if not total:
+                return None
+            choice, count = max(counts.items(), key=lambda item: item[1])
+            return choice if count / total >= PREFETCH_MIN_CONFIDENCE else None
+
+
+class _PrefetchEntry:
+    """یک دانلود پیش‌دستانه"""
+
+    def __init__(self, url: str, choice: str):
+        self.url = url
+        self.choice = choice
+        self.state = RUNNING
+        self.file_path: Optional[str] = None
+        self.size = 0
+        self.downloaded_bytes = 0
+        self.created_at = time.time()
+        self.finished_at = 0.0
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+        self.forward_hook: Optional[Callable] = None
+        # فایل‌های موقت yt-dlp (.part) برای حذف پس از لغو یا خطا
+        self.partial_files = set()
+
+
+class PrefetchManager:
+    """مدیریت دانلودهای پیش‌دستانه با سقف همزمانی، پهنای باند و دیسک"""
+
+    def __init__(self, max_active: int = PREFETCH_MAX_ACTIVE):
+        self.max_active = max_active
+        self.max_file_size = PREFETCH_MAX_FILE_MB * 1024 * 1024
+        self.disk_budget = PREFETCH_DISK_BUDGET_MB * 1024 * 1024
+        self.choices = ChoiceStats()
+        self._executor = ThreadPoolExecutor(max_workers=max_active, thread_name_prefix='prefetch')
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], _PrefetchEntry] = {}
+
+        # آمار
+        self.stats = {
+            'started': 0,
+            'hits': 0,
+            'misses': 0,
+            'cancelled': 0,
+            'failed': 0,
+            'skipped_budget': 0,
+            'wasted_bytes': 0,
+            'saved_seconds': 0.0,
+        }
+
+    def ytdlp_limits(self) -> Dict:
+        """محدودیت‌های سرعت و حجم برای افزودن به تنظیمات yt-dlp دانلودهای پیش‌دستانه"""
+        limits = {'max_filesize': self.max_file_size}
+        if PREFETCH_RATE_LIMIT_KBPS > 0:
+            limits['ratelimit'] = PREFETCH_RATE_LIMIT_KBPS * 1024
+        return limits
+
+    def record_choice(self, user_id: int, platform: str, choice: str) -> None:
+        """ثبت انتخاب کاربر در آمار انتخاب‌ها"""
+        self.choices.record(user_id, platform, choice)
+
+    def predict(self, user_id: int, platform: str, offered: List[str]) -> Optional[str]:
+        """پیش‌بینی گزینه محتمل کاربر (در صورت غیرفعال بودن پیش‌دستانه None)"""
+        if not PREFETCH_ENABLED:
+            return None
+        return self.choices.predict(user_id, platform, offered)
+
+    def _unclaimed_bytes(self) -> int:
+        return sum(entry.size or entry.downloaded_bytes for entry in self._entries.values()
+                   if entry.state in (RUNNING, DONE))
+
+    def _active_count(self) -> int:
+        return sum(1 for entry in self._entries.values() if entry.state == RUNNING)
+
+    def start(self, url: str, choice: str, fetch: Callable[[Callable], Optional[str]]) -> bool:
+        """
+        شروع دانلود پیش‌دستانه
+
+        Args:
+            url: آدرس محتوا
+            choice: گزینه پیش‌بینی شده (کلید تحویل)
+            fetch: تابع دانلود با امضای (progress_hook) -> مسیر فایل؛ hook باید به yt-dlp داده شود
+
+        Returns:
+            True اگر دانلود شروع شد
+        """
+        if not PREFETCH_ENABLED:
+            return False
+
+        self._sweep()
+        key = (url, choice)
+        with self._lock:
+            if key in self._entries:
+                return False
+            if self._active_count() >= self.max_active:
+                self.stats['skipped_budget'] += 1
+                return False
+            if self._unclaimed_bytes() + self.max_file_size > self.disk_budget:
+                self.stats['skipped_budget'] += 1
+                logger.info("دانلود پیش‌دستانه به دلیل سقف دیسک انجام نشد")
+                return False
+            entry = _PrefetchEntry(url, choice)
+            self._entries[key] = entry
+            self.stats['started'] += 1
+
+        logger.info(f"شروع دانلود پیش‌دستانه {choice} برای {url[:50]}")
+        self._executor.submit(self._run, entry, fetch)
+        return True
+
+    def _make_hook(self, entry: _PrefetchEntry) -> Callable:
+        """progress hook برای پیگیری حجم، اعمال سقف حجم و لغو دانلود"""
+        def hook(status: Dict) -> None:
+            if entry.cancelled.is_set():
+                raise PrefetchCancelled("دانلود پیش‌دستانه لغو شد")
+            if status.get('tmpfilename'):
+                entry.partial_files.add((status['tmpfilename'], status.get('filename')))
+            entry.downloaded_bytes = status.get('downloaded_bytes', entry.downloaded_bytes)
+            total = status.get('total_bytes') or status.get('total_bytes_estimate') or 0
+            if max(total, entry.downloaded_bytes) > self.max_file_size:
+                entry.cancelled.set()
+                raise PrefetchCancelled("حجم فایل بیش از سقف دانلود پیش‌دستانه است")
+            if entry.forward_hook is not None:
+                entry.forward_hook(status)
+        return hook
+
+    def _run(self, entry: _PrefetchEntry, fetch: Callable[[Callable], Optional[str]]) -> None:
+        file_path = None
+        try:
+            file_path = fetch(self._make_hook(entry))
+        except Exception as e:
+            if not entry.cancelled.is_set():
+                logger.warning(f"خطا در دانلود پیش‌دستانه {entry.choice}: {e}")
+
+        with self._lock:
+            entry.finished_at = time.time()
+            if entry.cancelled.is_set():
+                entry.state = CANCELLED
+                self.stats['cancelled'] += 1
+                self.stats['wasted_bytes'] += entry.downloaded_bytes
+            elif file_path and os.path.exists(file_path):
+                entry.state = DONE
+                entry.file_path = file_path
+                entry.size = os.path.getsize(file_path)
+            else:
+                entry.state = FAILED
+                self.stats['failed'] += 1
+            if entry.state != DONE:
+                self._entries.pop((entry.url, entry.choice), None)
+        entry.finished.set()
+
+        if entry.state == CANCELLED and file_path:
+            self._remove_file(file_path)
+        if entry.state in (CANCELLED, FAILED):
+            self._remove_partial_files(entry)
+        if entry.state == DONE:
+            logger.info(f"دانلود پیش‌دستانه {entry.choice} آماده شد ({entry.size / (1024 * 1024):.1f} MB)")
+            self._enforce_budget()
+
+    def claim(self, url: str, choice: str, progress_hook: Optional[Callable] = None,
+              timeout: float = PREFETCH_CLAIM_TIMEOUT) -> Optional[str]:
+        """
+        تحویل فایل پیش‌دستانه به هندلر (و لغو دانلودهای پیش‌دستانه دیگر همین محتوا)
+
+        اگر دانلود در حال اجرا باشد تا پایان آن (حداکثر timeout) منتظر می‌ماند و پیشرفت را
+        به progress_hook هندلر منتقل می‌کند. پس از تحویل، مالکیت فایل با هندلر است.
+
+        Args:
+            url: آدرس محتوا
+            choice: گزینه انتخاب شده
+            progress_hook: hook پیشرفت هندلر (مثلاً برای ویرایشگر پیام وضعیت)
+            timeout: حداکثر زمان انتظار
+
+        Returns:
+            مسیر فایل یا None اگر دانلود پیش‌دستانه مناسبی وجود نداشت
+        """
+        self.cancel(url, keep=choice)
+        with self._lock:
+            entry = self._entries.get((url, choice))
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            entry.forward_hook = progress_hook
+
+        if not entry.finished.wait(timeout):
+            logger.warning(f"دانلود پیش‌دستانه {choice} در مهلت تمام نشد، دانلود عادی انجام می‌شود")
+            self.cancel(url)
+            return None
+
+        with self._lock:
+            self._entries.pop((url, choice), None)
+            if entry.state != DONE:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            # زمانی که کاربر منتظر نماند: از لحظه شروع دانلود تا تحویل یا پایان دانلود
+            self.stats['saved_seconds'] += max(0.0, min(time.time(), entry.finished_at) - entry.created_at)
+
+        logger.info(f"فایل پیش‌دستانه {choice} تحویل داده شد: {entry.file_path}")
+        return entry.file_path
+
+    def cancel(self, url: str, keep: Optional[str] = None) -> None:
+        """
+        لغو دانلودهای پیش‌دستانه یک محتوا
+
+        Args:
+            url: آدرس محتوا
+            keep: گزینه‌ای که نباید لغو شود
+        """
+        removed = []
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.url != url or entry.choice == keep:
+                    continue
+                if entry.state == RUNNING:
+                    entry.cancelled.set()
+                else:
+                    self._entries.pop(key, None)
+                    self.stats['cancelled'] += 1
+                    self.stats['wasted_bytes'] += entry.size
+                    removed.append(entry.file_path)
+        for file_path in removed:
+            self._remove_file(file_path)
+
+    def _enforce_budget(self) -> None:
+        """حذف قدیمی‌ترین فایل‌های تحویل گرفته نشده در صورت عبور از سقف دیسک"""
+        removed = []
+        with self._lock:
+            done = sorted((entry for entry in self._entries.values() if entry.state == DONE),
+                          key=lambda entry: entry.finished_at)
+            total = self._unclaimed_bytes()
+            for entry in done:
+                if total <= self.disk_budget:
+                    break
+                self._entries.pop((entry.url, entry.choice), None)
+                total -= entry.size
+                self.stats['wasted_bytes'] += entry.size
+                removed.append(entry.file_path)
+        for file_path in removed:
+            self._remove_file(file_path)
+
+    def _sweep(self) -> None:
+        """حذف فایل‌های تحویل گرفته نشده قدیمی‌تر از PREFETCH_TTL"""
+        now = time.time()
+        removed = []
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.state == DONE and now - entry.finished_at > PREFETCH_TTL:
+                    self._entries.pop(key, None)
+                    self.stats['wasted_bytes'] += entry.size
+                    removed.append(entry.file_path)
+        for file_path in removed:
+            self._remove_file(file_path)
+
+    @staticmethod
+    def _remove_file(file_path: Optional[str]) -> None:
+        if not file_path:
+            return
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+    def _remove_partial_files(self, entry: _PrefetchEntry) -> None:
+        """حذف فایل‌های نیمه‌کاره yt-dlp (.part، قطعه‌ها و فایل وضعیت .ytdl) یک دانلود لغو شده"""
+        for tmp_file, final_file in entry.partial_files:
+            self._remove_file(tmp_file)
+            for fragment_file in glob.glob(f"{glob.escape(tmp_file)}-Frag*"):
+                self._remove_file(fragment_file)
+            if final_file:
+                self._remove_file(f"{final_file}.ytdl")
+
+    def get_stats(self) -> Dict:
+        """
+        دریافت آمار دانلود پیش‌دستانه
+
+        Returns:
+            دیکشنری آمار شامل نرخ موفقیت پیش‌بینی و حجم هدر رفته
+        """
+        self._sweep()
+        with self._lock:
+            stats = dict(self.stats)
+            claims = stats['hits'] + stats['misses']
+            stats.update({
+                'active': self._active_count(),
+                'unclaimed_bytes': self._unclaimed_bytes(),
+                'hit_rate': round(stats['hits'] / claims, 2) if claims else 0.0,
+            })
+        return stats
+
+
+# نمونه مشترک مدیریت دانلود پیش‌دستانه
+prefetch_manager = PrefetchManager()
+# ذخیره انتخاب‌های ثبت شده در آخرین فاصله ذخیره هنگام خروج
+atexit.register(prefetch_manager.choices.flush)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+کنترل‌کننده نرخ درخواست‌ها به اینستاگرام و یوتیوب در سطح کل برنامه
+
+برای هر میزبان و هر دسته endpoint (api برای صفحات و API، cdn برای فایل‌های رسانه) یک
+سطل توکن وجود دارد که همه مسیرهای دریافت پیش از ارسال درخواست از آن توکن می‌گیرند.
+نرخ‌ها به صورت AIMD تطبیق داده می‌شوند: پس از پاسخ 429 نرخ نصف می‌شود و سطل تا پایان
+Retry-After متوقف می‌ماند؛ با پاسخ‌های موفق نرخ به تدریج تا سقف تنظیم شده بالا می‌رود.
+
+با install_requests_governor متد ارسال HTTPAdapter کتابخانه requests پوشانده می‌شود، بنابراین
+درخواست‌های instaloader، دانلودرهای مستقیم و yt-dlp (که در صورت نصب بودن requests از آن
+استفاده می‌کند) همگی از همین سطل‌ها عبور می‌کنند. انتظار برای توکن فقط در تردهای اجرایی انجام
+می‌شود؛ درخواستی که روی ترد یک event loop ارسال شود منتظر نمی‌ماند و توکن را قرض می‌گیرد
+(کسری آن از درخواست‌های بعدی کم می‌شود) تا loop مسدود نشود.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+try:
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    HTTPAdapter = None
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# فعال بودن کنترل نرخ
+GOVERNOR_ENABLED = os.environ.get('GOVERNOR_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# حداکثر انتظار برای گرفتن توکن (ثانیه)؛ پس از آن درخواست بدون توکن ارسال می‌شود
+GOVERNOR_MAX_WAIT = float(os.environ.get('GOVERNOR_MAX_WAIT', '60'))
+# ضریب کاهش نرخ پس از پاسخ 429
+GOVERNOR_DECREASE_FACTOR = 0.5
+# افزایش نرخ پس از هر پاسخ موفق (کسری از سقف نرخ)
+GOVERNOR_INCREASE_STEP = 0.02
+# حداقل نرخ (کسری از سقف نرخ)
+GOVERNOR_MIN_RATE_RATIO = 0.05
+# توقف پیش‌فرض پس از 429 بدون هدر Retry-After (ثانیه)
+GOVERNOR_DEFAULT_BACKOFF = 30
+
+# میزبان‌ها: (پلتفرم, دسته endpoint, پسوندهای دامنه) - ترتیب مهم است
+HOST_RULES = (
+    ('instagram', 'cdn', ('cdninstagram.com', 'fbcdn.net')),
+    ('instagram', 'api', ('instagram.com', 'instagr.am')),
+    ('youtube', 'cdn', ('googlevideo.com', 'ytimg.com', 'ggpht.com')),
+    ('youtube', 'api', ('youtube.com', 'youtu.be', 'youtube-nocookie.com')),
+)
+
+# سقف نرخ (درخواست بر ثانیه) و ظرفیت سطل هر دسته
+DEFAULT_LIMITS = {
+    ('instagram', 'api'): (float(os.environ.get('GOVERNOR_INSTAGRAM_API_RPS', '1')), 5),
+    ('instagram', 'cdn'): (float(os.environ.get('GOVERNOR_INSTAGRAM_CDN_RPS', '20')), 40),
+    ('youtube', 'api'): (float(os.environ.get('GOVERNOR_YOUTUBE_API_RPS', '5')), 10),
+    ('youtube', 'cdn'): (float(os.environ.get('GOVERNOR_YOUTUBE_CDN_RPS', '50')), 100),
+}
+
+
+def classify(url: str) -> Optional[Tuple[str, str]]:
+    """
+    تعیین پلتفرم و دسته endpoint یک آدرس
+
+    Args:
+        url: آدرس درخواست
+
+    Returns:
+        (پلتفرم, دسته) یا None برای میزبان‌های بدون کنترل نرخ
+    """
+    host = (urlparse(url).hostname or '').lower()
+    for platform, endpoint_class, suffixes in HOST_RULES:
+        if any(host == suffix or host.endswith('.' + suffix) for suffix in suffixes):
+            return platform, endpoint_class
+    return None
+
+
+def _on_event_loop() -> bool:
+    """آیا ترد فعلی در حال اجرای یک event loop است (انتظار مسدودکننده در آن مجاز نیست)"""
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def _parse_retry_after(value) -> Optional[float]:
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveTokenBucket:
+    """سطل توکن با نرخ تطبیقی (AIMD)"""
+
+    def __init__(self, name: str, max_rate: float, burst: int):
+        self.name = name
+        self.max_rate = max_rate
+        self.min_rate = max_rate * GOVERNOR_MIN_RATE_RATIO
+        self.rate = max_rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+        # آمار
+        self.granted = 0
+        self.throttled = 0
+        self.timeouts = 0
+        self.borrowed = 0
+        self.total_wait = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, max_wait: float = GOVERNOR_MAX_WAIT) -> Optional[float]:
+        """
+        رزرو یک توکن
+
+        Returns:
+            مدت انتظار تا قابل استفاده شدن توکن؛ None اگر انتظار از max_wait بیشتر باشد (توکن رزرو نمی‌شود)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(self.paused_until - now, (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0)
+            if wait > max_wait:
+                self.timeouts += 1
+                return None
+            self.tokens -= 1
+            self.granted += 1
+            self.total_wait += wait
+            return wait
+
+    def borrow(self) -> float:
+        """
+        گرفتن توکن بدون انتظار (برای درخواست‌های ترد event loop)
+
+        توکن حتی در صورت خالی بودن سطل کم می‌شود، پس درخواست‌های بعدی تردهای اجرایی
+        کسری آن را جبران می‌کنند و نرخ کل حفظ می‌شود.
+
+        Returns:
+            مدت انتظاری که رعایت نشد
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(self.paused_until - now, (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0)
+            self.tokens -= 1
+            self.granted += 1
+            if wait > 0:
+                self.borrowed += 1
+            return wait
+
+    def on_success(self) -> None:
+        """افزایش جمعی نرخ پس از پاسخ موفق"""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * GOVERNOR_INCREASE_STEP)
+
+    def on_throttled(self, retry_after: Optional[float] = None) -> None:
+        """
+        کاهش ضربی نرخ و توقف سطل پس از پاسخ 429
+
+        گزارش‌های تکراری همان رخداد (مثلاً پاسخ 429 در HTTPAdapter و سپس خطای instaloader یا yt-dlp)
+        در زمان توقف فقط توقف را تمدید می‌کنند و نرخ را دوباره نصف نمی‌کنند.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.throttled += 1
+            if now >= self.paused_until:
+                self.rate = max(self.min_rate, self.rate * GOVERNOR_DECREASE_FACTOR)
+            self.tokens = min(self.tokens, 0.0)
+            backoff = retry_after if retry_after is not None else GOVERNOR_DEFAULT_BACKOFF
+            self.paused_until = max(self.paused_until, now + backoff)
+        logger.warning(f"پاسخ 429 از {self.name}: نرخ به {self.rate:.2f} درخواست بر ثانیه کاهش یافت "
+                       f"و {backoff:.0f} ثانیه توقف")
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'rate': round(self.rate, 3),
+                'max_rate': self.max_rate,
+                'tokens': round(self.tokens, 2),
+                'paused_for': round(max(0.0, self.paused_until - time.monotonic()), 1),
+                'granted': self.granted,
+                'throttled': self.throttled,
+                'timeouts': self.timeouts,
+                'borrowed': self.borrowed,
+                'avg_wait': round(self.total_wait / self.granted, 3) if self.granted else 0.0,
+            }
+
+
+class RequestGovernor:
+    """کنترل‌کننده مشترک نرخ درخواست‌ها برای همه مسیرهای دریافت"""
+
+    def __init__(self, limits: Dict[Tuple[str, str], Tuple[float, int]] = None):
+        limits = limits or DEFAULT_LIMITS
+        self.buckets = {key: AdaptiveTokenBucket(f"{key[0]}/{key[1]}", rate, burst)
+                        for key, (rate, burst) in limits.items()}
+
+    def _bucket(self, url: str) -> Optional[AdaptiveTokenBucket]:
+        if not GOVERNOR_ENABLED:
+            return None
+        key = classify(url)
+        return self.buckets.get(key) if key else None
+
+    def acquire(self, url: str) -> float:
+        """
+        گرفتن توکن پیش از ارسال درخواست (مسدودکننده در تردهای اجرایی)
+
+        روی ترد event loop منتظر نمی‌ماند و توکن را قرض می‌گیرد.
+
+        Args:
+            url: آدرس درخواست
+
+        Returns:
+            مدت انتظار (ثانیه)
+        """
+        bucket = self._bucket(url)
+        if bucket is None:
+            return 0.0
+        if _on_event_loop():
+            skipped = bucket.borrow()
+            if skipped > 0:
+                logger.debug(f"درخواست همزمان {bucket.name} روی event loop بدون انتظار {skipped:.1f} ثانیه‌ای ارسال شد")
+            return 0.0
+        wait = bucket.reserve()
+        if wait is None:
+            logger.warning(f"انتظار برای توکن {bucket.name} بیش از حد مجاز بود، درخواست بدون توکن ارسال می‌شود")
+            return 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, url: str) -> float:
+        """نسخه آسنکرون acquire (بدون مسدود کردن event loop)"""
+        bucket = self._bucket(url)
+        if bucket is None:
+            return 0.0
+        wait = bucket.reserve()
+        if wait is None:
+            return 0.0
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def report(self, url: str, status_code: int, retry_after=None) -> None:
+        """
+        گزارش نتیجه درخواست برای تطبیق نرخ
+
+        Args:
+            url: آدرس درخواست
+            status_code: کد وضعیت HTTP
+            retry_after: مقدار هدر Retry-After (در صورت وجود)
+        """
+        bucket = self._bucket(url)
+        if bucket is None:
+            return
+        if status_code == 429:
+            bucket.on_throttled(_parse_retry_after(retry_after))
+        elif status_code < 400:
+            bucket.on_success()
+
+    def report_exception(self, url: str, error: Exception) -> None:
+        """
+        گزارش خطای کتابخانه‌هایی که کد وضعیت را فقط در متن خطا برمی‌گردانند (yt-dlp و instaloader)
+
+        Args:
+            url: آدرس صفحه محتوا (خطا به سطل api همان پلتفرم نسبت داده می‌شود)
+            error: خطای رخ داده
+        """
+        message = str(error)
+        if '429' in message or 'Too Many Requests' in message:
+            self.report(url, 429)
+
+    def get_stats(self) -> Dict:
+        """آمار هر سطل"""
+        return {bucket.name: bucket.get_stats() for bucket in self.buckets.values()}
+
+
+# نمونه مشترک کنترل‌کننده نرخ
+request_governor = RequestGovernor()
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install_requests_governor() -> bool:
+    """
+    پوشاندن متد ارسال HTTPAdapter تا همه درخواست‌های requests از کنترل‌کننده عبور کنند
+
+    Returns:
+        True اگر نصب انجام شد (یا قبلاً انجام شده بود)
+    """
+    global _installed
+    if HTTPAdapter is None or not GOVERNOR_ENABLED:
+        return False
+
+    with _install_lock:
+        if _installed:
+            return True
+        original_send = HTTPAdapter.send
+
+        def governed_send(self, request, *args, **kwargs):
+            request_governor.acquire(request.url)
+            response = original_send(self, request, *args, **kwargs)
+            request_governor.report(request.url, response.status_code, response.headers.get('Retry-After'))
+            return response
+
+        HTTPAdapter.send = governed_send
+        _installed = True
+
+    logger.info("کنترل نرخ درخواست‌های اینستاگرام و یوتیوب فعال شد")
+    return True
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ویرایشگر پیام وضعیت با ادغام و محدودسازی نرخ ویرایش
+
+هر پیام وضعیت یک ویرایشگر دارد که پیشرفت yt-dlp و ffmpeg را دریافت می‌کند و:
+- حداکثر هر STATUS_EDIT_INTERVAL ثانیه یک بار پیام را ویرایش می‌کند
+- وضعیت‌های میانی کهنه را دور می‌ریزد و فقط آخرین وضعیت را ارسال می‌کند
+- ویرایش‌هایی که متن پیام را تغییر نمی‌دهند ارسال نمی‌کند
+- در صورت خطای RetryAfter ویرایش بعدی را تا پایان زمان انتظار عقب می‌اندازد
+
+فراخوانی update از هر تردی (مثلاً hook های yt-dlp در ترد دانلود) امن است.
+"""
+
+import os
+import time
+import asyncio
+import inspect
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    from telegram.error import RetryAfter
+except ImportError:
+    RetryAfter = None
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# حداقل فاصله بین دو ویرایش یک پیام (به ثانیه)
+STATUS_EDIT_INTERVAL = float(os.environ.get('STATUS_EDIT_INTERVAL', '3'))
+# گام گرد کردن درصد پیشرفت (تغییرات کوچک‌تر متن را عوض نمی‌کنند)
+PROGRESS_PERCENT_STEP = 5
+# طول نوار پیشرفت
+PROGRESS_BAR_LENGTH = 10
+# مدت بیکاری که پس از آن ویرایشگر یک پیام از لیست ویرایشگرهای فعال حذف می‌شود (به ثانیه)
+STATUS_EDITOR_IDLE_TTL = float(os.environ.get('STATUS_EDITOR_IDLE_TTL', '300'))
+
+# ویرایشگرهای فعال: (شناسه چت, شناسه پیام) -> ویرایشگر
+_editors: Dict[Tuple[int, int], 'StatusEditor'] = {}
+_editors_lock = threading.Lock()
+
+
+def format_progress_text(title: str, percent: Optional[float] = None, speed: Optional[float] = None,
+                         eta: Optional[float] = None) -> str:
+    """
+    ساخت متن پیشرفت با نوار و اطلاعات سرعت/زمان باقیمانده
+
+    Args:
+        title: عنوان مرحله (مثلاً "⏳ در حال دانلود...")
+        percent: درصد پیشرفت
+        speed: سرعت به بایت بر ثانیه
+        eta: زمان باقیمانده به ثانیه
+
+    Returns:
+        متن پیام
+    """
+    lines = [title]
+    if percent is not None:
+        percent = min(100, int(percent // PROGRESS_PERCENT_STEP) * PROGRESS_PERCENT_STEP)
+        filled = int(percent * PROGRESS_BAR_LENGTH / 100)
+        lines.append(f"{'▓' * filled}{'░' * (PROGRESS_BAR_LENGTH - filled)} {percent}%")
+    if speed:
+        lines.append(f"🚀 سرعت: {speed / (1024 * 1024):.1f} MB/s")
+    if eta is not None:
+        lines.append(f"⏱ زمان باقیمانده: {int(eta)} ثانیه")
+    return "\n".join(lines)
+
+
+class StatusEditor:
+    """ویرایشگر ادغام‌کننده یک پیام وضعیت"""
+
+    def __init__(self, edit_func: Callable, min_interval: float = STATUS_EDIT_INTERVAL, loop=None):
+        """
+        Args:
+            edit_func: تابع ویرایش پیام با امضای (text, **kwargs)؛ در نسخه 20 کوروتین و در نسخه 13 تابع معمولی
+            min_interval: حداقل فاصله بین دو ویرایش (ثانیه)
+            loop: event loop برای اجرای ویرایش‌های آسنکرون (پیش‌فرض: loop در حال اجرا در صورت وجود)
+        """
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+
+        self._edit_func = edit_func
+        self._loop = loop
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._pending: Optional[Tuple[str, Dict[str, Any]]] = None
+        self._last_sent: Optional[Tuple[str, Dict[str, Any]]] = None
+        self._next_allowed = 0.0
+        self._scheduled = False
+        self._closed = False
+        self._tasks = set()
+
+        # آمار
+        self.edits_sent = 0
+        self.edits_skipped = 0
+
+    def update(self, text: str, **kwargs) -> None:
+        """
+        ثبت وضعیت جدید (بدون انتظار)؛ وضعیت قبلی ارسال نشده جایگزین می‌شود
+
+        Args:
+            text: متن جدید پیام
+            kwargs: سایر پارامترهای ویرایش (مثلاً parse_mode یا reply_markup)
+        """
+        state = (text, kwargs)
+        with self._lock:
+            if self._closed:
+                return
+            if self._pending is not None:
+                self.edits_skipped += 1
+            if state == self._last_sent:
+                # متن پیام تغییری نمی‌کند
+                self._pending = None
+                return
+            self._pending = state
+            if self._scheduled:
+                return
+            self._scheduled = True
+            delay = max(0.0, self._next_allowed - time.monotonic())
+        self._schedule(delay)
+
+    def _schedule(self, delay: float) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.call_later, delay, self._start_async_flush)
+        else:
+            timer = threading.Timer(delay, self._flush_sync)
+            timer.daemon = True
+            timer.start()
+
+    def _take_pending(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """برداشتن آخرین وضعیت برای ارسال و رزرو زمان ویرایش بعدی"""
+        with self._lock:
+            self._scheduled = False
+            pending, self._pending = self._pending, None
+            if pending is None or pending == self._last_sent:
+                return None
+            self._last_sent = pending
+            self._next_allowed = time.monotonic() + self.min_interval
+            self.edits_sent += 1
+            return pending
+
+    def _start_async_flush(self) -> None:
+        task = self._loop.create_task(self._flush_async())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_async(self) -> None:
+        pending = self._take_pending()
+        if pending is None:
+            return
+        try:
+            result = self._edit_func(pending[0], **pending[1])
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            self._handle_error(e, pending)
+
+    def _flush_sync(self) -> None:
+        pending = self._take_pending()
+        if pending is None:
+            return
+        try:
+            self._edit_func(pending[0], **pending[1])
+        except Exception as e:
+            self._handle_error(e, pending)
+
+    def _handle_error(self, error: Exception, state: Tuple[str, Dict[str, Any]]) -> None:
+        if 'not modified' in str(error).lower():
+            return
+
+        if RetryAfter is not None and isinstance(error, RetryAfter):
+            retry_after = error.retry_after
+            if hasattr(retry_after, 'total_seconds'):
+                retry_after = retry_after.total_seconds()
+            logger.warning(f"محدودیت ویرایش پیام وضعیت، ویرایش بعدی پس از {retry_after} ثانیه")
+            with self._lock:
+                self._next_allowed = time.monotonic() + float(retry_after)
+                self._last_sent = None
+                if self._closed or self._scheduled:
+                    return
+                if self._pending is None:
+                    self._pending = state
+                self._scheduled = True
+            self._schedule(float(retry_after))
+            return
+
+        logger.warning(f"خطا در ویرایش پیام وضعیت: {error}")
+
+    def _close(self) -> float:
+        """بستن ویرایشگر و محاسبه زمان انتظار تا مجاز شدن ویرایش بعدی"""
+        with self._lock:
+            self._closed = True
+            self._pending = None
+            return max(0.0, self._next_allowed - time.monotonic())
+
+    def close(self) -> None:
+        """
+        توقف ویرایش‌های پیشرفت پیش از ویرایش مستقیم پیام توسط هندلر (نسخه همزمان)
+
+        تا پایان فاصله مجاز منتظر می‌ماند تا ویرایش بعدی هندلر باعث خطای 429 نشود.
+        """
+        delay = self._close()
+        if delay:
+            time.sleep(delay)
+
+    async def aclose(self) -> None:
+        """نسخه آسنکرون close"""
+        delay = self._close()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def stop(self) -> None:
+        """
+        توقف ویرایش‌های در انتظار بدون صبر کردن
+
+        برای ویرایشگرهای مشترک get_editor کافی است: ویرایشگر بعدی همان پیام نوبت ویرایش را به ارث می‌برد.
+        """
+        self._close()
+
+    def _reserve_edit(self, state: Tuple[str, Dict[str, Any]]) -> Optional[float]:
+        """رزرو نوبت ویرایش مستقیم؛ زمان انتظار تا نوبت یا None اگر متن پیام تغییری نمی‌کند"""
+        with self._lock:
+            self._pending = None
+            if state == self._last_sent:
+                return None
+            now = time.monotonic()
+            delay = max(0.0, self._next_allowed - now)
+            self._next_allowed = now + delay + self.min_interval
+            self._last_sent = state
+            self.edits_sent += 1
+            return delay
+
+    def _retry_delay(self, error: Exception) -> Optional[float]:
+        """زمان انتظار خطای RetryAfter یا None برای سایر خطاها"""
+        if RetryAfter is None or not isinstance(error, RetryAfter):
+            return None
+        retry_after = error.retry_after
+        if hasattr(retry_after, 'total_seconds'):
+            retry_after = retry_after.total_seconds()
+        with self._lock:
+            self._next_allowed = time.monotonic() + float(retry_after)
+        return float(retry_after)
+
+    async def edit(self, text: str, **kwargs) -> None:
+        """
+        ویرایش مستقیم پیام توسط هندلر (تغییر مرحله یا پیام نهایی) با رعایت فاصله مجاز
+
+        وضعیت پیشرفت ارسال نشده دور ریخته می‌شود و نوبت ویرایش بعدی رزرو می‌شود تا
+        نوارهای پیشرفت بعدی همین پیام بلافاصله پس از آن ویرایش نشوند. پس از close هم قابل استفاده است.
+
+        Args:
+            text: متن جدید پیام
+            kwargs: سایر پارامترهای ویرایش
+        """
+        delay = self._reserve_edit((text, kwargs))
+        if delay is None:
+            return
+        if delay:
+            await asyncio.sleep(delay)
+        for attempt in range(2):
+            try:
+                result = self._edit_func(text, **kwargs)
+                if inspect.isawaitable(result):
+                    await result
+                return
+            except Exception as e:
+                if 'not modified' in str(e).lower():
+                    return
+                retry_after = self._retry_delay(e)
+                if retry_after is None or attempt:
+                    raise
+                logger.warning(f"محدودیت ویرایش پیام وضعیت، ویرایش مستقیم پس از {retry_after} ثانیه")
+                await asyncio.sleep(retry_after)
+
+    def edit_sync(self, text: str, **kwargs) -> None:
+        """نسخه همزمان edit برای هندلرهای نسخه 13"""
+        delay = self._reserve_edit((text, kwargs))
+        if delay is None:
+            return
+        if delay:
+            time.sleep(delay)
+        for attempt in range(2):
+            try:
+                self._edit_func(text, **kwargs)
+                return
+            except Exception as e:
+                if 'not modified' in str(e).lower():
+                    return
+                retry_after = self._retry_delay(e)
+                if retry_after is None or attempt:
+                    raise
+                logger.warning(f"محدودیت ویرایش پیام وضعیت، ویرایش مستقیم پس از {retry_after} ثانیه")
+                time.sleep(retry_after)
+
+    def ytdlp_hook(self, title: str) -> Callable[[Dict], None]:
+        """
+        ساخت progress hook برای yt-dlp
+
+        Args:
+            title: عنوان مرحله دانلود
+
+        Returns:
+            تابع hook برای قرار دادن در progress_hooks
+        """
+        def hook(status: Dict) -> None:
+            if status.get('status') != 'downloading':
+                return
+            total = status.get('total_bytes') or status.get('total_bytes_estimate')
+            percent = status.get('downloaded_bytes', 0) * 100 / total if total else None
+            self.update(format_progress_text(title, percent, status.get('speed'), status.get('eta')))
+        return hook
+
+    def ffmpeg_callback(self, title: str) -> Callable[[Dict], None]:
+        """
+        ساخت progress_callback برای ffmpeg_runner
+
+        Args:
+            title: عنوان مرحله پردازش
+
+        Returns:
+            تابع دریافت پیشرفت ffmpeg
+        """
+        def callback(progress: Dict) -> None:
+            if progress.get('done'):
+                return
+            self.update(format_progress_text(title, progress.get('percent'), eta=progress.get('eta')))
+        return callback
+
+
+def _prune_idle_editors() -> None:
+    """حذف ویرایشگرهایی که مدتی ویرایشی نداشته‌اند (با قفل _editors_lock فراخوانی می‌شود)"""
+    now = time.monotonic()
+    for key, editor in list(_editors.items()):
+        if not editor._scheduled and now - editor._next_allowed > STATUS_EDITOR_IDLE_TTL:
+            del _editors[key]
+
+
+def get_editor(chat_id: int, message_id: int, edit_func: Callable) -> StatusEditor:
+    """
+    دریافت ویرایشگر مشترک یک پیام (ایجاد در صورت نیاز)
+
+    ویرایشگری که جایگزین یک ویرایشگر بسته شده می‌شود نوبت ویرایش بعدی و آخرین متن ارسال شده
+    را از آن به ارث می‌برد تا مراحل پشت سر هم یک پیام از محدودیت نرخ عبور نکنند.
+
+    Args:
+        chat_id: شناسه چت
+        message_id: شناسه پیام
+        edit_func: تابع ویرایش پیام (فقط هنگام ایجاد استفاده می‌شود)
+
+    Returns:
+        ویرایشگر پیام
+    """
+    with _editors_lock:
+        editor = _editors.get((chat_id, message_id))
+        if editor is None or editor._closed:
+            previous = editor
+            _prune_idle_editors()
+            editor = StatusEditor(edit_func)
+            if previous is not None:
+                editor._next_allowed = previous._next_allowed
+                editor._last_sent = previous._last_sent
+            _editors[(chat_id, message_id)] = editor
+        return editor
+
+
+def release_editor(chat_id: int, message_id: int) -> None:
+    """حذف ویرایشگر یک پیام از لیست ویرایشگرهای فعال"""
+    with _editors_lock:
+        _editors.pop((chat_id, message_id), None)
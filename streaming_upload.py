@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+آپلود جریانی فایل‌ها به Bot API بدون بارگذاری کل فایل در حافظه
+
+بدنه multipart درخواست به صورت تکه‌تکه از دیسک ارسال می‌شود:
+- روی اتصال‌های بدون TLS (مثلاً سرور Bot API محلی روی http) با sendfile و بدون کپی در فضای کاربر
+- روی اتصال‌های TLS با mmap و ارسال تکه‌های ثابت از memoryview
+
+به این ترتیب مصرف حافظه هر آپلود مستقل از حجم فایل است و آپلودهای همزمان بیشتری در همان
+حافظه کانتینر ممکن می‌شود. این مسیر با STREAMING_UPLOAD_ENABLED=true فعال می‌شود و از پراکسی و
+مهلت‌های تنظیم شده روی بات استفاده نمی‌کند. با فعال بودن STREAMING_UPLOAD_MEASURE_RSS، افزایش RSS
+پردازه در طول هر آپلود اندازه‌گیری و در آمار ثبت می‌شود.
+
+آزمایش مستقل (مقایسه با آپلود بافر شده روی یک سرور محلی):
+    python streaming_upload.py --self-test --size-mb 50
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import uuid
+import socket
+import logging
+import argparse
+import mimetypes
+import threading
+import http.client
+from contextlib import nullcontext
+from urllib.parse import urlsplit
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    from telegram.error import RetryAfter
+except ImportError:
+    RetryAfter = None
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# فعال بودن آپلود جریانی (پیش‌فرض غیرفعال: این مسیر اتصال مستقیم می‌سازد و از پراکسی، مهلت‌ها و
+# استخر اتصال تنظیم شده روی بات عبور نمی‌کند؛ فقط وقتی Bot API بدون پراکسی در دسترس است فعال شود)
+STREAMING_UPLOAD_ENABLED = os.environ.get('STREAMING_UPLOAD_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# اندازه‌گیری افزایش RSS در طول هر آپلود
+STREAMING_UPLOAD_MEASURE_RSS = os.environ.get('STREAMING_UPLOAD_MEASURE_RSS', 'false').lower() in ('1', 'true', 'yes')
+# اندازه تکه‌های ارسال روی اتصال TLS (بایت)
+STREAM_CHUNK_SIZE = 256 * 1024
+# مهلت برقراری اتصال (ثانیه)
+STREAM_CONNECT_TIMEOUT = 30
+# مهلت ارسال و دریافت پاسخ (ثانیه)
+STREAM_UPLOAD_TIMEOUT = int(os.environ.get('STREAMING_UPLOAD_TIMEOUT', '600'))
+# فاصله نمونه‌برداری RSS (ثانیه)
+RSS_SAMPLE_INTERVAL = 0.02
+
+# آمار آپلودهای جریانی
+stats = {
+    'uploads': 0,
+    'failed': 0,
+    'bytes': 0,
+    'sendfile': 0,
+    'mmap': 0,
+    'last_rss_delta': 0,
+    'max_rss_delta': 0,
+}
+_stats_lock = threading.Lock()
+
+
+class BotAPIError(Exception):
+    """خطای برگردانده شده توسط Bot API"""
+
+    def __init__(self, description: str, error_code: int = 0):
+        super().__init__(description)
+        self.error_code = error_code
+
+
+def current_rss() -> int:
+    """
+    مصرف فعلی حافظه فیزیکی پردازه (بایت)
+
+    Returns:
+        RSS فعلی یا صفر اگر قابل اندازه‌گیری نباشد
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class RssSampler:
+    """نمونه‌برداری RSS در پس‌زمینه برای محاسبه بیشینه افزایش حافظه در یک بازه"""
+
+    def __init__(self, interval: float = RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        self.baseline = self.peak = current_rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+        return False
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    @property
+    def delta(self) -> int:
+        """بیشینه افزایش RSS نسبت به شروع بازه (بایت)"""
+        return max(0, self.peak - self.baseline)
+
+
+def _encode_value(value: Any) -> str:
+    """تبدیل پارامتر به رشته قابل ارسال در فرم (اشیای تلگرام به JSON)"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if hasattr(value, 'to_json'):
+        return value.to_json()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def build_multipart(fields: Dict[str, Any], file_field: str, file_name: str,
+                    boundary: str) -> Tuple[bytes, bytes]:
+    """
+    ساخت بخش‌های ابتدا و انتهای بدنه multipart (محتوای فایل بین این دو ارسال می‌شود)
+
+    Args:
+        fields: پارامترهای متنی درخواست
+        file_field: نام فیلد فایل (video، audio یا document)
+        file_name: نام فایل
+        boundary: مرز بخش‌های multipart
+
+    Returns:
+        (بایت‌های پیش از فایل, بایت‌های پس از فایل)
+    """
+    lines = []
+    for name, value in fields.items():
+        if value is None:
+            continue
+        lines.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                     f'{_encode_value(value)}\r\n')
+
+    content_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+    safe_name = file_name.replace('"', '')
+    lines.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+                 f'filename="{safe_name}"\r\nContent-Type: {content_type}\r\n\r\n')
+
+    preamble = ''.join(lines).encode('utf-8')
+    epilogue = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return preamble, epilogue
+
+
+def _send_file(sock, file_obj, file_size: int) -> str:
+    """
+    ارسال محتوای فایل روی سوکت
+
+    Returns:
+        روش استفاده شده (sendfile یا mmap)
+    """
+    if not hasattr(sock, 'version'):
+        # سوکت بدون TLS: ارسال مستقیم از کرنل
+        sock.sendfile(file_obj)
+        return 'sendfile'
+
+    with mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            for offset in range(0, file_size, STREAM_CHUNK_SIZE):
+                sock.sendall(view[offset:offset + STREAM_CHUNK_SIZE])
+        finally:
+            view.release()
+    return 'mmap'
+
+
+def _raise_api_error(data: Dict) -> None:
+    """تبدیل پاسخ خطای Bot API به استثنای مناسب (برای تصمیم‌گیری صف آپلود درباره تکرار)"""
+    error_code = data.get('error_code', 0)
+    description = data.get('description', 'Unknown error')
+    retry_after = (data.get('parameters') or {}).get('retry_after')
+
+    if error_code == 429 and retry_after is not None and RetryAfter is not None:
+        raise RetryAfter(retry_after)
+    if error_code >= 500 or error_code == 429:
+        raise ConnectionError(f"Bot API {error_code}: {description}")
+    raise BotAPIError(description, error_code)
+
+
+def upload_file(base_url: str, method: str, file_field: str, file_path: str,
+                params: Dict[str, Any], timeout: float = STREAM_UPLOAD_TIMEOUT) -> Dict:
+    """
+    ارسال فایل به یک متد Bot API با بدنه multipart جریانی
+
+    Args:
+        base_url: آدرس پایه بات شامل توکن (مثلاً https://api.telegram.org/bot<token>)
+        method: نام متد (sendVideo، sendAudio یا sendDocument)
+        file_field: نام فیلد فایل
+        file_path: مسیر فایل روی دیسک
+        params: سایر پارامترهای متد (chat_id، caption و ...)
+        timeout: مهلت ارسال و دریافت پاسخ
+
+    Returns:
+        دیکشنری result پاسخ Bot API (پیام ارسال شده)
+
+    Raises:
+        RetryAfter: در صورت محدودیت flood
+        ConnectionError / TimeoutError: خطاهای موقت شبکه یا سرور
+        BotAPIError: سایر خطاهای Bot API
+    """
+    url = urlsplit(f"{base_url}/{method}")
+    connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+    boundary = uuid.uuid4().hex
+    preamble, epilogue = build_multipart(params, file_field, os.path.basename(file_path), boundary)
+    file_size = os.path.getsize(file_path)
+
+    sampler = RssSampler() if STREAMING_UPLOAD_MEASURE_RSS else None
+    started = time.monotonic()
+    connection = connection_class(url.hostname, url.port, timeout=STREAM_CONNECT_TIMEOUT)
+    try:
+        with sampler or nullcontext():
+            connection.putrequest('POST', url.path)
+            connection.putheader('Content-Type', f'multipart/form-data; boundary={boundary}')
+            connection.putheader('Content-Length', str(len(preamble) + file_size + len(epilogue)))
+            connection.endheaders()
+            connection.sock.settimeout(timeout)
+
+            connection.sock.sendall(preamble)
+            with open(file_path, 'rb') as file_obj:
+                send_method = _send_file(connection.sock, file_obj, file_size)
+            connection.sock.sendall(epilogue)
+
+            response = connection.getresponse()
+            body = response.read()
+    except socket.timeout as e:
+        _record(False)
+        raise TimeoutError(f"مهلت آپلود جریانی به پایان رسید: {e}")
+    except (OSError, http.client.HTTPException) as e:
+        _record(False)
+        raise ConnectionError(f"خطای شبکه در آپلود جریانی: {e}")
+    finally:
+        connection.close()
+
+    try:
+        data = json.loads(body)
+    except ValueError:
+        _record(False)
+        raise ConnectionError(f"پاسخ نامعتبر از Bot API (HTTP {response.status})")
+
+    if not data.get('ok'):
+        _record(False)
+        _raise_api_error(data)
+
+    rss_delta = sampler.delta if sampler else None
+    _record(True, file_size, send_method, rss_delta)
+    elapsed = time.monotonic() - started
+    logger.info(f"آپلود جریانی {os.path.basename(file_path)} ({file_size / (1024 * 1024):.1f} MB) "
+                f"با {send_method} در {elapsed:.1f} ثانیه"
+                + (f"، افزایش RSS: {rss_delta / (1024 * 1024):.1f} MB" if rss_delta is not None else ""))
+    return data.get('result', {})
+
+
+def _record(success: bool, size: int = 0, send_method: str = '', rss_delta: Optional[int] = None) -> None:
+    with _stats_lock:
+        if not success:
+            stats['failed'] += 1
+            return
+        stats['uploads'] += 1
+        stats['bytes'] += size
+        stats[send_method] += 1
+        if rss_delta is not None:
+            stats['last_rss_delta'] = rss_delta
+            stats['max_rss_delta'] = max(stats['max_rss_delta'], rss_delta)
+
+
+def get_stats() -> Dict[str, int]:
+    """دریافت آمار آپلودهای جریانی"""
+    with _stats_lock:
+        return dict(stats)
+
+
+def get_base_url(bot) -> Optional[str]:
+    """
+    آدرس پایه Bot API شامل توکن از شیء بات (در هر دو نسخه کتابخانه)
+
+    Returns:
+        آدرس پایه یا None اگر قابل تشخیص نباشد
+    """
+    base_url = getattr(bot, 'base_url', None)
+    if isinstance(base_url, str) and base_url:
+        return base_url.rstrip('/')
+    return None
+
+
+# ---------- آزمایش مستقل ----------
+
+def _run_sink_server(port: int):
+    """سرور HTTP محلی که بدنه را می‌خواند و دور می‌ریزد"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class SinkHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+            payload = json.dumps({'ok': True, 'result': {'message_id': 1}}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), SinkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _buffered_upload(base_url: str, file_path: str) -> None:
+    """آپلود مرجع با خواندن کل فایل در حافظه (رفتار قبلی)"""
+    import urllib.request
+
+    boundary = uuid.uuid4().hex
+    preamble, epilogue = build_multipart({'chat_id': 1}, 'document', os.path.basename(file_path), boundary)
+    with open(file_path, 'rb') as f:
+        body = preamble + f.read() + epilogue
+    request = urllib.request.Request(f"{base_url}/sendDocument", data=body,
+                                     headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    with urllib.request.urlopen(request) as response:
+        response.read()
+
+
+def run_self_test(size_mb: int, port: int) -> Dict:
+    """مقایسه افزایش RSS آپلود جریانی و بافر شده روی سرور محلی"""
+    import tempfile
+
+    server = _run_sink_server(port)
+    base_url = f"http://127.0.0.1:{port}/botTEST"
+    fd, file_path = tempfile.mkstemp(suffix='.mp4')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            block = os.urandom(1024 * 1024)
+            for _ in range(size_mb):
+                f.write(block)
+
+        results = {}
+        for name, func in (('streaming', lambda: upload_file(base_url, 'sendDocument', 'document',
+                                                             file_path, {'chat_id': 1})),
+                           ('buffered', lambda: _buffered_upload(base_url, file_path))):
+            with RssSampler() as sampler:
+                started = time.monotonic()
+                func()
+            results[name] = {
+                'elapsed_s': round(time.monotonic() - started, 2),
+                'rss_delta_mb': round(sampler.delta / (1024 * 1024), 1),
+            }
+        return {'file_mb': size_mb, **results}
+    finally:
+        server.shutdown()
+        os.remove(file_path)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="آزمایش حافظه آپلود جریانی")
+    parser.add_argument('--self-test', action='store_true', help="مقایسه با آپلود بافر شده روی سرور محلی")
+    parser.add_argument('--size-mb', type=int, default=50, help="حجم فایل آزمایشی (مگابایت)")
+    parser.add_argument('--port', type=int, default=18081, help="پورت سرور محلی")
+    args = parser.parse_args()
+
+    if not args.self_test:
+        parser.error("فقط حالت --self-test پشتیبانی می‌شود")
+
+    print(json.dumps(run_self_test(args.size_mb, args.port), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
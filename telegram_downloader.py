@@ -44,7 +44,7 @@ import traceback
 import concurrent.futures
 from datetime import datetime
 from urllib.parse import urlparse
-from typing import Dict, List, Any, Optional, Tuple, Union
+from typing import Dict, List, Any, Callable, Optional, Tuple, Union
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # تنظیمات لاگینگ
@@ -215,6 +215,25 @@ except ImportError:
 except Exception as e:
     logger.error(f"خطا در بارگیری ماژول instagram_direct_downloader: {e}")
 
+# صف آپلود جدا از دانلود (هندلرها پس از آماده شدن فایل بلافاصله آزاد می‌شوند)
+from upload_pipeline import upload_pipeline
+from local_bot_api import get_max_upload_size, configure_application_builder, get_updater_kwargs
+from media_splitter import MEDIA_SPLIT_ENABLED, split_media
+from status_editor import StatusEditor, get_editor
+from webhook_server import WEBHOOK_MODE, start_webhook
+from handler_runtime import (add_handler, configure_builder, run_coroutine, offload_download,
+                             offload_transcode, download_executor, transcode_executor)
+from admission_control import admission_gate
+from instagram_carousel import deliver_carousel, deliver_carousel_sync, get_post, peek_post
+from prefetch_manager import prefetch_manager
+from fair_scheduler import fair_scheduler, CLASS_INTERACTIVE
+from playlist_engine import download_playlist, PLAYLIST_ITEMS
+from request_governor import install_requests_governor, request_governor
+from ffmpeg_runner import run_ffmpeg_async
+
+# همه درخواست‌های requests (instaloader، دانلودرهای مستقیم و yt-dlp) از کنترل‌کننده نرخ مشترک عبور می‌کنند
+install_requests_governor()
+
 """
 بخش 1: تنظیمات و ثابت‌ها
 """
@@ -339,7 +358,10 @@ STATUS_MESSAGES = {
     "complete": r"✅ عملیات با موفقیت انجام شد!",
     "format_select": r"📊 لطفاً کیفیت مورد نظر را انتخاب کنید:",
     "processing_audio": r"🎵 در حال استخراج صدا... لطفاً صبر کنید.",
-    "downloading_audio": r"🎵 در حال دانلود صدا... لطفاً صبر کنید."
+    "downloading_audio": r"🎵 در حال دانلود صدا... لطفاً صبر کنید.",
+    "splitting": r"✂️ فایل از حد مجاز تلگرام بزرگ‌تر است، در حال تقسیم به چند بخش...",
+    "converting": r"🎞 در حال تبدیل کیفیت ویدیو... لطفاً صبر کنید.",
+    "carousel": r"🖼 پست شامل {count} آیتم است، در حال ارسال آلبوم..."
 }
 
 # پیام‌های گزینه‌های دانلود
@@ -377,8 +399,8 @@ HTTP_HEADERS = {
     "Referer": "https://www.google.com/"
 }
 
-# محدودیت حجم فایل تلگرام (50 مگابایت)
-MAX_TELEGRAM_FILE_SIZE = 50 * 1024 * 1024  # 50 MB در بایت
+# محدودیت حجم فایل تلگرام (50 مگابایت، یا سقف سرور Bot API محلی در صورت فعال بودن)
+MAX_TELEGRAM_FILE_SIZE = get_max_upload_size()
 
 def create_youtube_cookies():
     """ایجاد فایل کوکی موقت برای یوتیوب"""
@@ -865,6 +887,14 @@ class InstagramDownloader:
                 
             logger.info(f"دانلود پست اینستاگرام با کد کوتاه: {shortcode}")
             
+            # پستی که هنگام بررسی پست چندتایی دریافت شده، بدون درخواست جدید به اینستاگرام
+            # از URL مستقیم ویدیوی همان پست دانلود می‌شود
+            if peek_post(shortcode) is not None:
+                logger.info(f"استفاده از اطلاعات پست دریافت شده برای دانلود مستقیم: {url}")
+                result = await self._download_with_direct_request(url, shortcode, quality)
+                if result:
+                    return result
+            
             # الویت با دانلود مستقیم با ماژول جدید است (حتی برای آزمایش)
             logger.info(f"شروع تلاش‌های دانلود برای اینستاگرام URL: {url}, کیفیت: {quality}")
             downloaded_file = None
@@ -903,7 +933,7 @@ class InstagramDownloader:
                     
                     # استفاده از run_in_executor
                     async_result = await loop.run_in_executor(
-                        None,
+                        download_executor,
                         lambda: download_instagram_content(url, output_dir, quality)
                     )
                     logger.info(f"نتیجه دانلود async: {async_result}")
@@ -963,11 +993,10 @@ class InstagramDownloader:
             # تنظیم مسیر خروجی
             self.loader.dirname_pattern = temp_dir
             
-            # دانلود پست
-            post = instaloader.Post.from_shortcode(self.loader.context, shortcode)
-            
-            # برای احترام به محدودیت اینستاگرام، مکث کوتاه
-            await asyncio.sleep(1)
+            # دانلود پست (پست بررسی شده در مسیر پست چندتایی دوباره دریافت نمی‌شود)
+            # درخواست‌های instaloader در پول دانلود اجرا می‌شوند تا انتظار کنترل نرخ loop را مسدود نکند
+            post = await offload_download(
+                lambda: get_post(shortcode) or instaloader.Post.from_shortcode(self.loader.context, shortcode))
             
             # بررسی اگر پست ویدیویی است
             if not post.is_video:
@@ -976,7 +1005,7 @@ class InstagramDownloader:
                 return None
                 
             # دانلود ویدیو
-            self.loader.download_post(post, target=shortcode)
+            await offload_download(self.loader.download_post, post, target=shortcode)
             
             # یافتن فایل ویدیوی دانلود شده
             video_files = [f for f in os.listdir(temp_dir) if f.endswith('.mp4')]
@@ -1005,7 +1034,7 @@ class InstagramDownloader:
                 try:
                     logger.info(f"تبدیل کیفیت ویدیو به {quality}...")
                     from telegram_fixes import convert_video_quality
-                    converted_path = convert_video_quality(original_path, quality, is_audio_request=False)
+                    converted_path = await offload_transcode(convert_video_quality, original_path, quality, is_audio_request=False)
                     if converted_path and os.path.exists(converted_path):
                         final_path = converted_path
                         logger.info(f"تبدیل کیفیت ویدیو به {quality} موفقیت‌آمیز بود: {final_path}")
@@ -1028,15 +1057,26 @@ class InstagramDownloader:
             return None
             
         except instaloader.exceptions.ConnectionException as e:
+            # TooManyRequestsException زیرکلاس همین خطاست و نرخ سطل اینستاگرام را کاهش می‌دهد
+            request_governor.report_exception(url, e)
             logger.error(f"خطای اتصال در دانلود با instaloader: {str(e)}")
             return None
             
         except Exception as e:
+            request_governor.report_exception(url, e)
             logger.error(f"خطا در دانلود با instaloader: {str(e)}")
             return None
             
-    async def _download_with_ytdlp(self, url: str, shortcode: str, quality: str) -> Optional[str]:
-        """روش دانلود با استفاده از yt-dlp با بهینه‌سازی برای اینستاگرام"""
+    async def _download_with_ytdlp(self, url: str, shortcode: str, quality: str,
+                                   progress_hook: Optional[Callable] = None,
+                                   extra_opts: Optional[Dict] = None) -> Optional[str]:
+        """
+        روش دانلود با استفاده از yt-dlp با بهینه‌سازی برای اینستاگرام
+        
+        Args:
+            progress_hook: hook پیشرفت (برای پیام وضعیت یا لغو دانلود پیش‌دستانه)
+            extra_opts: تنظیمات اضافه yt-dlp برای همه روش‌ها (مثلاً سقف سرعت و حجم دانلود پیش‌دستانه)
+        """
         try:
             # تنظیمات yt-dlp
             ext = 'mp4'
@@ -1117,27 +1157,34 @@ class InstagramDownloader:
                 # استفاده از کوکی‌های رندوم برای جلوگیری از محدودیت نرخ درخواست
                 'cookiefile': None,
                 'cookiesfrombrowser': None,
-                # تنظیمات پیشرفته‌تر
-                'sleep_interval': 1,  # فاصله زمانی بین درخواست‌ها
-                'max_sleep_interval': 5,  # حداکثر فاصله زمانی
+                # تنظیمات پیشرفته‌تر (فاصله بین درخواست‌ها توسط request_governor کنترل می‌شود)
                 'force_generic_extractor': False,  # استفاده از استخراج‌کننده تخصصی
             }
             
+            # گزارش پیشرفت دانلود به پیام وضعیت
+            if progress_hook:
+                ydl_opts['progress_hooks'] = [progress_hook]
+            if extra_opts:
+                ydl_opts.update(extra_opts)
+            
             # اجرا در thread pool با کنترل خطا
-            loop = asyncio.get_event_loop()
             download_success = False
             
             # روش 1: استفاده اصلی با تنظیمات بهینه
             try:
                 logger.info(f"شروع دانلود اینستاگرام با yt-dlp و تنظیمات پیشرفته: {url[:30]}")
                 with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    await loop.run_in_executor(None, ydl.download, [url])
+                    await offload_download(ydl.download, [url])
                     
                 # بررسی موفقیت دانلود
                 if os.path.exists(final_path) and os.path.getsize(final_path) > 0:
                     download_success = True
                     logger.info(f"دانلود با روش اصلی موفق: {os.path.getsize(final_path)} بایت")
+            except yt_dlp.utils.DownloadCancelled:
+                # لغو از طریق progress hook؛ روش‌های جایگزین نباید دانلود را دوباره شروع کنند
+                raise
             except Exception as e:
+                request_governor.report_exception(url, e)
                 logger.warning(f"خطا در دانلود اینستاگرام با yt-dlp: {e}, تلاش با روش جایگزین...")
             
             # روش 2: استفاده از تنظیمات جایگزین با User-Agent متفاوت
@@ -1151,13 +1198,16 @@ class InstagramDownloader:
                     fallback_ydl_opts['http_headers']['User-Agent'] = fallback_ydl_opts['user_agent']
                     
                     with yt_dlp.YoutubeDL(fallback_ydl_opts) as ydl:
-                        await loop.run_in_executor(None, ydl.download, [url])
+                        await offload_download(ydl.download, [url])
                     
                     # بررسی موفقیت دانلود با روش جایگزین
                     if os.path.exists(final_path) and os.path.getsize(final_path) > 0:
                         download_success = True
                         logger.info(f"دانلود با روش جایگزین اول موفق: {os.path.getsize(final_path)} بایت")
+                except yt_dlp.utils.DownloadCancelled:
+                    raise
                 except Exception as fallback_error:
+                    request_governor.report_exception(url, fallback_error)
                     logger.warning(f"خطا در روش جایگزین اول: {fallback_error}")
             
             # روش 3: استفاده از حالت اندروید با تنظیمات مینیمال
@@ -1177,15 +1227,20 @@ class InstagramDownloader:
                         },
                         'ffmpeg_location': '/nix/store/3zc5jbvqzrn8zmva4fx5p0nh4yy03wk4-ffmpeg-6.1.1-bin/bin/ffmpeg',
                     }
+                    if progress_hook:
+                        android_ydl_opts['progress_hooks'] = [progress_hook]
+                    if extra_opts:
+                        android_ydl_opts.update(extra_opts)
                     
                     with yt_dlp.YoutubeDL(android_ydl_opts) as ydl:
-                        await loop.run_in_executor(None, ydl.download, [url])
+                        await offload_download(ydl.download, [url])
                     
                     # بررسی موفقیت دانلود با روش جایگزین
                     if os.path.exists(final_path) and os.path.getsize(final_path) > 0:
                         download_success = True
                         logger.info(f"دانلود با روش جایگزین دوم موفق: {os.path.getsize(final_path)} بایت")
                 except Exception as android_error:
+                    request_governor.report_exception(url, android_error)
                     logger.warning(f"خطا در روش جایگزین دوم: {android_error}")
                         
             # پردازش فایل دانلود شده برای تبدیل کیفیت اگر موفق بودیم
@@ -1195,7 +1250,7 @@ class InstagramDownloader:
                     try:
                         from telegram_fixes import convert_video_quality
                         logger.info(f"تبدیل کیفیت ویدیو به {quality}...")
-                        converted_path = convert_video_quality(final_path, quality, is_audio_request=False)
+                        converted_path = await offload_transcode(convert_video_quality, final_path, quality, is_audio_request=False)
                         if converted_path and os.path.exists(converted_path):
                             logger.info(f"تبدیل کیفیت ویدیو به {quality} موفقیت‌آمیز بود: {converted_path}")
                             # جایگزینی فایل نهایی
@@ -1210,7 +1265,7 @@ class InstagramDownloader:
                         try:
                             from audio_processing import extract_audio
                             logger.info(f"تبدیل ویدیو به صوت: {final_path}")
-                            audio_path = extract_audio(final_path, 'mp3', '192k')
+                            audio_path = await offload_transcode(extract_audio, final_path, 'mp3', '192k')
                             if audio_path and os.path.exists(audio_path):
                                 final_path = audio_path
                                 logger.info(f"تبدیل ویدیو به صوت موفق: {audio_path}")
@@ -1226,6 +1281,9 @@ class InstagramDownloader:
                 logger.warning(f"فایل دانلود شده با همه روش‌ها خالی یا ناقص است")
                 return None
                 
+        except yt_dlp.utils.DownloadCancelled as e:
+            logger.info(f"دانلود yt-dlp لغو شد: {e}")
+            return None
         except Exception as e:
             logger.error(f"خطا در دانلود با yt-dlp: {str(e)}")
             return None
@@ -1236,63 +1294,73 @@ class InstagramDownloader:
             # ابتدا باید URL مستقیم ویدیو را پیدا کنیم
             video_url = None
             
+            # اگر پست هنگام بررسی پست چندتایی دریافت شده، از همان URL ویدیو استفاده می‌کنیم
+            cached_post = peek_post(shortcode)
+            if cached_post is not None and getattr(cached_post, 'video_url', None):
+                video_url = cached_post.video_url
+                logger.info("URL مستقیم از پست دریافت شده قبلی استفاده شد")
+            
             # روش 1: استفاده از yt-dlp برای استخراج URL مستقیم (بدون دانلود)
-            try:
-                logger.info(f"تلاش برای استخراج URL مستقیم با yt-dlp: {url}")
-                ydl_opts = {
-                    'format': 'best',
-                    'quiet': True,
-                    'no_warnings': True,
-                    'skip_download': True,  # فقط اطلاعات را استخراج کن، دانلود نکن
-                    'dump_single_json': True,
-                    'user_agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 15_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.0 Mobile/15E148 Safari/604.1',
-                    'http_headers': {
-                        'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 15_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.0 Mobile/15E148 Safari/604.1',
-                        'Accept': '*/*',
-                        'Accept-Language': 'en-US,en;q=0.5',
-                        'Origin': 'https://www.instagram.com',
-                        'Referer': 'https://www.instagram.com/',
+            if not video_url:
+                try:
+                    logger.info(f"تلاش برای استخراج URL مستقیم با yt-dlp: {url}")
+                    ydl_opts = {
+                        'format': 'best',
+                        'quiet': True,
+                        'no_warnings': True,
+                        'skip_download': True,  # فقط اطلاعات را استخراج کن، دانلود نکن
+                        'dump_single_json': True,
+                        'user_agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 15_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.0 Mobile/15E148 Safari/604.1',
+                        'http_headers': {
+                            'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 15_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.0 Mobile/15E148 Safari/604.1',
+                            'Accept': '*/*',
+                            'Accept-Language': 'en-US,en;q=0.5',
+                            'Origin': 'https://www.instagram.com',
+                            'Referer': 'https://www.instagram.com/',
+                        }
                     }
-                }
                 
-                # استفاده از فانکشن extract_info برای دریافت اطلاعات بدون دانلود
-                loop = asyncio.get_event_loop()
+                    # استفاده از فانکشن extract_info برای دریافت اطلاعات بدون دانلود
+                    loop = asyncio.get_event_loop()
                 
-                def get_video_info():
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        return ydl.extract_info(url, download=False)
-                
-                info = await loop.run_in_executor(None, get_video_info)
-                
-                # بررسی اطلاعات استخراج شده
-                if info and 'url' in info:
-                    video_url = info['url']
-                    logger.info(f"URL مستقیم با yt-dlp پیدا شد")
-                elif info and 'formats' in info and info['formats']:
-                    # انتخاب بهترین فرمت
-                    best_format = None
-                    for fmt in info['formats']:
-                        if fmt.get('vcodec', 'none') != 'none' and fmt.get('acodec', 'none') != 'none':
-                            if best_format is None or fmt.get('height', 0) > best_format.get('height', 0):
-                                best_format = fmt
+                    def get_video_info():
+                        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                            return ydl.extract_info(url, download=False)
+                
+                    info = await loop.run_in_executor(download_executor, get_video_info)
+                
+                    # بررسی اطلاعات استخراج شده
+                    if info and 'url' in info:
+                        video_url = info['url']
+                        logger.info(f"URL مستقیم با yt-dlp پیدا شد")
+                    elif info and 'formats' in info and info['formats']:
+                        # انتخاب بهترین فرمت
+                        best_format = None
+                        for fmt in info['formats']:
+                            if fmt.get('vcodec', 'none') != 'none' and fmt.get('acodec', 'none') != 'none':
+                                if best_format is None or fmt.get('height', 0) > best_format.get('height', 0):
+                                    best_format = fmt
                     
-                    if best_format and 'url' in best_format:
-                        video_url = best_format['url']
-                        logger.info(f"URL مستقیم از فرمت‌های موجود انتخاب شد: {best_format.get('format_id', 'نامشخص')}")
-            except Exception as e_ytdlp:
-                logger.warning(f"خطا در استخراج URL مستقیم با yt-dlp: {e_ytdlp}")
+                        if best_format and 'url' in best_format:
+                            video_url = best_format['url']
+                            logger.info(f"URL مستقیم از فرمت‌های موجود انتخاب شد: {best_format.get('format_id', 'نامشخص')}")
+                except Exception as e_ytdlp:
+                    request_governor.report_exception(url, e_ytdlp)
+                    logger.warning(f"خطا در استخراج URL مستقیم با yt-dlp: {e_ytdlp}")
             
             # روش 2: استفاده از instaloader اگر yt-dlp موفق نبود
             if not video_url:
                 try:
                     logger.info(f"تلاش برای استخراج URL مستقیم با instaloader: {shortcode}")
-                    post = instaloader.Post.from_shortcode(self.loader.context, shortcode)
+                    post = await offload_download(
+                        lambda: get_post(shortcode) or instaloader.Post.from_shortcode(self.loader.context, shortcode))
                     if hasattr(post, 'video_url') and post.video_url:
                         video_url = post.video_url
                         logger.info("URL مستقیم با instaloader پیدا شد")
                     else:
                         logger.warning("URL ویدیو با instaloader یافت نشد")
                 except Exception as e_insta:
+                    request_governor.report_exception(url, e_insta)
                     logger.warning(f"خطا در یافتن URL مستقیم با instaloader: {e_insta}")
             
             # روش 3: پارس کردن صفحه
@@ -1407,7 +1475,7 @@ class InstagramDownloader:
                             logger.warning(f"خطا در دانلود فایل (تلاش {attempt+1}): {e}")
                             return False
                     
-                    success = await loop.run_in_executor(None, download_file)
+                    success = await loop.run_in_executor(download_executor, download_file)
                     
                     if success:
                         logger.info(f"دانلود موفق در تلاش {attempt+1}")
@@ -1431,7 +1499,8 @@ class InstagramDownloader:
                     try:
                         from telegram_fixes import convert_video_quality
                         logger.info(f"تبدیل کیفیت ویدیو دانلود شده به {quality}...")
-                        converted_path = convert_video_quality(final_path, quality, is_audio_request=False)
+                        converted_path = await offload_transcode(convert_video_quality, final_path, quality,
+                                                                 is_audio_request=False)
                         if converted_path and os.path.exists(converted_path):
                             final_path = converted_path
                     except Exception as conv_error:
@@ -1441,7 +1510,7 @@ class InstagramDownloader:
                     try:
                         from audio_processing import extract_audio
                         logger.info("استخراج صدا از ویدیو...")
-                        audio_path = extract_audio(final_path, 'mp3', '192k')
+                        audio_path = await offload_transcode(extract_audio, final_path, 'mp3', '192k')
                         if audio_path and os.path.exists(audio_path):
                             final_path = audio_path
                     except Exception as audio_error:
@@ -1578,9 +1647,8 @@ class YouTubeDownloader:
             }
             
             # اجرای yt-dlp برای دریافت اطلاعات
-            loop = asyncio.get_event_loop()
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = await loop.run_in_executor(None, ydl.extract_info, clean_url, True)
+                info = await offload_download(ydl.extract_info, clean_url, True)
                 
             if not info:
                 logger.error(f"اطلاعات ویدیو دریافت نشد: {clean_url}")
@@ -1589,6 +1657,7 @@ class YouTubeDownloader:
             return info
             
         except Exception as e:
+            request_governor.report_exception(url, e)
             logger.error(f"خطا در دریافت اطلاعات ویدیوی یوتیوب: {str(e)}")
             return None
             
@@ -1623,7 +1692,7 @@ class YouTubeDownloader:
                 options = [
                     {
                         "id": "youtube_playlist_hd", 
-                        "label": "دانلود 3 ویدیوی اول پلی‌لیست (720p)", 
+                        "label": f"دانلود ویدیوهای {PLAYLIST_ITEMS} پلی‌لیست (720p)", 
                         "quality": "720p", 
                         "format": "best[height<=720]",
                         "display_name": "پلی‌لیست - کیفیت HD",
@@ -1632,7 +1701,7 @@ class YouTubeDownloader:
                     },
                     {
                         "id": "youtube_playlist_sd", 
-                        "label": "دانلود 3 ویدیوی اول پلی‌لیست (480p)", 
+                        "label": f"دانلود ویدیوهای {PLAYLIST_ITEMS} پلی‌لیست (480p)", 
                         "quality": "480p", 
                         "format": "best[height<=480]",
                         "display_name": "پلی‌لیست - کیفیت متوسط",
@@ -1641,7 +1710,7 @@ class YouTubeDownloader:
                     },
                     {
                         "id": "youtube_playlist_audio", 
-                        "label": "دانلود صدای 3 ویدیوی اول پلی‌لیست", 
+                        "label": f"دانلود صدای ویدیوهای {PLAYLIST_ITEMS} پلی‌لیست", 
                         "quality": "audio", 
                         "format": "bestaudio[ext=m4a]",
                         "display_name": "پلی‌لیست - فقط صدا",
@@ -1778,13 +1847,18 @@ class YouTubeDownloader:
             logger.error(f"جزئیات خطا: {traceback.format_exc()}")
             return []
             
-    async def download_video(self, url: str, format_option: str) -> Optional[str]:
+    async def download_video(self, url: str, format_option: str,
+                             progress_hook: Optional[Callable] = None, user_id: Optional[int] = None,
+                             playlist_items: Optional[str] = None) -> Optional[str]:
         """
         دانلود ویدیوی یوتیوب
         
         Args:
             url: آدرس ویدیوی یوتیوب
             format_option: فرمت انتخاب شده برای دانلود
+            progress_hook: hook پیشرفت yt-dlp (اختیاری)
+            user_id: شناسه کاربر برای نوبت‌دهی منصفانه دانلود ویدیوهای پلی‌لیست
+            playlist_items: محدوده ویدیوهای پلی‌لیست (پیش‌فرض PLAYLIST_ITEMS)
             
         Returns:
             مسیر فایل دانلود شده یا None در صورت خطا
@@ -1823,6 +1897,8 @@ class YouTubeDownloader:
             
             # تنظیمات دانلود
             ydl_opts = self.ydl_opts.copy()
+            if progress_hook:
+                ydl_opts['progress_hooks'] = [progress_hook]
             
             if is_audio_only:
                 try:
@@ -1837,19 +1913,17 @@ class YouTubeDownloader:
                         'outtmpl': output_path.replace('.mp3', '.%(ext)s'),
                     })
                     
-                    # دانلود با yt-dlp - بدون استفاده از loop
+                    # دانلود با yt-dlp در پول دانلود (بدون مسدود کردن event loop)
                     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
                         try:
                             # روش مستقیم
-                            ydl.download([clean_url])
+                            await offload_download(ydl.download, [clean_url])
                         except Exception as e1:
+                            request_governor.report_exception(clean_url, e1)
                             logger.error(f"خطا در دانلود صوتی با روش اول: {e1}")
-                            # روش با ترد جدا
+                            # تلاش دوباره با مهلت
                             try:
-                                import threading
-                                download_thread = threading.Thread(target=ydl.download, args=([clean_url],))
-                                download_thread.start()
-                                download_thread.join(timeout=30) # انتظار حداکثر 30 ثانیه
+                                await asyncio.wait_for(offload_download(ydl.download, [clean_url]), timeout=30)  # انتظار حداکثر 30 ثانیه
                             except Exception as e2:
                                 logger.error(f"خطا در دانلود صوتی با روش دوم: {e2}")
                         
@@ -1865,15 +1939,13 @@ class YouTubeDownloader:
                         with yt_dlp.YoutubeDL(video_ydl_opts) as ydl:
                             try:
                                 # روش مستقیم
-                                ydl.download([clean_url])
+                                await offload_download(ydl.download, [clean_url])
                             except Exception as e1:
+                                request_governor.report_exception(clean_url, e1)
                                 logger.error(f"خطا در دانلود ویدیو با روش اول: {e1}")
-                                # روش با ترد جداگانه
+                                # تلاش دوباره با مهلت
                                 try:
-                                    import threading
-                                    download_thread = threading.Thread(target=ydl.download, args=([clean_url],))
-                                    download_thread.start()
-                                    download_thread.join(timeout=30)  # انتظار حداکثر 30 ثانیه
+                                    await asyncio.wait_for(offload_download(ydl.download, [clean_url]), timeout=30)  # انتظار حداکثر 30 ثانیه
                                 except Exception as e2:
                                     logger.error(f"خطا در دانلود ویدیو با روش دوم: {e2}")
                             
@@ -1882,7 +1954,7 @@ class YouTubeDownloader:
                         if os.path.exists(video_path):
                             try:
                                 from audio_processing import extract_audio
-                                audio_path = extract_audio(video_path, 'mp3', '192k')
+                                audio_path = await offload_transcode(extract_audio, video_path, 'mp3', '192k')
                                 if audio_path:
                                     shutil.move(audio_path, output_path)
                                     os.remove(video_path)
@@ -1890,7 +1962,7 @@ class YouTubeDownloader:
                                 logger.warning("ماژول audio_processing یافت نشد")
                                 try:
                                     from telegram_fixes import extract_audio_from_video
-                                    audio_path = extract_audio_from_video(video_path, 'mp3', '192k')
+                                    audio_path = await offload_transcode(extract_audio_from_video, video_path, 'mp3', '192k')
                                     if audio_path:
                                         shutil.move(audio_path, output_path)
                                         os.remove(video_path)
@@ -1970,46 +2042,12 @@ class YouTubeDownloader:
                 
             # بررسی پلی‌لیست
             if is_youtube_playlist(clean_url):
-                ydl_opts.update({
-                    'noplaylist': False,
-                    'playlist_items': '1-3',  # دانلود حداکثر 3 ویدیوی اول
-                })
-                
-                # اگر پلی‌لیست باشد، مسیر خروجی را تغییر می‌دهیم
-                playlist_id = re.search(r'list=([A-Za-z0-9_-]+)', clean_url).group(1)
-                playlist_dir = os.path.join(TEMP_DOWNLOAD_DIR, f'playlist_{playlist_id}_{uuid.uuid4().hex[:8]}')
-                os.makedirs(playlist_dir, exist_ok=True)
-                
-                ydl_opts['outtmpl'] = os.path.join(playlist_dir, '%(playlist_index)s-%(title)s.%(ext)s')
-                
-                # دانلود ویدیوها
-                loop = asyncio.get_event_loop()
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    await loop.run_in_executor(None, ydl.download, [clean_url])
-                    
-                # ایجاد فایل zip از ویدیوهای دانلود شده
-                zip_filename = f"playlist_{playlist_id}.zip"
-                zip_path = get_unique_filename(TEMP_DOWNLOAD_DIR, zip_filename)
-                
-                # لیست فایل‌های دانلود شده
-                downloaded_files = [os.path.join(playlist_dir, f) for f in os.listdir(playlist_dir) 
-                                  if os.path.isfile(os.path.join(playlist_dir, f))]
-                
-                # لاگ تعداد فایل‌های دانلود شده
-                logger.info(f"تعداد {len(downloaded_files)} فایل از پلی‌لیست دانلود شد.")
-                
-                if not downloaded_files:
+                # استخراج فهرست با extract_flat، دانلود همزمان ویدیوها و افزودن تدریجی به ZIP بدون فشرده‌سازی
+                zip_path = await download_playlist(clean_url, ydl_opts, TEMP_DOWNLOAD_DIR,
+                                                   user_id=user_id or 0, items=playlist_items)
+                if not zip_path:
                     logger.error(f"هیچ فایلی از پلی‌لیست دانلود نشد: {clean_url}")
                     return None
-                    
-                # ایجاد فایل zip
-                import zipfile
-                with zipfile.ZipFile(zip_path, 'w') as zipf:
-                    for file in downloaded_files:
-                        zipf.write(file, os.path.basename(file))
-                        
-                # پاکسازی دایرکتوری موقت
-                shutil.rmtree(playlist_dir, ignore_errors=True)
                 
                 # افزودن به کش
                 add_to_cache(cache_key, zip_path)
@@ -2017,19 +2055,17 @@ class YouTubeDownloader:
                 return zip_path
                 
             else:
-                # دانلود ویدیو - بدون استفاده از loop
+                # دانلود ویدیو در پول دانلود (بدون مسدود کردن event loop)
                 with yt_dlp.YoutubeDL(ydl_opts) as ydl:
                     try:
                         # روش مستقیم
-                        ydl.download([clean_url])
+                        await offload_download(ydl.download, [clean_url])
                     except Exception as e1:
+                        request_governor.report_exception(clean_url, e1)
                         logger.error(f"خطا در دانلود ویدیو با روش اول: {e1}")
-                        # روش با ترد جداگانه
+                        # تلاش دوباره با مهلت
                         try:
-                            import threading
-                            download_thread = threading.Thread(target=ydl.download, args=([clean_url],))
-                            download_thread.start()
-                            download_thread.join(timeout=30)  # انتظار حداکثر 30 ثانیه
+                            await asyncio.wait_for(offload_download(ydl.download, [clean_url]), timeout=30)  # انتظار حداکثر 30 ثانیه
                         except Exception as e2:
                             logger.error(f"خطا در دانلود ویدیو با روش دوم: {e2}")
                     
@@ -2056,7 +2092,7 @@ class YouTubeDownloader:
                     try:
                         logger.info(f"تبدیل کیفیت ویدیو به {quality}...")
                         from telegram_fixes import convert_video_quality
-                        converted_path = convert_video_quality(output_path, quality, is_audio_request=False)
+                        converted_path = await offload_transcode(convert_video_quality, output_path, quality, is_audio_request=False)
                         if converted_path and os.path.exists(converted_path):
                             logger.info(f"تبدیل کیفیت موفق: {converted_path}")
                             output_path = converted_path
@@ -2073,6 +2109,7 @@ class YouTubeDownloader:
                 return output_path
                 
         except Exception as e:
+            request_governor.report_exception(url, e)
             logger.error(f"خطا در دانلود ویدیوی یوتیوب: {str(e)}")
             return None
 
@@ -2326,6 +2363,17 @@ async def process_instagram_url(update: Update, context, url: str, status_messag
     # تنظیم متغیر کلاس برای استفاده در هندلرهای دکمه
     context.bot_data['direct_download_available'] = direct_download_available
     try:
+        # پست‌های چندتایی و عکسی بدون انتخاب کیفیت در قالب آلبوم ارسال می‌شوند
+        async def on_carousel_queued(count: int) -> None:
+            await status_message.edit_text(STATUS_MESSAGES["carousel"].format(count=count))
+        
+        async def on_carousel_done(success: bool) -> None:
+            await status_message.edit_text(STATUS_MESSAGES["complete"] if success else ERROR_MESSAGES["telegram_upload"])
+        
+        if await deliver_carousel(context.bot, update.effective_chat.id, url,
+                                  on_queued=on_carousel_queued, on_done=on_carousel_done):
+            return
+        
         # ایجاد دانلودر اینستاگرام
         downloader = InstagramDownloader()
         
@@ -2584,7 +2632,11 @@ async def handle_download_option(update: Update, context) -> None:
     هندلر انتخاب گزینه دانلود توسط کاربر
     """
     query = update.callback_query
-    await query.answer()
+    try:
+        await query.answer()
+    except Exception as e:
+        # کالبک‌هایی که در صف پذیرش منتظر مانده‌اند ممکن است منقضی شده باشند
+        logger.debug(f"خطا در پاسخ به کالبک: {e}")
     
     # استخراج اطلاعات کالبک
     callback_data = query.data
@@ -2605,7 +2657,7 @@ async def handle_download_option(update: Update, context) -> None:
         parts = callback_data.split('_')
         if len(parts) < 4:
             logger.warning(f"فرمت نامعتبر کالبک: {callback_data}")
-            await query.edit_message_text(ERROR_MESSAGES["generic_error"])
+            await _edit_status(query, ERROR_MESSAGES["generic_error"])
             return
             
         # استخراج نوع دانلود (اینستاگرام/یوتیوب)، گزینه و شناسه URL
@@ -2688,18 +2740,18 @@ async def handle_download_option(update: Update, context) -> None:
                 
             # اگر همچنان URL پیدا نشد، نمایش پیام خطا
             if not url:
-                await query.edit_message_text(ERROR_MESSAGES["url_expired"])
+                await _edit_status(query, ERROR_MESSAGES["url_expired"])
                 return
         
         # ارسال پیام در حال دانلود
-        await query.edit_message_text(STATUS_MESSAGES["downloading"])
+        await _edit_status(query, STATUS_MESSAGES["downloading"])
         
         # بررسی اگر کالبک مربوط به دکمه "فقط صدا" است
         if download_type == "audio" or option_id == "audio" or "audio" in callback_data or (download_type == "ig" and option_id == "audio"):
             logger.info(f"درخواست دانلود صوتی تشخیص داده شد برای URL: {url[:30]}...")
             
             # ارسال پیام در حال پردازش صدا
-            await query.edit_message_text(STATUS_MESSAGES["processing_audio"])
+            await _edit_status(query, STATUS_MESSAGES["processing_audio"])
             
             # تشخیص نوع URL (اینستاگرام یا یوتیوب)
             if is_instagram_url(url):
@@ -2721,14 +2773,14 @@ async def handle_download_option(update: Update, context) -> None:
                         try:
                             # تلاش اول با ماژول audio_processing
                             from audio_processing import extract_audio
-                            audio_path = extract_audio(downloaded_file, 'mp3', '192k')
+                            audio_path = await offload_transcode(extract_audio, downloaded_file, 'mp3', '192k')
                             logger.info(f"تبدیل با ماژول audio_processing: {audio_path}")
                         except ImportError:
                             logger.warning("ماژول audio_processing یافت نشد، تلاش با audio_extractor")
                             try:
                                 # تلاش دوم با ماژول audio_extractor
                                 from audio_processing.audio_extractor import extract_audio
-                                audio_path = extract_audio(downloaded_file, 'mp3', '192k')
+                                audio_path = await offload_transcode(extract_audio, downloaded_file, 'mp3', '192k')
                                 logger.info(f"تبدیل با ماژول audio_extractor: {audio_path}")
                             except ImportError:
                                 logger.warning("ماژول audio_extractor نیز یافت نشد")
@@ -2738,7 +2790,7 @@ async def handle_download_option(update: Update, context) -> None:
                             logger.info("تلاش با ماژول telegram_fixes...")
                             try:
                                 from telegram_fixes import extract_audio_from_video
-                                audio_path = extract_audio_from_video(downloaded_file, 'mp3', '192k')
+                                audio_path = await offload_transcode(extract_audio_from_video, downloaded_file, 'mp3', '192k')
                                 logger.info(f"تبدیل با ماژول telegram_fixes: {audio_path}")
                             except (ImportError, Exception) as e:
                                 logger.error(f"خطا در استفاده از ماژول telegram_fixes: {str(e)}")
@@ -2767,14 +2819,8 @@ async def handle_download_option(update: Update, context) -> None:
                             
                             try:
                                 # اجرای FFmpeg
-                                import subprocess
                                 logger.info(f"اجرای دستور FFmpeg: {' '.join(cmd)}")
-                                result = subprocess.run(
-                                    cmd,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                    text=True
-                                )
+                                result = await run_ffmpeg_async(cmd)
                                 
                                 if result.returncode != 0:
                                     logger.error(f"خطا در اجرای FFmpeg: {result.stderr}")
@@ -2789,23 +2835,15 @@ async def handle_download_option(update: Update, context) -> None:
                         # بررسی نتیجه نهایی
                         if not audio_path or not os.path.exists(audio_path):
                             logger.error("تمام روش‌های استخراج صدا ناموفق بودند")
-                            await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+                            await _edit_status(query, ERROR_MESSAGES["download_failed"])
                             return
                     
-                    # ارسال فایل صوتی
-                    await query.edit_message_text(STATUS_MESSAGES["uploading"])
+                    # ارسال فایل صوتی از طریق صف آپلود
                     file_size = os.path.getsize(audio_path)
-                    
-                    with open(audio_path, 'rb') as audio_file:
-                        caption = f"🎵 صدای دانلود شده از اینستاگرام\n💾 حجم: {human_readable_size(file_size)}"
-                        await context.bot.send_audio(
-                            chat_id=update.effective_chat.id,
-                            audio=audio_file,
-                            caption=caption
-                        )
-                    await query.edit_message_text(STATUS_MESSAGES["complete"])
+                    caption = f"🎵 صدای دانلود شده از اینستاگرام\n💾 حجم: {human_readable_size(file_size)}"
+                    await enqueue_upload(update, context, query, audio_path, "audio", caption)
                 else:
-                    await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+                    await _edit_status(query, ERROR_MESSAGES["download_failed"])
                 
                 return
                 
@@ -2839,7 +2877,7 @@ async def handle_download_option(update: Update, context) -> None:
                     info = await youtube_dl.get_video_info(url)
                     
                     if not info:
-                        await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+                        await _edit_status(query, ERROR_MESSAGES["download_failed"])
                         return
                         
                     video_id = info.get('id', 'video')
@@ -2848,7 +2886,7 @@ async def handle_download_option(update: Update, context) -> None:
                     
                     # اجرای دانلود
                     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        await loop.run_in_executor(None, ydl.download, [url])
+                        await loop.run_in_executor(download_executor, ydl.download, [url])
                     
                     # ممکن است فایل با فرمت دیگری ذخیره شده باشد
                     if not os.path.exists(output_path):
@@ -2859,31 +2897,23 @@ async def handle_download_option(update: Update, context) -> None:
                                 break
                     
                     if os.path.exists(output_path):
-                        # ارسال فایل صوتی
-                        await query.edit_message_text(STATUS_MESSAGES["uploading"])
+                        # ارسال فایل صوتی از طریق صف آپلود
                         file_size = os.path.getsize(output_path)
-                        
-                        with open(output_path, 'rb') as audio_file:
-                            caption = f"🎵 صدای دانلود شده از یوتیوب\n🎵 {title}\n💾 حجم: {human_readable_size(file_size)}"
-                            await context.bot.send_audio(
-                                chat_id=update.effective_chat.id,
-                                audio=audio_file,
-                                caption=caption
-                            )
-                        await query.edit_message_text(STATUS_MESSAGES["complete"])
+                        caption = f"🎵 صدای دانلود شده از یوتیوب\n🎵 {title}\n💾 حجم: {human_readable_size(file_size)}"
+                        await enqueue_upload(update, context, query, output_path, "audio", caption)
                     else:
                         logger.error(f"فایل صوتی دانلود شده یافت نشد: {output_path}")
-                        await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+                        await _edit_status(query, ERROR_MESSAGES["download_failed"])
                 
                 except Exception as e:
                     logger.error(f"خطا در دانلود صوتی یوتیوب: {str(e)}")
                     logger.error(traceback.format_exc())
-                    await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+                    await _edit_status(query, ERROR_MESSAGES["download_failed"])
                     
                 return
             
             else:
-                await query.edit_message_text(ERROR_MESSAGES["unsupported_url"])
+                await _edit_status(query, ERROR_MESSAGES["unsupported_url"])
                 return
             
         # بررسی وجود اطلاعات گزینه‌های دانلود در کش
@@ -2927,7 +2957,7 @@ async def handle_download_option(update: Update, context) -> None:
                 elif download_type == "yt":
                     await download_youtube_with_option(update, context, url, selected_option)
                 else:
-                    await query.edit_message_text(ERROR_MESSAGES["generic_error"])
+                    await _edit_status(query, ERROR_MESSAGES["generic_error"])
                 return
         
         # اگر کش وجود نداشت، از روش قدیمی استفاده کن
@@ -2937,12 +2967,96 @@ async def handle_download_option(update: Update, context) -> None:
         elif download_type == "yt":
             await download_youtube(update, context, url, option_id)
         else:
-            await query.edit_message_text(ERROR_MESSAGES["generic_error"])
+            await _edit_status(query, ERROR_MESSAGES["generic_error"])
             
     except Exception as e:
         logger.error(f"خطا در پردازش انتخاب دانلود: {str(e)}")
         logger.error(f"جزئیات خطا: {traceback.format_exc()}")
-        await query.edit_message_text(ERROR_MESSAGES["generic_error"])
+        await _edit_status(query, ERROR_MESSAGES["generic_error"])
+
+def _status_editor(query) -> StatusEditor:
+    """ویرایشگر مشترک پیام وضعیت یک کوئری کالبک (همه مراحل یک پیام از یک محدودیت نرخ عبور می‌کنند)"""
+    if query.message is not None:
+        return get_editor(query.message.chat_id, query.message.message_id, query.edit_message_text)
+    return get_editor(None, query.inline_message_id, query.edit_message_text)
+
+async def _edit_status(query, text: str, **kwargs) -> None:
+    """
+    ویرایش مستقیم پیام وضعیت کوئری کالبک از طریق ویرایشگر مشترک آن
+    
+    Args:
+        query: کوئری کالبک
+        text: متن جدید پیام
+        kwargs: سایر پارامترهای ویرایش
+    """
+    await _status_editor(query).edit(text, **kwargs)
+
+def _message_status_editor(message) -> StatusEditor:
+    """ویرایشگر مشترک یک پیام وضعیت در هندلرهای همزمان نسخه 13"""
+    return get_editor(message.chat_id, message.message_id, message.edit_text)
+
+def _edit_status_sync(message, text: str, **kwargs) -> None:
+    """ویرایش مستقیم پیام وضعیت از طریق ویرایشگر مشترک آن (نسخه همزمان)"""
+    _message_status_editor(message).edit_sync(text, **kwargs)
+
+async def enqueue_upload(update: Update, context, query, file_path: str, kind: str, caption: str, **send_kwargs) -> None:
+    """
+    سپردن فایل آماده به صف آپلود و آزاد کردن هندلر دانلود
+    
+    Args:
+        update: آبجکت آپدیت تلگرام
+        context: کانتکست تلگرام
+        query: کوئری کالبک برای بروزرسانی پیام وضعیت
+        file_path: مسیر فایل روی دیسک
+        kind: نوع ارسال (video، audio یا document)
+        caption: متن همراه فایل
+    """
+    await _edit_status(query, STATUS_MESSAGES["uploading"])
+    upload_pipeline.submit(context.bot, update.effective_chat.id, file_path, kind, caption,
+                           on_done=_upload_status_callback(query), **send_kwargs)
+
+def _upload_status_callback(query):
+    """ساخت تابع پایان آپلود برای بروزرسانی پیام وضعیت"""
+    async def on_done(success: bool):
+        try:
+            await _edit_status(query, STATUS_MESSAGES["complete"] if success else ERROR_MESSAGES["telegram_upload"])
+        except Exception as e:
+            logger.warning(f"خطا در بروزرسانی پیام وضعیت آپلود: {e}")
+    return on_done
+
+async def enqueue_split_upload(update: Update, context, query, file_path: str, kind: str, caption: str) -> bool:
+    """
+    تقسیم فایل بزرگ‌تر از سقف آپلود به چند بخش (بدون انکود مجدد) و سپردن بخش‌ها به صف آپلود
+    
+    Args:
+        update: آبجکت آپدیت تلگرام
+        context: کانتکست تلگرام
+        query: کوئری کالبک برای بروزرسانی پیام وضعیت
+        file_path: مسیر فایل بزرگ
+        kind: نوع ارسال بخش‌ها (video یا audio)
+        caption: متن همراه بخش‌ها
+        
+    Returns:
+        bool: True اگر فایل تقسیم و در صف آپلود قرار گرفت
+    """
+    if not MEDIA_SPLIT_ENABLED:
+        return False
+    
+    await _edit_status(query, STATUS_MESSAGES["splitting"])
+    loop = asyncio.get_running_loop()
+    status_editor = _status_editor(query)
+    try:
+        parts = await loop.run_in_executor(transcode_executor, split_media, file_path, MAX_TELEGRAM_FILE_SIZE,
+                                           status_editor.ffmpeg_callback(STATUS_MESSAGES["splitting"]))
+    finally:
+        await status_editor.aclose()
+    if not parts:
+        return False
+    
+    await _edit_status(query, STATUS_MESSAGES["uploading"])
+    upload_pipeline.submit_parts(context.bot, update.effective_chat.id, parts, kind, caption,
+                                 on_done=_upload_status_callback(query))
+    return True
 
 async def download_instagram(update: Update, context, url: str, option_id: str) -> None:
     """
@@ -3062,7 +3176,7 @@ async def download_instagram(update: Update, context, url: str, option_id: str)
         if direct_download_available:
             try:
                 # پیام وضعیت آپدیت
-                await query.edit_message_text(STATUS_MESSAGES["downloading"])
+                await _edit_status(query, STATUS_MESSAGES["downloading"])
                 
                 # استفاده از دانلودر مستقیم برای دانلود با کیفیت انتخاب شده
                 logger.info(f"استفاده از ماژول دانلود مستقیم instagram_direct_downloader با کیفیت {quality}")
@@ -3072,17 +3186,17 @@ async def download_instagram(update: Update, context, url: str, option_id: str)
                     os.makedirs(output_dir, exist_ok=True)
                     
                 try:
-                    # اجرای download_instagram_content در یک thread جداگانه
-                    with ThreadPoolExecutor() as executor:
-                        direct_download_task = executor.submit(download_instagram_content, url, output_dir, quality)
-                        try:
-                            downloaded_file = direct_download_task.result(timeout=90)  # 90 ثانیه تایم‌اوت - زمان بیشتر
-                        except concurrent.futures.TimeoutError:
-                            logger.error(f"تایم‌اوت در دانلود با instagram_direct_downloader پس از 90 ثانیه")
-                            downloaded_file = None
-                        except Exception as e:
-                            logger.error(f"خطا در دانلود با instagram_direct_downloader: {e}")
-                            downloaded_file = None
+                    # اجرای download_instagram_content در پول اجرایی دانلود بدون مسدود کردن event loop
+                    try:
+                        downloaded_file = await asyncio.wait_for(
+                            offload_download(download_instagram_content, url, output_dir, quality),
+                            timeout=90)  # 90 ثانیه تایم‌اوت - زمان بیشتر
+                    except asyncio.TimeoutError:
+                        logger.error(f"تایم‌اوت در دانلود با instagram_direct_downloader پس از 90 ثانیه")
+                        downloaded_file = None
+                    except Exception as e:
+                        logger.error(f"خطا در دانلود با instagram_direct_downloader: {e}")
+                        downloaded_file = None
                 except Exception as e:
                     logger.error(f"خطای کلی در فراخوانی instagram_direct_downloader: {e}")
                     downloaded_file = None
@@ -3130,7 +3244,7 @@ async def download_instagram(update: Update, context, url: str, option_id: str)
                 logger.info(f"فایل با بهترین کیفیت دانلود شد: {best_quality_file}")
         
         if not best_quality_file or not os.path.exists(best_quality_file):
-            await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+            await _edit_status(query, ERROR_MESSAGES["download_failed"])
             return
         
         # 2. اگر کیفیت انتخابی "best" است، همان فایل را برگردان
@@ -3139,7 +3253,7 @@ async def download_instagram(update: Update, context, url: str, option_id: str)
         # 3. تبدیل کیفیت برای سایر موارد
         if quality != "best" or is_audio:
             # پیام در حال پردازش
-            await query.edit_message_text(STATUS_MESSAGES["processing"])
+            await _edit_status(query, STATUS_MESSAGES["processing"])
             
             try:
                 # بررسی کش برای کیفیت درخواستی
@@ -3154,11 +3268,17 @@ async def download_instagram(update: Update, context, url: str, option_id: str)
                         logger.info(f"تبدیل کیفیت ویدیو به {quality}, صوتی: {is_audio}")
                         
                         # انجام تبدیل
-                        converted_file = convert_video_quality(
-                            video_path=best_quality_file, 
-                            quality=quality,
-                            is_audio_request=is_audio
-                        )
+                        status_editor = _status_editor(query)
+                        try:
+                            converted_file = await offload_transcode(convert_video_quality,
+                                video_path=best_quality_file, 
+                                quality=quality,
+                                is_audio_request=is_audio,
+                                progress_callback=status_editor.ffmpeg_callback(
+                                    STATUS_MESSAGES["processing_audio" if is_audio else "converting"])
+                            )
+                        finally:
+                            await status_editor.aclose()
                         
                         if converted_file and os.path.exists(converted_file):
                             downloaded_file = converted_file
@@ -3174,7 +3294,7 @@ async def download_instagram(update: Update, context, url: str, option_id: str)
                             try:
                                 logger.info("تلاش برای استخراج صوت با ماژول audio_processing")
                                 from audio_processing import extract_audio
-                                audio_path = extract_audio(best_quality_file)
+                                audio_path = await offload_transcode(extract_audio, best_quality_file)
                                 if audio_path and os.path.exists(audio_path):
                                     downloaded_file = audio_path
                                     logger.info(f"استخراج صدا با audio_processing موفق: {audio_path}")
@@ -3191,61 +3311,36 @@ async def download_instagram(update: Update, context, url: str, option_id: str)
                 # در صورت خطا از فایل اصلی استفاده می‌کنیم
             
         if not downloaded_file or not os.path.exists(downloaded_file):
-            await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+            await _edit_status(query, ERROR_MESSAGES["download_failed"])
             return
             
         # بررسی حجم فایل
         file_size = os.path.getsize(downloaded_file)
         if file_size > MAX_TELEGRAM_FILE_SIZE:
-            await query.edit_message_text(ERROR_MESSAGES["file_too_large"])
+            # تلاش برای تقسیم فایل به چند بخش بدون انکود مجدد
+            caption = f"📥 {os.path.basename(downloaded_file)}\n💾 حجم: {human_readable_size(file_size)}"
+            if not await enqueue_split_upload(update, context, query, downloaded_file, "audio" if is_audio else "video", caption):
+                await _edit_status(query, ERROR_MESSAGES["file_too_large"])
             return
             
-        # ارسال پیام در حال آپلود
-        await query.edit_message_text(STATUS_MESSAGES["uploading"])
-        
         # احترام به انتخاب کاربر برای نوع فایل (صوتی یا ویدیویی)
         # اینجا تصمیم فقط بر اساس انتخاب کاربر است، نه پسوند فایل
         # اگر کاربر گزینه صوتی انتخاب نکرده باشد، حتی اگر فایل با پسوند صوتی باشد، 
         # به عنوان ویدیو در نظر گرفته می‌شود (ممکن است کیفیت با عنوان "فقط صدا" انتخاب شده باشد)
         
-        # ارسال فایل بر اساس نوع آن
+        # ارسال فایل بر اساس نوع آن از طریق صف آپلود
+        # (در صورت خطای ارسال صوتی، صف آپلود فایل را به عنوان سند ارسال می‌کند)
         if is_audio:
-            try:
-                with open(downloaded_file, 'rb') as audio_file:
-                    caption = f"🎵 صدای دانلود شده از اینستاگرام\n💾 حجم: {human_readable_size(file_size)}"
-                    await context.bot.send_audio(
-                        chat_id=update.effective_chat.id,
-                        audio=audio_file,
-                        caption=caption
-                    )
-            except Exception as audio_error:
-                logger.error(f"خطا در ارسال فایل صوتی: {str(audio_error)}")
-                # اگر ارسال به عنوان صوت خطا داد، به عنوان سند ارسال کن
-                with open(downloaded_file, 'rb') as document_file:
-                    caption = f"🎵 صدای دانلود شده از اینستاگرام\n💾 حجم: {human_readable_size(file_size)}"
-                    await context.bot.send_document(
-                        chat_id=update.effective_chat.id,
-                        document=document_file,
-                        caption=caption
-                    )
+            caption = f"🎵 صدای دانلود شده از اینستاگرام\n💾 حجم: {human_readable_size(file_size)}"
+            await enqueue_upload(update, context, query, downloaded_file, "audio", caption)
         else:
-            # ارسال ویدیو
-            with open(downloaded_file, 'rb') as video_file:
-                caption = f"📥 دانلود شده از اینستاگرام\n💾 حجم: {human_readable_size(file_size)}\n🎬 کیفیت: {quality}"
-                await context.bot.send_video(
-                    chat_id=update.effective_chat.id,
-                    video=video_file,
-                    caption=caption,
-                    supports_streaming=True
-                )
-            
-        # ارسال پیام تکمیل
-        await query.edit_message_text(STATUS_MESSAGES["complete"])
+            caption = f"📥 دانلود شده از اینستاگرام\n💾 حجم: {human_readable_size(file_size)}\n🎬 کیفیت: {quality}"
+            await enqueue_upload(update, context, query, downloaded_file, "video", caption)
         
     except Exception as e:
         logger.error(f"خطا در دانلود ویدیوی اینستاگرام: {str(e)}")
         logger.error(f"جزئیات خطا: {traceback.format_exc()}")
-        await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+        await _edit_status(query, ERROR_MESSAGES["download_failed"])
 
 async def download_instagram_with_option(update: Update, context, url: str, selected_option: Dict) -> None:
     """
@@ -3300,11 +3395,11 @@ async def download_instagram_with_option(update: Update, context, url: str, sele
             
             # پیام وضعیت
             if is_audio:
-                await query.edit_message_text(STATUS_MESSAGES["downloading_audio"])
+                await _edit_status(query, STATUS_MESSAGES["downloading_audio"])
                 quality = 'audio'  # تنظیم کیفیت به 'audio' برای دانلود صوتی
                 logger.info("دانلود درخواست صوتی اینستاگرام")
             else:
-                await query.edit_message_text(STATUS_MESSAGES["downloading"])
+                await _edit_status(query, STATUS_MESSAGES["downloading"])
             
             # ابتدا ویدیو را با بهترین کیفیت دانلود می‌کنیم
             # بررسی کش برای بهترین کیفیت
@@ -3336,7 +3431,7 @@ async def download_instagram_with_option(update: Update, context, url: str, sele
                 logger.info(f"تبدیل فایل به کیفیت {quality}")
                 
                 # پیام وضعیت جدید
-                await query.edit_message_text(STATUS_MESSAGES["processing"])
+                await _edit_status(query, STATUS_MESSAGES["processing"])
                 
                 try:
                     # استفاده از تابع convert_video_quality برای تبدیل کیفیت
@@ -3346,11 +3441,17 @@ async def download_instagram_with_option(update: Update, context, url: str, sele
                     # قبلاً: if is_audio: quality = "audio"
                     
                     # تبدیل کیفیت ویدیو یا استخراج صدا با تابع جامع
-                    converted_file = convert_video_quality(
-                        video_path=best_quality_file, 
-                        quality=quality,
-                        is_audio_request=is_audio
-                    )
+                    status_editor = _status_editor(query)
+                    try:
+                        converted_file = await offload_transcode(convert_video_quality,
+                            video_path=best_quality_file, 
+                            quality=quality,
+                            is_audio_request=is_audio,
+                            progress_callback=status_editor.ffmpeg_callback(
+                                STATUS_MESSAGES["processing_audio" if is_audio else "converting"])
+                        )
+                    finally:
+                        await status_editor.aclose()
                     
                     if converted_file and os.path.exists(converted_file):
                         downloaded_file = converted_file
@@ -3396,7 +3497,7 @@ async def download_instagram_with_option(update: Update, context, url: str, sele
                     final_path = os.path.join(TEMP_DOWNLOAD_DIR, f"instagram_audio_{shortcode}.mp3")
                     
                     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        await loop.run_in_executor(None, ydl.download, [url])
+                        await loop.run_in_executor(download_executor, ydl.download, [url])
                     
                     # بررسی وجود فایل خروجی
                     if os.path.exists(final_path):
@@ -3418,12 +3519,12 @@ async def download_instagram_with_option(update: Update, context, url: str, sele
                     if video_file and os.path.exists(video_file):
                         try:
                             # ارسال پیام وضعیت استخراج صدا
-                            await query.edit_message_text(STATUS_MESSAGES["processing_audio"])
+                            await _edit_status(query, STATUS_MESSAGES["processing_audio"])
                             
                             # استخراج صدا با استفاده از ماژول audio_processing
                             try:
                                 from audio_processing import extract_audio
-                                audio_file = extract_audio(video_file)
+                                audio_file = await offload_transcode(extract_audio, video_file)
                                 if audio_file and os.path.exists(audio_file):
                                     downloaded_file = audio_file
                             except ImportError:
@@ -3431,7 +3532,7 @@ async def download_instagram_with_option(update: Update, context, url: str, sele
                                 # استفاده از تابع extract_audio_from_video از ماژول اصلاحات
                                 try:
                                     from telegram_fixes import extract_audio_from_video
-                                    audio_file = extract_audio_from_video(video_file)
+                                    audio_file = await offload_transcode(extract_audio_from_video, video_file)
                                     if audio_file and os.path.exists(audio_file):
                                         downloaded_file = audio_file
                                 except ImportError:
@@ -3450,46 +3551,30 @@ async def download_instagram_with_option(update: Update, context, url: str, sele
         
         # بررسی موفقیت دانلود
         if not downloaded_file or not os.path.exists(downloaded_file):
-            await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+            await _edit_status(query, ERROR_MESSAGES["download_failed"])
             return
             
         # بررسی حجم فایل
         file_size = os.path.getsize(downloaded_file)
         if file_size > MAX_TELEGRAM_FILE_SIZE:
-            await query.edit_message_text(ERROR_MESSAGES["file_too_large"])
+            # تلاش برای تقسیم فایل به چند بخش بدون انکود مجدد
+            caption = f"📥 {os.path.basename(downloaded_file)}\n💾 حجم: {human_readable_size(file_size)}"
+            if not await enqueue_split_upload(update, context, query, downloaded_file, "audio" if is_audio else "video", caption):
+                await _edit_status(query, ERROR_MESSAGES["file_too_large"])
             return
             
-        # ارسال پیام در حال آپلود
-        await query.edit_message_text(STATUS_MESSAGES["uploading"])
-        
-        # ارسال محتوا بر اساس نوع آن
+        # ارسال محتوا بر اساس نوع آن از طریق صف آپلود
         if is_audio:
-            # ارسال فایل صوتی
-            with open(downloaded_file, 'rb') as audio_file:
-                caption = f"🎵 صدای دانلود شده از اینستاگرام\n💾 حجم: {human_readable_size(file_size)}"
-                await context.bot.send_audio(
-                    chat_id=update.effective_chat.id,
-                    audio=audio_file,
-                    caption=caption
-                )
+            caption = f"🎵 صدای دانلود شده از اینستاگرام\n💾 حجم: {human_readable_size(file_size)}"
+            await enqueue_upload(update, context, query, downloaded_file, "audio", caption)
         else:
-            # ارسال ویدیو
-            with open(downloaded_file, 'rb') as video_file:
-                caption = f"📥 دانلود شده از اینستاگرام\n💾 حجم: {human_readable_size(file_size)}"
-                await context.bot.send_video(
-                    chat_id=update.effective_chat.id,
-                    video=video_file,
-                    caption=caption,
-                    supports_streaming=True
-                )
-                
-        # ارسال پیام تکمیل
-        await query.edit_message_text(STATUS_MESSAGES["complete"])
+            caption = f"📥 دانلود شده از اینستاگرام\n💾 حجم: {human_readable_size(file_size)}"
+            await enqueue_upload(update, context, query, downloaded_file, "video", caption)
         
     except Exception as e:
         logger.error(f"خطا در دانلود اینستاگرام با گزینه: {str(e)}")
         logger.error(f"جزئیات خطا: {traceback.format_exc()}")
-        await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+        await _edit_status(query, ERROR_MESSAGES["download_failed"])
 
 async def download_youtube_with_option(update: Update, context, url: str, selected_option: Dict) -> None:
     """
@@ -3525,9 +3610,9 @@ async def download_youtube_with_option(update: Update, context, url: str, select
             is_audio = True
             quality = "audio"  # تنظیم کیفیت برای درخواست صوتی
             logger.info(f"درخواست دانلود صوتی از یوتیوب تشخیص داده شد: {format_id}, quality تنظیم شد به: {quality}")
-            await query.edit_message_text(STATUS_MESSAGES["downloading_audio"])
+            await _edit_status(query, STATUS_MESSAGES["downloading_audio"])
         else:
-            await query.edit_message_text(STATUS_MESSAGES["downloading"])
+            await _edit_status(query, STATUS_MESSAGES["downloading"])
             
         # بررسی اگر ماژول بهبودهای جدید در دسترس است
         try:
@@ -3576,9 +3661,9 @@ async def download_youtube_with_option(update: Update, context, url: str, select
                 
                 # پیام وضعیت جدید
                 if is_audio:
-                    await query.edit_message_text(STATUS_MESSAGES["processing_audio"])
+                    await _edit_status(query, STATUS_MESSAGES["processing_audio"])
                 else:
-                    await query.edit_message_text(STATUS_MESSAGES["processing"])
+                    await _edit_status(query, STATUS_MESSAGES["processing"])
                 
                 try:
                     # استفاده از تابع convert_video_quality برای تبدیل کیفیت
@@ -3588,11 +3673,17 @@ async def download_youtube_with_option(update: Update, context, url: str, select
                     # قبلاً: if is_audio: quality = "audio"
                     
                     # تبدیل کیفیت ویدیو یا استخراج صدا با تابع جامع
-                    converted_file = convert_video_quality(
-                        video_path=best_quality_file, 
-                        quality=quality,
-                        is_audio_request=is_audio
-                    )
+                    status_editor = _status_editor(query)
+                    try:
+                        converted_file = await offload_transcode(convert_video_quality,
+                            video_path=best_quality_file, 
+                            quality=quality,
+                            is_audio_request=is_audio,
+                            progress_callback=status_editor.ffmpeg_callback(
+                                STATUS_MESSAGES["processing_audio" if is_audio else "converting"])
+                        )
+                    finally:
+                        await status_editor.aclose()
                     
                     if converted_file and os.path.exists(converted_file):
                         downloaded_file = converted_file
@@ -3613,7 +3704,7 @@ async def download_youtube_with_option(update: Update, context, url: str, select
                         audio_path = None
                         try:
                             from telegram_fixes import extract_audio_from_video
-                            audio_path = extract_audio_from_video(downloaded_file, 'mp3', '192k')
+                            audio_path = await offload_transcode(extract_audio_from_video, downloaded_file, 'mp3', '192k')
                             logger.info(f"تبدیل با ماژول telegram_fixes: {audio_path}")
                         except (ImportError, Exception) as e:
                             logger.error(f"خطا در استفاده از تابع extract_audio_from_video: {e}")
@@ -3622,7 +3713,6 @@ async def download_youtube_with_option(update: Update, context, url: str, select
                         if not audio_path or not os.path.exists(audio_path):
                             logger.info("استفاده مستقیم از FFmpeg...")
                             try:
-                                import subprocess
                                 import uuid
                                 
                                 base_name = os.path.basename(downloaded_file)
@@ -3643,12 +3733,7 @@ async def download_youtube_with_option(update: Update, context, url: str, select
                                 ]
                                 
                                 logger.info(f"اجرای دستور FFmpeg: {' '.join(cmd)}")
-                                result = subprocess.run(
-                                    cmd,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                    text=True
-                                )
+                                result = await run_ffmpeg_async(cmd)
                                 
                                 if result.returncode != 0:
                                     logger.error(f"خطا در استخراج صدا با FFmpeg: {result.stderr}")
@@ -3680,7 +3765,7 @@ async def download_youtube_with_option(update: Update, context, url: str, select
                 # تنظیمات دانلود صوتی
                 info = await downloader.get_video_info(url)
                 if not info:
-                    await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+                    await _edit_status(query, ERROR_MESSAGES["download_failed"])
                     return
                     
                 # ایجاد نام فایل خروجی
@@ -3712,7 +3797,7 @@ async def download_youtube_with_option(update: Update, context, url: str, select
                 # اجرا در thread pool
                 loop = asyncio.get_event_loop()
                 with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    await loop.run_in_executor(None, ydl.download, [url])
+                    await loop.run_in_executor(download_executor, ydl.download, [url])
                 
                 # بررسی وجود فایل mp3
                 if not os.path.exists(output_path):
@@ -3726,7 +3811,7 @@ async def download_youtube_with_option(update: Update, context, url: str, select
                 
                 if not os.path.exists(output_path):
                     logger.error(f"فایل صوتی دانلود شده پیدا نشد: {output_path}")
-                    await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+                    await _edit_status(query, ERROR_MESSAGES["download_failed"])
                     return
                     
                 downloaded_file = output_path
@@ -3738,82 +3823,55 @@ async def download_youtube_with_option(update: Update, context, url: str, select
                 format_option = selected_option.get('format_id', selected_option.get('format', ''))
                 logger.info(f"فرمت انتخاب شده برای دانلود ویدیو: {format_option}")
                 
-                downloaded_file = await downloader.download_video(url, format_option if format_option else format_id)
+                status_editor = _status_editor(query)
+                try:
+                    downloaded_file = await downloader.download_video(
+                        url, format_option if format_option else format_id,
+                        progress_hook=status_editor.ytdlp_hook(STATUS_MESSAGES["downloading"]),
+                        user_id=update.effective_user.id
+                    )
+                finally:
+                    await status_editor.aclose()
         
         # بررسی موفقیت دانلود
         if not downloaded_file or not os.path.exists(downloaded_file):
-            await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+            await _edit_status(query, ERROR_MESSAGES["download_failed"])
             return
             
         # بررسی حجم فایل
         file_size = os.path.getsize(downloaded_file)
         if file_size > MAX_TELEGRAM_FILE_SIZE:
-            await query.edit_message_text(ERROR_MESSAGES["file_too_large"])
+            # تلاش برای تقسیم فایل به چند بخش بدون انکود مجدد
+            caption = f"📥 {os.path.basename(downloaded_file)}\n💾 حجم: {human_readable_size(file_size)}"
+            if not await enqueue_split_upload(update, context, query, downloaded_file, "audio" if is_audio else "video", caption):
+                await _edit_status(query, ERROR_MESSAGES["file_too_large"])
             return
             
-        # ارسال پیام در حال آپلود
-        await query.edit_message_text(STATUS_MESSAGES["uploading"])
-        
         is_playlist = 'playlist' in format_option.lower() if format_option else 'playlist' in format_id.lower()
         
         # تشخیص نوع فایل براساس پسوند فایل (برای اطمینان)
         if downloaded_file and os.path.exists(downloaded_file) and downloaded_file.endswith(('.mp3', '.m4a', '.aac', '.wav')):
             is_audio = True
         
-        # ارسال فایل بر اساس نوع آن
+        # ارسال فایل بر اساس نوع آن از طریق صف آپلود
         if is_audio:
-            # ارسال فایل صوتی
-            try:
-                if os.path.exists(downloaded_file):
-                    with open(downloaded_file, 'rb') as audio_file:
-                        caption = f"🎵 صدای دانلود شده از یوتیوب\n💾 حجم: {human_readable_size(file_size)}"
-                        logger.info(f"ارسال فایل صوتی: {downloaded_file}")
-                        await context.bot.send_audio(
-                            chat_id=update.effective_chat.id,
-                            audio=audio_file,
-                            caption=caption
-                        )
-                else:
-                    logger.error(f"فایل صوتی برای ارسال وجود ندارد: {downloaded_file}")
-                    await query.edit_message_text(ERROR_MESSAGES["download_failed"])
-                    return
-            except Exception as e:
-                logger.error(f"خطا در ارسال فایل صوتی: {str(e)}. تلاش برای ارسال به عنوان سند...")
-                # اگر ارسال به عنوان صوت خطا داد، به عنوان سند ارسال کن
-                with open(downloaded_file, 'rb') as document_file:
-                    caption = f"🎵 صدای دانلود شده از یوتیوب\n💾 حجم: {human_readable_size(file_size)}"
-                    await context.bot.send_document(
-                        chat_id=update.effective_chat.id,
-                        document=document_file,
-                        caption=caption
-                    )
+            # ارسال فایل صوتی (در صورت خطا به عنوان سند ارسال می‌شود)
+            caption = f"🎵 صدای دانلود شده از یوتیوب\n💾 حجم: {human_readable_size(file_size)}"
+            logger.info(f"ارسال فایل صوتی: {downloaded_file}")
+            await enqueue_upload(update, context, query, downloaded_file, "audio", caption)
         elif is_playlist:
             # ارسال فایل زیپ پلی‌لیست
-            with open(downloaded_file, 'rb') as zip_file:
-                caption = f"📁 پلی‌لیست دانلود شده از یوتیوب\n💾 حجم: {human_readable_size(file_size)}"
-                await context.bot.send_document(
-                    chat_id=update.effective_chat.id,
-                    document=zip_file,
-                    caption=caption
-                )
+            caption = f"📁 پلی‌لیست دانلود شده از یوتیوب\n💾 حجم: {human_readable_size(file_size)}"
+            await enqueue_upload(update, context, query, downloaded_file, "document", caption)
         else:
             # ارسال ویدیو
-            with open(downloaded_file, 'rb') as video_file:
-                caption = f"📥 دانلود شده از یوتیوب\n💾 حجم: {human_readable_size(file_size)}\n🎬 کیفیت: {selected_option.get('label', 'نامشخص')}"
-                await context.bot.send_video(
-                    chat_id=update.effective_chat.id,
-                    video=video_file,
-                    caption=caption,
-                    supports_streaming=True
-                )
-                
-        # ارسال پیام تکمیل
-        await query.edit_message_text(STATUS_MESSAGES["complete"])
+            caption = f"📥 دانلود شده از یوتیوب\n💾 حجم: {human_readable_size(file_size)}\n🎬 کیفیت: {selected_option.get('label', 'نامشخص')}"
+            await enqueue_upload(update, context, query, downloaded_file, "video", caption)
         
     except Exception as e:
         logger.error(f"خطا در دانلود یوتیوب با گزینه: {str(e)}")
         logger.error(f"جزئیات خطا: {traceback.format_exc()}")
-        await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+        await _edit_status(query, ERROR_MESSAGES["download_failed"])
 
 async def download_youtube(update: Update, context, url: str, option_id: str) -> None:
     """
@@ -3893,7 +3951,7 @@ async def download_youtube(update: Update, context, url: str, option_id: str) ->
             # تنظیمات دانلود صوتی
             info = await downloader.get_video_info(url)
             if not info:
-                await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+                await _edit_status(query, ERROR_MESSAGES["download_failed"])
                 return
                 
             # ایجاد نام فایل خروجی
@@ -3955,7 +4013,7 @@ async def download_youtube(update: Update, context, url: str, option_id: str) ->
             
             if not os.path.exists(output_path):
                 logger.error("فایل صوتی دانلود شده پیدا نشد")
-                await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+                await _edit_status(query, ERROR_MESSAGES["download_failed"])
                 return
                 
             downloaded_file = output_path
@@ -3964,7 +4022,14 @@ async def download_youtube(update: Update, context, url: str, option_id: str) ->
         else:
             # دانلود ویدیو با گزینه انتخاب شده
             logger.info(f"دانلود ویدیوی یوتیوب با گزینه {format_option}: {url[:30]}...")
-            downloaded_file = await downloader.download_video(url, format_option)
+            status_editor = _status_editor(query)
+            try:
+                downloaded_file = await downloader.download_video(
+                    url, format_option, progress_hook=status_editor.ytdlp_hook(STATUS_MESSAGES["downloading"]),
+                    user_id=update.effective_user.id
+                )
+            finally:
+                await status_editor.aclose()
             
             # بروزرسانی متغیر کیفیت برای استفاده در caption
             option_id = format_option
@@ -3980,11 +4045,17 @@ async def download_youtube(update: Update, context, url: str, option_id: str) ->
                     # استفاده از ماژول بهبود یافته برای تبدیل کیفیت
                     try:
                         from telegram_fixes import convert_video_quality
-                        converted_file = convert_video_quality(
-                            video_path=downloaded_file, 
-                            quality=quality,
-                            is_audio_request=is_audio
-                        )
+                        status_editor = _status_editor(query)
+                        try:
+                            converted_file = await offload_transcode(convert_video_quality,
+                                video_path=downloaded_file, 
+                                quality=quality,
+                                is_audio_request=is_audio,
+                                progress_callback=status_editor.ffmpeg_callback(
+                                    STATUS_MESSAGES["processing_audio" if is_audio else "converting"])
+                            )
+                        finally:
+                            await status_editor.aclose()
                         
                         if converted_file and os.path.exists(converted_file):
                             logger.info(f"تبدیل کیفیت موفق: {converted_file}")
@@ -4025,7 +4096,7 @@ async def download_youtube(update: Update, context, url: str, option_id: str) ->
                 ]
                 
                 try:
-                    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+                    result = await run_ffmpeg_async(cmd)
                     if result.returncode == 0 and os.path.exists(video_path):
                         downloaded_file = video_path
                         is_audio = False
@@ -4038,18 +4109,18 @@ async def download_youtube(update: Update, context, url: str, option_id: str) ->
                     is_audio = True
             
         if not downloaded_file or not os.path.exists(downloaded_file):
-            await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+            await _edit_status(query, ERROR_MESSAGES["download_failed"])
             return
             
         # بررسی حجم فایل
         file_size = os.path.getsize(downloaded_file)
         if file_size > MAX_TELEGRAM_FILE_SIZE:
-            await query.edit_message_text(ERROR_MESSAGES["file_too_large"])
+            # تلاش برای تقسیم فایل به چند بخش بدون انکود مجدد
+            caption = f"📥 {os.path.basename(downloaded_file)}\n💾 حجم: {human_readable_size(file_size)}"
+            if not await enqueue_split_upload(update, context, query, downloaded_file, "audio" if is_audio else "video", caption):
+                await _edit_status(query, ERROR_MESSAGES["file_too_large"])
             return
             
-        # ارسال پیام در حال آپلود
-        await query.edit_message_text(STATUS_MESSAGES["uploading"])
-        
         # تعیین نوع فایل و نحوه ارسال
         is_playlist = 'playlist' in option_id and downloaded_file.endswith('.zip')
         
@@ -4058,49 +4129,19 @@ async def download_youtube(update: Update, context, url: str, option_id: str) ->
         if not is_audio and not is_playlist and downloaded_file and not downloaded_file.endswith(('.mp4', '.webm', '.mkv', '.avi', '.mov')):
             is_audio = downloaded_file.endswith(('.mp3', '.m4a', '.aac', '.wav'))
         
-        # ارسال فایل بر اساس نوع آن
+        # ارسال فایل بر اساس نوع آن از طریق صف آپلود
         if is_audio:
-            # ارسال فایل صوتی
-            try:
-                with open(downloaded_file, 'rb') as audio_file:
-                    caption = f"🎵 صدای دانلود شده از یوتیوب\n💾 حجم: {human_readable_size(file_size)}"
-                    await context.bot.send_audio(
-                        chat_id=update.effective_chat.id,
-                        audio=audio_file,
-                        caption=caption
-                    )
-            except Exception as audio_error:
-                logger.error(f"خطا در ارسال فایل صوتی: {str(audio_error)}")
-                # اگر ارسال به عنوان صوت خطا داد، به عنوان سند ارسال کن
-                with open(downloaded_file, 'rb') as document_file:
-                    caption = f"🎵 صدای دانلود شده از یوتیوب\n💾 حجم: {human_readable_size(file_size)}"
-                    await context.bot.send_document(
-                        chat_id=update.effective_chat.id,
-                        document=document_file,
-                        caption=caption
-                    )
+            # ارسال فایل صوتی (در صورت خطا به عنوان سند ارسال می‌شود)
+            caption = f"🎵 صدای دانلود شده از یوتیوب\n💾 حجم: {human_readable_size(file_size)}"
+            await enqueue_upload(update, context, query, downloaded_file, "audio", caption)
         elif is_playlist:
             # ارسال فایل زیپ پلی‌لیست
-            with open(downloaded_file, 'rb') as zip_file:
-                caption = f"📁 پلی‌لیست دانلود شده از یوتیوب\n💾 حجم: {human_readable_size(file_size)}"
-                await context.bot.send_document(
-                    chat_id=update.effective_chat.id,
-                    document=zip_file,
-                    caption=caption
-                )
+            caption = f"📁 پلی‌لیست دانلود شده از یوتیوب\n💾 حجم: {human_readable_size(file_size)}"
+            await enqueue_upload(update, context, query, downloaded_file, "document", caption)
         else:
             # ارسال ویدیو
-            with open(downloaded_file, 'rb') as video_file:
-                caption = f"📥 دانلود شده از یوتیوب\n💾 حجم: {human_readable_size(file_size)}"
-                await context.bot.send_video(
-                    chat_id=update.effective_chat.id,
-                    video=video_file,
-                    caption=caption,
-                    supports_streaming=True
-                )
-                
-        # ارسال پیام تکمیل
-        await query.edit_message_text(STATUS_MESSAGES["complete"])
+            caption = f"📥 دانلود شده از یوتیوب\n💾 حجم: {human_readable_size(file_size)}"
+            await enqueue_upload(update, context, query, downloaded_file, "video", caption)
         
         # ثبت آمار دانلود در صورت فعال بودن سیستم آمار
         if STATS_ENABLED:
@@ -4161,7 +4202,7 @@ async def download_youtube(update: Update, context, url: str, option_id: str) ->
             except Exception as stats_error:
                 logger.error(f"خطا در ثبت آمار خطای دانلود: {stats_error}")
                 
-        await query.edit_message_text(ERROR_MESSAGES["download_failed"])
+        await _edit_status(query, ERROR_MESSAGES["download_failed"])
 
 """
 بخش 6: توابع تست و راه‌اندازی (از ماژول main.py)
@@ -4348,12 +4389,12 @@ async def main():
             # نسخه 20.x
             try:
                 from telegram.ext import ApplicationBuilder
-                app = ApplicationBuilder().token(telegram_token).build()
+                app = configure_builder(configure_application_builder(ApplicationBuilder().token(telegram_token))).build()
                 logger.info("اپلیکیشن ربات با نسخه PTB 20.x ایجاد شد")
             except (AttributeError, ImportError):
                 # نسخه 13.x
                 from telegram.ext import Updater
-                updater = Updater(token=telegram_token)
+                updater = Updater(token=telegram_token, **get_updater_kwargs())
                 app = updater.dispatcher
                 logger.info("اپلیکیشن ربات با نسخه PTB 13.x ایجاد شد")
         except Exception as e:
@@ -4549,6 +4590,16 @@ async def main():
             """نسخه sync از process_instagram_url برای سازگاری با PTB 13.x"""
             logger.info(f"شروع پردازش URL اینستاگرام (sync): {url[:30]}...")
             try:
+                # پست‌های چندتایی و عکسی بدون انتخاب کیفیت در قالب آلبوم ارسال می‌شوند
+                def on_carousel_done(success):
+                    status_message.edit_text(STATUS_MESSAGES["complete"] if success else ERROR_MESSAGES["telegram_upload"])
+                
+                if deliver_carousel_sync(context.bot, update.effective_chat.id, url,
+                                         on_queued=lambda count: status_message.edit_text(
+                                             STATUS_MESSAGES["carousel"].format(count=count)),
+                                         on_done=on_carousel_done):
+                    return
+                
                 # ایجاد دانلودر اینستاگرام
                 downloader = InstagramDownloader()
                 
@@ -4661,6 +4712,9 @@ async def main():
                 user_download_data[user_id]['instagram_options'] = options
                 user_download_data[user_id]['url'] = url
                 
+                # دانلود پیش‌دستانه در زمانی که کاربر در حال انتخاب است
+                start_prefetch_sync(user_id, 'instagram', url, options)
+                
             except Exception as e:
                 logger.error(f"خطا در پردازش URL اینستاگرام (sync): {str(e)}")
                 
@@ -4807,6 +4861,10 @@ async def main():
                 user_download_data[user_id]['youtube_options'] = options
                 user_download_data[user_id]['url'] = url
                 
+                # دانلود پیش‌دستانه در زمانی که کاربر در حال انتخاب است
+                if not is_youtube_playlist(url):
+                    start_prefetch_sync(user_id, 'youtube', url, options)
+                
             except Exception as e:
                 logger.error(f"خطا در پردازش URL یوتیوب (sync): {str(e)}")
                 
@@ -4826,10 +4884,12 @@ async def main():
                     
                 status_message.edit_text(error_message)
             
-        # ثبت هندلرهای اصلی با نسخه sync
-        app.add_handler(CommandHandler("start", start_sync))
-        app.add_handler(CommandHandler("help", help_command_sync))
-        app.add_handler(CommandHandler("about", about_command_sync))
+        # ثبت هندلرهای اصلی: در نسخه 20 کوروتین‌ها مستقیماً ثبت می‌شوند و نسخه‌های sync فقط برای نسخه 13 هستند
+        # (متدهای Bot در نسخه 20 کوروتین برمی‌گردانند و نسخه‌های sync در آن کار نمی‌کنند)
+        use_async_handlers = PTB_VERSION >= 20
+        add_handler(app, CommandHandler("start", start if use_async_handlers else start_sync))
+        add_handler(app, CommandHandler("help", help_command if use_async_handlers else help_command_sync))
+        add_handler(app, CommandHandler("about", about_command if use_async_handlers else about_command_sync))
         
         # اضافه کردن هندلر دستور آمار (فقط برای مدیران)
         if STATS_ENABLED:
@@ -4837,21 +4897,26 @@ async def main():
                 # وارد کردن ماژول آمار
                 from stats_manager import stats_command, handle_stats_buttons
                 
-                app.add_handler(CommandHandler("stats", stats_command))
+                add_handler(app, CommandHandler("stats", stats_command))
                 # هندلر کالبک دکمه‌های آمار
-                app.add_handler(CallbackQueryHandler(handle_stats_buttons, pattern="^(stats_chart|daily_chart|refresh_stats)$"))
+                add_handler(app, CallbackQueryHandler(handle_stats_buttons, pattern="^(stats_chart|daily_chart|refresh_stats)$"))
                 logger.info("هندلرهای آمار با موفقیت اضافه شدند")
             except Exception as e:
                 logger.error(f"خطا در افزودن هندلرهای آمار: {e}")
                 
-        # استفاده از نسخه sync برای تابع process_url
-        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, process_url_sync))
+        # پردازش لینک‌ها پس از کنترل پذیرش
+        add_handler(app, MessageHandler(filters.TEXT & ~filters.COMMAND,
+                                        admission_gate(process_url if use_async_handlers else process_url_sync)))
         
         # نسخه sync از handle_download_option
         def handle_download_option_sync(update, context):
             """نسخه sync از handle_download_option برای سازگاری با PTB 13.x"""
             query = update.callback_query
-            query.answer()
+            try:
+                query.answer()
+            except Exception as e:
+                # کالبک‌هایی که در صف پذیرش منتظر مانده‌اند ممکن است منقضی شده باشند
+                logger.debug(f"خطا در پاسخ به کالبک: {e}")
             
             # استخراج اطلاعات کالبک
             callback_data = query.data
@@ -4990,7 +5055,7 @@ async def main():
                 download_instagram_with_option_sync(update, context, url, selected_option, status_message)
             except Exception as e:
                 logger.error(f"خطا در دانلود اینستاگرام: {e}")
-                status_message.edit_text(ERROR_MESSAGES["generic_error"])
+                _edit_status_sync(status_message, ERROR_MESSAGES["generic_error"])
         
         def download_instagram_with_option_sync(update, context, url, selected_option, status_message=None, url_id=None):
             """نسخه sync از download_instagram_with_option"""
@@ -4998,6 +5063,9 @@ async def main():
             # مقداردهی اولیه متغیرهای مهم
             download_time = 0
             logger.info(f"شروع دانلود اینستاگرام برای کاربر {user_id} با کیفیت {selected_option.get('quality', 'نامشخص')}")
+            prefetch_manager.record_choice(user_id, 'instagram', selected_option.get('quality', 'best'))
+            # لغو دانلودهای پیش‌دستانه غیرقابل استفاده (همه گزینه‌ها از فایل منبع ساخته می‌شوند)
+            prefetch_manager.cancel(url, keep='best')
             
             try:
                 # اگر پیام وضعیت ارائه نشده باشد، آن را ایجاد کن
@@ -5011,9 +5079,9 @@ async def main():
                 is_audio = selected_option.get('type') == 'audio' or selected_option.get('quality') == 'audio'
                 
                 if is_audio:
-                    status_message.edit_text(STATUS_MESSAGES["downloading_audio"])
+                    _edit_status_sync(status_message, STATUS_MESSAGES["downloading_audio"])
                 else:
-                    status_message.edit_text(STATUS_MESSAGES["downloading"])
+                    _edit_status_sync(status_message, STATUS_MESSAGES["downloading"])
                 
                 # انتخاب کیفیت مناسب
                 quality = selected_option.get('quality', 'best')
@@ -5042,12 +5110,22 @@ async def main():
                     try:
                         # ابتدا با بهترین کیفیت دانلود می‌کنیم
                         logger.info(f"شروع دانلود ویدیوی اینستاگرام با بهترین کیفیت برای تبدیل به {quality}")
-                        # استفاده از ThreadPoolExecutor به جای asyncio
-                        with ThreadPoolExecutor() as executor:
-                            future = executor.submit(lambda: asyncio.run(
-                                instagram_dl._download_with_ytdlp(url, "", "best")))
-                            best_file_path = future.result(timeout=60)  # تایم‌اوت 60 ثانیه
-                            logger.info(f"دانلود با ThreadPoolExecutor: {best_file_path}")
+                        # اجرا در پول اجرایی دانلود مشترک
+                        status_editor = _message_status_editor(status_message)
+                        try:
+                            progress_hook = status_editor.ytdlp_hook(STATUS_MESSAGES["downloading"])
+                            # تحویل فایل منبع دانلود پیش‌دستانه (در صورت وجود) یا دانلود عادی
+                            best_file_path = prefetch_manager.claim(url, 'best', progress_hook=progress_hook)
+                            if not best_file_path:
+                                # نوبت‌دهی منصفانه (درخواست تعاملی بر آیتم‌های دسته‌ای مقدم است)
+                                with fair_scheduler.slot(user_id, CLASS_INTERACTIVE):
+                                    best_file_path = run_coroutine(
+                                        lambda: instagram_dl._download_with_ytdlp(
+                                            url, "", "best", progress_hook=progress_hook),
+                                        timeout=60)  # تایم‌اوت 60 ثانیه
+                            logger.info(f"دانلود در پول اجرایی دانلود: {best_file_path}")
+                        finally:
+                            status_editor.close()
                         
                         if best_file_path and os.path.exists(best_file_path) and os.path.getsize(best_file_path) > 0:
                             logger.info(f"ویدیو با بهترین کیفیت دانلود شد: {best_file_path}")
@@ -5063,13 +5141,19 @@ async def main():
                                 logger.info(f"کیفیت اصلی انتخاب شده، تبدیل لازم نیست")
                             # اجبار به تبدیل کیفیت حتی برای 1080p
                             elif quality == '1080p':
-                                status_message.edit_text(f"⏳ ویدیو دانلود شد، در حال تبدیل به کیفیت {quality}...")
+                                _edit_status_sync(status_message, f"⏳ ویدیو دانلود شد، در حال تبدیل به کیفیت {quality}...")
                                 from telegram_fixes import convert_video_quality
-                                file_path = convert_video_quality(best_file_path, quality)
+                                status_editor = _message_status_editor(status_message)
+                                try:
+                                    file_path = convert_video_quality(
+                                        best_file_path, quality,
+                                        progress_callback=status_editor.ffmpeg_callback(STATUS_MESSAGES["converting"]))
+                                finally:
+                                    status_editor.close()
                                 logger.info(f"ویدیو با موفقیت به کیفیت {quality} تبدیل شد: {file_path}")
                             else:
                                 # تبدیل به کیفیت درخواست شده
-                                status_message.edit_text(f"⏳ ویدیو دانلود شد، در حال تبدیل به کیفیت {quality}...")
+                                _edit_status_sync(status_message, f"⏳ ویدیو دانلود شد، در حال تبدیل به کیفیت {quality}...")
                                 
                                 # تبدیل به کیفیت درخواست شده با ffmpeg
                                 if quality.endswith('p'):
@@ -5079,7 +5163,13 @@ async def main():
                                     target_height = {'720': 720, '480': 480, '360': 360, '240': 240}.get(quality, 720)
                                 
                                 from telegram_fixes import convert_video_quality
-                                converted_path = convert_video_quality(best_file_path, target_height)
+                                status_editor = _message_status_editor(status_message)
+                                try:
+                                    converted_path = convert_video_quality(
+                                        best_file_path, target_height,
+                                        progress_callback=status_editor.ffmpeg_callback(STATUS_MESSAGES["converting"]))
+                                finally:
+                                    status_editor.close()
                                 
                                 if converted_path and os.path.exists(converted_path):
                                     file_path = converted_path
@@ -5089,28 +5179,26 @@ async def main():
                                     file_path = best_file_path
                         else:
                             logger.warning(f"دانلود با بهترین کیفیت ناموفق بود، تلاش مستقیم با کیفیت {quality}")
-                            # تلاش دانلود مستقیم با کیفیت درخواستی - با ThreadPoolExecutor
-                            with ThreadPoolExecutor() as executor:
-                                try:
-                                    future = executor.submit(lambda: asyncio.run(
-                                        instagram_dl._download_with_ytdlp(url, "", quality)))
-                                    file_path = future.result(timeout=60)  # تایم‌اوت 60 ثانیه
-                                    logger.info(f"دانلود مستقیم با کیفیت {quality}: {file_path}")
-                                except Exception as e:
-                                    logger.error(f"خطا در دانلود مستقیم با کیفیت {quality}: {e}")
-                                    file_path = None
-                    except Exception as e:
-                        logger.error(f"خطا در روش بهبود یافته: {e}, تلاش با روش قدیمی")
-                        # روش قدیمی به عنوان پشتیبان - با ThreadPoolExecutor
-                        with ThreadPoolExecutor() as executor:
+                            # تلاش دانلود مستقیم با کیفیت درخواستی - در پول اجرایی دانلود
                             try:
-                                future = executor.submit(lambda: asyncio.run(
-                                    instagram_dl._download_with_ytdlp(url, "", quality)))
-                                file_path = future.result(timeout=60)  # تایم‌اوت 60 ثانیه
-                                logger.info(f"دانلود با روش پشتیبان: {file_path}")
+                                file_path = run_coroutine(
+                                    lambda: instagram_dl._download_with_ytdlp(url, "", quality),
+                                    timeout=60)  # تایم‌اوت 60 ثانیه
+                                logger.info(f"دانلود مستقیم با کیفیت {quality}: {file_path}")
                             except Exception as e:
-                                logger.error(f"خطا در دانلود با روش پشتیبان: {e}")
+                                logger.error(f"خطا در دانلود مستقیم با کیفیت {quality}: {e}")
                                 file_path = None
+                    except Exception as e:
+                        logger.error(f"خطا در روش بهبود یافته: {e}, تلاش با روش قدیمی")
+                        # روش قدیمی به عنوان پشتیبان - در پول اجرایی دانلود
+                        try:
+                            file_path = run_coroutine(
+                                lambda: instagram_dl._download_with_ytdlp(url, "", quality),
+                                timeout=60)  # تایم‌اوت 60 ثانیه
+                            logger.info(f"دانلود با روش پشتیبان: {file_path}")
+                        except Exception as e:
+                            logger.error(f"خطا در دانلود با روش پشتیبان: {e}")
+                            file_path = None
                     
                     download_time = time.time() - download_timer
                     logger.info(f"دانلود با کیفیت {quality} در {download_time:.2f} ثانیه کامل شد")
@@ -5123,49 +5211,79 @@ async def main():
                 
                 if not file_path or not os.path.exists(file_path):
                     logger.error(f"خطا: مسیر فایل نامعتبر است - {file_path}")
-                    status_message.edit_text(ERROR_MESSAGES["download_failed"])
+                    _edit_status_sync(status_message, ERROR_MESSAGES["download_failed"])
                     return
                 
+                # پیام نهایی پس از پایان آپلود (توسط صف آپلود فراخوانی می‌شود)
+                def on_upload_done(success):
+                    if not success:
+                        _edit_status_sync(status_message, ERROR_MESSAGES["telegram_upload"])
+                        return
+                    
+                    # افزودن به آمار
+                    if STATS_ENABLED:
+                        try:
+                            StatsManager.add_download_record(update.effective_user, "instagram", "audio" if is_audio else quality, os.path.getsize(upload_path))
+                        except Exception as e:
+                            logger.error(f"خطا در ثبت آمار: {e}")
+                    
+                    # اضافه کردن دکمه "دانلود مجدد" به پیام کامل شده
+                    keyboard = [
+                        [InlineKeyboardButton("⬇️ دانلود با کیفیت دیگر", callback_data=f"redownload_{url}")],
+                        [InlineKeyboardButton("🔍 دانلود لینک جدید", callback_data="new_download")]
+                    ]
+                    reply_markup = InlineKeyboardMarkup(keyboard)
+                    
+                    _edit_status_sync(status_message, 
+                        f"✅ دانلود با موفقیت انجام شد!\n\n" +
+                        f"📌 نوع: {'صوتی' if is_audio else 'ویدیویی'}\n" +
+                        (f"🎬 کیفیت: {quality}\n" if not is_audio else "") +
+                        f"⏱ زمان پردازش: {int(download_time)} ثانیه",
+                        reply_markup=reply_markup
+                    )
+                
                 # مدیریت فایل‌های صوتی
                 if is_audio:
-                    status_message.edit_text(STATUS_MESSAGES["processing_audio"])
+                    _edit_status_sync(status_message, STATUS_MESSAGES["processing_audio"])
                     
                     # استخراج صدا
                     audio_file = extract_audio(file_path)
                     
                     if not audio_file:
                         logger.error("خطا در استخراج صدا")
-                        status_message.edit_text(ERROR_MESSAGES["download_failed"])
+                        _edit_status_sync(status_message, ERROR_MESSAGES["download_failed"])
                         return
                         
-                    # آپلود صدا به تلگرام
-                    status_message.edit_text(STATUS_MESSAGES["uploading"])
-                    
-                    with open(audio_file, 'rb') as audio:
-                        update.effective_chat.send_audio(
-                            audio=audio,
-                            title=os.path.basename(audio_file),
-                            caption=f"🎵 فایل صوتی از اینستاگرام\n🔗 {url}",
-                            performer="Instagram Audio"
-                        )
-                        
-                    status_message.edit_text(STATUS_MESSAGES["complete"])
-                    
-                    # افزودن به آمار
-                    if STATS_ENABLED:
-                        try:
-                            StatsManager.add_download_record(update.effective_user, "instagram", "audio", os.path.getsize(audio_file))
-                        except Exception as e:
-                            logger.error(f"خطا در ثبت آمار: {e}")
+                    # آپلود صدا به تلگرام از طریق صف آپلود
+                    _edit_status_sync(status_message, STATUS_MESSAGES["uploading"])
+                    upload_path = audio_file
+                    upload_pipeline.submit_sync(
+                        context.bot, update.effective_chat.id, audio_file, "audio",
+                        caption=f"🎵 فایل صوتی از اینستاگرام\n🔗 {url}",
+                        on_done=on_upload_done,
+                        title=os.path.basename(audio_file),
+                        performer="Instagram Audio"
+                    )
                 else:
                     # آپلود ویدیو به تلگرام
-                    status_message.edit_text(STATUS_MESSAGES["uploading"])
+                    _edit_status_sync(status_message, STATUS_MESSAGES["uploading"])
                     
                     # بررسی حجم فایل
                     file_size = os.path.getsize(file_path)
-                    if file_size > MAX_TELEGRAM_FILE_SIZE:
+                    split_parts = None
+                    if file_size > MAX_TELEGRAM_FILE_SIZE and MEDIA_SPLIT_ENABLED:
+                        # تلاش برای تقسیم فایل به چند بخش بدون انکود مجدد
+                        _edit_status_sync(status_message, STATUS_MESSAGES["splitting"])
+                        status_editor = _message_status_editor(status_message)
+                        try:
+                            split_parts = split_media(file_path, MAX_TELEGRAM_FILE_SIZE,
+                                                      status_editor.ffmpeg_callback(STATUS_MESSAGES["splitting"]))
+                        finally:
+                            status_editor.close()
+                    
+                    if file_size > MAX_TELEGRAM_FILE_SIZE and not split_parts:
                         logger.warning(f"فایل خیلی بزرگ است ({file_size} بایت)، در حال کاهش کیفیت...")
-                        status_message.edit_text(f"⚠️ فایل بسیار بزرگ است ({human_readable_size(file_size)}). در حال پردازش کیفیت پایین‌تر...")
+                        _edit_status_sync(status_message, f"⚠️ فایل بسیار بزرگ است ({human_readable_size(file_size)}). در حال پردازش کیفیت پایین‌تر...")
                         
                         # تلاش برای تبدیل به کیفیت پایین‌تر
                         try:
@@ -5176,55 +5294,157 @@ async def main():
                                 logger.info(f"فایل با موفقیت به کیفیت پایین‌تر تبدیل شد: {file_path}")
                             else:
                                 logger.error("تبدیل به کیفیت پایین‌تر ناموفق بود")
-                                status_message.edit_text(ERROR_MESSAGES["file_too_large"])
+                                _edit_status_sync(status_message, ERROR_MESSAGES["file_too_large"])
                                 return
                         except Exception as e:
                             logger.error(f"خطا در تبدیل به کیفیت پایین‌تر: {e}")
-                            status_message.edit_text(ERROR_MESSAGES["file_too_large"])
+                            _edit_status_sync(status_message, ERROR_MESSAGES["file_too_large"])
                             return
                     
-                    # آپلود فایل
-                    try:
-                        with open(file_path, 'rb') as video:
-                            update.effective_chat.send_video(
-                                video=video,
-                                caption=f"🎬 ویدیوی اینستاگرام | کیفیت: {quality}\n🔗 {url}",
-                                supports_streaming=True
-                            )
-                            
-                        status_message.edit_text(STATUS_MESSAGES["complete"])
-                        
-                        # افزودن به آمار
-                        if STATS_ENABLED:
-                            try:
-                                StatsManager.add_download_record(update.effective_user, "instagram", quality, os.path.getsize(file_path))
-                            except Exception as e:
-                                logger.error(f"خطا در ثبت آمار: {e}")
-                    except Exception as e:
-                        logger.error(f"خطا در آپلود ویدیو: {e}")
-                        status_message.edit_text(ERROR_MESSAGES["telegram_upload"])
-                        return
-                
-                # اضافه کردن دکمه "دانلود مجدد" به پیام کامل شده
-                keyboard = [
-                    [InlineKeyboardButton("⬇️ دانلود با کیفیت دیگر", callback_data=f"redownload_{url}")],
-                    [InlineKeyboardButton("🔍 دانلود لینک جدید", callback_data="new_download")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                status_message.edit_text(
-                    f"✅ دانلود با موفقیت انجام شد!\n\n" +
-                    f"📌 نوع: {'صوتی' if is_audio else 'ویدیویی'}\n" +
-                    (f"🎬 کیفیت: {quality}\n" if not is_audio else "") +
-                    f"⏱ زمان پردازش: {int(download_time)} ثانیه",
-                    reply_markup=reply_markup
-                )
+                    # آپلود فایل از طریق صف آپلود (هندلر بلافاصله آزاد می‌شود)
+                    upload_path = file_path
+                    _edit_status_sync(status_message, STATUS_MESSAGES["uploading"])
+                    if split_parts:
+                        upload_pipeline.submit_parts_sync(
+                            context.bot, update.effective_chat.id, split_parts, "video",
+                            caption=f"🎬 ویدیوی اینستاگرام | کیفیت: {quality}\n🔗 {url}",
+                            on_done=on_upload_done
+                        )
+                    else:
+                        upload_pipeline.submit_sync(
+                            context.bot, update.effective_chat.id, file_path, "video",
+                            caption=f"🎬 ویدیوی اینستاگرام | کیفیت: {quality}\n🔗 {url}",
+                            on_done=on_upload_done
+                        )
             except Exception as e:
                 logger.error(f"خطا در دانلود اینستاگرام با گزینه: {e}")
                 logger.error(traceback.format_exc())
                 if status_message:
-                    status_message.edit_text(ERROR_MESSAGES["generic_error"])
+                    _edit_status_sync(status_message, ERROR_MESSAGES["generic_error"])
         
+        def fetch_youtube_option_sync(url, selected_option, is_audio, progress_hook, extra_opts=None):
+            """
+            دانلود یک گزینه یوتیوب با yt-dlp (مشترک بین هندلر دانلود و دانلود پیش‌دستانه)
+
+            Args:
+                url: آدرس ویدیو
+                selected_option: گزینه انتخاب شده
+                is_audio: دانلود فقط صدا
+                progress_hook: hook پیشرفت yt-dlp
+                extra_opts: تنظیمات اضافه yt-dlp (مثلاً محدودیت سرعت دانلود پیش‌دستانه)
+
+            Returns:
+                مسیر فایل دانلود شده
+            """
+            quality = selected_option.get('quality', 'best')
+            if is_audio:
+                # دانلود فقط صدا
+                ydl_opts = {
+                    'format': 'bestaudio/best',
+                    'outtmpl': os.path.join(TEMP_DOWNLOAD_DIR, 'youtube', 'yt_audio_%(id)s.%(ext)s'),
+                    'postprocessors': [{
+                        'key': 'FFmpegExtractAudio',
+                        'preferredcodec': 'mp3',
+                        'preferredquality': '192',
+                    }],
+                    'cookies': YOUTUBE_COOKIE_FILE,
+                    'quiet': True,
+                    'no_warnings': True,
+                    'progress_hooks': [progress_hook]
+                }
+                ydl_opts.update(extra_opts or {})
+
+                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    info = ydl.extract_info(url, download=True)
+                    video_id = info.get('id', '')
+                    return os.path.join(TEMP_DOWNLOAD_DIR, 'youtube', f'yt_audio_{video_id}.mp3')
+
+            # دانلود ویدیو - اینجا از format_id استفاده می‌کنیم
+            format_id = selected_option.get('format_id', '')
+
+            ydl_opts = {
+                'format': format_id if format_id else f'best[height<={quality[:-1]}]',
+                'outtmpl': os.path.join(TEMP_DOWNLOAD_DIR, 'youtube', '%(title)s-%(id)s_video_%(resolution)s.%(ext)s'),
+                'cookies': YOUTUBE_COOKIE_FILE,
+                'quiet': True,
+                'no_warnings': True,
+                'progress_hooks': [progress_hook]
+            }
+            ydl_opts.update(extra_opts or {})
+
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=True)
+                file_path = ydl.prepare_filename(info)
+                # بررسی وجود فایل با پسوندهای مختلف در صورتی که ydl پسوند را تغییر داده باشد
+                if not os.path.exists(file_path):
+                    for ext in ['mp4', 'webm', 'mkv']:
+                        test_path = os.path.splitext(file_path)[0] + f'.{ext}'
+                        if os.path.exists(test_path):
+                            file_path = test_path
+                            break
+                return file_path
+
+        def fetch_youtube_playlist_sync(url, selected_option, is_audio, user_id):
+            """
+            دانلود موازی ویدیوهای پلی‌لیست و ساخت فایل ZIP
+
+            Args:
+                url: آدرس پلی‌لیست
+                selected_option: گزینه انتخاب شده
+                is_audio: دانلود فقط صدا
+                user_id: شناسه کاربر برای نوبت‌دهی منصفانه
+
+            Returns:
+                مسیر فایل ZIP
+            """
+            quality = selected_option.get('quality', 'best')
+            ydl_opts = {'cookies': YOUTUBE_COOKIE_FILE}
+            if is_audio:
+                ydl_opts.update({
+                    'format': 'bestaudio/best',
+                    'postprocessors': [{
+                        'key': 'FFmpegExtractAudio',
+                        'preferredcodec': 'mp3',
+                        'preferredquality': '192',
+                    }],
+                })
+            else:
+                ydl_opts['format'] = selected_option.get('format') or f'best[height<={quality[:-1]}]/best'
+            return asyncio.run(download_playlist(url, ydl_opts, os.path.join(TEMP_DOWNLOAD_DIR, 'youtube'),
+                                                 user_id=user_id))
+
+        def start_prefetch_sync(user_id, platform, url, options):
+            """
+            شروع دانلود پیش‌دستانه گزینه محتمل پس از نمایش کیبورد گزینه‌ها
+
+            Args:
+                user_id: شناسه کاربر
+                platform: youtube یا instagram
+                url: آدرس محتوا
+                options: گزینه‌های نمایش داده شده
+            """
+            try:
+                predicted = prefetch_manager.predict(user_id, platform, [o.get('quality') for o in options])
+                if not predicted:
+                    return
+
+                if platform == 'instagram':
+                    # همه گزینه‌های اینستاگرام از فایل با بهترین کیفیت ساخته می‌شوند،
+                    # بنابراین فایل منبع پیش‌دستانه دانلود می‌شود
+                    instagram_dl = InstagramDownloader()
+                    # اجرا مستقیم در ترد پیش‌دستانه تا ظرفیت پول اجرایی دانلود اشغال نشود
+                    prefetch_manager.start(url, 'best', lambda hook: asyncio.run(
+                        instagram_dl._download_with_ytdlp(url, "", "best", progress_hook=hook,
+                                                          extra_opts=prefetch_manager.ytdlp_limits())))
+                    return
+
+                option = next(o for o in options if o.get('quality') == predicted)
+                is_audio = option.get('format_note', '').lower() == 'audio only' or predicted == 'audio'
+                prefetch_manager.start(url, predicted, lambda hook: fetch_youtube_option_sync(
+                    url, option, is_audio, hook, extra_opts=prefetch_manager.ytdlp_limits()))
+            except Exception as e:
+                logger.warning(f"خطا در شروع دانلود پیش‌دستانه: {e}")
+
         def download_youtube_sync(update, context, url, quality, status_message):
             """نسخه sync از download_youtube"""
             try:
@@ -5238,13 +5458,16 @@ async def main():
                 download_youtube_with_option_sync(update, context, url, selected_option, status_message)
             except Exception as e:
                 logger.error(f"خطا در دانلود یوتیوب: {e}")
-                status_message.edit_text(ERROR_MESSAGES["generic_error"])
+                _edit_status_sync(status_message, ERROR_MESSAGES["generic_error"])
         
         def download_youtube_with_option_sync(update, context, url, selected_option, status_message=None):
             """نسخه sync از download_youtube_with_option"""
             user_id = update.effective_user.id
             quality = selected_option.get('quality', 'best')
             logger.info(f"شروع دانلود یوتیوب برای کاربر {user_id} با کیفیت {quality}")
+            prefetch_manager.record_choice(user_id, 'youtube', quality)
+            # لغو دانلودهای پیش‌دستانه گزینه‌های دیگر
+            prefetch_manager.cancel(url, keep=quality)
             
             try:
                 # اگر پیام وضعیت ارائه نشده باشد، آن را ایجاد کن
@@ -5256,11 +5479,12 @@ async def main():
                 
                 # نوع دانلود را تعیین کن
                 is_audio = selected_option.get('format_note', '').lower() == 'audio only' or quality == 'audio'
+                is_playlist = 'playlist' in selected_option.get('id', '') and is_youtube_playlist(url)
                 
                 if is_audio:
-                    status_message.edit_text(STATUS_MESSAGES["downloading_audio"])
+                    _edit_status_sync(status_message, STATUS_MESSAGES["downloading_audio"])
                 else:
-                    status_message.edit_text(STATUS_MESSAGES["downloading"])
+                    _edit_status_sync(status_message, STATUS_MESSAGES["downloading"])
                 
                 # دانلود را انجام بده
                 youtube_dl = YouTubeDownloader()
@@ -5280,48 +5504,23 @@ async def main():
                     # ایجاد و شروع تایمر برای اندازه‌گیری زمان دانلود
                     download_timer = time.time()
                 
-                    # انتخاب روش دانلود بر اساس نوع
-                    if is_audio:
-                        # دانلود فقط صدا
-                        ydl_opts = {
-                            'format': 'bestaudio/best',
-                            'outtmpl': os.path.join(TEMP_DOWNLOAD_DIR, 'youtube', 'yt_audio_%(id)s.%(ext)s'),
-                            'postprocessors': [{
-                                'key': 'FFmpegExtractAudio',
-                                'preferredcodec': 'mp3',
-                                'preferredquality': '192',
-                            }],
-                            'cookies': YOUTUBE_COOKIE_FILE,
-                            'quiet': True,
-                            'no_warnings': True
-                        }
-                        
-                        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                            info = ydl.extract_info(url, download=True)
-                            video_id = info.get('id', '')
-                            file_path = os.path.join(TEMP_DOWNLOAD_DIR, 'youtube', f'yt_audio_{video_id}.mp3')
-                    else:
-                        # دانلود ویدیو - اینجا از format_id استفاده می‌کنیم
-                        format_id = selected_option.get('format_id', '')
-                        
-                        ydl_opts = {
-                            'format': format_id if format_id else f'best[height<={quality[:-1]}]',
-                            'outtmpl': os.path.join(TEMP_DOWNLOAD_DIR, 'youtube', '%(title)s-%(id)s_video_%(resolution)s.%(ext)s'),
-                            'cookies': YOUTUBE_COOKIE_FILE,
-                            'quiet': True,
-                            'no_warnings': True
-                        }
-                        
-                        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                            info = ydl.extract_info(url, download=True)
-                            file_path = ydl.prepare_filename(info)
-                            # بررسی وجود فایل با پسوندهای مختلف در صورتی که ydl پسوند را تغییر داده باشد
-                            if not os.path.exists(file_path):
-                                for ext in ['mp4', 'webm', 'mkv']:
-                                    test_path = os.path.splitext(file_path)[0] + f'.{ext}'
-                                    if os.path.exists(test_path):
-                                        file_path = test_path
-                                        break
+                    # بروزرسانی پیام وضعیت با پیشرفت دانلود (ادغام شده و با محدودیت نرخ)
+                    status_editor = _message_status_editor(status_message)
+                    try:
+                        progress_hook = status_editor.ytdlp_hook(
+                            STATUS_MESSAGES["downloading_audio"] if is_audio else STATUS_MESSAGES["downloading"])
+                        # تحویل فایل دانلود پیش‌دستانه (در صورت وجود) یا دانلود عادی
+                        if is_playlist:
+                            # هر ویدیوی پلی‌لیست جداگانه از زمان‌بند منصفانه جا می‌گیرد
+                            file_path = fetch_youtube_playlist_sync(url, selected_option, is_audio, user_id)
+                        else:
+                            file_path = prefetch_manager.claim(url, quality, progress_hook=progress_hook)
+                        if not file_path and not is_playlist:
+                            # نوبت‌دهی منصفانه (درخواست تعاملی بر آیتم‌های دسته‌ای مقدم است)
+                            with fair_scheduler.slot(user_id, CLASS_INTERACTIVE):
+                                file_path = fetch_youtube_option_sync(url, selected_option, is_audio, progress_hook)
+                    finally:
+                        status_editor.close()
                     
                     download_time = time.time() - download_timer
                     logger.info(f"دانلود با کیفیت {quality} در {download_time:.2f} ثانیه کامل شد")
@@ -5336,14 +5535,29 @@ async def main():
                 
                 if not file_path or not os.path.exists(file_path):
                     logger.error(f"خطا: مسیر فایل نامعتبر است - {file_path}")
-                    status_message.edit_text(ERROR_MESSAGES["download_failed"])
+                    _edit_status_sync(status_message, ERROR_MESSAGES["download_failed"])
                     return
                 
                 # بررسی حجم فایل
                 file_size = os.path.getsize(file_path)
-                if file_size > MAX_TELEGRAM_FILE_SIZE and not is_audio:
+                split_parts = None
+                if file_size > MAX_TELEGRAM_FILE_SIZE and is_playlist:
+                    _edit_status_sync(status_message, ERROR_MESSAGES["file_too_large"])
+                    return
+                
+                if file_size > MAX_TELEGRAM_FILE_SIZE and MEDIA_SPLIT_ENABLED:
+                    # تلاش برای تقسیم فایل به چند بخش بدون انکود مجدد
+                    _edit_status_sync(status_message, STATUS_MESSAGES["splitting"])
+                    status_editor = _message_status_editor(status_message)
+                    try:
+                        split_parts = split_media(file_path, MAX_TELEGRAM_FILE_SIZE,
+                                                  status_editor.ffmpeg_callback(STATUS_MESSAGES["splitting"]))
+                    finally:
+                        status_editor.close()
+                
+                if file_size > MAX_TELEGRAM_FILE_SIZE and not is_audio and not split_parts:
                     logger.warning(f"فایل خیلی بزرگ است ({file_size} بایت)، در حال کاهش کیفیت...")
-                    status_message.edit_text(f"⚠️ فایل بسیار بزرگ است ({human_readable_size(file_size)}). در حال پردازش کیفیت پایین‌تر...")
+                    _edit_status_sync(status_message, f"⚠️ فایل بسیار بزرگ است ({human_readable_size(file_size)}). در حال پردازش کیفیت پایین‌تر...")
                     
                     # تلاش برای تبدیل به کیفیت پایین‌تر
                     try:
@@ -5354,34 +5568,20 @@ async def main():
                             logger.info(f"فایل با موفقیت به کیفیت پایین‌تر تبدیل شد: {file_path}")
                         else:
                             logger.error("تبدیل به کیفیت پایین‌تر ناموفق بود")
-                            status_message.edit_text(ERROR_MESSAGES["file_too_large"])
+                            _edit_status_sync(status_message, ERROR_MESSAGES["file_too_large"])
                             return
                     except Exception as e:
                         logger.error(f"خطا در تبدیل به کیفیت پایین‌تر: {e}")
-                        status_message.edit_text(ERROR_MESSAGES["file_too_large"])
+                        _edit_status_sync(status_message, ERROR_MESSAGES["file_too_large"])
                         return
                 
-                # آپلود فایل به تلگرام
-                status_message.edit_text(STATUS_MESSAGES["uploading"])
+                # آپلود فایل به تلگرام از طریق صف آپلود (هندلر بلافاصله آزاد می‌شود)
+                _edit_status_sync(status_message, STATUS_MESSAGES["uploading"])
                 
-                try:
-                    if is_audio:
-                        # آپلود به عنوان فایل صوتی
-                        with open(file_path, 'rb') as audio:
-                            update.effective_chat.send_audio(
-                                audio=audio,
-                                title=os.path.basename(file_path),
-                                caption=f"🎵 فایل صوتی از یوتیوب\n🔗 {url}",
-                                performer="YouTube Audio"
-                            )
-                    else:
-                        # آپلود به عنوان ویدیو
-                        with open(file_path, 'rb') as video:
-                            update.effective_chat.send_video(
-                                video=video,
-                                caption=f"🎬 ویدیوی یوتیوب | کیفیت: {quality}\n🔗 {url}",
-                                supports_streaming=True
-                            )
+                def on_upload_done(success):
+                    if not success:
+                        _edit_status_sync(status_message, ERROR_MESSAGES["telegram_upload"])
+                        return
                     
                     # افزودن به آمار
                     if STATS_ENABLED:
@@ -5396,31 +5596,62 @@ async def main():
                     ]
                     reply_markup = InlineKeyboardMarkup(keyboard)
                     
-                    status_message.edit_text(
+                    _edit_status_sync(status_message, 
                         f"✅ دانلود با موفقیت انجام شد!\n\n" +
                         f"📌 نوع: {'صوتی' if is_audio else 'ویدیویی'}\n" +
                         (f"🎬 کیفیت: {quality}\n" if not is_audio else "") +
                         f"⏱ زمان پردازش: {int(download_time)} ثانیه",
                         reply_markup=reply_markup
                     )
-                except Exception as e:
-                    logger.error(f"خطا در آپلود فایل: {e}")
-                    status_message.edit_text(ERROR_MESSAGES["telegram_upload"])
+                
+                if split_parts:
+                    # آپلود بخش‌های فایل تقسیم شده به ترتیب
+                    parts_caption = "🎵 فایل صوتی از یوتیوب" if is_audio else f"🎬 ویدیوی یوتیوب | کیفیت: {quality}"
+                    upload_pipeline.submit_parts_sync(
+                        context.bot, update.effective_chat.id, split_parts, "audio" if is_audio else "video",
+                        caption=f"{parts_caption}\n🔗 {url}",
+                        on_done=on_upload_done
+                    )
+                elif is_playlist:
+                    # آپلود فایل ZIP پلی‌لیست به عنوان سند
+                    upload_pipeline.submit_sync(
+                        context.bot, update.effective_chat.id, file_path, "document",
+                        caption=f"📁 پلی‌لیست دانلود شده از یوتیوب\n💾 حجم: {human_readable_size(file_size)}\n🔗 {url}",
+                        on_done=on_upload_done
+                    )
+                elif is_audio:
+                    # آپلود به عنوان فایل صوتی
+                    upload_pipeline.submit_sync(
+                        context.bot, update.effective_chat.id, file_path, "audio",
+                        caption=f"🎵 فایل صوتی از یوتیوب\n🔗 {url}",
+                        on_done=on_upload_done,
+                        title=os.path.basename(file_path),
+                        performer="YouTube Audio"
+                    )
+                else:
+                    # آپلود به عنوان ویدیو
+                    upload_pipeline.submit_sync(
+                        context.bot, update.effective_chat.id, file_path, "video",
+                        caption=f"🎬 ویدیوی یوتیوب | کیفیت: {quality}\n🔗 {url}",
+                        on_done=on_upload_done
+                    )
             except Exception as e:
                 logger.error(f"خطا در دانلود یوتیوب با گزینه: {e}")
                 logger.error(traceback.format_exc())
                 if status_message:
-                    status_message.edit_text(ERROR_MESSAGES["generic_error"])
+                    _edit_status_sync(status_message, ERROR_MESSAGES["generic_error"])
             
         # ثبت هندلرهای کالبک دکمه‌ها
         from telegram_handlers import handle_menu_button
         
         # هندلر کالبک دکمه‌های دانلود (برای دکمه‌های دانلود فایل)
         # این هندلر باید اول ثبت شود زیرا اولویت بیشتری دارد
-        app.add_handler(CallbackQueryHandler(handle_download_option_sync, pattern="^dl_"))
+        add_handler(app, CallbackQueryHandler(
+            admission_gate(handle_download_option if use_async_handlers else handle_download_option_sync),
+            pattern="^dl_"))
         
         # هندلر کالبک دکمه‌های منو (برای دکمه‌های بازگشت و راهنما)
-        app.add_handler(CallbackQueryHandler(handle_menu_button, pattern="^(back_to_start|help|about|help_video|help_audio|help_bulk|mydownloads)$"))
+        add_handler(app, CallbackQueryHandler(handle_menu_button, pattern="^(back_to_start|help|about|help_video|help_audio|help_bulk|mydownloads)$"))
         
         # افزودن هندلرهای دانلود موازی
         try:
@@ -5436,16 +5667,23 @@ async def main():
         asyncio.create_task(run_periodic_cleanup(app))
         
         # راه‌اندازی ربات مطابق با نسخه کتابخانه
+        webhook_server = None
         try:
             # برای نسخه 20.x
             await app.initialize()
             await app.start()
-            await app.updater.start_polling()
+            if WEBHOOK_MODE:
+                webhook_server = await start_webhook(app)
+            else:
+                await app.updater.start_polling()
             logger.info("ربات با API نسخه 20.x راه‌اندازی شد")
         except AttributeError:
             # برای نسخه 13.x
             try:
-                updater.start_polling()
+                if WEBHOOK_MODE:
+                    webhook_server = await start_webhook(app)
+                else:
+                    updater.start_polling()
                 logger.info("ربات با API نسخه 13.x راه‌اندازی شد")
             except Exception as e:
                 logger.error(f"خطا در راه‌اندازی polling: {e}")
@@ -5466,6 +5704,9 @@ async def main():
                 except Exception as e:
                     logger.error(f"خطا در اجرای idle: {e}")
         finally:
+            # توقف سرور webhook
+            if webhook_server is not None:
+                await webhook_server.stop()
             # حذف فایل قفل هنگام خروج
             if os.path.exists(lock_file):
                 os.remove(lock_file)
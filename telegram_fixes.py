@@ -10,15 +10,28 @@
 
 import os
 import re
+import time
 import uuid
 import logging
 import asyncio
 import tempfile
 import subprocess
-from typing import Optional, Dict, Tuple, List
+from typing import Callable, Optional, Dict, Tuple, List
 
 import yt_dlp
 from audio_processing import extract_audio, is_video_file, is_audio_file
+from ffmpeg_runner import run_ffmpeg, run_ffmpeg_async
+
+try:
+    import variant_cache
+except ImportError:
+    variant_cache = None
+
+try:
+    from encoder_tuning import select_encoder_settings, probe_duration
+except ImportError:
+    select_encoder_settings = None
+    probe_duration = None
 
 # تنظیم مسیر پیشفرض ffmpeg
 def get_ffmpeg_path():
@@ -76,6 +89,19 @@ os.makedirs(DEFAULT_DOWNLOAD_DIR, exist_ok=True)
 # تنظیمات FFmpeg
 DEFAULT_FFMPEG_PATH = FFMPEG_PATH  # استفاده از مسیر تشخیص داده شده
 
+# ارتفاع کیفیت‌های استاندارد برای تبدیل چندگانه (یک دیکود، چند خروجی)
+LADDER_QUALITY_HEIGHTS = {
+    "1080p": 1080,
+    "720p": 720,
+    "480p": 480,
+    "360p": 360,
+    "240p": 240
+}
+# کیفیت‌هایی که هنگام اولین تبدیل یک ویدیو همراه با کیفیت درخواستی ساخته می‌شوند (مثلاً "720p,480p,360p")
+LADDER_PREWARM_QUALITIES = [q.strip() for q in os.environ.get('LADDER_PREWARM_QUALITIES', '').split(',') if q.strip()]
+# تنظیمات صدای نسخه‌های کش شونده (مشترک بین تبدیل اصلی و تبدیل چندگانه تا یک کلید کش یک خروجی داشته باشد)
+VARIANT_AUDIO_OPTIONS = ['-c:a', 'aac', '-b:a', '96k', '-ac', '2', '-ar', '44100']
+
 # تعیین کیفیت‌های استاندارد ویدیو با گزینه‌های پیشرفته و بهینه‌سازی شده برای تناسب حجم با کیفیت
 # نقشه کیفیت‌های ویدیو با مشخصات کامل برای پردازش
 VIDEO_QUALITY_MAP = {
@@ -492,8 +518,8 @@ async def download_with_quality(url: str, quality: str = 'best', is_audio: bool
         # اگر فایل ویدیویی است و کاربر صدا درخواست کرده، استخراج صدا
         if is_audio and is_video_file(downloaded_file):
             logger.info(f"استخراج صدا از ویدیو: {downloaded_file}")
-            # استفاده از yt-dlp برای استخراج صدا
-            audio_file = extract_audio(downloaded_file, 'mp3', '192k')
+            # استفاده از yt-dlp برای استخراج صدا (خارج از event loop)
+            audio_file = await loop.run_in_executor(None, extract_audio, downloaded_file, 'mp3', '192k')
             if audio_file:
                 logger.info(f"فایل صوتی با موفقیت استخراج شد: {audio_file}")
                 return audio_file
@@ -517,12 +543,7 @@ async def download_with_quality(url: str, quality: str = 'best', is_audio: bool
                 ]
                 
                 try:
-                    result = subprocess.run(
-                        cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        text=True
-                    )
+                    result = await run_ffmpeg_async(cmd)
                     
                     if result.returncode == 0 and os.path.exists(audio_path):
                         logger.info(f"استخراج صدا با FFmpeg موفق: {audio_path}")
@@ -546,7 +567,61 @@ async def download_with_quality(url: str, quality: str = 'best', is_audio: bool
         logger.error(f"جزئیات خطا: {traceback.format_exc()}")
         return None
 
-def convert_video_quality(video_path: str, quality: str = "720p", is_audio_request: bool = False) -> Optional[str]:
+def get_encoder_settings(video_path: str, target_height: int, default_preset: str = 'ultrafast', default_crf: int = 30) -> Dict:
+    """
+    دریافت preset و CRF مناسب این ماشین از پروفایل بنچمارک (encoder_tuning)
+    
+    Args:
+        video_path: مسیر فایل ویدیویی اصلی
+        target_height: ارتفاع هدف
+        default_preset: پریست پیش‌فرض در صورت نبود پروفایل
+        default_crf: CRF پیش‌فرض در صورت نبود پروفایل
+        
+    Returns:
+        دیکشنری {'preset': ..., 'crf': ...}
+    """
+    if not select_encoder_settings:
+        return {'preset': default_preset, 'crf': default_crf}
+    duration = probe_duration(video_path) if probe_duration else None
+    return select_encoder_settings(target_height, duration, default_preset=default_preset, default_crf=default_crf)
+
+def get_variant_profile(video_path: str, quality: str, target_height: int) -> str:
+    """ساخت پروفایل کش نسخه‌ها شامل تنظیمات انکودر انتخاب شده"""
+    settings = get_encoder_settings(video_path, target_height)
+    return variant_cache.build_profile(quality, target_height, preset=settings['preset'], crf=settings['crf'])
+
+def get_variant_scale_filter(target_height: int) -> str:
+    """فیلتر مقیاس‌بندی نسخه‌های کش شونده (مشترک بین تبدیل تکی و تبدیل چندگانه)"""
+    return f"scale=-2:{target_height}:force_original_aspect_ratio=decrease,format=yuv420p"
+
+def get_variant_video_options(video_path: str, target_height: int) -> List[str]:
+    """
+    گزینه‌های انکود ویدیوی نسخه‌های کش شونده
+
+    تبدیل تکی و تبدیل چندگانه خروجی خود را با یک کلید کش ثبت می‌کنند، بنابراین هر گزینه‌ای
+    که روی خروجی اثر دارد فقط در این تابع تعیین می‌شود.
+
+    Args:
+        video_path: مسیر فایل ویدیویی اصلی
+        target_height: ارتفاع هدف
+
+    Returns:
+        لیست آرگومان‌های ffmpeg برای یک خروجی
+    """
+    encoder_settings = get_encoder_settings(video_path, target_height)
+    return [
+        '-c:v', 'libx264',
+        '-preset', encoder_settings['preset'],  # حالت انکود (از پروفایل میزبان)
+        '-tune', 'zerolatency',                 # بهینه‌سازی برای تأخیر صفر
+        '-crf', str(encoder_settings['crf']),   # کیفیت (از پروفایل میزبان؛ بدون سقف بیت‌ریت)
+        '-g', '48',                             # فاصله بین I-frames
+        '-sc_threshold', '0',                   # غیرفعال کردن تغییر صحنه برای سرعت بیشتر
+        '-rc_lookahead', '0',                   # حذف look-ahead برای سرعت بیشتر
+        '-threads', '8',                        # تعداد تردهای انکودر
+    ]
+
+def convert_video_quality(video_path: str, quality: str = "720p", is_audio_request: bool = False, use_ladder: bool = True,
+                          progress_callback: Optional[Callable[[Dict], None]] = None) -> Optional[str]:
     """
     تبدیل کیفیت ویدیو با استفاده از ffmpeg (روش فوق پیشرفته با چندین بهینه‌سازی)
     
@@ -554,6 +629,8 @@ def convert_video_quality(video_path: str, quality: str = "720p", is_audio_reque
         video_path: مسیر فایل ویدیویی اصلی
         quality: کیفیت هدف (1080p, 720p, 480p, 360p, 240p, audio)
         is_audio_request: آیا خروجی باید فایل صوتی باشد
+        use_ladder: ساخت همزمان کیفیت‌های LADDER_PREWARM_QUALITIES با یک بار دیکود
+        progress_callback: تابع دریافت پیشرفت ffmpeg (مثلاً StatusEditor.ffmpeg_callback)
         
     Returns:
         مسیر فایل تبدیل شده یا None در صورت خطا
@@ -629,9 +706,6 @@ def convert_video_quality(video_path: str, quality: str = "720p", is_audio_reque
         
         logger.info(f"استفاده از {thread_count} هسته پردازشی برای تبدیل ویدیو")
         
-        # فورس کردن تبدیل کیفیت با مکانیزم پیشرفته
-        force_conversion = True
-        
         # تبدیل quality به رشته اگر عدد باشد
         if isinstance(quality, (int, float)):
             logger.info(f"تبدیل کیفیت عددی {quality} به رشته")
@@ -655,11 +729,9 @@ def convert_video_quality(video_path: str, quality: str = "720p", is_audio_reque
             elif "360" in quality or "low" in quality.lower():
                 logger.info(f"کیفیت {quality} به 360p نگاشت شد.")
                 quality = "360p"
-                force_conversion = True  # فورس تبدیل کیفیت برای 360p
             elif "240" in quality or "very" in quality.lower() or "lowest" in quality.lower():
                 logger.info(f"کیفیت {quality} به 240p نگاشت شد.")
                 quality = "240p"
-                force_conversion = True  # فورس تبدیل کیفیت برای 240p
             else:
                 # اگر هیچ تطابقی پیدا نشد، از کیفیت 720p استفاده می‌کنیم
                 logger.warning(f"کیفیت {quality} پشتیبانی نمی‌شود. استفاده از 720p به جای آن.")
@@ -674,14 +746,25 @@ def convert_video_quality(video_path: str, quality: str = "720p", is_audio_reque
         file_name, file_ext = os.path.splitext(os.path.basename(video_path))
         converted_file = os.path.join(file_dir, f"{file_name}_video_{quality}{file_ext}")
         
-        # بررسی وجود فایل از قبل (فقط در صورتی که فورس تبدیل نباشد)
-        if not force_conversion and os.path.exists(converted_file):
-            logger.info(f"فایل تبدیل شده از قبل وجود دارد: {converted_file}")
-            return converted_file
+        # جستجو در کش نسخه‌ها قبل از هر اجرای ffmpeg
+        variant_profile = None
+        if variant_cache:
+            variant_profile = get_variant_profile(video_path, quality, target_height)
+            cached_variant = variant_cache.lookup(video_path, variant_profile, converted_file)
+            if cached_variant:
+                logger.info(f"نسخه {quality} از کش بازیابی شد: {cached_variant}")
+                return cached_variant
             
-        # اگر فورس تبدیل باشد و فایل از قبل وجود داشته باشد، آن را حذف می‌کنیم
-        if force_conversion and os.path.exists(converted_file):
-            logger.info(f"حذف فایل قبلی برای تبدیل اجباری: {converted_file}")
+        # اگر پیش‌گرم کردن فعال است، کیفیت درخواستی همراه با سایر کیفیت‌ها با یک دیکود ساخته می‌شود
+        if use_ladder and quality in LADDER_QUALITY_HEIGHTS and any(q != quality for q in LADDER_PREWARM_QUALITIES):
+            ladder_results = convert_video_ladder(video_path, [quality] + LADDER_PREWARM_QUALITIES,
+                                                  progress_callback=progress_callback)
+            if ladder_results.get(quality):
+                return ladder_results[quality]
+            
+        # حذف خروجی قدیمی که در کش ثبت نشده است (ممکن است ناقص باشد)
+        if os.path.exists(converted_file):
+            logger.info(f"حذف فایل قبلی برای تبدیل مجدد: {converted_file}")
             try:
                 os.remove(converted_file)
             except Exception as e:
@@ -702,10 +785,15 @@ def convert_video_quality(video_path: str, quality: str = "720p", is_audio_reque
         for method_index, conversion_method in enumerate(conversion_methods):
             try:
                 logger.info(f"تلاش تبدیل کیفیت با روش {method_index + 1}: {conversion_method.__name__}")
-                result_file = conversion_method(video_path, quality, target_height, converted_file)
+                result_file = conversion_method(video_path, quality, target_height, converted_file,
+                                                progress_callback=progress_callback)
                 
-                if result_file and os.path.exists(result_file) and os.path.getsize(result_file) > 10000:
+                if result_file and os.path.exists(result_file) and os.path.getsize(result_file) > 10000 and result_file != video_path:
                     logger.info(f"روش {method_index + 1} ({conversion_method.__name__}) موفق: {result_file}")
+                    # ثبت خروجی در کش نسخه‌ها برای درخواست‌های بعدی (فقط روش اصلی؛ روش‌های پشتیبان
+                    # تنظیمات صدا و تصویر متفاوتی دارند و نباید با کلید همان پروفایل ذخیره شوند)
+                    if variant_cache and variant_profile and conversion_method is method_ffmpeg_advanced:
+                        variant_cache.store(video_path, variant_profile, result_file)
                     return result_file
                 else:
                     logger.warning(f"روش {method_index + 1} ({conversion_method.__name__}) ناموفق بود")
@@ -730,7 +818,8 @@ def convert_video_quality(video_path: str, quality: str = "720p", is_audio_reque
         # در صورت خطای کلی، فایل اصلی را برمی‌گردانیم
         return video_path
 
-def method_ffmpeg_advanced(video_path: str, quality: str, target_height: int, output_path: str) -> Optional[str]:
+def method_ffmpeg_advanced(video_path: str, quality: str, target_height: int, output_path: str,
+                           progress_callback: Optional[Callable[[Dict], None]] = None) -> Optional[str]:
     """روش پیشرفته با استفاده از ffmpeg با تنظیمات بهینه برای کیفیت و سرعت"""
     
     logger.info(f"روش پیشرفته ffmpeg برای تبدیل به کیفیت {quality}")
@@ -745,12 +834,7 @@ def method_ffmpeg_advanced(video_path: str, quality: str, target_height: int, ou
         video_path
     ]
     
-    probe_result = subprocess.run(
-        ffprobe_cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
+    probe_result = run_ffmpeg(ffprobe_cmd)
     
     original_width = 0
     original_height = 0
@@ -767,55 +851,25 @@ def method_ffmpeg_advanced(video_path: str, quality: str, target_height: int, ou
         except (ValueError, Exception) as e:
             logger.warning(f"خطا در تفسیر ابعاد: {e}")
     
-    # محاسبه عرض جدید با حفظ نسبت تصویر
-    # برای کیفیت‌های 360p و 240p، از روش ساده‌تر استفاده می‌کنیم
-    if quality in ["360p", "240p"]:
-        scale_filter = f"scale=-2:{target_height}"
-    else:
-        scale_filter = f'scale=-2:{target_height}:force_original_aspect_ratio=decrease,format=yuv420p'
-    
-    # بیت‌ریت هوشمندانه برای هر کیفیت - تنظیم شده برای اطمینان از تناسب حجم با کیفیت
-    video_bitrates = {
-        "1080p": "6000k",  # بیت‌ریت بالا برای 1080p (کاهش نسبت به قبل برای حجم منطقی‌تر)
-        "720p": "3500k",   # بیت‌ریت متوسط رو به بالا برای 720p (کاهش برای حل مشکل)
-        "480p": "2000k",   # بیت‌ریت متوسط
-        "360p": "1200k",   # بیت‌ریت متوسط رو به پایین
-        "240p": "700k"     # بیت‌ریت کم
-    }
-    
-    video_bitrate = video_bitrates.get(quality, "3000k")  # بیت‌ریت پیش‌فرض کمتر
-    
     # دستور ffmpeg فوق‌بهینه با پارامترهای تنظیم شده برای سرعت چندبرابری
     cmd = [
         FFMPEG_PATH, 
         '-hwaccel', 'auto',    # استفاده خودکار از شتاب‌دهنده سخت‌افزاری اگر موجود باشد
         '-i', video_path,
-        '-c:v', 'libx264',     # کدک ویدیو
-        '-c:a', 'aac',         # کدک صدا
-        '-b:a', '96k',         # کاهش بیت‌ریت صدا برای سرعت بیشتر
-        '-ac', '2',            # استریو (بهینه‌ترین حالت)
-        '-ar', '44100',        # نرخ نمونه‌برداری استاندارد
-        '-b:v', video_bitrate, # بیت‌ریت ویدیو
-        '-vf', scale_filter,   # فیلتر مقیاس‌بندی 
-        '-preset', 'ultrafast', # سریع‌ترین حالت انکود
-        '-tune', 'zerolatency', # بهینه‌سازی برای تأخیر صفر
-        '-crf', '30',          # کیفیت پایین‌تر برای سرعت بسیار بیشتر
-        '-g', '48',            # فاصله بین I-frames (افزایش برای سرعت بیشتر)
-        '-sc_threshold', '0',  # غیرفعال کردن تغییر صحنه برای سرعت بیشتر
+        '-vf', get_variant_scale_filter(target_height),  # فیلتر مقیاس‌بندی (مشترک با تبدیل چندگانه)
+        *get_variant_video_options(video_path, target_height),  # انکود ویدیو (مشترک با تبدیل چندگانه)
+        *VARIANT_AUDIO_OPTIONS, # صدای aac استریو 96k (مشترک با تبدیل چندگانه)
         '-max_muxing_queue_size', '9999',
         '-movflags', '+faststart',
-        '-threads', '8',       # افزایش تعداد هسته‌های پردازشی
         '-tile-columns', '6',  # بهینه‌سازی برای پردازش موازی
         '-frame-parallel', '1', # پردازش فریم‌های موازی
         '-deadline', 'realtime', # حداکثر سرعت
         '-cpu-used', '8',      # استفاده حداکثری از CPU
         '-static-thresh', '0', # حد آستانه استاتیک
         '-drop-threshold', '30', # امکان از دست دادن برخی فریم‌ها
-        '-rc_lookahead', '0',  # حذف کامل look-ahead برای سرعت بیشتر
         '-lag-in-frames', '0', # حذف تاخیر در فریم‌ها
         '-row-mt', '1',        # چند رشته‌ای در سطح ردیف
         '-use_timeline', '0',  # عدم استفاده از timeline
-        '-vsync', '0',        # حذف همگام‌سازی فریم
         '-f', 'mp4',           # فرمت خروجی
         '-y',                  # جایگزینی فایل موجود
         '-loglevel', 'error',  # فقط نمایش خطاها
@@ -826,12 +880,7 @@ def method_ffmpeg_advanced(video_path: str, quality: str, target_height: int, ou
     logger.debug(f"دستور FFMPEG: {' '.join(cmd)}")
     
     # اجرای دستور
-    result = subprocess.run(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
+    result = run_ffmpeg(cmd, progress_callback=progress_callback)
     
     # بررسی نتیجه
     if result.returncode == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 10000:
@@ -841,7 +890,8 @@ def method_ffmpeg_advanced(video_path: str, quality: str, target_height: int, ou
         logger.error(f"خطا در تبدیل کیفیت به روش پیشرفته: {result.stderr[:300]}...")
         return None
 
-def method_ffmpeg_simple(video_path: str, quality: str, target_height: int, output_path: str) -> Optional[str]:
+def method_ffmpeg_simple(video_path: str, quality: str, target_height: int, output_path: str,
+                         progress_callback: Optional[Callable[[Dict], None]] = None) -> Optional[str]:
     """روش ساده با استفاده از ffmpeg با تنظیمات ساده‌تر (احتمال سازگاری بالاتر)"""
     
     # مسیر فایل خروجی متفاوت برای جلوگیری از تداخل
@@ -863,6 +913,9 @@ def method_ffmpeg_simple(video_path: str, quality: str, target_height: int, outp
     
     video_bitrate = video_bitrates.get(quality, "3000k")  # بیت‌ریت پیش‌فرض کمتر
     
+    # پریست متناسب با سخت‌افزار (این روش بر اساس بیت‌ریت است و CRF ندارد)
+    encoder_settings = get_encoder_settings(video_path, target_height)
+    
     # دستور ffmpeg ساده‌تر با تنظیمات بهینه شده برای سرعت
     cmd = [
         FFMPEG_PATH, 
@@ -872,7 +925,7 @@ def method_ffmpeg_simple(video_path: str, quality: str, target_height: int, outp
         '-b:v', video_bitrate,         # بیت‌ریت ویدیو
         '-c:a', 'copy',                # فقط کپی صدا
         '-pix_fmt', 'yuv420p',         # فرمت پیکسل استاندارد
-        '-preset', 'ultrafast',        # سرعت فوق‌العاده بالا
+        '-preset', encoder_settings['preset'], # سرعت انکود (از پروفایل میزبان)
         '-tune', 'fastdecode',         # بهینه‌سازی برای دیکود سریع
         '-threads', '4',               # استفاده از 4 هسته پردازشی
         '-deadline', 'realtime',       # حالت سریع برای انکود
@@ -887,12 +940,7 @@ def method_ffmpeg_simple(video_path: str, quality: str, target_height: int, outp
     logger.debug(f"دستور FFMPEG: {' '.join(cmd)}")
     
     # اجرای دستور
-    result = subprocess.run(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
+    result = run_ffmpeg(cmd, progress_callback=progress_callback)
     
     # بررسی نتیجه
     if result.returncode == 0 and os.path.exists(simple_output_path) and os.path.getsize(simple_output_path) > 10000:
@@ -918,7 +966,8 @@ def method_ffmpeg_simple(video_path: str, quality: str, target_height: int, outp
         logger.error(f"خطا در تبدیل کیفیت به روش ساده: {result.stderr[:300]}...")
         return None
 
-def method_ffmpeg_native(video_path: str, quality: str, target_height: int, output_path: str) -> Optional[str]:
+def method_ffmpeg_native(video_path: str, quality: str, target_height: int, output_path: str,
+                         progress_callback: Optional[Callable[[Dict], None]] = None) -> Optional[str]:
     """روش با استفاده از فقط کدگذاری صوتی و تصویری با سازگاری بیشتر"""
     
     # مسیر فایل خروجی متفاوت برای جلوگیری از تداخل
@@ -948,12 +997,7 @@ def method_ffmpeg_native(video_path: str, quality: str, target_height: int, outp
     logger.info(f"در حال تبدیل ویدیو به کیفیت {quality} با روش بومی...")
     
     # اجرای دستور
-    result = subprocess.run(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
+    result = run_ffmpeg(cmd, progress_callback=progress_callback)
     
     # بررسی نتیجه
     if result.returncode == 0 and os.path.exists(native_output_path) and os.path.getsize(native_output_path) > 10000:
@@ -979,7 +1023,8 @@ def method_ffmpeg_native(video_path: str, quality: str, target_height: int, outp
         logger.error(f"خطا در تبدیل کیفیت به روش بومی: {result.stderr[:300]}...")
         return None
 
-def method_fallback(video_path: str, quality: str, target_height: int, output_path: str) -> Optional[str]:
+def method_fallback(video_path: str, quality: str, target_height: int, output_path: str,
+                    progress_callback: Optional[Callable[[Dict], None]] = None) -> Optional[str]:
     """روش پشتیبان نهایی با استفاده از دستورات بسیار ساده"""
     
     # مسیر فایل خروجی متفاوت برای جلوگیری از تداخل
@@ -1005,12 +1050,7 @@ def method_fallback(video_path: str, quality: str, target_height: int, output_pa
     logger.info(f"در حال تبدیل ویدیو به کیفیت {quality} با روش پشتیبان نهایی...")
     
     # اجرای دستور
-    result = subprocess.run(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
+    result = run_ffmpeg(cmd, progress_callback=progress_callback)
     
     # بررسی نتیجه
     if result.returncode == 0 and os.path.exists(fallback_output_path) and os.path.getsize(fallback_output_path) > 10000:
@@ -1039,6 +1079,126 @@ def method_fallback(video_path: str, quality: str, target_height: int, output_pa
         logger.info(f"همه روش‌ها ناموفق بودند. استفاده از فایل اصلی: {video_path}")
         return video_path
 
+def convert_video_ladder(video_path: str, qualities: List[str],
+                         progress_callback: Optional[Callable[[Dict], None]] = None) -> Dict[str, str]:
+    """
+    تبدیل یک ویدیو به چند کیفیت با یک بار دیکود (فیلتر split در یک اجرای ffmpeg)
+    
+    Args:
+        video_path: مسیر فایل ویدیویی اصلی
+        qualities: لیست کیفیت‌های هدف (مثلاً ['720p', '480p', '360p'])
+        progress_callback: تابع دریافت پیشرفت ffmpeg
+        
+    Returns:
+        دیکشنری کیفیت -> مسیر فایل تبدیل شده (فقط کیفیت‌های موفق)
+    """
+    results: Dict[str, str] = {}
+    
+    if not video_path or not os.path.exists(video_path):
+        logger.error(f"مسیر فایل ویدیویی نامعتبر است: {video_path}")
+        return results
+    
+    # حذف کیفیت‌های تکراری یا نامعتبر با حفظ ترتیب
+    requested = []
+    for quality in qualities:
+        quality = str(quality)
+        if quality in LADDER_QUALITY_HEIGHTS and quality not in requested:
+            requested.append(quality)
+        elif quality not in LADDER_QUALITY_HEIGHTS:
+            logger.warning(f"کیفیت {quality} در تبدیل چندگانه پشتیبانی نمی‌شود")
+    
+    file_dir = os.path.dirname(video_path)
+    file_name, file_ext = os.path.splitext(os.path.basename(video_path))
+    
+    # ابتدا کیفیت‌های موجود در کش نسخه‌ها را جدا می‌کنیم
+    pending = []
+    for quality in requested:
+        output_path = os.path.join(file_dir, f"{file_name}_video_{quality}{file_ext}")
+        if variant_cache:
+            profile = get_variant_profile(video_path, quality, LADDER_QUALITY_HEIGHTS[quality])
+            cached_variant = variant_cache.lookup(video_path, profile, output_path)
+            if cached_variant:
+                results[quality] = cached_variant
+                continue
+        pending.append((quality, output_path))
+    
+    if not pending:
+        return results
+    
+    # یک کیفیت تنها نیازی به گراف split ندارد
+    if len(pending) == 1:
+        quality = pending[0][0]
+        converted = convert_video_quality(video_path, quality, use_ladder=False, progress_callback=progress_callback)
+        if converted and converted != video_path:
+            results[quality] = converted
+        return results
+    
+    # ساخت گراف فیلتر: یک دیکود، split به N شاخه و مقیاس‌بندی هر شاخه
+    split_labels = ''.join(f"[s{i}]" for i in range(len(pending)))
+    filter_parts = [f"[0:v]split={len(pending)}{split_labels}"]
+    for i, (quality, _) in enumerate(pending):
+        filter_parts.append(f"[s{i}]{get_variant_scale_filter(LADDER_QUALITY_HEIGHTS[quality])}[v{i}]")
+    
+    cmd = [
+        FFMPEG_PATH,
+        '-i', video_path,
+        '-filter_complex', ';'.join(filter_parts),
+    ]
+    
+    # هر شاخه دقیقاً با گزینه‌های تبدیل تکی انکود می‌شود تا خروجی کلید کش مشترک یکسان باشد
+    for i, (quality, output_path) in enumerate(pending):
+        cmd.extend([
+            '-map', f'[v{i}]',
+            '-map', '0:a?',
+            *get_variant_video_options(video_path, LADDER_QUALITY_HEIGHTS[quality]),
+            *VARIANT_AUDIO_OPTIONS,
+            '-movflags', '+faststart',
+            '-y',
+            output_path
+        ])
+    
+    logger.info(f"تبدیل چندگانه با یک بار دیکود به کیفیت‌های: {', '.join(q for q, _ in pending)}")
+    logger.debug(f"دستور FFMPEG: {' '.join(cmd)}")
+    
+    start_time = time.time()
+    result = run_ffmpeg(cmd, progress_callback=progress_callback)
+    
+    if result.returncode != 0:
+        logger.error(f"خطا در تبدیل چندگانه: {result.stderr[:300]}...")
+    else:
+        logger.info(f"زمان تبدیل چندگانه: {time.time() - start_time:.2f} ثانیه")
+    
+    # انتشار خروجی‌های موفق در کش نسخه‌ها و تبدیل جداگانه خروجی‌های ناموفق
+    for quality, output_path in pending:
+        if result.returncode == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 10000:
+            results[quality] = output_path
+            if variant_cache:
+                profile = get_variant_profile(video_path, quality, LADDER_QUALITY_HEIGHTS[quality])
+                variant_cache.store(video_path, profile, output_path)
+        else:
+            logger.warning(f"خروجی {quality} در تبدیل چندگانه ایجاد نشد، تبدیل جداگانه...")
+            converted = convert_video_quality(video_path, quality, use_ladder=False)
+            if converted and converted != video_path:
+                results[quality] = converted
+    
+    return results
+
+def prewarm_variants(video_path: str, qualities: Optional[List[str]] = None) -> Dict[str, str]:
+    """
+    آماده‌سازی پیشاپیش نسخه‌های رایج یک ویدیو در کش نسخه‌ها
+    
+    Args:
+        video_path: مسیر فایل ویدیویی اصلی
+        qualities: کیفیت‌های هدف (پیش‌فرض LADDER_PREWARM_QUALITIES)
+        
+    Returns:
+        دیکشنری کیفیت -> مسیر فایل تبدیل شده
+    """
+    qualities = qualities or LADDER_PREWARM_QUALITIES
+    if not qualities:
+        return {}
+    return convert_video_ladder(video_path, qualities)
+
 def fallback_convert_video(video_path: str, quality: str) -> str:
     """
     روش پشتیبان برای تبدیل کیفیت ویدیو در صورت شکست روش اصلی
@@ -1110,12 +1270,7 @@ def fallback_convert_video(video_path: str, quality: str) -> str:
         logger.info(f"روش پشتیبان در حال اجرا: {' '.join(cmd)}")
         
         # اجرای دستور
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        result = run_ffmpeg(cmd)
         
         # بررسی نتیجه
         if result.returncode == 0 and os.path.exists(converted_file) and os.path.getsize(converted_file) > 10000:
@@ -1258,12 +1413,7 @@ def extract_audio_from_video(video_path: str, output_format: str = 'mp3', bitrat
                 audio_path
             ]
             
-            result = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
+            result = run_ffmpeg(cmd)
             
             if result.returncode == 0 and os.path.exists(audio_path):
                 logger.info(f"روش 4 موفق: {audio_path}")
@@ -1289,12 +1439,7 @@ def extract_audio_from_video(video_path: str, output_format: str = 'mp3', bitrat
                 audio_path
             ]
             
-            result = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
+            result = run_ffmpeg(cmd)
             
             if result.returncode == 0 and os.path.exists(audio_path):
                 logger.info(f"روش 5 موفق: {audio_path}")
@@ -1333,13 +1478,7 @@ def extract_audio_from_video(video_path: str, output_format: str = 'mp3', bitrat
                         audio_path
                     ]
                     
-                    result = subprocess.run(
-                        cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        text=True,
-                        timeout=60  # حداکثر 60 ثانیه منتظر باش
-                    )
+                    result = run_ffmpeg(cmd, timeout=60)
                     
                     if result.returncode == 0 and os.path.exists(audio_path):
                         logger.info(f"روش 6 موفق با {ffmpeg_path}: {audio_path}")
@@ -1410,7 +1549,7 @@ def convert_to_lower_quality(video_path: str) -> Optional[str]:
         ]
         
         # اجرای دستور
-        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        run_ffmpeg(cmd, check=True)
         
         if os.path.exists(output_path) and os.path.getsize(output_path) > 10240:  # حداقل 10KB
             logger.info(f"تبدیل موفق به کیفیت پایین‌تر: {output_path}")
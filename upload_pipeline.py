@@ -0,0 +1,717 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+صف آپلود جدا از دانلود برای ارسال فایل‌ها به تلگرام
+
+هندلرهای دانلود پس از آماده شدن فایل روی دیسک، آن را به این صف می‌سپارند و بلافاصله آزاد می‌شوند.
+صف آپلود:
+- تعداد آپلودهای همزمان را به صورت کلی و برای هر چت جداگانه محدود می‌کند
+- در صورت خطای RetryAfter (محدودیت flood تلگرام) آپلود را پس از زمان اعلام شده دوباره زمان‌بندی می‌کند
+  (تا سقف مجموع انتظار هر کار)
+- خطاهای موقت شبکه را با تأخیر افزایشی تکرار می‌کند
+- در صورت شکست ارسال صوتی، فایل را به عنوان سند ارسال می‌کند
+- فایل‌های تکی را با آپلود جریانی (streaming_upload) و بدون بارگذاری کامل در حافظه ارسال می‌کند
+
+هر دو نسخه python-telegram-bot پشتیبانی می‌شوند: submit برای هندلرهای آسنکرون (نسخه 20)
+و submit_sync برای هندلرهای همزمان (نسخه 13).
+"""
+
+import os
+import time
+import asyncio
+import inspect
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager, ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+try:
+    from telegram.error import RetryAfter, TimedOut, NetworkError
+except ImportError:
+    RetryAfter = TimedOut = NetworkError = None
+
+from local_bot_api import LOCAL_BOT_API_MODE, to_upload_input
+from streaming_upload import STREAMING_UPLOAD_ENABLED, get_base_url, upload_file
+from file_id_cache import extract_file_id, store_file_id
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# حداکثر آپلودهای همزمان در کل ربات
+UPLOAD_MAX_CONCURRENT = int(os.environ.get('UPLOAD_MAX_CONCURRENT', '4'))
+# حداکثر آپلودهای همزمان برای هر چت
+UPLOAD_MAX_PER_CHAT = int(os.environ.get('UPLOAD_MAX_PER_CHAT', '2'))
+# حداکثر تعداد تکرار برای خطاهای موقت شبکه
+UPLOAD_MAX_RETRIES = int(os.environ.get('UPLOAD_MAX_RETRIES', '3'))
+# تأخیر پایه تکرار برای خطاهای شبکه (به ثانیه)
+UPLOAD_RETRY_BASE_DELAY = 2.0
+# حداکثر مجموع انتظار flood برای یک کار آپلود (به ثانیه)؛ پس از آن آپلود ناموفق اعلام می‌شود
+UPLOAD_MAX_FLOOD_WAIT = float(os.environ.get('UPLOAD_MAX_FLOOD_WAIT', '600'))
+# حاشیه اضافه روی زمان انتظار اعلام شده توسط تلگرام (به ثانیه)
+RETRY_AFTER_MARGIN = 1.0
+
+# انواع فایل قابل ارسال
+KIND_VIDEO = 'video'
+KIND_AUDIO = 'audio'
+KIND_DOCUMENT = 'document'
+KIND_PHOTO = 'photo'
+
+# حداکثر تعداد آیتم‌های یک media group در تلگرام
+MEDIA_GROUP_MAX_ITEMS = 10
+
+
+def _retry_after_seconds(error: Exception) -> float:
+    """استخراج زمان انتظار از خطای RetryAfter (عدد یا timedelta بسته به نسخه کتابخانه)"""
+    retry_after = getattr(error, 'retry_after', 1)
+    if hasattr(retry_after, 'total_seconds'):
+        retry_after = retry_after.total_seconds()
+    return float(retry_after) + RETRY_AFTER_MARGIN
+
+
+def _is_retry_after(error: Exception) -> bool:
+    return RetryAfter is not None and isinstance(error, RetryAfter)
+
+
+def _is_transient(error: Exception) -> bool:
+    """آیا خطا موقت است و ارزش تکرار دارد"""
+    if TimedOut is not None and isinstance(error, TimedOut):
+        return True
+    # RetryAfter زیرکلاس NetworkError نیست، اما BadRequest هست و نباید تکرار شود
+    if NetworkError is not None and type(error) is NetworkError:
+        return True
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class UploadJob:
+    """یک کار آپلود در صف"""
+
+    def __init__(self, bot, chat_id: int, file_path: str, kind: str, caption: Optional[str] = None,
+                 on_done: Optional[Callable] = None, send_kwargs: Optional[Dict[str, Any]] = None,
+                 cache_key: Optional[str] = None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.file_path = file_path
+        self.kind = kind
+        self.caption = caption
+        self.on_done = on_done
+        self.send_kwargs = send_kwargs or {}
+        self.cache_key = cache_key
+        self.attempts = 0
+        self.flood_waits = 0
+        self.flood_wait_total = 0.0
+        self.created_at = time.time()
+
+    def files_exist(self) -> bool:
+        return os.path.exists(self.file_path)
+
+    def next_kind(self) -> Optional[str]:
+        """نوع ارسال جایگزین در صورت شکست (صوت -> سند)"""
+        if self.kind == KIND_AUDIO:
+            return KIND_DOCUMENT
+        return None
+
+    @contextmanager
+    def open_input(self):
+        """ورودی فایل برای ارسال: مسیر محلی در حالت سرور Bot API محلی، در غیر این صورت فایل باز شده"""
+        local_input = to_upload_input(self.file_path)
+        if local_input is not None:
+            yield local_input
+            return
+        with open(self.file_path, 'rb') as file_obj:
+            yield file_obj
+
+    def _send_params(self) -> Dict[str, Any]:
+        """پارامترهای متد ارسال بر اساس نوع فایل"""
+        kwargs = dict(self.send_kwargs)
+        if self.caption is not None:
+            kwargs['caption'] = self.caption
+
+        if self.kind == KIND_VIDEO:
+            kwargs.setdefault('supports_streaming', True)
+        elif self.kind != KIND_AUDIO:
+            # پارامترهای مخصوص صوت/ویدیو برای سند معتبر نیستند
+            for key in ('supports_streaming', 'title', 'performer', 'duration', 'width', 'height'):
+                kwargs.pop(key, None)
+        return kwargs
+
+    def send_call(self, file_obj):
+        """ساخت فراخوانی متد ارسال مناسب روی بات"""
+        kwargs = self._send_params()
+        if self.kind == KIND_VIDEO:
+            return self.bot.send_video(chat_id=self.chat_id, video=file_obj, **kwargs)
+        if self.kind == KIND_AUDIO:
+            return self.bot.send_audio(chat_id=self.chat_id, audio=file_obj, **kwargs)
+        return self.bot.send_document(chat_id=self.chat_id, document=file_obj, **kwargs)
+
+    def can_stream(self) -> bool:
+        """
+        آیا فایل با آپلود جریانی (بدون بارگذاری در حافظه) ارسال شود
+
+        در حالت سرور Bot API محلی فایل با مسیر ارسال می‌شود و نیازی به آپلود جریانی نیست.
+        """
+        return STREAMING_UPLOAD_ENABLED and not LOCAL_BOT_API_MODE and get_base_url(self.bot) is not None
+
+    def stream_send(self) -> Dict:
+        """ارسال فایل با آپلود جریانی (فراخوانی همزمان؛ در حالت آسنکرون در پول اجرایی اجرا می‌شود)"""
+        method, file_field = {
+            KIND_VIDEO: ('sendVideo', 'video'),
+            KIND_AUDIO: ('sendAudio', 'audio'),
+        }.get(self.kind, ('sendDocument', 'document'))
+        params = self._send_params()
+        params['chat_id'] = self.chat_id
+        return upload_file(get_base_url(self.bot), method, file_field, self.file_path, params)
+
+    def handle_result(self, result) -> None:
+        """پردازش پاسخ متد ارسال پس از موفقیت (ثبت file_id در صورت تعیین cache_key)"""
+        if self.cache_key:
+            store_file_id(self.cache_key, extract_file_id(result, self.kind), self.kind)
+
+
+class MediaGroupJob(UploadJob):
+    """کار آپلود چند فایل در یک پیام media group (مثلاً بخش‌های یک فایل تقسیم شده)"""
+
+    def __init__(self, bot, chat_id: int, file_paths: List[str], kind: str, caption: Optional[str] = None,
+                 on_done: Optional[Callable] = None, send_kwargs: Optional[Dict[str, Any]] = None):
+        super().__init__(bot, chat_id, file_paths[0], kind, caption, on_done, send_kwargs)
+        self.file_paths = file_paths
+
+    def files_exist(self) -> bool:
+        return all(os.path.exists(path) for path in self.file_paths)
+
+    def can_stream(self) -> bool:
+        return False
+
+    @contextmanager
+    def open_input(self):
+        with ExitStack() as stack:
+            inputs = []
+            for path in self.file_paths:
+                local_input = to_upload_input(path)
+                inputs.append(local_input if local_input is not None else stack.enter_context(open(path, 'rb')))
+            yield inputs
+
+    def send_call(self, file_objs):
+        from telegram import InputMediaAudio, InputMediaDocument, InputMediaVideo
+
+        media_class = {KIND_VIDEO: InputMediaVideo, KIND_AUDIO: InputMediaAudio}.get(self.kind, InputMediaDocument)
+        media = []
+        for index, file_obj in enumerate(file_objs):
+            item_kwargs = {}
+            # متن فقط روی اولین آیتم نمایش داده می‌شود
+            if index == 0 and self.caption:
+                item_kwargs['caption'] = self.caption
+            if media_class is InputMediaVideo:
+                item_kwargs['supports_streaming'] = True
+            media.append(media_class(media=file_obj, **item_kwargs))
+        return self.bot.send_media_group(chat_id=self.chat_id, media=media, **self.send_kwargs)
+
+
+class MediaItem:
+    """یک آیتم از گروه رسانه‌ای ترکیبی (عکس یا ویدیو)"""
+
+    def __init__(self, kind: str, file_path: Optional[str] = None, file_id: Optional[str] = None,
+                 cache_key: Optional[str] = None):
+        """
+        Args:
+            kind: نوع آیتم (photo یا video؛ audio و document فقط برای ارسال تک‌آیتمی)
+            file_path: مسیر فایل روی دیسک (برای آیتم‌هایی که باید آپلود شوند)
+            file_id: شناسه فایل ارسال شده قبلی (به جای آپلود دوباره)
+            cache_key: کلید ثبت file_id پس از ارسال موفق
+        """
+        self.kind = kind
+        self.file_path = file_path
+        self.file_id = file_id
+        self.cache_key = cache_key
+
+
+class MixedMediaGroupJob(UploadJob):
+    """کار ارسال آیتم‌های عکس و ویدیو در یک media group با استفاده از file_id های کش شده"""
+
+    def __init__(self, bot, chat_id: int, items: List[MediaItem], caption: Optional[str] = None,
+                 on_done: Optional[Callable] = None, send_kwargs: Optional[Dict[str, Any]] = None):
+        first_path = next((item.file_path for item in items if item.file_path), None) or (items[0].cache_key or '')
+        super().__init__(bot, chat_id, first_path, KIND_PHOTO, caption, on_done, send_kwargs)
+        self.items = items
+
+    def files_exist(self) -> bool:
+        return all(item.file_id or (item.file_path and os.path.exists(item.file_path)) for item in self.items)
+
+    def next_kind(self) -> Optional[str]:
+        return None
+
+    def can_stream(self) -> bool:
+        return False
+
+    @property
+    def uses_cached_ids(self) -> bool:
+        return any(item.file_id for item in self.items)
+
+    @contextmanager
+    def open_input(self):
+        with ExitStack() as stack:
+            inputs = []
+            for item in self.items:
+                if item.file_id:
+                    inputs.append(item.file_id)
+                    continue
+                local_input = to_upload_input(item.file_path)
+                inputs.append(local_input if local_input is not None else stack.enter_context(open(item.file_path, 'rb')))
+            yield inputs
+
+    def send_call(self, file_objs):
+        kwargs = dict(self.send_kwargs)
+        if len(self.items) == 1:
+            # گروه تک‌آیتمی در تلگرام مجاز نیست
+            if self.caption is not None:
+                kwargs['caption'] = self.caption
+            if self.items[0].kind == KIND_VIDEO:
+                return self.bot.send_video(chat_id=self.chat_id, video=file_objs[0], supports_streaming=True, **kwargs)
+            if self.items[0].kind == KIND_AUDIO:
+                return self.bot.send_audio(chat_id=self.chat_id, audio=file_objs[0], **kwargs)
+            if self.items[0].kind == KIND_DOCUMENT:
+                return self.bot.send_document(chat_id=self.chat_id, document=file_objs[0], **kwargs)
+            return self.bot.send_photo(chat_id=self.chat_id, photo=file_objs[0], **kwargs)
+
+        from telegram import InputMediaPhoto, InputMediaVideo
+
+        media = []
+        for index, (item, file_obj) in enumerate(zip(self.items, file_objs)):
+            item_kwargs = {}
+            if index == 0 and self.caption:
+                item_kwargs['caption'] = self.caption
+            if item.kind == KIND_VIDEO:
+                media.append(InputMediaVideo(media=file_obj, supports_streaming=True, **item_kwargs))
+            else:
+                media.append(InputMediaPhoto(media=file_obj, **item_kwargs))
+        return self.bot.send_media_group(chat_id=self.chat_id, media=media, **kwargs)
+
+    def handle_result(self, result) -> None:
+        """ثبت file_id آیتم‌های تازه آپلود شده برای ارسال‌های بعدی"""
+        messages = result if isinstance(result, (list, tuple)) else [result]
+        for item, message in zip(self.items, messages):
+            if item.cache_key and not item.file_id:
+                store_file_id(item.cache_key, extract_file_id(message, item.kind), item.kind)
+
+
+class UploadPipeline:
+    """صف آپلود با محدودیت همزمانی کلی و هر چت"""
+
+    def __init__(self, max_concurrent: int = UPLOAD_MAX_CONCURRENT, max_per_chat: int = UPLOAD_MAX_PER_CHAT):
+        self.max_concurrent = max_concurrent
+        self.max_per_chat = max_per_chat
+
+        # حالت آسنکرون (سمافورها در اولین استفاده روی loop فعلی ساخته می‌شوند؛ سمافور هر چت
+        # فقط تا وقتی کاری برای آن چت در جریان یا منتظر است نگهداری می‌شود)
+        self._global_semaphore: Optional[asyncio.Semaphore] = None
+        self._chat_semaphores: Dict[int, asyncio.Semaphore] = {}
+        self._chat_users: Dict[int, int] = {}
+        self._tasks = set()
+
+        # حالت همزمان (نسخه 13): پول اجرایی به اندازه سقف کلی، شمارنده و صف انتظار هر چت
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._chat_active: Dict[int, int] = {}
+        self._chat_waiting: Dict[int, Deque[UploadJob]] = {}
+        self._lock = threading.Lock()
+
+        # آمار
+        self.stats = {
+            'queued': 0,
+            'active': 0,
+            'completed': 0,
+            'failed': 0,
+            'flood_waits': 0,
+            'retries': 0,
+        }
+
+    # ---------- حالت آسنکرون ----------
+
+    def _get_global_semaphore(self) -> asyncio.Semaphore:
+        if self._global_semaphore is None:
+            self._global_semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._global_semaphore
+
+    @asynccontextmanager
+    async def _chat_slot(self, chat_id: int):
+        """گرفتن ظرفیت چت؛ سمافور چت پس از خالی شدن حذف می‌شود"""
+        semaphore = self._chat_semaphores.get(chat_id)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_per_chat)
+            self._chat_semaphores[chat_id] = semaphore
+        self._chat_users[chat_id] = self._chat_users.get(chat_id, 0) + 1
+        try:
+            async with semaphore:
+                yield
+        finally:
+            remaining = self._chat_users[chat_id] - 1
+            if remaining > 0:
+                self._chat_users[chat_id] = remaining
+            else:
+                self._chat_users.pop(chat_id, None)
+                self._chat_semaphores.pop(chat_id, None)
+
+    def submit(self, bot, chat_id: int, file_path: str, kind: str = KIND_VIDEO, caption: Optional[str] = None,
+               on_done: Optional[Callable] = None, cache_key: Optional[str] = None, **send_kwargs) -> asyncio.Task:
+        """
+        افزودن فایل به صف آپلود (برای هندلرهای آسنکرون)
+
+        Args:
+            bot: شیء بات تلگرام
+            chat_id: شناسه چت مقصد
+            file_path: مسیر فایل روی دیسک
+            kind: نوع ارسال (video، audio یا document)
+            caption: متن همراه فایل
+            on_done: تابع (یا کوروتین) فراخوانی شده پس از پایان با آرگومان success
+            cache_key: کلید ثبت file_id فایل ارسال شده در کش file_id
+            send_kwargs: سایر پارامترهای متد ارسال
+
+        Returns:
+            تسک آپلود (هندلر نیازی به انتظار برای آن ندارد)
+        """
+        job = UploadJob(bot, chat_id, file_path, kind, caption, on_done, send_kwargs, cache_key)
+        self.stats['queued'] += 1
+        return self._schedule_async(job)
+
+    def submit_parts(self, bot, chat_id: int, part_paths: List[str], kind: str = KIND_VIDEO,
+                     caption: Optional[str] = None, on_done: Optional[Callable] = None, **send_kwargs) -> None:
+        """
+        افزودن بخش‌های یک فایل تقسیم شده به صف آپلود (برای هندلرهای آسنکرون)
+
+        بخش‌ها به ترتیب و در گروه‌های media group ارسال می‌شوند؛ هر گروه پس از موفقیت گروه قبلی در صف قرار می‌گیرد.
+
+        Args:
+            مانند submit؛ part_paths لیست مسیر بخش‌ها به ترتیب پخش است
+        """
+        jobs = self._build_part_jobs(bot, chat_id, part_paths, kind, caption, send_kwargs)
+        self._submit_chain_async(jobs, on_done)
+
+    def submit_media_items(self, bot, chat_id: int, items: List[MediaItem], caption: Optional[str] = None,
+                           on_done: Optional[Callable] = None, **send_kwargs) -> List[MixedMediaGroupJob]:
+        """
+        افزودن آیتم‌های عکس/ویدیو یک پست به صف آپلود در قالب media group (برای هندلرهای آسنکرون)
+
+        Args:
+            مانند submit؛ items لیست آیتم‌ها به ترتیب نمایش است
+
+        Returns:
+            کارهای آپلود گروهی ساخته شده
+        """
+        jobs = self._build_item_jobs(bot, chat_id, items, caption, send_kwargs)
+        self._submit_chain_async(jobs, on_done)
+        return jobs
+
+    def _submit_chain_async(self, jobs: List[UploadJob], on_done: Optional[Callable]) -> None:
+        """ارسال ترتیبی کارها؛ هر کار پس از موفقیت کار قبلی در صف قرار می‌گیرد"""
+        def make_callback(index: int):
+            async def callback(success: bool):
+                if success and index + 1 < len(jobs):
+                    self._schedule_async(jobs[index + 1])
+                    return
+                if on_done:
+                    result = on_done(success)
+                    if inspect.isawaitable(result):
+                        await result
+            return callback
+
+        for index, job in enumerate(jobs):
+            job.on_done = make_callback(index)
+        self.stats['queued'] += len(jobs)
+        self._schedule_async(jobs[0])
+
+    def _schedule_async(self, job: UploadJob, delay: float = 0.0) -> Optional[asyncio.Task]:
+        """زمان‌بندی اجرای کار روی loop فعلی (با تأخیر اختیاری)"""
+        loop = asyncio.get_running_loop()
+        if delay > 0:
+            loop.call_later(delay, self._schedule_async, job)
+            return None
+
+        task = loop.create_task(self._run_async(job))
+        # نگهداری ارجاع تا تسک توسط garbage collector حذف نشود
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run_async(self, job: UploadJob) -> None:
+        """اجرای یک تلاش آپلود در حالت آسنکرون"""
+        if not job.files_exist():
+            logger.error(f"فایل برای آپلود وجود ندارد: {job.file_path}")
+            await self._finish_async(job, False)
+            return
+
+        error = None
+        async with self._chat_slot(job.chat_id), self._get_global_semaphore():
+            self.stats['active'] += 1
+            try:
+                job.attempts += 1
+                if job.can_stream():
+                    loop = asyncio.get_running_loop()
+                    result = await loop.run_in_executor(self._get_executor(), job.stream_send)
+                else:
+                    with job.open_input() as file_obj:
+                        result = await job.send_call(file_obj)
+            except Exception as e:
+                error = e
+            finally:
+                self.stats['active'] -= 1
+
+        # تصمیم‌گیری پس از آزاد کردن ظرفیت، تا انتظار flood مانع آپلودهای دیگر نشود
+        if error is None:
+            self._handle_result(job, result)
+            await self._finish_async(job, True)
+            return
+
+        retry_delay = self._handle_error(job, error)
+        if retry_delay is not None:
+            self._schedule_async(job, retry_delay)
+            return
+
+        await self._finish_async(job, False)
+
+    async def _finish_async(self, job: UploadJob, success: bool) -> None:
+        self._record_result(job, success)
+        if job.on_done:
+            try:
+                result = job.on_done(success)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"خطا در اجرای تابع پایان آپلود: {e}")
+
+    # ---------- حالت همزمان (python-telegram-bot نسخه 13) ----------
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix='upload')
+        return self._executor
+
+    def submit_sync(self, bot, chat_id: int, file_path: str, kind: str = KIND_VIDEO, caption: Optional[str] = None,
+                    on_done: Optional[Callable] = None, cache_key: Optional[str] = None, **send_kwargs) -> UploadJob:
+        """
+        افزودن فایل به صف آپلود (برای هندلرهای همزمان نسخه 13)
+
+        Args:
+            مانند submit؛ on_done باید تابع معمولی باشد
+
+        Returns:
+            کار آپلود ثبت شده
+        """
+        job = UploadJob(bot, chat_id, file_path, kind, caption, on_done, send_kwargs, cache_key)
+        self.stats['queued'] += 1
+        self._get_executor().submit(self._run_sync, job)
+        return job
+
+    def submit_parts_sync(self, bot, chat_id: int, part_paths: List[str], kind: str = KIND_VIDEO,
+                          caption: Optional[str] = None, on_done: Optional[Callable] = None, **send_kwargs) -> None:
+        """
+        افزودن بخش‌های یک فایل تقسیم شده به صف آپلود (برای هندلرهای همزمان نسخه 13)
+
+        Args:
+            مانند submit_parts؛ on_done باید تابع معمولی باشد
+        """
+        jobs = self._build_part_jobs(bot, chat_id, part_paths, kind, caption, send_kwargs)
+        self._submit_chain_sync(jobs, on_done)
+
+    def submit_media_items_sync(self, bot, chat_id: int, items: List[MediaItem], caption: Optional[str] = None,
+                                on_done: Optional[Callable] = None, **send_kwargs) -> List[MixedMediaGroupJob]:
+        """
+        افزودن آیتم‌های عکس/ویدیو یک پست به صف آپلود (برای هندلرهای همزمان نسخه 13)
+
+        Args:
+            مانند submit_media_items؛ on_done باید تابع معمولی باشد
+
+        Returns:
+            کارهای آپلود گروهی ساخته شده
+        """
+        jobs = self._build_item_jobs(bot, chat_id, items, caption, send_kwargs)
+        self._submit_chain_sync(jobs, on_done)
+        return jobs
+
+    def _submit_chain_sync(self, jobs: List[UploadJob], on_done: Optional[Callable]) -> None:
+        """ارسال ترتیبی کارها در حالت همزمان"""
+        def make_callback(index: int):
+            def callback(success: bool):
+                if success and index + 1 < len(jobs):
+                    self._get_executor().submit(self._run_sync, jobs[index + 1])
+                    return
+                if on_done:
+                    on_done(success)
+            return callback
+
+        for index, job in enumerate(jobs):
+            job.on_done = make_callback(index)
+        self.stats['queued'] += len(jobs)
+        self._get_executor().submit(self._run_sync, jobs[0])
+
+    def _schedule_sync(self, job: UploadJob, delay: float) -> None:
+        """زمان‌بندی تلاش مجدد بدون اشغال یکی از کارگرهای آپلود"""
+        timer = threading.Timer(delay, lambda: self._get_executor().submit(self._run_sync, job))
+        timer.daemon = True
+        timer.start()
+
+    def _release_chat_sync(self, chat_id: int) -> None:
+        """آزاد کردن ظرفیت چت؛ اگر کاری از همین چت منتظر است، ظرفیت مستقیماً به آن سپرده می‌شود"""
+        with self._lock:
+            waiting = self._chat_waiting.get(chat_id)
+            if waiting:
+                next_job = waiting.popleft()
+                if not waiting:
+                    self._chat_waiting.pop(chat_id, None)
+            else:
+                next_job = None
+                remaining = self._chat_active.get(chat_id, 1) - 1
+                if remaining > 0:
+                    self._chat_active[chat_id] = remaining
+                else:
+                    self._chat_active.pop(chat_id, None)
+        if next_job is not None:
+            self._get_executor().submit(self._run_sync, next_job, True)
+
+    def _run_sync(self, job: UploadJob, reserved: bool = False) -> None:
+        """
+        اجرای یک تلاش آپلود در حالت همزمان
+
+        Args:
+            job: کار آپلود
+            reserved: ظرفیت چت قبلاً هنگام آزاد شدن کار قبلی برای این کار نگه داشته شده است
+        """
+        if not job.files_exist():
+            logger.error(f"فایل برای آپلود وجود ندارد: {job.file_path}")
+            if reserved:
+                self._release_chat_sync(job.chat_id)
+            self._finish_sync(job, False)
+            return
+
+        # اگر ظرفیت این چت پر است، کار در صف انتظار چت می‌ماند و کارگر آزاد می‌شود
+        with self._lock:
+            if not reserved:
+                if self._chat_active.get(job.chat_id, 0) >= self.max_per_chat:
+                    self._chat_waiting.setdefault(job.chat_id, deque()).append(job)
+                    return
+                self._chat_active[job.chat_id] = self._chat_active.get(job.chat_id, 0) + 1
+            self.stats['active'] += 1
+
+        error = None
+        try:
+            job.attempts += 1
+            if job.can_stream():
+                result = job.stream_send()
+            else:
+                with job.open_input() as file_obj:
+                    result = job.send_call(file_obj)
+        except Exception as e:
+            error = e
+        finally:
+            with self._lock:
+                self.stats['active'] -= 1
+            self._release_chat_sync(job.chat_id)
+
+        if error is None:
+            self._handle_result(job, result)
+            self._finish_sync(job, True)
+            return
+
+        retry_delay = self._handle_error(job, error)
+        if retry_delay is not None:
+            self._schedule_sync(job, retry_delay)
+            return
+
+        self._finish_sync(job, False)
+
+    def _finish_sync(self, job: UploadJob, success: bool) -> None:
+        self._record_result(job, success)
+        if job.on_done:
+            try:
+                job.on_done(success)
+            except Exception as e:
+                logger.error(f"خطا در اجرای تابع پایان آپلود: {e}")
+
+    # ---------- منطق مشترک ----------
+
+    def _build_part_jobs(self, bot, chat_id: int, part_paths: List[str], kind: str,
+                         caption: Optional[str], send_kwargs: Dict[str, Any]) -> List[UploadJob]:
+        """ساخت کارهای آپلود گروهی برای بخش‌های یک فایل (هر گروه حداکثر MEDIA_GROUP_MAX_ITEMS بخش)"""
+        jobs = []
+        total = len(part_paths)
+        for start in range(0, total, MEDIA_GROUP_MAX_ITEMS):
+            chunk = part_paths[start:start + MEDIA_GROUP_MAX_ITEMS]
+            if len(chunk) == 1:
+                label = f"📦 بخش {start + 1} از {total}"
+            else:
+                label = f"📦 بخش‌های {start + 1} تا {start + len(chunk)} از {total}"
+            chunk_caption = f"{caption}\n{label}" if caption else label
+
+            if len(chunk) == 1:
+                jobs.append(UploadJob(bot, chat_id, chunk[0], kind, chunk_caption, None, dict(send_kwargs)))
+            else:
+                jobs.append(MediaGroupJob(bot, chat_id, chunk, kind, chunk_caption, None, dict(send_kwargs)))
+        return jobs
+
+    def _build_item_jobs(self, bot, chat_id: int, items: List[MediaItem], caption: Optional[str],
+                         send_kwargs: Dict[str, Any]) -> List[MixedMediaGroupJob]:
+        """ساخت کارهای گروهی برای آیتم‌های یک پست (متن فقط روی گروه اول)"""
+        jobs = []
+        for start in range(0, len(items), MEDIA_GROUP_MAX_ITEMS):
+            chunk = items[start:start + MEDIA_GROUP_MAX_ITEMS]
+            jobs.append(MixedMediaGroupJob(bot, chat_id, chunk, caption if start == 0 else None,
+                                           None, dict(send_kwargs)))
+        return jobs
+
+    def _handle_result(self, job: UploadJob, result) -> None:
+        try:
+            job.handle_result(result)
+        except Exception as e:
+            logger.warning(f"خطا در پردازش پاسخ آپلود: {e}")
+
+    def _handle_error(self, job: UploadJob, error: Exception) -> Optional[float]:
+        """
+        تصمیم‌گیری درباره خطای آپلود
+
+        Returns:
+            تأخیر تلاش مجدد به ثانیه یا None اگر کار باید شکست بخورد
+        """
+        if _is_retry_after(error):
+            delay = _retry_after_seconds(error)
+            if job.flood_wait_total + delay > UPLOAD_MAX_FLOOD_WAIT:
+                logger.error(f"مجموع انتظار flood برای آپلود {job.file_path} از {UPLOAD_MAX_FLOOD_WAIT:.0f} ثانیه "
+                             f"بیشتر می‌شود، آپلود متوقف شد")
+                return None
+            job.flood_waits += 1
+            job.flood_wait_total += delay
+            self.stats['flood_waits'] += 1
+            logger.warning(f"محدودیت flood تلگرام برای چت {job.chat_id}، آپلود پس از {delay:.0f} ثانیه تکرار می‌شود")
+            return delay
+
+        if _is_transient(error) and job.attempts <= UPLOAD_MAX_RETRIES:
+            delay = UPLOAD_RETRY_BASE_DELAY * (2 ** (job.attempts - 1))
+            self.stats['retries'] += 1
+            logger.warning(f"خطای موقت در آپلود ({error})، تلاش {job.attempts} از {UPLOAD_MAX_RETRIES} پس از {delay:.0f} ثانیه")
+            return delay
+
+        fallback_kind = job.next_kind()
+        if fallback_kind:
+            logger.error(f"خطا در ارسال فایل به صورت {job.kind}: {error}. تلاش برای ارسال به صورت {fallback_kind}...")
+            job.kind = fallback_kind
+            job.attempts = 0
+            return 0.0
+
+        logger.error(f"خطا در آپلود فایل {job.file_path}: {error}")
+        return None
+
+    def _record_result(self, job: UploadJob, success: bool) -> None:
+        with self._lock:
+            self.stats['queued'] = max(0, self.stats['queued'] - 1)
+            self.stats['completed' if success else 'failed'] += 1
+        if success:
+            logger.info(f"آپلود کامل شد: {os.path.basename(job.file_path)} "
+                        f"(چت {job.chat_id}، {time.time() - job.created_at:.1f} ثانیه، {job.flood_waits} انتظار flood)")
+
+    def get_stats(self) -> Dict[str, int]:
+        """دریافت آمار صف آپلود"""
+        with self._lock:
+            return dict(self.stats)
+
+
+# نمونه سراسری صف آپلود
+upload_pipeline = UploadPipeline()
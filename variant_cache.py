@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+کش پایدار نسخه‌های تبدیل شده ویدیو
+
+این ماژول خروجی‌های تبدیل کیفیت را بر اساس هش محتوای فایل منبع و پروفایل انکود
+نگهداری می‌کند تا درخواست‌های تکراری (مثلاً 480p از یک ویدیو) دوباره انکود نشوند.
+ایندکس در SQLite (حالت WAL) نگهداری می‌شود تا ربات و پردازه‌های کارگر بدون از دست رفتن
+بروزرسانی‌ها همزمان از آن استفاده کنند و هر استفاده از کش فقط یک ردیف را بروزرسانی کند.
+"""
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# مسیر دایرکتوری دانلود (مانند مسیر دانلود ربات نسبت به دایرکتوری اجرا؛ cache_optimizer نیز از همین استفاده می‌کند)
+DOWNLOADS_DIR = os.path.abspath(os.environ.get('DOWNLOAD_DIR', 'downloads'))
+# مسیر دایرکتوری نسخه‌های تبدیل شده
+VARIANTS_DIR = os.path.join(DOWNLOADS_DIR, 'variants')
+# پایگاه داده ایندکس کش (مشترک بین ربات و پردازه‌های کارگر؛ SQLite نوشتن همزمان پردازه‌ها را هماهنگ می‌کند)
+VARIANT_INDEX_DB = os.path.join(VARIANTS_DIR, 'index.db')
+# فایل ایندکس JSON قدیمی (فقط برای انتقال یک‌باره)
+LEGACY_INDEX_FILE = os.path.join(VARIANTS_DIR, 'index.json')
+# حداکثر اندازه کش نسخه‌ها (به گیگابایت)
+VARIANT_CACHE_MAX_GB = float(os.environ.get('VARIANT_CACHE_MAX_GB', '2'))
+# نسخه پروفایل انکود - با تغییر تنظیمات ffmpeg افزایش یابد تا نسخه‌های قدیمی استفاده نشوند
+ENCODE_PROFILE_VERSION = 3
+# حداقل اندازه معتبر برای فایل خروجی (بایت)
+MIN_VARIANT_SIZE = 10000
+# اندازه بلوک خواندن برای محاسبه هش
+HASH_CHUNK_SIZE = 1024 * 1024
+# حداکثر تعداد هش‌های نگهداری شده در حافظه
+HASH_MEMO_MAX_ENTRIES = 1024
+# مهلت انتظار برای قفل پایگاه داده (ثانیه)
+INDEX_DB_TIMEOUT = 30
+
+# اطمینان از وجود دایرکتوری کش
+os.makedirs(VARIANTS_DIR, exist_ok=True)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS variants (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    profile TEXT NOT NULL,
+    source_hash TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_variants_access ON variants (last_access);
+"""
+
+# قفل دسترسی به اتصال پایگاه داده در این پردازه
+_index_lock = threading.RLock()
+_conn: Optional[sqlite3.Connection] = None
+# هش‌های محاسبه شده (LRU): (مسیر, اندازه, زمان تغییر) -> هش
+_hash_memo: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_hash_lock = threading.Lock()
+
+
+def _get_conn() -> sqlite3.Connection:
+    """اتصال پایگاه داده ایندکس (در اولین دسترسی ساخته و ایندکس JSON قدیمی منتقل می‌شود)"""
+    global _conn
+    with _index_lock:
+        if _conn is None:
+            conn = sqlite3.connect(VARIANT_INDEX_DB, timeout=INDEX_DB_TIMEOUT, check_same_thread=False,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            _migrate_legacy_index(conn)
+            _conn = conn
+        return _conn
+
+
+def _migrate_legacy_index(conn: sqlite3.Connection) -> None:
+    """انتقال یک‌باره ورودی‌های index.json قدیمی به پایگاه داده"""
+    if not os.path.exists(LEGACY_INDEX_FILE):
+        return
+    try:
+        with open(LEGACY_INDEX_FILE, 'r', encoding='utf-8') as f:
+            legacy = json.load(f)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR IGNORE INTO variants (key, path, size, profile, source_hash, created, last_access, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(key, entry['path'], entry.get('size', 0), entry.get('profile', ''), entry.get('source_hash', ''),
+                  entry.get('created', 0), entry.get('last_access', 0), entry.get('hits', 0))
+                 for key, entry in legacy.items() if entry.get('path')])
+        os.replace(LEGACY_INDEX_FILE, f"{LEGACY_INDEX_FILE}.migrated")
+        logger.info(f"تعداد {len(legacy)} نسخه از ایندکس قدیمی به پایگاه داده منتقل شد")
+    except (ValueError, OSError, sqlite3.Error) as e:
+        logger.warning(f"خطا در انتقال ایندکس قدیمی کش نسخه‌ها: {e}")
+
+
+def get_source_hash(file_path: str) -> Optional[str]:
+    """
+    محاسبه هش SHA-256 محتوای فایل منبع (با حافظه‌سازی بر اساس مسیر، اندازه و زمان تغییر)
+
+    Args:
+        file_path: مسیر فایل منبع
+
+    Returns:
+        هش هگزادسیمال یا None در صورت خطا
+    """
+    try:
+        stat = os.stat(file_path)
+        memo_key = (os.path.realpath(file_path), stat.st_size, stat.st_mtime_ns)
+        with _hash_lock:
+            cached_hash = _hash_memo.get(memo_key)
+            if cached_hash:
+                _hash_memo.move_to_end(memo_key)
+                return cached_hash
+
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+        source_hash = digest.hexdigest()
+        with _hash_lock:
+            _hash_memo[memo_key] = source_hash
+            while len(_hash_memo) > HASH_MEMO_MAX_ENTRIES:
+                _hash_memo.popitem(last=False)
+        return source_hash
+    except OSError as e:
+        logger.warning(f"خطا در محاسبه هش فایل {file_path}: {e}")
+        return None
+
+
+def build_profile(quality: str, target_height: int, **params) -> str:
+    """
+    ساخت رشته پروفایل انکود برای استفاده در کلید کش
+
+    Args:
+        quality: کیفیت هدف (مثلاً 480p)
+        target_height: ارتفاع هدف
+        params: سایر پارامترهای موثر بر خروجی (preset، crf و ...)
+
+    Returns:
+        رشته پروفایل
+    """
+    parts = [f"v{ENCODE_PROFILE_VERSION}", str(quality), str(target_height)]
+    for name in sorted(params):
+        parts.append(f"{name}={params[name]}")
+    return "|".join(parts)
+
+
+def _make_key(source_hash: str, profile: str) -> str:
+    """ساخت کلید کش از هش منبع و پروفایل"""
+    profile_hash = hashlib.sha256(profile.encode('utf-8')).hexdigest()[:16]
+    return f"{source_hash[:32]}_{profile_hash}"
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    """ایجاد لینک سخت از فایل (یا کپی در صورت عدم امکان)"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def lookup(source_path: str, profile: str, output_path: Optional[str] = None) -> Optional[str]:
+    """
+    جستجوی نسخه تبدیل شده در کش قبل از اجرای ffmpeg
+
+    Args:
+        source_path: مسیر فایل منبع
+        profile: پروفایل انکود (خروجی build_profile)
+        output_path: در صورت تعیین، نسخه کش شده در این مسیر قرار می‌گیرد
+
+    Returns:
+        مسیر فایل تبدیل شده یا None اگر در کش نباشد
+    """
+    source_hash = get_source_hash(source_path)
+    if not source_hash:
+        return None
+
+    key = _make_key(source_hash, profile)
+
+    try:
+        with _index_lock:
+            conn = _get_conn()
+            row = conn.execute("SELECT path FROM variants WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+
+            cached_path = row[0]
+            if not os.path.exists(cached_path) or os.path.getsize(cached_path) < MIN_VARIANT_SIZE:
+                # فایل کش حذف شده است - ورودی را پاک می‌کنیم
+                conn.execute("DELETE FROM variants WHERE key = ?", (key,))
+                return None
+
+            # فقط همین ردیف بروزرسانی می‌شود (نه کل ایندکس)
+            conn.execute("UPDATE variants SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+    except sqlite3.Error as e:
+        logger.warning(f"خطا در خواندن ایندکس کش نسخه‌ها: {e}")
+        return None
+
+    logger.info(f"نسخه تبدیل شده از کش استفاده شد: {profile} -> {cached_path}")
+
+    if not output_path:
+        return cached_path
+
+    try:
+        _link_or_copy(cached_path, output_path)
+        return output_path
+    except OSError as e:
+        logger.warning(f"خطا در انتقال نسخه کش شده به {output_path}: {e}")
+        return cached_path
+
+
+def store(source_path: str, profile: str, variant_path: str) -> Optional[str]:
+    """
+    ثبت نسخه تبدیل شده در کش
+
+    Args:
+        source_path: مسیر فایل منبع
+        profile: پروفایل انکود (خروجی build_profile)
+        variant_path: مسیر فایل تبدیل شده
+
+    Returns:
+        مسیر فایل در کش یا None در صورت خطا
+    """
+    if not variant_path or not os.path.exists(variant_path) or os.path.getsize(variant_path) < MIN_VARIANT_SIZE:
+        return None
+
+    source_hash = get_source_hash(source_path)
+    if not source_hash:
+        return None
+
+    key = _make_key(source_hash, profile)
+    ext = os.path.splitext(variant_path)[1] or '.mp4'
+    cached_path = os.path.join(VARIANTS_DIR, f"{key}{ext}")
+
+    try:
+        _link_or_copy(variant_path, cached_path)
+        size = os.path.getsize(cached_path)
+        now = time.time()
+
+        with _index_lock:
+            _get_conn().execute(
+                "INSERT OR REPLACE INTO variants (key, path, size, profile, source_hash, created, last_access, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, cached_path, size, profile, source_hash, now, now))
+
+        logger.info(f"نسخه تبدیل شده در کش ثبت شد: {profile} ({size / (1024 * 1024):.2f} MB)")
+
+        # رعایت سقف اندازه کش نسخه‌ها
+        evict_to_budget(int(VARIANT_CACHE_MAX_GB * 1024 * 1024 * 1024))
+        return cached_path
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"خطا در ثبت نسخه تبدیل شده در کش: {e}")
+        return None
+
+
+def get_variant_cache_size() -> Tuple[int, int]:
+    """
+    محاسبه حجم کل و تعداد نسخه‌های کش شده
+
+    Returns:
+        tuple: (اندازه به بایت, تعداد نسخه‌ها)
+    """
+    with _index_lock:
+        total_size, count = _get_conn().execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM variants").fetchone()
+    return total_size, count
+
+
+def evict_to_budget(max_bytes: int) -> int:
+    """
+    حذف نسخه‌های کم‌استفاده (LRU) تا رسیدن حجم کش به سقف تعیین شده
+
+    Args:
+        max_bytes: حداکثر حجم مجاز کش نسخه‌ها به بایت
+
+    Returns:
+        int: تعداد نسخه‌های حذف شده
+    """
+    deleted_count = 0
+
+    with _index_lock:
+        conn = _get_conn()
+
+        # حذف ورودی‌هایی که فایلشان وجود ندارد
+        missing = [(key,) for key, path in conn.execute("SELECT key, path FROM variants") if not os.path.exists(path)]
+        if missing:
+            conn.executemany("DELETE FROM variants WHERE key = ?", missing)
+
+        total_size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM variants").fetchone()[0]
+        if total_size <= max_bytes:
+            return 0
+
+        # مرتب‌سازی بر اساس آخرین دسترسی (قدیمی‌ترین‌ها اول)
+        evicted = []
+        for key, path, size in conn.execute("SELECT key, path, size FROM variants ORDER BY last_access").fetchall():
+            if total_size <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"خطا در حذف نسخه کش شده {path}: {e}")
+            total_size -= size
+            evicted.append((key,))
+            deleted_count += 1
+
+        conn.executemany("DELETE FROM variants WHERE key = ?", evicted)
+
+    if deleted_count:
+        logger.info(f"{deleted_count} نسخه تبدیل شده از کش حذف شد (حجم فعلی: {total_size / (1024 * 1024):.2f} MB)")
+    return deleted_count
@@ -9,7 +9,6 @@
 """
 
 import os
-import subprocess
 import logging
 import json
 import uuid
@@ -17,6 +16,8 @@ import time
 import traceback
 from typing import Dict, List, Tuple, Optional, Any
 
+from ffmpeg_runner import run_ffmpeg
+
 # تنظیم لاگر
 logging.basicConfig(
     level=logging.DEBUG,
@@ -54,12 +55,7 @@ def get_video_info(video_path: str) -> Dict:
         ]
         
         logger.debug(f"اجرای دستور ffprobe: {' '.join(cmd)}")
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        result = run_ffmpeg(cmd)
         
         if result.returncode != 0:
             logger.error(f"خطا در اجرای ffprobe: {result.stderr}")
@@ -136,35 +132,24 @@ def convert_video_with_debug(input_path: str, output_path: str, quality: str) ->
         # لاگ کامل دستور
         logger.debug(f"دستور ffmpeg: {' '.join(cmd)}")
         
-        # اجرای دستور با ثبت خروجی کامل
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,  # خط‌به‌خط بافر شود
-            universal_newlines=True
-        )
-        
-        # پردازش خروجی خط به خط
-        for line in process.stderr:
+        # اجرای دستور با گزارش پیشرفت (هر 10 درصد)
+        def log_progress(progress: Dict):
+            percent = progress.get('percent')
+            if percent is not None and int(percent) % 10 == 0:
+                logger.debug(f"پیشرفت تبدیل: {percent:.0f}% (سرعت: {progress.get('speed')})")
+        
+        process = run_ffmpeg(cmd, progress_callback=log_progress)
+        
+        # پردازش خروجی خطا خط به خط
+        for line in process.stderr.splitlines():
             line = line.strip()
-            if "frame=" in line and "fps=" in line:
-                # خط پیشرفت - فقط هر 100 فریم لاگ می‌کنیم تا لاگ بیش از حد نشود
-                if "frame=" in line and "fps=" in line:
-                    frames = line.split("frame=")[1].split("fps=")[0].strip()
-                    if frames.isdigit() and int(frames) % 100 == 0:
-                        logger.debug(f"پیشرفت: {line}")
-            elif "Error" in line or "Invalid" in line or "Failed" in line:
+            if "Error" in line or "Invalid" in line or "Failed" in line:
                 # خطای مهم
                 logger.error(f"خطای ffmpeg: {line}")
             elif "width not divisible by 2" in line:
                 # خطای عرض نامناسب
                 logger.error(f"خطای عرض نامناسب: {line}")
         
-        # منتظر اتمام پردازش می‌مانیم
-        process.wait()
-        
         # بررسی نتیجه
         if process.returncode == 0 and os.path.exists(output_path):
             output_info = get_video_info(output_path)
@@ -236,34 +221,20 @@ def extract_audio_with_debug(input_path: str, output_path: str) -> bool:
         # لاگ کامل دستور
         logger.debug(f"دستور ffmpeg: {' '.join(cmd)}")
         
-        # اجرای دستور با ثبت خروجی کامل
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,  # خط‌به‌خط بافر شود
-            universal_newlines=True
-        )
-        
-        # پردازش خروجی خط به خط
-        for line in process.stderr:
+        # اجرای دستور با گزارش پیشرفت (هر 10 ثانیه از صدا)
+        def log_progress(progress: Dict):
+            if int(progress.get('out_time') or 0) % 10 == 0:
+                logger.debug(f"پیشرفت استخراج صدا: {progress.get('out_time', 0):.0f} ثانیه (سرعت: {progress.get('speed')})")
+        
+        process = run_ffmpeg(cmd, progress_callback=log_progress)
+        
+        # پردازش خروجی خطا خط به خط
+        for line in process.stderr.splitlines():
             line = line.strip()
-            if "time=" in line:
-                # خط پیشرفت - فقط هر 10 ثانیه لاگ می‌کنیم
-                if "time=" in line:
-                    time_parts = line.split("time=")[1].split()[0].split(":")
-                    if len(time_parts) == 3:
-                        seconds = int(time_parts[0]) * 3600 + int(time_parts[1]) * 60 + float(time_parts[2])
-                        if int(seconds) % 10 == 0:
-                            logger.debug(f"پیشرفت استخراج صدا: {line}")
-            elif "Error" in line or "Invalid" in line or "Failed" in line:
+            if "Error" in line or "Invalid" in line or "Failed" in line:
                 # خطای مهم
                 logger.error(f"خطای ffmpeg: {line}")
         
-        # منتظر اتمام پردازش می‌مانیم
-        process.wait()
-        
         # بررسی نتیجه
         if process.returncode == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
             output_info = get_video_info(output_path)
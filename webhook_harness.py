@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ابزار آزمایش محلی webhook با آپدیت‌های ساختگی
+
+آپدیت‌های ساختگی تلگرام را با همزمانی قابل تنظیم به سرور webhook ارسال می‌کند و
+تأخیر پاسخ HTTP، توان عملیاتی و آمار تأخیر هندلرها (از مسیر /healthz) را گزارش می‌دهد.
+
+استفاده:
+    # آزمایش یک ربات در حال اجرا (حالت webhook)
+    python webhook_harness.py --url http://127.0.0.1:8443/telegram/webhook --secret TOKEN -n 500 -c 50
+
+    # آزمایش مستقل بدون تلگرام با هندلر شبیه‌سازی شده
+    python webhook_harness.py --self-test --handler-delay 0.2 -n 500 -c 50
+"""
+
+import sys
+import time
+import json
+import random
+import asyncio
+import argparse
+from typing import Dict, List
+from urllib.parse import urlsplit, urlunsplit
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from webhook_server import SECRET_TOKEN_HEADER, WebhookServer, _percentile
+
+# متن‌های نمونه برای آپدیت‌های ساختگی
+SAMPLE_TEXTS = [
+    "/start",
+    "/help",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://www.instagram.com/p/CxYz123AbCd/",
+]
+
+
+def build_synthetic_update(update_id: int, text: str, chat_id: int) -> Dict:
+    """
+    ساخت آپدیت ساختگی پیام متنی با ساختار Bot API
+
+    Args:
+        update_id: شناسه آپدیت
+        text: متن پیام
+        chat_id: شناسه چت (و کاربر)
+
+    Returns:
+        دیکشنری آپدیت
+    """
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private', 'first_name': 'Load'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load', 'language_code': 'fa'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+async def run_load(url: str, secret: str, total: int, concurrency: int, chat_count: int) -> Dict:
+    """
+    ارسال آپدیت‌های ساختگی به سرور webhook
+
+    Args:
+        url: آدرس کامل webhook
+        secret: توکن مخفی
+        total: تعداد کل آپدیت‌ها
+        concurrency: تعداد درخواست‌های همزمان
+        chat_count: تعداد چت‌های ساختگی متفاوت
+
+    Returns:
+        خلاصه نتایج سمت کلاینت
+    """
+    headers = {SECRET_TOKEN_HEADER: secret} if secret else {}
+    latencies: List[float] = []
+    status_counts: Dict[int, int] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send_one(session, update_id: int):
+        update = build_synthetic_update(update_id, random.choice(SAMPLE_TEXTS), 100000 + update_id % chat_count)
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                async with session.post(url, json=update, headers=headers) as response:
+                    await response.read()
+                    status = response.status
+            except aiohttp.ClientError:
+                status = 0
+            latencies.append(time.monotonic() - started)
+            status_counts[status] = status_counts.get(status, 0) + 1
+
+    started = time.monotonic()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(send_one(session, update_id) for update_id in range(1, total + 1)))
+    elapsed = time.monotonic() - started
+
+    return {
+        'sent': total,
+        'elapsed_s': round(elapsed, 2),
+        'throughput_rps': round(total / elapsed, 1) if elapsed else 0.0,
+        'status_counts': status_counts,
+        'ack_latency_ms': {
+            'p50': round(_percentile(latencies, 50) * 1000, 1),
+            'p95': round(_percentile(latencies, 95) * 1000, 1),
+            'p99': round(_percentile(latencies, 99) * 1000, 1),
+        },
+    }
+
+
+async def fetch_server_stats(url: str) -> Dict:
+    """دریافت آمار سرور از مسیر /healthz"""
+    parts = urlsplit(url)
+    health_url = urlunsplit((parts.scheme, parts.netloc, '/healthz', '', ''))
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(health_url) as response:
+                return await response.json()
+    except aiohttp.ClientError as e:
+        return {'error': str(e)}
+
+
+async def wait_for_drain(url: str, total: int, timeout: float) -> Dict:
+    """انتظار تا پردازش همه آپدیت‌ها توسط سرور (یا پایان مهلت)"""
+    deadline = time.monotonic() + timeout
+    stats = await fetch_server_stats(url)
+    while time.monotonic() < deadline:
+        if 'error' in stats or stats.get('processed', 0) + stats.get('failed', 0) >= total:
+            break
+        await asyncio.sleep(0.5)
+        stats = await fetch_server_stats(url)
+    return stats
+
+
+async def run_self_test(args) -> Dict:
+    """راه‌اندازی سرور webhook محلی با هندلر شبیه‌سازی شده و اجرای آزمایش روی آن"""
+    async def simulated_handler(data: Dict) -> None:
+        await asyncio.sleep(args.handler_delay)
+
+    server = WebhookServer(simulated_handler, secret_token=args.secret, path='/telegram/webhook',
+                           listen='127.0.0.1', port=args.port, max_concurrent_updates=args.max_concurrent)
+    await server.start()
+    url = f"http://127.0.0.1:{args.port}/telegram/webhook"
+    try:
+        client = await run_load(url, args.secret, args.requests, args.concurrency, args.chats)
+        # سرور بلافاصله پاسخ می‌دهد؛ تا پایان پردازش آپدیت‌ها منتظر می‌مانیم
+        deadline = time.monotonic() + args.drain_timeout
+        while server.stats['processed'] + server.stats['failed'] < args.requests and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        return {'client': client, 'server': server.get_stats()}
+    finally:
+        await server.stop()
+
+
+async def run_remote_test(args) -> Dict:
+    client = await run_load(args.url, args.secret, args.requests, args.concurrency, args.chats)
+    server = await wait_for_drain(args.url, args.requests, args.drain_timeout)
+    return {'client': client, 'server': server}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="آزمایش بار webhook با آپدیت‌های ساختگی")
+    parser.add_argument('--url', help="آدرس کامل webhook ربات در حال اجرا")
+    parser.add_argument('--secret', default='', help="توکن مخفی webhook")
+    parser.add_argument('-n', '--requests', type=int, default=200, help="تعداد آپدیت‌ها")
+    parser.add_argument('-c', '--concurrency', type=int, default=20, help="درخواست‌های همزمان")
+    parser.add_argument('--chats', type=int, default=50, help="تعداد چت‌های ساختگی")
+    parser.add_argument('--drain-timeout', type=float, default=60.0, help="مهلت انتظار برای پایان پردازش (ثانیه)")
+    parser.add_argument('--self-test', action='store_true', help="اجرای سرور محلی با هندلر شبیه‌سازی شده")
+    parser.add_argument('--handler-delay', type=float, default=0.1, help="مدت هندلر شبیه‌سازی شده (ثانیه)")
+    parser.add_argument('--max-concurrent', type=int, default=32, help="سقف آپدیت‌های همزمان سرور محلی")
+    parser.add_argument('--port', type=int, default=18443, help="پورت سرور محلی")
+    args = parser.parse_args()
+
+    if aiohttp is None:
+        print("کتابخانه aiohttp نصب نشده است (pip install aiohttp)")
+        return 1
+    if not args.self_test and not args.url:
+        parser.error("یکی از --url یا --self-test لازم است")
+
+    result = asyncio.run(run_self_test(args) if args.self_test else run_remote_test(args))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
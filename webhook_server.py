@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+حالت دریافت آپدیت‌ها از طریق webhook با سرور aiohttp داخلی
+
+با تنظیم متغیر محیطی TELEGRAM_WEBHOOK_URL، ربات به جای long polling یک سرور HTTP آسنکرون
+راه‌اندازی می‌کند و آدرس آن را به عنوان webhook در تلگرام ثبت می‌کند. ویژگی‌ها:
+- اعتبارسنجی هدر X-Telegram-Bot-Api-Secret-Token
+- پاسخ فوری به تلگرام و پردازش آپدیت در پس‌زمینه
+- محدودیت قابل تنظیم تعداد آپدیت‌های در حال پردازش همزمان
+- مسیر /healthz برای load balancer و آمار تأخیر هندلرها
+
+با هر دو نسخه python-telegram-bot کار می‌کند (Application در نسخه 20 و Dispatcher در نسخه 13).
+"""
+
+import os
+import hmac
+import json
+import time
+import asyncio
+import logging
+import secrets
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+# تنظیم لاگر
+logger = logging.getLogger(__name__)
+
+# آدرس عمومی webhook (در صورت خالی بودن از long polling استفاده می‌شود)
+WEBHOOK_URL = os.environ.get('TELEGRAM_WEBHOOK_URL', '').rstrip('/')
+# فعال بودن حالت webhook
+WEBHOOK_MODE = bool(WEBHOOK_URL)
+# آدرس و پورت شنود سرور
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', os.environ.get('PORT', '8443')))
+# مسیر دریافت آپدیت‌ها
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram/webhook')
+# توکن مخفی برای اعتبارسنجی درخواست‌های تلگرام
+WEBHOOK_SECRET_TOKEN = os.environ.get('WEBHOOK_SECRET_TOKEN', '')
+# حداکثر آپدیت‌های در حال پردازش همزمان
+WEBHOOK_MAX_CONCURRENT_UPDATES = int(os.environ.get('WEBHOOK_MAX_CONCURRENT_UPDATES', '32'))
+# حداکثر اتصال‌های همزمان تلگرام به webhook (پارامتر setWebhook)
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', '40'))
+# تعداد نمونه‌های نگهداری شده برای محاسبه صدک‌های تأخیر
+LATENCY_SAMPLE_SIZE = 1000
+
+# هدر توکن مخفی ارسالی توسط تلگرام
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def _percentile(samples, percent: float) -> float:
+    """محاسبه صدک از لیست نمونه‌ها"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class WebhookServer:
+    """سرور HTTP دریافت آپدیت‌های تلگرام"""
+
+    def __init__(self, process_update: Callable[[Dict], Awaitable], secret_token: str = '',
+                 path: str = WEBHOOK_PATH, listen: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT,
+                 max_concurrent_updates: int = WEBHOOK_MAX_CONCURRENT_UPDATES):
+        """
+        Args:
+            process_update: کوروتین پردازش یک آپدیت (دیکشنری JSON دریافتی)
+            secret_token: توکن مخفی مورد انتظار در هدر درخواست (خالی یعنی بدون اعتبارسنجی)
+            path: مسیر دریافت آپدیت‌ها
+            listen: آدرس شنود
+            port: پورت شنود
+            max_concurrent_updates: حداکثر آپدیت‌های در حال پردازش همزمان
+        """
+        if web is None:
+            raise RuntimeError("کتابخانه aiohttp برای حالت webhook نصب نشده است (pip install aiohttp)")
+
+        self.process_update = process_update
+        self.secret_token = secret_token
+        self.path = path
+        self.listen = listen
+        self.port = port
+        self.max_concurrent_updates = max_concurrent_updates
+
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._runner = None
+        self._tasks = set()
+        self._latencies = deque(maxlen=LATENCY_SAMPLE_SIZE)
+        self.started_at = None
+
+        # آمار
+        self.stats = {
+            'received': 0,
+            'rejected': 0,
+            'invalid': 0,
+            'processed': 0,
+            'failed': 0,
+            'in_flight': 0,
+        }
+
+    def create_app(self):
+        """ساخت اپلیکیشن aiohttp با مسیرهای webhook و سلامت"""
+        app = web.Application()
+        app.router.add_post(self.path, self._handle_update)
+        app.router.add_get('/healthz', self._handle_health)
+        return app
+
+    async def start(self) -> None:
+        """راه‌اندازی سرور"""
+        self._semaphore = asyncio.Semaphore(self.max_concurrent_updates)
+        self._runner = web.AppRunner(self.create_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        self.started_at = time.time()
+        logger.info(f"سرور webhook روی {self.listen}:{self.port}{self.path} راه‌اندازی شد "
+                    f"(حداکثر {self.max_concurrent_updates} آپدیت همزمان)")
+
+    async def stop(self) -> None:
+        """توقف سرور و انتظار برای پایان آپدیت‌های در حال پردازش"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        logger.info("سرور webhook متوقف شد")
+
+    async def _handle_update(self, request):
+        """دریافت یک آپدیت از تلگرام"""
+        if self.secret_token:
+            received_token = request.headers.get(SECRET_TOKEN_HEADER, '')
+            if not hmac.compare_digest(received_token, self.secret_token):
+                self.stats['rejected'] += 1
+                logger.warning(f"درخواست webhook با توکن مخفی نامعتبر از {request.remote} رد شد")
+                return web.Response(status=403)
+
+        try:
+            data = await request.json()
+        except (json.JSONDecodeError, ValueError):
+            self.stats['invalid'] += 1
+            return web.Response(status=400)
+
+        self.stats['received'] += 1
+
+        # پاسخ فوری به تلگرام؛ پردازش در پس‌زمینه انجام می‌شود
+        task = asyncio.get_running_loop().create_task(self._process(data, time.monotonic()))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response(status=200)
+
+    async def _process(self, data: Dict, received_at: float) -> None:
+        """پردازش آپدیت با رعایت سقف همزمانی"""
+        async with self._semaphore:
+            self.stats['in_flight'] += 1
+            try:
+                await self.process_update(data)
+                self.stats['processed'] += 1
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.error(f"خطا در پردازش آپدیت {data.get('update_id')}: {e}")
+            finally:
+                self.stats['in_flight'] -= 1
+                self._latencies.append(time.monotonic() - received_at)
+
+    async def _handle_health(self, request):
+        """وضعیت سرور، آمار تأخیر پردازش، عمق صف کلاس‌های زمان‌بند، نرخ درخواست‌ها و اجرای FFmpeg"""
+        from fair_scheduler import fair_scheduler
+        from request_governor import request_governor
+        from ffmpeg_runner import get_runner_stats
+        stats = self.get_stats()
+        stats['scheduler'] = fair_scheduler.get_stats()
+        stats['governor'] = request_governor.get_stats()
+        stats['ffmpeg'] = get_runner_stats()
+        return web.json_response(stats)
+
+    def get_stats(self) -> Dict:
+        """
+        دریافت آمار سرور
+
+        Returns:
+            دیکشنری شمارنده‌ها و صدک‌های تأخیر (به میلی‌ثانیه، از دریافت تا پایان هندلر)
+        """
+        samples = list(self._latencies)
+        stats = dict(self.stats)
+        stats.update({
+            'queued': max(0, len(self._tasks) - stats['in_flight']),
+            'uptime': round(time.time() - self.started_at, 1) if self.started_at else 0,
+            'latency_ms': {
+                'p50': round(_percentile(samples, 50) * 1000, 1),
+                'p95': round(_percentile(samples, 95) * 1000, 1),
+                'p99': round(_percentile(samples, 99) * 1000, 1),
+                'max': round(max(samples) * 1000, 1) if samples else 0.0,
+            },
+        })
+        return stats
+
+
+async def start_webhook(app) -> WebhookServer:
+    """
+    راه‌اندازی حالت webhook برای ربات و ثبت آدرس آن در تلگرام
+
+    Args:
+        app: Application در نسخه 20 یا Dispatcher در نسخه 13
+
+    Returns:
+        سرور webhook در حال اجرا
+    """
+    from telegram import Update
+
+    bot = app.bot
+    secret_token = WEBHOOK_SECRET_TOKEN
+    if not secret_token:
+        # بدون توکن ثابت، هر نمونه توکن تصادفی خود را ثبت می‌کند (برای چند نمونه پشت load balancer مناسب نیست)
+        secret_token = secrets.token_urlsafe(32)
+        logger.warning("WEBHOOK_SECRET_TOKEN تنظیم نشده است، از توکن تصادفی استفاده می‌شود")
+
+    if asyncio.iscoroutinefunction(app.process_update):
+        # نسخه 20: پردازش آسنکرون
+        async def process_update(data: Dict) -> None:
+            await app.process_update(Update.de_json(data, bot))
+    else:
+        # نسخه 13: هندلرها همزمان هستند و در پول اجرایی جداگانه اجرا می‌شوند
+        dispatch_executor = ThreadPoolExecutor(max_workers=WEBHOOK_MAX_CONCURRENT_UPDATES,
+                                               thread_name_prefix='webhook_dispatch')
+        loop = asyncio.get_running_loop()
+
+        async def process_update(data: Dict) -> None:
+            await loop.run_in_executor(dispatch_executor, app.process_update, Update.de_json(data, bot))
+
+    server = WebhookServer(process_update, secret_token=secret_token)
+    await server.start()
+
+    webhook_url = f"{WEBHOOK_URL}{WEBHOOK_PATH}"
+    webhook_kwargs = {'url': webhook_url, 'max_connections': WEBHOOK_MAX_CONNECTIONS}
+    if asyncio.iscoroutinefunction(bot.set_webhook):
+        await bot.set_webhook(secret_token=secret_token, **webhook_kwargs)
+    else:
+        # نسخه 13 پارامتر secret_token را مستقیماً نمی‌شناسد
+        bot.set_webhook(api_kwargs={'secret_token': secret_token}, **webhook_kwargs)
+
+    logger.info(f"webhook در تلگرام ثبت شد: {webhook_url}")
+    return server